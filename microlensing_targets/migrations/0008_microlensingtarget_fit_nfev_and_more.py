@@ -0,0 +1,28 @@
+# Generated by Django 5.2.15 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0007_alter_microlensingtarget_fit_covariance_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='microlensingtarget',
+            name='fit_nfev',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='microlensingtarget',
+            name='fit_nfev_saved',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='microlensingtarget',
+            name='fit_warm_start',
+            field=models.BooleanField(default=False),
+        ),
+    ]
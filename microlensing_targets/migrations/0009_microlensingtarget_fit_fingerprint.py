@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0008_microlensingtarget_fit_nfev_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='microlensingtarget',
+            name='fit_fingerprint',
+            field=models.JSONField(blank=True, default=dict, null=True),
+        ),
+    ]
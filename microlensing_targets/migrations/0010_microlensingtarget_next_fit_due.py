@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0009_microlensingtarget_fit_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='microlensingtarget',
+            name='next_fit_due',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.15 on 2026-10-18 18:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0010_microlensingtarget_next_fit_due'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('leased', 'Leased'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('priority', models.FloatField(default=0)),
+                ('enqueued', models.DateTimeField()),
+                ('lease_expiry', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('attempts', models.IntegerField(default=0)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fit_job', to='microlensing_targets.microlensingtarget')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.15 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0011_fitjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('ncompleted', models.IntegerField(default=0)),
+                ('remaining', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.15 on 2026-10-18 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0012_fitcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitTelemetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True)),
+                ('backend', models.CharField(blank=True, default='', max_length=20)),
+                ('status', models.BooleanField(default=False)),
+                ('ndata', models.IntegerField(default=0)),
+                ('ndata_fitted', models.IntegerField(default=0)),
+                ('ndata_per_telescope', models.JSONField(blank=True, default=dict)),
+                ('niter', models.IntegerField(default=0)),
+                ('nfev', models.IntegerField(default=0)),
+                ('warm_start', models.BooleanField(default=False)),
+                ('selected_model', models.IntegerField(blank=True, null=True)),
+                ('wall_time', models.FloatField(default=0)),
+                ('cpu_time', models.FloatField(default=0)),
+                ('stage_times', models.JSONField(blank=True, default=dict)),
+                ('peak_rss', models.FloatField(blank=True, null=True)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='fit_telemetry', to='microlensing_targets.fitcheckpoint')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fit_telemetry', to='microlensing_targets.microlensingtarget')),
+            ],
+        ),
+    ]
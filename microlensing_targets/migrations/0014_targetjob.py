@@ -0,0 +1,31 @@
+# Generated by Django 5.2.15 on 2026-10-18 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0013_fittelemetry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(choices=[('fit_event_PSPL', 'Model fit'), ('run_TAP', 'TAP')], max_length=30)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('requested', models.DateTimeField()),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('message', models.TextField(blank=True, default='')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='target_jobs', to='microlensing_targets.microlensingtarget')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('target', 'command'), name='unique_active_target_job')],
+            },
+        ),
+    ]
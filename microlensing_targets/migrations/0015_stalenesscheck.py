@@ -0,0 +1,31 @@
+# Generated by Django 5.2.15 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0014_targetjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StalenessCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True)),
+                ('refit', models.BooleanField(default=True)),
+                ('reason', models.CharField(blank=True, default='', max_length=100)),
+                ('nnew', models.IntegerField(default=0)),
+                ('chi2_new', models.FloatField(blank=True, null=True)),
+                ('p_value', models.FloatField(blank=True, null=True)),
+                ('t0_shift', models.FloatField(blank=True, null=True)),
+                ('u0_shift', models.FloatField(blank=True, null=True)),
+                ('wall_time', models.FloatField(default=0)),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='staleness_checks', to='microlensing_targets.fitcheckpoint')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staleness_checks', to='microlensing_targets.microlensingtarget')),
+            ],
+        ),
+    ]
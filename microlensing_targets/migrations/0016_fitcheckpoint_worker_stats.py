@@ -0,0 +1,18 @@
+# Generated by Django 5.2.15 on 2026-10-18 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0015_stalenesscheck'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitcheckpoint',
+            name='worker_stats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
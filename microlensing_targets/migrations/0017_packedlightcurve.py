@@ -0,0 +1,33 @@
+# Generated by Django 5.2.15 on 2026-10-18 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0016_fitcheckpoint_worker_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedLightcurve',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bandpass', models.CharField(max_length=32)),
+                ('source_name', models.CharField(blank=True, default='', max_length=100)),
+                ('jd', models.BinaryField(default=bytes)),
+                ('mag', models.BinaryField(default=bytes)),
+                ('mag_err', models.BinaryField(default=bytes)),
+                ('ndata', models.IntegerField(default=0)),
+                ('last_datum', models.BigIntegerField(default=0)),
+                ('version', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField()),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='packed_lightcurves', to='microlensing_targets.microlensingtarget')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('target', 'bandpass', 'source_name'), name='unique_packed_lightcurve')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.15 on 2026-10-18 20:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('microlensing_targets', '0017_packedlightcurve'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LightcurveSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bandpass', models.CharField(blank=True, default='', max_length=32)),
+                ('ndata', models.IntegerField(default=0)),
+                ('first_jd', models.FloatField(blank=True, null=True)),
+                ('last_jd', models.FloatField(blank=True, null=True)),
+                ('mag_min', models.FloatField(blank=True, null=True)),
+                ('mag_max', models.FloatField(blank=True, null=True)),
+                ('mag_median', models.FloatField(blank=True, null=True)),
+                ('mag_baseline', models.FloatField(blank=True, null=True)),
+                ('last_datum', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField()),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lightcurve_summaries', to='microlensing_targets.microlensingtarget')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('target', 'bandpass'), name='unique_lightcurve_summary')],
+            },
+        ),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models
+from django.db.models.query import QuerySet
 from tom_targets.models import BaseTarget
-from astropy.time import Time
+from mop.toolbox import lightcurve_loader
 from datetime import datetime
 import json
+import hashlib
 import logging
 import pytz
 import numpy as np
@@ -77,6 +79,11 @@ class MicrolensingTarget(BaseTarget):
     ks_test = models.FloatField(default=0)
     sw_test = models.FloatField(default=0)
     ad_test = models.FloatField(default=0)
+    fit_warm_start = models.BooleanField(default=False)
+    fit_nfev = models.IntegerField(default=0)
+    fit_nfev_saved = models.IntegerField(default=0)
+    fit_fingerprint = models.JSONField(default=dict, null=True, blank=True)
+    next_fit_due = models.FloatField(default=0)
     latest_data_hjd = models.FloatField(default=0)
     latest_data_utc = models.DateTimeField(null=True, blank=True)
     mag_now = models.FloatField(default=0)
@@ -151,39 +158,51 @@ class MicrolensingTarget(BaseTarget):
 
         return extras
 
-    def get_reduced_data(self, photometry_qs, qs):
+    def get_reduced_data(self, photometry_qs, qs, datasets=None):
         """Function to extract the timeseries data from a QuerySet of PhotometryReducedDatums, and
         creates the necessary arrays.
-        Also accepts a QuerySet of generic ReducedDatums (lc_model, tabular, etc.) for the same
+        Also accepts a QuerySet or list of generic ReducedDatums (lc_model, tabular, etc.) for the same
         target, used to identify pre-existing derived datasets.
-        Note that the querysets must be provided separately and not derived directly from a query
+        Note that the querysets must be provided separately and not derived directly from a query.
+        Lightcurves already loaded, e.g. from a snapshot, may be given as datasets instead of the photometry.
         """
 
         # Store the complete set of results
         self.red_data = photometry_qs
 
         # Unpack the lightcurve data:
-        self.repackage_lightcurves(self.red_data)
+        if datasets is None:
+            self.repackage_lightcurves(self.red_data)
+        else:
+            self.datasets = datasets
+            self.ndata = sum([len(lc) for lc in datasets.values()])
+            self.fingerprint = self.compute_photometry_fingerprint()
         print('REPACK: ', self.ndata)
 
-        # Extract the timestamp of the last observation
-        time = [Time(i.timestamp).jd for i in self.red_data]
-        if len(time) > 0:
-            self.first_observation = min(time)
-            self.last_observation = max(time)
+        # Extract the timestamps of the first and last observations
+        if self.ndata > 0:
+            self.first_observation = float(min([lc[:, 0].min() for lc in self.datasets.values()]))
+            self.last_observation = float(max([lc[:, 0].max() for lc in self.datasets.values()]))
         else:
             self.first_observation = None
             self.last_observation = None
 
-        # Identify any pre-existing datasets of specific categories, if available
-        self.existing_model = None
+        # Identify any pre-existing model lightcurve.  Since the model is evaluated from the fitted
+        # parameters of the target where needed, its stored value is not loaded here; the entry
+        # is retained so that it can be updated when the target is refitted.
+        # The datasets may also be given as a list, already retrieved for a set of targets
+        if isinstance(qs, QuerySet):
+            self.existing_model = qs.filter(data_type='lc_model').defer('value').first()
+            datums = qs.exclude(data_type='lc_model')
+        else:
+            self.existing_model = next((dset for dset in qs if dset.data_type == 'lc_model'), None)
+            datums = [dset for dset in qs if dset.data_type != 'lc_model']
+
+        # Identify any pre-existing datasets of other specific categories, if available
         self.gsc_results = None
         self.aoft_table = None
         self.neighbours = []
-        for dset in qs:
-            if dset.data_type == 'lc_model':
-                self.existing_model = dset
-
+        for dset in datums:
             if dset.data_type == 'tabular' and dset.source_name == 'Interferometry_predictor':
                 self.neighbours = dset
 
@@ -193,48 +212,73 @@ class MicrolensingTarget(BaseTarget):
             if dset.data_type == 'tabular' and dset.source_name == 'AOFT_table':
                 self.aoft_table = dset
 
-            if self.existing_model and self.neighbours \
-                    and self.gsc_results and self.aoft_table:
+            if self.neighbours and self.gsc_results and self.aoft_table:
                 break
 
+    def release_reduced_data(self):
+        """Method to release the timeseries data and derived datasets loaded by get_reduced_data
+        once they are no longer required, e.g. after a model fit has been performed.  The summary
+        attributes (ndata, fingerprint, first/last_observation and existing_model) are retained
+        since they are used to store the results of the fit"""
+
+        self.red_data = None
+        self.datasets = {}
+        self.gsc_results = None
+        self.aoft_table = None
+        self.neighbours = []
+
     def repackage_lightcurves(self, photometry_qs):
         """Method to sort through a QuerySet of PhotometryReducedDatums for a given event and repackage the data as a
          dictionary of individual lightcurves in PyLIMA-compatible format for different facilities.
+         The datapoints are loaded as columns, without creating model instances, and their
+         timestamps converted to JD in a single step.
          """
 
-        datasets = {}
+        (self.datasets, self.ndata) = lightcurve_loader.load_lightcurves(photometry_qs)
+        self.fingerprint = self.compute_photometry_fingerprint()
 
-        for rd in photometry_qs:
-            if rd.source_name != 'Interferometry_predictor':
-                # Identify different lightcurves from the filter label given
-                passband = rd.bandpass
-                if passband in datasets.keys():
-                    lc = datasets[passband]
-                else:
-                    lc = []
-
-                # Append the datapoint to the corresponding dataset
-                try:
-                    lc.append([Time(rd.timestamp).jd, rd.brightness, rd.brightness_error])
-                except:
-                    # Necessary to handle the datapoints where only a limit is available.
-                    # Skipping these for now
-                    try:
-                        lc.append([Time(rd.timestamp).jd, rd.brightness, 1.0])
-                    except KeyError:
-                        pass
-
-                datasets[passband] = lc
-
-        # Count the total number of datapoints available, and convert the
-        # accumulated lightcurves into numpy arrays:
-        ndata = 0
-        for passband, lc in datasets.items():
-            ndata += len(lc)
-            datasets[passband] = np.array(lc)
-
-        self.datasets = datasets
-        self.ndata = ndata
+    def compute_photometry_fingerprint(self):
+        """
+        Method to summarize the lightcurve data as a fingerprint, consisting of the number of
+        datapoints in each bandpass, the timestamp of the most recent datapoint and a
+        running hash of all (timestamp, magnitude, error) entries.
+        The datapoints are hashed in a fixed order, so the fingerprint does not depend on the
+        order in which the data were retrieved from the database.
+        """
+
+        counts = {}
+        max_jd = 0.0
+        running_hash = hashlib.sha1()
+
+        for passband in sorted(self.datasets.keys()):
+            lc = np.asarray(self.datasets[passband], dtype=float)
+            counts[passband] = len(lc)
+            if len(lc) > 0:
+                lc = lc[np.lexsort((lc[:, 2], lc[:, 1], lc[:, 0]))]
+                max_jd = max(max_jd, float(lc[:, 0].max()))
+                running_hash.update(passband.encode('utf-8'))
+                running_hash.update(np.ascontiguousarray(lc[:, 0:3]).tobytes())
+
+        fingerprint = {
+            'counts': counts,
+            'max_jd': max_jd,
+            'hash': running_hash.hexdigest()
+        }
+
+        return fingerprint
+
+    def check_fingerprint(self):
+        """
+        Returns True if the lightcurve data are unchanged since the last model fit, i.e. the
+        fingerprint of the current data matches the one consumed by that fit
+        """
+
+        if not self.fit_fingerprint or not hasattr(self, 'fingerprint'):
+            return False
+
+        # The fingerprint stored may also record the data the model was originally fitted to,
+        # if later data were found to be consistent with the model without a refit
+        return {key: self.fit_fingerprint.get(key) for key in self.fingerprint.keys()} == self.fingerprint
 
     def check_need_to_fit(self):
         """
@@ -245,7 +289,16 @@ class MicrolensingTarget(BaseTarget):
         self.need_to_fit = True
 
         if self.last_observation:
-            if self.last_fit:
+            # If the lightcurve data have been fitted before, the fingerprint of the data used
+            # in that fit is the definitive test, since it also catches re-ingested datapoints
+            if self.fit_fingerprint and hasattr(self, 'fingerprint'):
+                if self.check_fingerprint():
+                    self.need_to_fit = False
+                    reason = 'Photometry unchanged since last fit'
+                else:
+                    reason = 'Photometry changed since last fit'
+
+            elif self.last_fit:
                 if (float(self.last_observation) < float(self.last_fit)):
                     self.need_to_fit = False
                     reason = 'Up to date model'
@@ -269,13 +322,17 @@ class MicrolensingTarget(BaseTarget):
                       'blend_magnitude', 'blend_mag_error',
                       'baseline_magnitude', 'baseline_mag_error',
                       'fit_covariance', 'chi2', 'red_chi2',
-                      'ks_test', 'ad_test', 'sw_test']
+                      'ks_test', 'ad_test', 'sw_test',
+                      'fit_warm_start', 'fit_nfev', 'fit_nfev_saved', 'fit_fingerprint',
+                      'next_fit_due']
 
         for key in parameters:
             if key in model_params.keys():
                 if key == 'fit_covariance':
                     payload = json.dumps(model_params['fit_covariance'].tolist())
                     data = {'covariance': payload}
+                elif key == 'fit_fingerprint':
+                    data = model_params['fit_fingerprint']
                 else:
                     # Intercept NaN values as these are not well supported by Django FloatFields
                     if np.isnan(model_params[key]):
@@ -305,6 +362,34 @@ class MicrolensingTarget(BaseTarget):
             data = np.array([])
         return data
 
+    def get_previous_fit(self):
+        """
+        Returns the parameters of the last model fit stored for this MicrolensingTarget,
+        used to warm-start the next fit, or None if no valid model has been stored.
+        """
+
+        # Parameters that could not be fitted are stored as zero
+        if not self.t0 or not self.tE:
+            return None
+
+        # The number of function evaluations a cold-start fit required is used as the reference
+        # to estimate the saving made by subsequent warm-start fits
+        if self.fit_warm_start:
+            nfev_reference = self.fit_nfev + self.fit_nfev_saved
+        else:
+            nfev_reference = self.fit_nfev
+
+        previous_fit = {
+            't0': self.t0, 't0_error': self.t0_error,
+            'u0': self.u0, 'u0_error': self.u0_error,
+            'tE': self.tE, 'tE_error': self.tE_error,
+            'red_chi2': self.red_chi2,
+            'fit_covariance': self.load_fit_covariance(),
+            'nfev_reference': nfev_reference
+        }
+
+        return previous_fit
+
     def get_custom_params(self):
         """List of the custom parameters for a MicrolensingTarget"""
 
@@ -369,6 +454,11 @@ class MicrolensingTarget(BaseTarget):
             'ks_test',
             'sw_test',
             'ad_test',
+            'fit_warm_start',
+            'fit_nfev',
+            'fit_nfev_saved',
+            'fit_fingerprint',
+            'next_fit_due',
             'latest_data_hjd',
             'latest_data_utc',
             'mag_now',
@@ -390,4 +480,210 @@ class MicrolensingTarget(BaseTarget):
             'TNS_class'
         ]
 
-        return param_list
\ No newline at end of file
+        return param_list
+
+
+class FitJob(models.Model):
+    """
+    Work item of the queue of model fits shared by fit_need_events_PSPL processes.
+    Each target has at most one job.  A worker claims a job by taking a lease on it, which it must
+    renew periodically while the fit is in progress; jobs whose lease expires without being
+    completed, e.g. because the worker crashed, are returned to the queue to be claimed by another
+    worker.
+    """
+
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('leased', 'Leased'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    )
+
+    target = models.OneToOneField(MicrolensingTarget, on_delete=models.CASCADE, related_name='fit_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    priority = models.FloatField(default=0)
+    enqueued = models.DateTimeField()
+    lease_expiry = models.DateTimeField(null=True, blank=True, db_index=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.target.name + ': ' + self.status
+
+
+class FitCheckpoint(models.Model):
+    """
+    Record of the progress of a fit_need_events_PSPL run, updated as the results of each fit are
+    stored.  The events which the run did not reach before its deadline are carried over
+    to the start of the following run.  If the workers of the run were recycled, the number of
+    fits made by each worker and its resident memory are also recorded.
+    """
+
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True, blank=True)
+    ncompleted = models.IntegerField(default=0)
+    remaining = models.JSONField(default=list, blank=True)
+    worker_stats = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return 'Fit run started ' + str(self.started) + ': ' + str(len(self.remaining)) + ' events remaining'
+
+
+
+class FitTelemetry(models.Model):
+    """
+    Record of the cost of a single model fit, written when its results are stored.  The time spent
+    in each stage of the fit is recorded as wall-clock and CPU time, together with the size of the
+    lightcurves, the number of optimizer iterations and function evaluations and the model selected,
+    so that the expense of fitting different events can be compared between runs.
+    """
+
+    target = models.ForeignKey(MicrolensingTarget, on_delete=models.CASCADE, related_name='fit_telemetry')
+    run = models.ForeignKey(FitCheckpoint, on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='fit_telemetry')
+    created = models.DateTimeField(db_index=True)
+    backend = models.CharField(max_length=20, blank=True, default='')
+    status = models.BooleanField(default=False)
+    ndata = models.IntegerField(default=0)
+    ndata_fitted = models.IntegerField(default=0)
+    ndata_per_telescope = models.JSONField(default=dict, blank=True)
+    niter = models.IntegerField(default=0)
+    nfev = models.IntegerField(default=0)
+    warm_start = models.BooleanField(default=False)
+    selected_model = models.IntegerField(null=True, blank=True)
+    wall_time = models.FloatField(default=0)
+    cpu_time = models.FloatField(default=0)
+    stage_times = models.JSONField(default=dict, blank=True)
+    peak_rss = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return self.target.name + ' fitted ' + str(self.created) + ' in ' + str(round(self.wall_time, 3)) + 's'
+
+
+class TargetJob(models.Model):
+    """
+    Request made from the target page to run a management command for a single target, such as a
+    model fit or TAP, which is executed by a worker process outside the web server.  At most one
+    job for each command and target can be queued or running at a time, so that repeated requests
+    for the same target are served by the job already in progress.
+    """
+
+    COMMAND_CHOICES = (
+        ('fit_event_PSPL', 'Model fit'),
+        ('run_TAP', 'TAP')
+    )
+
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    )
+
+    target = models.ForeignKey(MicrolensingTarget, on_delete=models.CASCADE, related_name='target_jobs')
+    command = models.CharField(max_length=30, choices=COMMAND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    requested = models.DateTimeField()
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    message = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'command'],
+                                    condition=models.Q(status__in=['queued', 'running']),
+                                    name='unique_active_target_job')
+        ]
+
+    def __str__(self):
+        return self.target.name + ' ' + self.command + ': ' + self.status
+
+
+class StalenessCheck(models.Model):
+    """
+    Record of a test of whether the stored model of a target still describes its lightcurve,
+    made before a refit by scoring the model against the datapoints received since it was fitted.
+    The refit is only made if the new datapoints are inconsistent with the model, or imply a
+    significant shift in t0 or u0, so that these records show the fraction of refits avoided.
+    """
+
+    target = models.ForeignKey(MicrolensingTarget, on_delete=models.CASCADE, related_name='staleness_checks')
+    run = models.ForeignKey(FitCheckpoint, on_delete=models.SET_NULL, null=True, blank=True,
+                            related_name='staleness_checks')
+    created = models.DateTimeField(db_index=True)
+    refit = models.BooleanField(default=True)
+    reason = models.CharField(max_length=100, blank=True, default='')
+    nnew = models.IntegerField(default=0)
+    chi2_new = models.FloatField(null=True, blank=True)
+    p_value = models.FloatField(null=True, blank=True)
+    t0_shift = models.FloatField(null=True, blank=True)
+    u0_shift = models.FloatField(null=True, blank=True)
+    wall_time = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.target.name + ' checked ' + str(self.created) + ': ' + ('refit' if self.refit else 'model current')
+
+
+class PackedLightcurve(models.Model):
+    """
+    Copy of the photometry of a target from a single source in a single bandpass, packed as binary
+    arrays of JD, magnitude and uncertainty in time order, so that the lightcurve can be read from
+    a single row rather than rebuilt from its PhotometryReducedDatums.  The copy is extended as new
+    photometry is ingested, recording the largest ID of the datapoints included, and its version is
+    incremented each time it changes.
+    """
+
+    target = models.ForeignKey(MicrolensingTarget, on_delete=models.CASCADE, related_name='packed_lightcurves')
+    bandpass = models.CharField(max_length=32)
+    source_name = models.CharField(max_length=100, blank=True, default='')
+    jd = models.BinaryField(default=bytes)
+    mag = models.BinaryField(default=bytes)
+    mag_err = models.BinaryField(default=bytes)
+    ndata = models.IntegerField(default=0)
+    last_datum = models.BigIntegerField(default=0)
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'bandpass', 'source_name'],
+                                    name='unique_packed_lightcurve')
+        ]
+
+    def __str__(self):
+        return self.target.name + ' ' + self.bandpass + ' ' + self.source_name + ': ' + str(self.ndata) \
+            + ' datapoints, version ' + str(self.version)
+
+
+class LightcurveSummary(models.Model):
+    """
+    Summary statistics of the photometry of a target in a single bandpass, or of all of its photometry
+    when the bandpass is blank, so that the extent and brightness range of a lightcurve can be read
+    from a single row.  The summaries are recomputed from the packed lightcurves of the bandpasses
+    affected whenever new photometry is ingested, recording the largest ID of the datapoints included.
+    Magnitudes which are not positive are excluded from the magnitude statistics, and the baseline is
+    estimated as the median magnitude of the fainter half of the datapoints.
+    """
+
+    target = models.ForeignKey(MicrolensingTarget, on_delete=models.CASCADE, related_name='lightcurve_summaries')
+    bandpass = models.CharField(max_length=32, blank=True, default='')
+    ndata = models.IntegerField(default=0)
+    first_jd = models.FloatField(null=True, blank=True)
+    last_jd = models.FloatField(null=True, blank=True)
+    mag_min = models.FloatField(null=True, blank=True)
+    mag_max = models.FloatField(null=True, blank=True)
+    mag_median = models.FloatField(null=True, blank=True)
+    mag_baseline = models.FloatField(null=True, blank=True)
+    last_datum = models.BigIntegerField(default=0)
+    updated = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'bandpass'], name='unique_lightcurve_summary')
+        ]
+
+    def __str__(self):
+        return self.target.name + ' ' + (self.bandpass if self.bandpass else 'all bandpasses') + ': ' \
+            + str(self.ndata) + ' datapoints'
@@ -13,7 +13,7 @@ from urllib.error import HTTPError
 
 from tom_dataproducts.models import PhotometryReducedDatum
 from tom_targets.models import Target
-from mop.toolbox import TAP, utilities
+from mop.toolbox import TAP, utilities, packed_lightcurves
 
 BROKER_URL = 'http://www.astronomy.ohio-state.edu/asassn/transients.html'
 photometry = 'https://asas-sn.osu.edu/photometry'
@@ -258,5 +258,7 @@ class ASASSNBroker():
                 
 
                 n = n + 1  # repeats for all of the data points on the link for a specific target
+            if len(hjd) > 0:
+                packed_lightcurves.refresh_packed_lightcurves(targets[indices_with_photometry_data[k]])
             k = k + 1  # repeats for all targets 
         return rd_list
@@ -15,7 +15,7 @@ import numpy as np
 from astropy.time import Time, TimezoneInfo
 import datetime
 from mop.toolbox import logs
-from mop.toolbox import TAP, utilities, classifier_tools
+from mop.toolbox import TAP, utilities, classifier_tools, packed_lightcurves
 from microlensing_targets.match_managers import validators
 import ssl
 
@@ -177,6 +177,7 @@ class MOABroker(GenericBroker):
                 except:
                         pass
 
+            packed_lightcurves.refresh_packed_lightcurves(target)
             (t_last_jd, t_last_date) = TAP.TAP_time_last_datapoint(target)
             target.latest_data_hjd = t_last_jd
             target.latest_data_utc = t_last_date
@@ -15,7 +15,7 @@ import numpy as np
 import requests
 from astropy.time import Time, TimezoneInfo
 import logging
-from mop.toolbox import TAP, utilities, classifier_tools
+from mop.toolbox import TAP, utilities, classifier_tools, packed_lightcurves
 from microlensing_targets.match_managers import validators
 
 logger = logging.getLogger(__name__)
@@ -289,6 +289,7 @@ class OGLEBroker(GenericBroker):
             except MultipleObjectsReturned:
                 logger.error('OGLE HARVESTER: Found duplicated data for event '+target.name)
 
+        packed_lightcurves.refresh_packed_lightcurves(target)
         (t_last_jd, t_last_date) = TAP.TAP_time_last_datapoint(target)
         target.latest_data_hjd = t_last_jd
         target.latest_data_utc = t_last_date
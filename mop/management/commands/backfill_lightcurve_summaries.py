@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from microlensing_targets.models import MicrolensingTarget
+from mop.toolbox import packed_lightcurves
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Calculate the lightcurve summaries of targets which have none, or whose summaries are not ' \
+           'up to date with their photometry, bringing their packed lightcurves up to date at the same time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', help='Name of a specific target or all')
+        parser.add_argument('--chunk-size', help='Number of targets checked by each query', type=int,
+                            default=500)
+
+    def handle(self, *args, **options):
+
+        t1 = datetime.datetime.utcnow()
+        if options['target'] == 'all':
+            qs = MicrolensingTarget.objects.all()
+        else:
+            qs = MicrolensingTarget.objects.filter(name=options['target'])
+        qs = qs.order_by('pk').only('pk', 'name')
+
+        # The targets are paged through by pk with ordinary queries, rather than held open in a
+        # server-side cursor, since updating each target commits a transaction
+        ntargets = 0
+        nupdated = 0
+        last_pk = 0
+        while True:
+            chunk = list(qs.filter(pk__gt=last_pk)[:max(1, options['chunk_size'])])
+            if len(chunk) == 0:
+                break
+            last_pk = chunk[-1].pk
+            ntargets += len(chunk)
+
+            current = packed_lightcurves.current_summary_targets(chunk)
+            for target in chunk:
+                if target.pk not in current:
+                    packed_lightcurves.update_lightcurve_summaries(target)
+                    logger.info('LIGHTCURVE_SUMMARIES: Updated the lightcurve summaries of ' + target.name)
+                    nupdated += 1
+
+        t2 = datetime.datetime.utcnow()
+        print('Checked ' + str(ntargets) + ' target(s), updated the lightcurve summaries of '
+              + str(nupdated) + ' target(s) in ' + str(t2 - t1))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from mop.toolbox import fittools, synthetic_lightcurves
+from datetime import datetime
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the throughput of the batched PSPL solver with the per-event fit_pspl_omega2 loop, ' \
+           'using a set of synthetic events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nevents', help='Number of synthetic events to fit', default=100, type=int)
+        parser.add_argument('--ndata', help='Number of datapoints per event', default=500, type=int)
+        parser.add_argument('--seed', help='Seed for the synthetic event generator', default=42, type=int)
+        parser.add_argument('--batch-size', help='Number of events per batch', default=100, type=int)
+        parser.add_argument('--backend', help='Fitting backend used for the per-event loop', default='pylima',
+                            choices=['pylima', 'numpy'])
+
+    def handle(self, *args, **options):
+
+        events = synthetic_lightcurves.generate_event_set(options['nevents'], seed=options['seed'],
+                                                          ndata=options['ndata'])
+        event_datasets = [event['datasets'] for event in events]
+        print('Generated ' + str(len(events)) + ' synthetic events with '
+              + str(options['ndata']) + ' datapoints each')
+
+        # Batched solver
+        t1 = datetime.utcnow()
+        batch_results = []
+        for i in range(0, len(event_datasets), options['batch_size']):
+            batch_results += fittools.fit_pspl_batch(event_datasets[i:i + options['batch_size']])
+        t2 = datetime.utcnow()
+        batch_time = (t2 - t1).total_seconds()
+
+        # Current per-event loop.  Note that fit_pspl_omega2 also evaluates the no-blend model
+        # where required and generates the model lightcurve
+        loop_results = []
+        for datasets in event_datasets:
+            (model_params, model_lightcurve, status) = fittools.fit_pspl_omega2(
+                0.0, 0.0, datasets, backend=options['backend'])
+            loop_results.append(model_params)
+        t3 = datetime.utcnow()
+        loop_time = (t3 - t2).total_seconds()
+
+        # Compare the goodness of fit achieved by the two approaches for each event
+        nagree = 0
+        nbetter = 0
+        nworse = 0
+        for batch_params, loop_params in zip(batch_results, loop_results):
+            if np.isnan(loop_params['chi2']) \
+                    or batch_params['chi2'] < loop_params['chi2'] * (1.0 - 1e-3):
+                nbetter += 1
+            elif batch_params['chi2'] > loop_params['chi2'] * (1.0 + 1e-3):
+                nworse += 1
+            else:
+                nagree += 1
+
+        print('Per-event fit_pspl_omega2 loop (' + options['backend'] + '): ' + str(round(loop_time, 3)) + 's, '
+              + str(round(len(events) / loop_time, 2)) + ' events/s')
+        print('Batched solver: ' + str(round(batch_time, 3)) + 's, '
+              + str(round(len(events) / batch_time, 2)) + ' events/s')
+        print('Speed-up: ' + str(round(loop_time / batch_time, 1)))
+        print('Batched chi2 within 0.1% of per-event fit for ' + str(nagree) + ' events, lower for '
+              + str(nbetter) + ', higher for ' + str(nworse))
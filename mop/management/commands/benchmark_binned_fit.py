@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from mop.toolbox import fittools, synthetic_lightcurves, lightcurve_binning
+from datetime import datetime
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the fit time and the fitted parameters of fit_pspl_omega2 for synthetic events ' \
+           'with dense survey lightcurves, with and without binning of the baseline photometry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nevents', help='Number of synthetic events to fit', default=20, type=int)
+        parser.add_argument('--ndata', help='Number of datapoints per event', default=5000, type=int)
+        parser.add_argument('--seed', help='Seed for the synthetic event generator', default=42, type=int)
+        parser.add_argument('--duration', help='Length of the lightcurves [days]', default=1826.25, type=float)
+        parser.add_argument('--backend', help='Fitting backend', default='numpy', choices=['pylima', 'numpy'])
+        parser.add_argument('--bin-window', help='Width of the bins [days]',
+                            default=lightcurve_binning.BIN_WINDOW, type=float)
+        parser.add_argument('--bin-te-multiple', help='Half-width of the region kept at full resolution [tE]',
+                            default=lightcurve_binning.TE_MULTIPLE, type=float)
+
+    def handle(self, *args, **options):
+
+        # Dense survey lightcurves covering several seasons, with follow-up observations around the peak
+        events = synthetic_lightcurves.generate_event_set(options['nevents'], seed=options['seed'],
+                                                          ndata=options['ndata'], telescopes=('I', 'g_ZTF', 'gp'),
+                                                          duration=options['duration'])
+        print('Generated ' + str(len(events)) + ' synthetic events with '
+              + str(options['ndata']) + ' datapoints each over ' + str(options['duration']) + ' days')
+
+        binning = {'window': options['bin_window'], 'tE_multiple': options['bin_te_multiple']}
+        results = {'unbinned': [], 'binned': []}
+        times = {'unbinned': 0.0, 'binned': 0.0}
+        ndata_binned = []
+        for event in events:
+            for mode, mode_binning in [('unbinned', None), ('binned', binning)]:
+                t1 = datetime.utcnow()
+                (model_params, model_lightcurve, status) = fittools.fit_pspl_omega2(
+                    0.0, 0.0, event['datasets'], backend=options['backend'], binning=mode_binning)
+                t2 = datetime.utcnow()
+                times[mode] += (t2 - t1).total_seconds()
+                results[mode].append(model_params)
+
+            binned_datasets = lightcurve_binning.reduce_datasets(
+                event['datasets'], fittools.order_datasets(event['datasets']), **binning)
+            ndata_binned.append(sum([len(lc) for lc in binned_datasets.values()]))
+
+        print('Binning reduced the lightcurves to a median of ' + str(int(np.median(ndata_binned)))
+              + ' datapoints per event')
+        for mode in ['unbinned', 'binned']:
+            print(mode.capitalize() + ' fits (' + options['backend'] + '): ' + str(round(times[mode], 3)) + 's, '
+                  + str(round(len(events) / times[mode], 2)) + ' events/s')
+        print('Speed-up: ' + str(round(times['unbinned'] / times['binned'], 1)))
+
+        # Bias of the binned fits, relative to the unbinned fits and to the true parameters, in units
+        # of the uncertainties of the unbinned fits
+        for reference in ['unbinned', 'true']:
+            offsets = {'t0': [], 'u0': [], 'tE': []}
+            for i, event in enumerate(events):
+                unbinned = results['unbinned'][i]
+                binned = results['binned'][i]
+                for key in offsets.keys():
+                    ref_value = unbinned[key] if reference == 'unbinned' else event['params'][key]
+                    if np.isfinite(binned[key]) and np.isfinite(ref_value) and unbinned[key + '_error'] > 0.0:
+                        offsets[key].append((binned[key] - ref_value) / unbinned[key + '_error'])
+
+            print('Binned fit offset from ' + reference + ' parameters [sigma]: '
+                  + ', '.join([key + ' median ' + str(round(float(np.median(values)), 3))
+                               + ' max ' + str(round(float(np.max(np.abs(values))), 3))
+                               for key, values in offsets.items() if len(values) > 0]))
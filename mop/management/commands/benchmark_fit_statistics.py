@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand
+from mop.toolbox import fittools, fit_statistics, synthetic_lightcurves
+from pyLIMA.fits import TRF_fit
+from pyLIMA.fits import stats as pylima_stats
+from pyLIMA.models import PSPL_model
+from datetime import datetime
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the number of model evaluations and the time taken to derive the fit statistics ' \
+           'of a pyLIMA fit with separate chi2, residual and statistical test calculations, and with ' \
+           'the single-pass, cached statistics stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nevents', help='Number of synthetic events to fit', default=20, type=int)
+        parser.add_argument('--ndata', help='Number of datapoints per event', default=1000, type=int)
+        parser.add_argument('--seed', help='Seed for the synthetic event generator', default=42, type=int)
+
+    def handle(self, *args, **options):
+
+        events = synthetic_lightcurves.generate_event_set(options['nevents'], seed=options['seed'],
+                                                          ndata=options['ndata'])
+        print('Generated ' + str(len(events)) + ' synthetic events with '
+              + str(options['ndata']) + ' datapoints each')
+
+        results = {
+            'separate': {'nevals': 0, 'time': 0.0},
+            'single_pass': {'nevals': 0, 'time': 0.0},
+            'cached': {'nevals': 0, 'time': 0.0}
+        }
+        for event in events:
+            pevent = fittools.build_pylima_event(0.0, 0.0, event['datasets'])
+            pspl = PSPL_model.PSPLmodel(pevent, parallax=['None', 0.], blend_flux_parameter='ftotal')
+            pspl.define_model_parameters()
+            fit_tap = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
+            fit_tap.fit()
+
+            # Count the evaluations of the microlensing model made after the fit has converged
+            counter = count_model_evaluations(pspl)
+
+            # Statistics calculated as separate passes, as in the previous implementation
+            counter['nevals'] = 0
+            t1 = datetime.utcnow()
+            (chi2, pyLIMA_parameters) = fit_tap.model_chi2(fit_tap.fit_results['best_model'])
+            res = fit_tap.model_residuals(fit_tap.fit_results['best_model'])
+            residuals = np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])
+            pylima_stats.normal_Shapiro_Wilk(residuals)
+            pylima_stats.normal_Anderson_Darling(residuals)
+            pylima_stats.normal_Kolmogorov_Smirnov(residuals)
+            np.sum(residuals ** 2) / (len(residuals) - 5)
+            t2 = datetime.utcnow()
+            results['separate']['nevals'] += counter['nevals']
+            results['separate']['time'] += (t2 - t1).total_seconds()
+
+            # Single-pass statistics stage, as used when the fitted parameters are gathered
+            counter['nevals'] = 0
+            t1 = datetime.utcnow()
+            fittools.gather_model_parameters(pevent, fit_tap)
+            t2 = datetime.utcnow()
+            results['single_pass']['nevals'] += counter['nevals']
+            results['single_pass']['time'] += (t2 - t1).total_seconds()
+
+            # A second request for the statistics of the same fit, which should be served from the
+            # cache without evaluating the model
+            counter['nevals'] = 0
+            t1 = datetime.utcnow()
+            fit_statistics.get_fit_statistics(fit_tap.fit_results,
+                                              lambda: fittools.pylima_normalized_residuals(fit_tap))
+            t2 = datetime.utcnow()
+            results['cached']['nevals'] += counter['nevals']
+            results['cached']['time'] += (t2 - t1).total_seconds()
+
+        for stage, label in [('separate', 'Separate chi2, residuals and statistical tests'),
+                             ('single_pass', 'Single-pass statistics stage'),
+                             ('cached', 'Repeated request for cached statistics')]:
+            print(label + ': ' + str(round(results[stage]['nevals'] / len(events), 2))
+                  + ' model evaluations per fit, '
+                  + str(round(1000.0 * results[stage]['time'] / len(events), 3)) + 'ms per fit')
+
+
+def count_model_evaluations(pspl):
+    """Function to wrap the microlensing model evaluation method of a pyLIMA model instance so that
+    the number of calls made can be counted"""
+
+    counter = {'nevals': 0}
+    compute_model = pspl.compute_the_microlensing_model
+
+    def counted_compute_model(*args, **kwargs):
+        counter['nevals'] += 1
+        return compute_model(*args, **kwargs)
+
+    pspl.compute_the_microlensing_model = counted_compute_model
+
+    return counter
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from mop.toolbox import fit_benchmarks
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Time the stages of the fitting pipeline for seeded synthetic events with between 10^2 and ' \
+           '10^5 datapoints, including fits from the default and grid-search initial guesses, writing the ' \
+           'results as JSON so that they can be compared between commits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ndata', help='Numbers of datapoints per event', nargs='+', type=int,
+                            default=fit_benchmarks.NDATA)
+        parser.add_argument('--nevents', help='Number of synthetic events for each ndata', default=3, type=int)
+        parser.add_argument('--seed', help='Seed for the synthetic event generator', default=42, type=int)
+        parser.add_argument('--repeats', help='Number of timed calls of each stage per event', default=3, type=int)
+        parser.add_argument('--backend', help='Fitting backend used by fit_pspl_omega2', default='pylima',
+                            choices=['pylima', 'numpy'])
+        parser.add_argument('--stages', help='Stages of the pipeline to benchmark', nargs='+',
+                            default=fit_benchmarks.STAGES, choices=fit_benchmarks.STAGES)
+        parser.add_argument('--output', help='Path of the JSON file of results',
+                            default='benchmark_fitting_pipeline.json')
+        parser.add_argument('--compare', help='Path of the JSON results of a reference run to compare against',
+                            default=None)
+        parser.add_argument('--tolerance', help='Fractional slow-down of the median time reported as a regression',
+                            default=0.2, type=float)
+
+    def handle(self, *args, **options):
+
+        reference = None
+        if options['compare']:
+            with open(options['compare'], 'r') as f:
+                reference = json.load(f)
+
+        benchmark = fit_benchmarks.run_benchmarks(ndata_list=options['ndata'], nevents=options['nevents'],
+                                                  seed=options['seed'], repeats=options['repeats'],
+                                                  backend=options['backend'], stages=options['stages'])
+
+        for result in benchmark['results']:
+            print(result['stage'] + ' ndata=' + str(result['ndata']) + ': median '
+                  + str(round(1000.0 * result['median'], 3)) + 'ms, min '
+                  + str(round(1000.0 * result['min'], 3)) + 'ms'
+                  + ('; median ' + str(result['niter_median']) + ' iterations, max ' + str(result['niter_max'])
+                     + '; ' + str(result['nfailed']) + ' failed fits, ' + str(result['nmissed'])
+                     + ' converged away from the true event' if 'nfailed' in result else ''))
+
+        if reference:
+            benchmark['comparison'] = fit_benchmarks.compare_benchmarks(benchmark, reference,
+                                                                        tolerance=options['tolerance'])
+            print('Compared with commit ' + str(reference['metadata'].get('commit')) + ':')
+            for entry in benchmark['comparison']:
+                print(entry['stage'] + ' ndata=' + str(entry['ndata']) + ': '
+                      + str(round(entry['ratio'], 2)) + 'x reference time'
+                      + (', ' + '{:+d}'.format(entry['delta_failed']) + ' failed, '
+                         + '{:+d}'.format(entry['delta_missed']) + ' missed fits' if 'delta_failed' in entry else '')
+                      + (' REGRESSION' if entry['regression'] else ''))
+
+        with open(options['output'], 'w') as f:
+            json.dump(benchmark, f, indent=2)
+        print('Results written to ' + options['output'])
+
+        if reference and any([entry['regression'] for entry in benchmark['comparison']]):
+            raise CommandError('Benchmark regressions found relative to ' + options['compare'])
@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from mop.toolbox import lightcurve_loader, fit_benchmarks, synthetic_lightcurves
+from astropy.time import Time
+import time
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_repackage_lightcurves(photometry_qs):
+    """Function reproducing the previous unpacking of the photometry of a target by
+    MicrolensingTarget.get_reduced_data, which created a model instance and an astropy Time for
+    each datapoint, and converted each timestamp again to find the last observation"""
+
+    datasets = {}
+    for rd in photometry_qs:
+        if rd.source_name != 'Interferometry_predictor':
+            lc = datasets.setdefault(rd.bandpass, [])
+            lc.append([Time(rd.timestamp).jd, rd.brightness, rd.brightness_error])
+
+    ndata = 0
+    for passband, lc in datasets.items():
+        ndata += len(lc)
+        datasets[passband] = np.array(lc)
+
+    time_obs = [Time(rd.timestamp).jd for rd in photometry_qs]
+    last_observation = max(time_obs) if len(time_obs) > 0 else None
+
+    return datasets, ndata, last_observation
+
+def time_call(func, repeats):
+    """Function to return the result and the median duration of repeated calls of func [s]"""
+
+    times = []
+    for i in range(repeats):
+        t1 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t1)
+
+    return result, float(np.median(times))
+
+
+class Command(BaseCommand):
+
+    help = 'Compare the time taken to load the lightcurves of targets from the database by the columnar ' \
+           'loader with the previous path through PhotometryReducedDatum instances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--targets', help='Names of targets in the database to benchmark', nargs='*',
+                            default=[])
+        parser.add_argument('--ndata', help='Numbers of datapoints of the synthetic targets benchmarked '
+                            'if no targets are named', nargs='*', default=[1000, 10000, 50000], type=int)
+        parser.add_argument('--seed', help='Seed for the synthetic event generator', default=42, type=int)
+        parser.add_argument('--repeats', help='Number of timed calls of each loader', default=3, type=int)
+
+    def handle(self, *args, **options):
+
+        if len(options['targets']) > 0:
+            for name in options['targets']:
+                target = Target.objects.get(name=name)
+                self.benchmark_target(target, options['repeats'])
+
+        # Synthetic targets are stored within a transaction which is rolled back afterwards, so
+        # that the database is left unchanged
+        else:
+            events = [synthetic_lightcurves.generate_event_set(1, seed=options['seed'], ndata=ndata)[0]
+                      for ndata in options['ndata']]
+            with transaction.atomic():
+                for i, event in enumerate(events):
+                    target = Target.objects.create(name='Benchmark_loader_' + str(i), ra=270.0, dec=-30.0)
+                    photometry = fit_benchmarks.synthetic_photometry(event['datasets'])
+                    for rd in photometry:
+                        rd.target = target
+                        rd.source_location = target.name
+                    PhotometryReducedDatum.objects.bulk_create(photometry, batch_size=5000)
+                    self.benchmark_target(target, options['repeats'])
+                transaction.set_rollback(True)
+
+    def benchmark_target(self, target, repeats):
+        """Method to time both loaders for one target and report the comparison"""
+
+        qs = PhotometryReducedDatum.objects.filter(target=target).order_by('timestamp')
+
+        # Each call is given a fresh QuerySet, so that the query is made every time
+        ((legacy_datasets, legacy_ndata, _), legacy_time) = time_call(
+            lambda: legacy_repackage_lightcurves(qs.all()), repeats)
+        ((datasets, ndata), loader_time) = time_call(
+            lambda: lightcurve_loader.load_lightcurves(qs.all()), repeats)
+
+        # Check that the loaders agree exactly, since the fingerprints of the lightcurves used to
+        # decide whether events need refitting hash the JDs
+        max_dt = 0.0
+        identical = (ndata == legacy_ndata and list(datasets.keys()) == list(legacy_datasets.keys()))
+        for passband, lc in datasets.items():
+            if not identical:
+                break
+            max_dt = max(max_dt, float(np.abs(lc[:, 0] - legacy_datasets[passband][:, 0]).max()) * 86400.0)
+            identical = np.array_equal(lc, legacy_datasets[passband])
+
+        print(target.name + ': ' + str(ndata) + ' datapoints in ' + str(len(datasets)) + ' bandpasses, '
+              + 'instance loader ' + str(round(legacy_time, 4)) + 's, columnar loader '
+              + str(round(loader_time, 4)) + 's, speedup x'
+              + str(round(legacy_time / loader_time, 1) if loader_time > 0.0 else 'inf')
+              + ', max time difference ' + str(round(max_dt * 1e6, 1)) + 'us, results '
+              + ('identical' if identical else 'DIFFER'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from mop.toolbox import lightcurve_snapshot
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Write or refresh the on-disk snapshot of the lightcurves of all alive events, from which local ' \
+           'or manual batch runs can read lightcurves without querying the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Directory of the snapshot, by default $LIGHTCURVE_SNAPSHOT_DIR',
+                            default=lightcurve_snapshot.SNAPSHOT_DIR)
+        parser.add_argument('--full', help='Rewrite all of the lightcurves rather than only those which '
+                            'have changed', default=False, action='store_true')
+        parser.add_argument('--compact-threshold', help='Fraction of superseded datapoints in the snapshot '
+                            'above which it is compacted', default=lightcurve_snapshot.COMPACT_THRESHOLD,
+                            type=float)
+
+    def handle(self, *args, **options):
+
+        if not options['path']:
+            raise CommandError('No snapshot directory given with --path or $LIGHTCURVE_SNAPSHOT_DIR')
+
+        t1 = datetime.datetime.utcnow()
+        summary = lightcurve_snapshot.refresh_snapshot(path=options['path'], full=options['full'],
+                                                       compact_threshold=options['compact_threshold'])
+        t2 = datetime.datetime.utcnow()
+
+        print('Snapshot in ' + options['path'] + ' holds ' + str(summary['ntargets']) + ' targets and '
+              + str(summary['ndata']) + ' datapoints in ' + str(summary['nsegments']) + ' segment(s); updated '
+              + str(summary['nupdated']) + ', removed ' + str(summary['nremoved'])
+              + (', compacted' if summary['compacted'] else '') + ' in ' + str(t2 - t1))
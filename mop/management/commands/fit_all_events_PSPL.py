@@ -17,6 +17,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
 
         parser.add_argument('name_search_term', help='Search term to use for selecting events by name')
+        parser.add_argument('--force', help='Refit even if the photometry is unchanged since the last fit',
+                            default=False, action='store_true')
 
     def handle(self, *args, **options):
 
@@ -40,7 +42,7 @@ class Command(BaseCommand):
             mulens.get_reduced_data(photometry_datums.filter(target=mulens), datums.filter(target=mulens))
 
             try:
-                result = run_fit(mulens)
+                result = run_fit(mulens, force=options['force'])
 
                 logger.info('FIT_ALL_EVENTS: Completed modeling of ' + mulens.name)
             except:
@@ -23,6 +23,18 @@ class Command(BaseCommand):
         parser.add_argument('target_name', help='name of the event to fit')
         parser.add_argument('--cores', help='Number of workers to use', default=os.cpu_count(), type=int)
         parser.add_argument('--stout', help='Direction for standard output',)
+        parser.add_argument('--backend', help='Fitting backend to use', default='pylima',
+                            choices=['pylima', 'numpy'])
+        parser.add_argument('--warm-start', help='Seed the fit from the previously stored model',
+                            default=False, action='store_true')
+        parser.add_argument('--force', help='Refit even if the photometry is unchanged since the last fit',
+                            default=False, action='store_true')
+        parser.add_argument('--concurrent-models', help='Fit the two PSPL models concurrently',
+                            default=False, action='store_true')
+        parser.add_argument('--initializer', help='Method used to find the starting parameters of '
+                            'cold-start fits', default='default', choices=['default', 'grid'])
+        parser.add_argument('--staleness-gate', help='Only refit the event if its new datapoints are '
+                            'inconsistent with its stored model', default=False, action='store_true')
 
 
     def handle(self, *args, **options):
@@ -37,8 +49,12 @@ class Command(BaseCommand):
             ReducedDatum.objects.filter(target=mulens).order_by("timestamp")
         )
 
-        if len(mulens.red_data) > 0:
-            result = run_fit(mulens, cores=options['cores'], verbose=True)
+        if mulens.ndata > 0:
+            result = run_fit(mulens, cores=options['cores'], verbose=True, backend=options['backend'],
+                             warm_start=options['warm_start'], force=options['force'],
+                             concurrent_models=options['concurrent_models'],
+                             initializer=options['initializer'],
+                             staleness_gate=options['staleness_gate'])
 
         #except:
         #    logger.warning('Fitting event '+mulens.name+' hit an exception')
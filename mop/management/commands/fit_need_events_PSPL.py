@@ -1,10 +1,13 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
 from tom_targets.models import Target,TargetExtra
 from django.db import transaction
 from astropy.time import Time
-from mop.toolbox import fittools, utilities, querytools
+from mop.toolbox import fittools, utilities, querytools, fit_pool, fit_scheduler, fit_queue, lightcurve_binning
+from mop.toolbox import fit_telemetry, model_staleness, lightcurve_snapshot
 from mop.toolbox.mop_classes import MicrolensingEvent
+from microlensing_targets.models import FitCheckpoint
+from django.utils import timezone
 import datetime
 import os
 import logging
@@ -14,7 +17,8 @@ logger = logging.getLogger(__name__)
 
 from django.db import connection
 
-def run_fit(mulens, cores=0, verbose=False):
+def run_fit(mulens, cores=0, verbose=False, backend='pylima', warm_start=False, force=False,
+            concurrent_models=False, initializer='default', staleness_gate=False):
     """
     Function to perform a microlensing model fit to timeseries photometry.
 
@@ -22,10 +26,35 @@ def run_fit(mulens, cores=0, verbose=False):
         target   Target object
         red_data QuerySet of ReducedDatums for the target
         cores integer, optional number of processing cores to use
+        backend  str, optional fitting backend, 'pylima' or 'numpy'
+        warm_start bool, optional, seed the fit from the previously stored model parameters
+        force    bool, optional, refit the event even if its photometry is unchanged since the last fit
+        concurrent_models bool, optional, fit the two PSPL models concurrently
+        initializer str, optional, method used to find the starting parameters, 'default' or 'grid'
+        staleness_gate bool, optional, only refit the event if its new datapoints are inconsistent
+                    with the stored model
     """
 
     logger.info('Fitting event: '+mulens.name)
 
+    # Skip the fit entirely if the lightcurve data are identical to those used for the last fit
+    if not force and mulens.check_fingerprint():
+        logger.info('FIT: Photometry for ' + mulens.name + ' unchanged since the last fit, skipping')
+        if mulens.t0 and mulens.tE:
+            alive = fittools.check_event_alive(float(mulens.t0), float(mulens.tE), mulens.last_observation)
+            mulens.store_parameter_set({
+                'alive': alive,
+                'next_fit_due': fit_scheduler.next_fit_due(float(mulens.t0), float(mulens.tE),
+                                                           Time(datetime.datetime.utcnow()).jd)
+            })
+        return True
+
+    # Skip the fit if the stored model still describes the datapoints received since it was fitted
+    if staleness_gate and not force and mulens.fit_fingerprint \
+            and not model_staleness.apply_staleness_gate(mulens, Time(datetime.datetime.utcnow()).jd):
+        logger.info('FIT: Model for ' + mulens.name + ' consistent with new photometry, skipping')
+        return True
+
     t5 = datetime.datetime.utcnow()
     if verbose: utilities.checkpoint()
 
@@ -45,8 +74,10 @@ def run_fit(mulens, cores=0, verbose=False):
     if verbose: logger.info('Time taken chk 3: ' + str(t7 - t6))
 
     if mulens.ndata > 10:
-        (model_params, model_telescope, fit_status) = fittools.fit_pspl_omega2(
-            mulens.ra, mulens.dec, mulens.datasets)
+        previous_fit = mulens.get_previous_fit() if warm_start else None
+        (model_params, model_lightcurve, fit_status) = fittools.fit_pspl_omega2(
+            mulens.ra, mulens.dec, mulens.datasets, backend=backend, previous_fit=previous_fit,
+            concurrent_models=concurrent_models, initializer=initializer)
         logger.info('FIT: completed modeling process for ' + mulens.name
                     + ' with status ' + repr(fit_status))
 
@@ -54,37 +85,7 @@ def run_fit(mulens, cores=0, verbose=False):
         if verbose: utilities.checkpoint()
         if verbose: logger.info('Time taken chk 4: ' + str(t8 - t7))
 
-        # Store model lightcurve
-        if model_telescope and fit_status:
-            fittools.store_model_lightcurve(mulens, model_telescope)
-            logger.info('FIT: Stored model lightcurve for event '+mulens.name)
-        else:
-            logger.warning('FIT: No valid model fit produced so not model lightcurve for event '+mulens.name)
-
-        t9 = datetime.datetime.utcnow()
-        if verbose: utilities.checkpoint()
-        if verbose: logger.info('Time taken chk 5: ' + str(t9 - t8))
-
-        # Determine whether or not an event is still active based on the
-        # current time relative to its t0 and tE
-        if fit_status:
-            alive = fittools.check_event_alive(model_params['t0'], model_params['tE'], mulens.last_observation)
-            logger.info(mulens.name + ' alive status: ' + repr(alive))
-
-        t10 = datetime.datetime.utcnow()
-        if verbose: utilities.checkpoint()
-        if verbose: logger.info('Time taken chk 6: ' + str(t10 - t9))
-
-        # Store model parameters
-        if fit_status:
-            model_params['last_fit'] = Time(datetime.datetime.utcnow()).jd
-            model_params['alive'] = alive
-            mulens.store_model_parameters(model_params)
-            logger.info('FIT: Stored model parameters for event ' + mulens.name)
-
-        t11 = datetime.datetime.utcnow()
-        if verbose: utilities.checkpoint()
-        if verbose: logger.info('Time taken chk 6: ' + str(t11 - t10))
+        store_fit_results(mulens, model_params, model_lightcurve, fit_status, verbose=verbose)
 
     else:
         logger.info('Insufficient lightcurve data available to model event '+mulens.name)
@@ -101,15 +102,303 @@ def run_fit(mulens, cores=0, verbose=False):
     #    logger.error('Job failed: '+mulens.name)
     #    return False
 
-def select_random_events(target_list, max_nevents):
+def store_fit_results(mulens, model_params, model_lightcurve, fit_status, verbose=False, run=None):
+    """
+    Function to store the results of a model fit to a MicrolensingTarget, including the
+    model lightcurve, the fitted parameters, the updated alive status and the telemetry of the fit.
+    This is kept separate from the fitting process itself so that fits performed in worker
+    processes can be stored by the parent process.
+
+    Parameters:
+        mulens            MicrolensingTarget object
+        model_params      dict   Fitted model parameters returned by fittools.fit_pspl_omega2
+        model_lightcurve  array  Model lightcurve returned by fittools.fit_pspl_omega2
+        fit_status        bool   Status of the fit
+        run               FitCheckpoint  Optional, the run in which the fit was made
+    """
+
+    t1 = datetime.datetime.utcnow()
+
+    # Store model lightcurve
+    if model_lightcurve is not None and fit_status:
+        fittools.store_model_lightcurve(mulens, model_lightcurve)
+        logger.info('FIT: Stored model lightcurve for event '+mulens.name)
+    else:
+        logger.warning('FIT: No valid model fit produced so not model lightcurve for event '+mulens.name)
+
+    t2 = datetime.datetime.utcnow()
+    if verbose: utilities.checkpoint()
+    if verbose: logger.info('Time taken chk 5: ' + str(t2 - t1))
+
+    # Determine whether or not an event is still active based on the
+    # current time relative to its t0 and tE
+    if fit_status:
+        alive = fittools.check_event_alive(model_params['t0'], model_params['tE'], mulens.last_observation)
+        logger.info(mulens.name + ' alive status: ' + repr(alive))
+
+    t3 = datetime.datetime.utcnow()
+    if verbose: utilities.checkpoint()
+    if verbose: logger.info('Time taken chk 6: ' + str(t3 - t2))
+
+    # Store model parameters
+    if fit_status:
+        model_params['last_fit'] = Time(datetime.datetime.utcnow()).jd
+        model_params['next_fit_due'] = fit_scheduler.next_fit_due(model_params['t0'], model_params['tE'],
+                                                                  model_params['last_fit'])
+        model_params['alive'] = alive
+        if hasattr(mulens, 'fingerprint'):
+            model_params['fit_fingerprint'] = mulens.fingerprint
+        mulens.store_model_parameters(model_params)
+        logger.info('FIT: Stored model parameters for event ' + mulens.name)
+
+    fit_telemetry.store_telemetry(mulens, model_params, fit_status, run=run)
+
+    t4 = datetime.datetime.utcnow()
+    if verbose: utilities.checkpoint()
+    if verbose: logger.info('Time taken chk 7: ' + str(t4 - t3))
+
+def store_fit_batch(batch, target_data, worker=None, run=None):
+    """
+    Function to store the results of a batch of model fits from the parent process.
+    Each batch is stored within its own (nested) transaction so that a failure while storing
+    the results for one batch does not affect those already stored.
+
+    Parameters:
+        batch       list    of tuples of (event name, model_params, model_lightcurve, fit_status)
+        target_data dict    of MicrolensingTargets, indexed by name
+        worker      str     optional, identifier of the queue worker whose jobs for these events
+                            are completed in the same transaction
+        run         FitCheckpoint  optional, the run in which the fits were made
+    """
+
+    with transaction.atomic():
+        for (target_name, model_params, model_lightcurve, fit_status) in batch:
+            mulens = target_data[target_name]
+            logger.info('FIT: completed modeling process for ' + mulens.name
+                        + ' with status ' + repr(fit_status))
+            store_fit_results(mulens, model_params, model_lightcurve, fit_status, run=run)
+
+        if worker:
+            fit_queue.complete_fits(worker, [target_data[result[0]] for result in batch])
+
+    logger.info('FIT_NEED_EVENTS: Stored results for a batch of ' + str(len(batch)) + ' events')
+
+def generate_fit_tasks(target_list, target_data, time_now, force=False, warm_start=False, backend='pylima',
+                       deadline=None, completed=None, staleness_gate=False, run=None, snapshot=None):
+    """
+    Generator to load the photometry of a list of events, one event at a time, from a single
+    streamed query, and yield a fitting task for each event that needs to be fitted.
+    Events that do not need to be fitted, or which have too few datapoints to fit, are dealt with
+    immediately and their data released.  The events to be fitted are added to target_data, so that
+    the results of their fits can be stored by the calling process.
+    No further events are loaded once the deadline has passed.
+
+    Parameters:
+        target_list  list   MicrolensingTargets, in order of priority
+        target_data  dict   to be populated with the MicrolensingTargets to be fitted, indexed by name
+        time_now     float  Current JD
+        force        bool   Fit the events whether or not they need it
+        warm_start   bool   Seed the fits from the previously stored model parameters
+        backend      str    Fitting backend, 'pylima' or 'numpy'
+        deadline     datetime  Optional UTC time after which no further events are loaded
+        completed    set    Optional, to be populated with the IDs of the events dealt with
+                            without a fit
+        staleness_gate  bool  Only refit events whose new datapoints are inconsistent with
+                            their stored model
+        run          FitCheckpoint  Optional, the run in which the events are fitted
+        snapshot     LightcurveSnapshot  Optional, snapshot from which to read the lightcurves
+                            that are up to date, instead of the database
+
+    Returns:
+        task  tuple  (event name, RA, Dec, datasets dictionary, previous fit parameters or None)
+    """
+
+    logger.info('FIT_NEED_EVENTS: Reviewing target list to identify those that need remodeling')
+    # Only the entries of the model lightcurves, without their values, are retrieved in advance,
+    # since the tabular datasets are not used by the fits
+    datums = querytools.fetch_reduced_datums_for_targetset(target_list, tabular=False)
+    for i, (mulens, photometry, datasets) in enumerate(querytools.stream_lightcurves_for_targetset(target_list,
+                                                                                                snapshot=snapshot)):
+        if deadline and datetime.datetime.utcnow() >= deadline:
+            logger.info('FIT_NEED_EVENTS: Deadline reached after reviewing ' + str(i) + ' out of '
+                        + str(len(target_list)) + ' targets')
+            return
+
+        # Catch for events where the RA, Dec is not set - source of this error unknown
+        fitted = False
+        try:
+            if type(mulens.ra) == float:
+                mulens.get_reduced_data(photometry, datums.pop(mulens.pk), datasets=datasets)
+                del photometry, datasets
+
+                (status, reason) = mulens.check_need_to_fit()
+                logger.info('FIT_NEED_EVENTS: Need to fit ' + mulens.name
+                            + ': ' + repr(status) + ', reason: ' + reason)
+
+                # If the event is to be fitted, this will take care of evaluating whether or
+                # not the event is still alive, based on the new model.
+                # If the event is not to be fitted for any reason, we need to check whether or not
+                # it is still alive.
+                if mulens.need_to_fit or force:
+                    if staleness_gate and not force and mulens.ndata > 10 and mulens.fit_fingerprint \
+                            and not model_staleness.apply_staleness_gate(mulens, time_now, run=run):
+                        mulens.release_reduced_data()
+
+                    elif mulens.ndata > 10:
+                        logger.info('FIT: Found ' + str(len(mulens.datasets)) + ' datasets and a total of '
+                                    + str(mulens.ndata) + ' datapoints to model for event ' + mulens.name)
+                        target_data[mulens.name] = mulens
+                        previous_fit = mulens.get_previous_fit() if warm_start else None
+                        fitted = True
+                        yield (mulens.name, mulens.ra, mulens.dec, mulens.datasets, previous_fit)
+                    else:
+                        run_fit(mulens, backend=backend, force=force)
+                        mulens.release_reduced_data()
+
+                else:
+                    if mulens.t0 and mulens.tE:
+                        alive = fittools.check_event_alive(float(mulens.t0),
+                                                           float(mulens.tE),
+                                                           mulens.last_observation)
+                        if alive != bool(mulens.alive):
+                            update_extras = {'alive': alive}
+                            mulens.store_parameter_set(update_extras)
+                            logger.info('Updated Alive status to ' + repr(alive))
+
+                    # Defer the event until it is next due, so that it does not displace
+                    # others from the schedule of the following runs
+                    mulens.store_parameter_set({
+                        'next_fit_due': fit_scheduler.next_fit_due(float(mulens.t0), float(mulens.tE),
+                                                                   time_now)
+                    })
+                    mulens.release_reduced_data()
+
+                logger.info('FIT_NEED_EVENTS: evaluated target ' + mulens.name + ', '
+                            + str(i) + ' out of ' + str(len(target_list)))
+                utilities.checkpoint()
+
+            else:
+                logger.info('FIT_NEED_EVENTS: Event with invalid RA, Dec, skipping')
+
+        except ValueError:
+            logger.info('FIT_NEED_EVENTS: Could not create an Event object for ' + mulens.name + ', skipping')
+
+        if not fitted and completed is not None:
+            completed.add(mulens.pk)
+
+def get_binning(options):
+    """Function to return the binning of the baseline photometry requested by the command options,
+    or None if the lightcurves are to be fitted unbinned"""
+
+    if not options.get('bin_window'):
+        return None
+
+    return {'window': options['bin_window'], 'tE_multiple': options['bin_te_multiple']}
+
+def release_fit_batch(batch, target_data, completed=None):
+    """Function to release the MicrolensingTargets of a batch of fits once their results have been stored,
+    optionally adding their IDs to the set of completed events"""
+
+    for result in batch:
+        mulens = target_data.pop(result[0], None)
+        if mulens and completed is not None:
+            completed.add(mulens.pk)
+
+def record_checkpoint(checkpoint, target_list, completed, finished=False):
     """
-    Function to select a random set of max_nevents from the list provided
+    Function to record the progress of a run in its FitCheckpoint, listing the IDs of the events
+    not yet completed in order of priority.
+
+    Parameters:
+        checkpoint   FitCheckpoint or None
+        target_list  list   MicrolensingTargets selected for the run, in order of priority
+        completed    set    IDs of the events completed
+        finished     bool   Whether the run has finished
+    """
+
+    if not checkpoint:
+        return
+
+    checkpoint.remaining = [mulens.pk for mulens in target_list if mulens.pk not in completed]
+    checkpoint.ncompleted = len(completed)
+    if finished:
+        checkpoint.finished = timezone.now()
+    checkpoint.save()
+
+def fit_target_list(target_list, time_now, options, worker=None, deadline=None, checkpoint=None,
+                    completed=None, finish=True):
     """
-    rng = np.random.default_rng()
-    rng.shuffle(target_list)
-    selected_targets = target_list[0:max_nevents]
+    Function to fit a list of events in order of priority, storing the results in batches.
+    The photometry of each event is streamed from the database and packaged as a task only when
+    the worker pool is ready to accept it.  Only the lightcurve arrays are sent to the workers;
+    the results are returned to this process and stored in batches, after which the data of each
+    event are released.
+    Each batch is committed as it is stored, so that the results are kept even if the run is
+    terminated.  No further events are started once the deadline has passed, and the events
+    not yet completed are recorded in the checkpoint, if one is given.
+
+    Parameters:
+        target_list  list   MicrolensingTargets, in order of priority
+        time_now     float  Current JD
+        options      dict   Options of the fit_need_events_PSPL command
+        worker       str    optional, identifier of the queue worker which has claimed these events
+        deadline     datetime  optional, UTC time after which no further events are started
+        checkpoint   FitCheckpoint  optional, record of the progress of this run
+        completed    set    optional, IDs of the events already completed during this run, to
+                            which those completed here are added
+        finish       bool   Whether to record the run as finished in the checkpoint afterwards
+
+    Returns:
+        completed    set    IDs of the events completed
+    """
+
+    target_data = {}
+    if completed is None:
+        completed = set()
+    worker_stats = []
+    tasks = generate_fit_tasks(target_list, target_data, time_now,
+                               force=options['force'], warm_start=options['warm_start'],
+                               backend=options['backend'], deadline=deadline, completed=completed,
+                               staleness_gate=options.get('staleness_gate', False), run=checkpoint,
+                               snapshot=options.get('lightcurve_snapshot'))
+
+    batch = []
+    for i, result in enumerate(fit_pool.fit_event_stream(tasks, cores=options['cores'],
+                                                         backend=options['backend'],
+                                                         max_pending=options['max_pending'],
+                                                         memory_limit=options['memory_limit'],
+                                                         binning=get_binning(options),
+                                                         concurrent_models=options.get('concurrent_models', False),
+                                                         initializer=options.get('initializer', 'default'),
+                                                         max_tasks_per_worker=options.get('max_tasks_per_worker'),
+                                                         rss_watermark=options.get('worker_rss_watermark'),
+                                                         worker_stats=worker_stats)):
+        logger.info('FIT_NEED_EVENTS: completed modeling of ' + result[0] + ', '
+                    + str(i) + ' out of at most ' + str(len(target_list)))
+        target_data[result[0]].release_reduced_data()
+        batch.append(result)
+
+        if len(batch) >= options['batch_size']:
+            store_fit_batch(batch, target_data, worker=worker, run=checkpoint)
+            release_fit_batch(batch, target_data, completed=completed)
+            record_checkpoint(checkpoint, target_list, completed)
+            batch = []
+            utilities.checkpoint()
 
-    return selected_targets
+    if len(batch) > 0:
+        store_fit_batch(batch, target_data, worker=worker, run=checkpoint)
+        release_fit_batch(batch, target_data, completed=completed)
+
+    for stats in worker_stats:
+        logger.info('FIT_NEED_EVENTS: Worker ' + str(stats['pid']) + ' made ' + str(stats['ntasks'])
+                    + ' fit(s), RSS ' + repr(stats['rss_start']) + 'MiB at start, ' + repr(stats['rss_peak'])
+                    + 'MiB peak, retired: ' + repr(stats['retired']))
+    if checkpoint and len(worker_stats) > 0:
+        checkpoint.worker_stats = worker_stats
+
+    record_checkpoint(checkpoint, target_list, completed, finished=finish)
+
+    return completed
 
 class Command(BaseCommand):
     help = 'Fit events with PSPL and parallax, then ingest fit parameters in the db'
@@ -118,101 +407,174 @@ class Command(BaseCommand):
         parser.add_argument('--cores', help='Number of workers (CPU cores) to use', default=os.cpu_count(), type=int)
         parser.add_argument('--run-every', help='Run each Fit every N hours', default=4, type=int)
         parser.add_argument('--force', help='Require model fits', default=False, action='store_true')
+        parser.add_argument('--backend', help='Fitting backend to use', default='pylima',
+                            choices=['pylima', 'numpy'])
+        parser.add_argument('--warm-start', help='Seed fits from the previously stored model',
+                            default=False, action='store_true')
+        parser.add_argument('--batch-size', help='Number of fit results to store per transaction',
+                            default=1, type=int)
+        parser.add_argument('--max-events', help='Maximum number of events to fit per run',
+                            default=100, type=int)
+        parser.add_argument('--active-deadline', help='activeDeadlineSeconds of the cronjob, from which '
+                            'the time budget for fitting is derived', default=3600, type=int)
+        parser.add_argument('--deadline', help='Wall-clock time [s] after which no further fits are started, '
+                            'default derived from --active-deadline', default=0, type=float)
+        parser.add_argument('--max-pending', help='Maximum number of loaded events awaiting fitting, '
+                            'default 2 per worker', default=0, type=int)
+        parser.add_argument('--memory-limit', help='Resident memory [MiB] above which no further events '
+                            'are loaded until pending fits complete, 0 to disable', default=0, type=float)
+        parser.add_argument('--bin-window', help='Width [days] of the bins used to reduce the baseline '
+                            'photometry before fitting, 0 to fit unbinned', default=0, type=float)
+        parser.add_argument('--bin-te-multiple', help='Half-width of the region around t0 kept at full '
+                            'resolution when binning, in units of tE',
+                            default=lightcurve_binning.TE_MULTIPLE, type=float)
+        parser.add_argument('--max-tasks-per-worker', help='Number of fits after which each worker process '
+                            'is replaced, 0 to keep workers for the whole run', default=0, type=int)
+        parser.add_argument('--worker-rss-watermark', help='Resident memory [MiB] of a worker process above '
+                            'which it is replaced, 0 to disable', default=0, type=float)
+        parser.add_argument('--concurrent-models', help='Fit the two PSPL models of each event concurrently, '
+                            'using up to two cores per worker', default=False, action='store_true')
+        parser.add_argument('--initializer', help='Method used to find the starting parameters of '
+                            'cold-start fits', default='default', choices=['default', 'grid'])
+        parser.add_argument('--staleness-gate', help='Only refit events whose new datapoints are '
+                            'inconsistent with their stored model', default=False, action='store_true')
+        parser.add_argument('--snapshot', help='Read the lightcurves that are up to date from the lightcurve '
+                            'snapshot in the directory given, by default $LIGHTCURVE_SNAPSHOT_DIR, for local '
+                            'or manual runs', nargs='?', const=lightcurve_snapshot.SNAPSHOT_DIR, default=False)
+        parser.add_argument('--queue', help='Share the events to fit with other processes through the '
+                            'queue of fit jobs', default=False, action='store_true')
+        parser.add_argument('--claim-size', help='Number of fit jobs to claim from the queue at a time',
+                            default=10, type=int)
 
     def handle(self, *args, **options):
 
         # Configuration
         # Cap maximum allowed number of events to fit to avoid massive model fit processes
         # that trigger the OOMKiller, and trigger endless recycling of the fitting process
-        max_nevents = 100
-
+        max_nevents = options['max_events']
+        budget = fit_scheduler.time_budget(options['active_deadline'])
+
+        t1 = datetime.datetime.utcnow()
+        time_now = Time(t1).jd
+        deadline = t1 + datetime.timedelta(seconds=options['deadline'] if options['deadline'] else budget)
+        logger.info('FIT_NEED_EVENTS: Run will stop starting new fits at ' + deadline.isoformat())
+
+        if options['snapshot'] is None:
+            raise CommandError('No snapshot directory given with --snapshot or $LIGHTCURVE_SNAPSHOT_DIR')
+        options['lightcurve_snapshot'] = lightcurve_snapshot.open_snapshot(options['snapshot']) \
+            if options['snapshot'] else None
+
+        if options['queue']:
+            self.handle_queue(t1, time_now, deadline, options)
+            return
+
+        logger.info('FIT_NEED_EVENTS: Starting checkpoint: ')
+        utilities.checkpoint()
+
+        # Events not reached by the previous run, if it stopped at its deadline, are fitted first
+        last_run = FitCheckpoint.objects.order_by('-started').first()
+        resume = last_run.remaining if last_run else []
+        if len(resume) > 0:
+            logger.info('FIT_NEED_EVENTS: Resuming ' + str(len(resume)) + ' events not reached by the previous run')
+
+        # The selection of events is made in a short transaction, so that the results of each
+        # fit can be committed as soon as they are stored
         with transaction.atomic():
 
-            t1 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Starting checkpoint: ')
-            utilities.checkpoint()
-
-            # Fetch a list of alive microlensing targets that were last modelled more than
-            # the maximum allowed model age:
-            ts = querytools.get_alive_events_with_old_model(options['run_every'])
+            # Fetch a list of alive microlensing targets that are due to be refitted, or that
+            # were last modelled more than the maximum allowed model age:
+            ts = querytools.get_alive_events_due_for_fit(options['run_every'], time_now=time_now)
             logger.info('FIT_NEED_EVENTS: Initial queries selected '
-                        + str(ts.count()) + ' alive microlensing events last modeled before '
+                        + str(ts.count()) + ' alive microlensing events due for fitting or last modeled before '
                         + repr(options['run_every']) + 'hrs ago')
-            target_list = list(set(ts))
-            if len(target_list) > max_nevents:
-                target_list = select_random_events(target_list, max_nevents)
-                logger.info('FIT_NEED_EVENTS: Capped number of models to fit at ' + str(max_nevents))
-
-            utilities.checkpoint()
-
-            datums = ReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-            photometry_datums = PhotometryReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-
-            t2 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Retrieved associated data for ' + str(len(target_list)) + ' Targets')
-            utilities.checkpoint()
-            logger.info('FIT_NEED_EVENTS: Time taken chk 2: ' + str(t2 - t1))
-
-            logger.info('FIT_NEED_EVENTS: Reviewing target list to identify those that need remodeling')
-            target_data = {}
-            for i,mulens in enumerate(target_list):
-
-                # Catch for events where the RA, Dec is not set - source of this error unknown
-                try:
-                    if type(mulens.ra) == float:
-                        mulens.get_reduced_data(photometry_datums.filter(target=mulens), datums.filter(target=mulens))
-
-                        (status, reason) = mulens.check_need_to_fit()
-                        logger.info('FIT_NEED_EVENTS: Need to fit ' + mulens.name
-                                    + ': ' + repr(status) + ', reason: ' + reason)
-
-                        # If the event is to be fitted, this will take care of evaluating whether or
-                        # not the event is still alive, based on the new model.
-                        # If the event is not to be fitted for any reason, we need to check whether or not
-                        # it is still alive.
-                        if mulens.need_to_fit or options['force']:
-                            target_data[mulens.name] = mulens
-
-                        else:
-                            if mulens.t0 and mulens.tE:
-                                alive = fittools.check_event_alive(float(mulens.t0),
-                                                                   float(mulens.tE),
-                                                                   mulens.last_observation)
-                                if alive != bool(mulens.alive):
-                                    update_extras = {'alive': alive}
-                                    mulens.store_parameter_set(update_extras)
-                                    logger.info('Updated Alive status to ' + repr(alive))
-
-                        logger.info('FIT_NEED_EVENTS: evaluated target ' + mulens.name + ', '
-                                    + str(i) + ' out of ' + str(len(target_list)))
-                        utilities.checkpoint()
-
-                    else:
-                        logger.info('FIT_NEED_EVENTS: Event with invalid RA, Dec, skipping')
-
-                except ValueError:
-                    logger.info('FIT_NEED_EVENTS: Could not create an Event object for ' + mulens.name + ', skipping')
-
-            t3 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Collated data for ' + str(len(target_data)) + ' targets in ' + str(t3 - t2))
-            utilities.checkpoint()
-
-            # Loop through all targets in the set
-            for i, (target_name, mulens) in enumerate(target_data.items()):
-                logger.info('FIT_NEED_EVENTS: modeling target ' + mulens.name + ', '
-                            + str(i) + ' out of ' + str(len(target_data)))
-
-                t4 = datetime.datetime.utcnow()
 
-                result = run_fit(mulens, cores=options['cores'])
+            # Select the highest-priority events that can be fitted within the time budget for this run
+            target_list = fit_scheduler.schedule_fits(list(set(ts)), time_now, budget,
+                                                      cores=options['cores'], max_nevents=max_nevents,
+                                                      resume=resume)
+
+        checkpoint = FitCheckpoint.objects.create(
+            started=timezone.now(),
+            remaining=[mulens.pk for mulens in target_list]
+        )
+        FitCheckpoint.objects.filter(started__lt=timezone.now() - datetime.timedelta(days=7)).delete()
+        fit_telemetry.prune_telemetry()
+
+        utilities.checkpoint()
+
+        t2 = datetime.datetime.utcnow()
+        logger.info('FIT_NEED_EVENTS: Time taken chk 2: ' + str(t2 - t1))
+
+        completed = fit_target_list(target_list, time_now, options, deadline=deadline, checkpoint=checkpoint)
+
+        t6 = datetime.datetime.utcnow()
+        logger.info('FIT_NEED_EVENTS: Finished modeling ' + str(len(completed)) + ' of '
+                    + str(len(target_list)) + ' targets in ' + str(t6 - t1))
+        utilities.checkpoint()
+
+    def handle_queue(self, t1, time_now, deadline, options):
+        """
+        Method to fit events through the queue of fit jobs, so that any number of processes can
+        share the events to be fitted.  All events due to be fitted are enqueued, after which jobs
+        are claimed in small batches, in order of priority, until the queue is empty, the deadline
+        for this run derived from the scheduler's time budget has passed, or --max-events events
+        have been claimed by this process; jobs claimed but not started before the deadline are
+        returned to the queue.  Each step is performed in its own short transaction, and the leases
+        on the claimed jobs are renewed by a heartbeat while the fits are in progress.
+        The progress of the run is recorded in a FitCheckpoint, as for a scheduled run.  Its list of
+        remaining events is left empty, since events not reached are resumed from the queue itself.
+        """
+
+        worker = fit_queue.get_worker_id()
+        logger.info('FIT_NEED_EVENTS: Starting queue worker ' + worker)
+        utilities.checkpoint()
 
-                t5 = datetime.datetime.utcnow()
-                logger.info('FIT_NEED_EVENTS: Completed modeling of ' + mulens.name + ' in ' + str(t5 - t4))
+        with transaction.atomic():
+            ts = querytools.get_alive_events_due_for_fit(options['run_every'], time_now=time_now)
+            ranking = fit_scheduler.rank_fits(list(set(ts)), time_now)
+            fit_queue.enqueue_fits(ranking)
+
+        checkpoint = FitCheckpoint.objects.create(started=timezone.now(), remaining=[])
+        FitCheckpoint.objects.filter(started__lt=timezone.now() - datetime.timedelta(days=7)).delete()
+        fit_telemetry.prune_telemetry()
+
+        completed = set()
+        nclaimed = 0
+        heartbeat = fit_queue.LeaseHeartbeat(worker)
+        heartbeat.start()
+        try:
+            while datetime.datetime.utcnow() < deadline:
+                claim_size = options['claim_size']
+                if options['max_events']:
+                    claim_size = min(claim_size, options['max_events'] - nclaimed)
+                if claim_size < 1:
+                    logger.info('FIT_NEED_EVENTS: Reached the maximum of ' + str(options['max_events'])
+                                + ' events for this run')
+                    break
+
+                target_list = fit_queue.claim_fits(worker, claim_size)
+                if len(target_list) == 0:
+                    break
+                nclaimed += len(target_list)
+
+                fit_target_list(target_list, time_now, options, worker=worker, deadline=deadline,
+                                checkpoint=checkpoint, completed=completed, finish=False)
+
+                # Events which did not require a fit are also complete
+                fit_queue.complete_fits(worker, [mulens for mulens in target_list if mulens.pk in completed])
                 utilities.checkpoint()
 
-            t6 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Finished modeling set of targets in ' + str(t6 - t1))
-            utilities.checkpoint()
+        finally:
+            heartbeat.stop()
+            nreleased = fit_queue.release_fits(worker)
+            if nreleased > 0:
+                logger.info('FIT_NEED_EVENTS: Returned ' + str(nreleased) + ' unfinished job(s) to the queue')
+            record_checkpoint(checkpoint, [], completed, finished=True)
+
+        t2 = datetime.datetime.utcnow()
+        logger.info('FIT_NEED_EVENTS: Queue worker ' + worker + ' finished ' + str(len(completed))
+                    + ' events in ' + str(t2 - t1))
+        utilities.checkpoint()
 
 if __name__ == '__main__':
     main()
@@ -7,7 +7,7 @@ from requests.exceptions import HTTPError
 from tom_dataproducts.models import PhotometryReducedDatum
 from datetime import datetime
 from astropy.time import Time, TimezoneInfo
-from mop.toolbox import TAP, utilities, classifier_tools
+from mop.toolbox import TAP, utilities, classifier_tools, packed_lightcurves
 import logging
 
 logger = logging.getLogger(__name__)
@@ -65,6 +65,7 @@ class MOPGaia(gaia.GaiaBroker):
                                 bandpass='G',
                                 brightness=float(phot_data[2]))
 
+            packed_lightcurves.refresh_packed_lightcurves(target)
             (t_last_jd, t_last_date) = TAP.TAP_time_last_datapoint(target)
             target.latest_data_hjd = t_last_jd
             target.latest_data_utc = t_last_date
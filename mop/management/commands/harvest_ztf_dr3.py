@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand
 from tom_dataproducts.models import PhotometryReducedDatum
 from tom_targets.models import Target,TargetExtra
 from astropy.time import Time, TimezoneInfo
-from mop.toolbox import fittools
+from mop.toolbox import fittools, packed_lightcurves
 from mop.brokers import gaia as gaia_mop
 from django.conf import settings
 
@@ -102,6 +102,7 @@ class Command(BaseCommand):
                         except:
                             pass
 
+                    packed_lightcurves.refresh_packed_lightcurves(target)
                     logger.info('ZTF HARVESTER: Ingested ZTF data for ' + str(target.name))
 
             except:
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from tom_targets.models import Target
+from mop.toolbox import packed_lightcurves
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Check the packed lightcurves of targets against their photometry, rebuilding any that are ' \
+           'inconsistent together with their lightcurve summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', help='Name of a specific target or all')
+        parser.add_argument('--check-only', help='Report inconsistent packed lightcurves without rebuilding them',
+                            action='store_true')
+        parser.add_argument('--force', help='Rebuild the packed lightcurves and lightcurve summaries of all '
+                            'targets selected, whether or not they are consistent', action='store_true')
+
+    def handle(self, *args, **options):
+
+        t1 = datetime.datetime.utcnow()
+        if options['target'] == 'all':
+            qs = Target.objects.all().order_by('pk')
+        else:
+            qs = Target.objects.filter(name=options['target'])
+
+        ntargets = 0
+        ninconsistent = 0
+        nrebuilt = 0
+        for target in qs.iterator(chunk_size=500):
+            ntargets += 1
+            problems = {} if options['force'] else packed_lightcurves.check_packed_lightcurves(target)
+            for (bandpass, source_name), problem in problems.items():
+                logger.warning('PACKED_LIGHTCURVES: ' + target.name + ' ' + bandpass + ' ' + source_name
+                               + ': ' + problem)
+            ninconsistent += len(problems)
+
+            if not options['check_only'] and (options['force'] or len(problems) > 0):
+                packed_lightcurves.rebuild_packed_lightcurves(target)
+                nrebuilt += 1
+
+        t2 = datetime.datetime.utcnow()
+        print('Checked ' + str(ntargets) + ' target(s): ' + str(ninconsistent)
+              + ' inconsistent packed lightcurve(s), rebuilt the packed lightcurves of ' + str(nrebuilt)
+              + ' target(s) in ' + str(t2 - t1))
@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand
 from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
 from tom_targets.models import Target
 from astropy.time import Time
-from mop.toolbox import fittools
+from mop.toolbox import fittools, packed_lightcurves
 from mop.brokers import gaia as gaia_mop
 from django.conf import settings
 
@@ -39,6 +39,7 @@ class Command(BaseCommand):
            resolved_type = settings.DATA_PRODUCT_TYPES[data_type[0]][0]
            if resolved_type == 'photometry':
                PhotometryReducedDatum.objects.filter(target=target).delete()
+               packed_lightcurves.rebuild_packed_lightcurves(target)
            else:
                ReducedDatum.objects.filter(target=target, data_type=resolved_type).delete()
            print(target.name, ' : Clean!')
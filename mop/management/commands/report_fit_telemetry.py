@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from microlensing_targets.models import FitTelemetry, StalenessCheck
+from mop.toolbox import fit_telemetry, model_staleness
+from django.utils import timezone
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Report the cost of recent model fits from their telemetry: the slowest events, the distribution ' \
+           'of the cost of each fit and the trend across days or runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', help='Report fits made within this many days', default=7.0, type=float)
+        parser.add_argument('--nslowest', help='Number of slowest fits to list', default=10, type=int)
+        parser.add_argument('--backend', help='Report only fits made with this backend', default=None,
+                            choices=['pylima', 'numpy'])
+        parser.add_argument('--trend', help='Group the trend by day or by fit_need_events_PSPL run',
+                            default='day', choices=['day', 'run'])
+
+    def handle(self, *args, **options):
+
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        qs = FitTelemetry.objects.filter(created__gte=cutoff)
+        if options['backend']:
+            qs = qs.filter(backend=options['backend'])
+
+        # Events that were not refitted because their stored model still described their new data
+        summary = model_staleness.staleness_summary(StalenessCheck.objects.filter(created__gte=cutoff))
+        if summary['nchecks'] > 0:
+            print('Model staleness tests: ' + str(summary['nchecks']) + ' made, '
+                  + str(summary['navoided']) + ' refits avoided (' + str(round(100.0 * summary['fraction_avoided'], 1))
+                  + '%), median cost ' + str(round(1000.0 * summary['median_wall_time'], 2)) + 'ms')
+            for reason, count in sorted(summary['reasons'].items(), key=lambda x: -x[1]):
+                print('  ' + reason + ': ' + str(count))
+
+        distribution = fit_telemetry.cost_distribution(qs)
+        print('Telemetry of ' + str(distribution['nfits']) + ' fits made in the last '
+              + str(options['days']) + ' days')
+        if distribution['nfits'] == 0:
+            return
+
+        print('\nSlowest fits:')
+        for record in fit_telemetry.slowest_fits(qs, nfits=options['nslowest']):
+            stages = ', '.join([stage + ' ' + str(round(times['wall'], 2)) + 's'
+                                for stage, times in record.stage_times.items()])
+            print(record.target.name + ' ' + record.created.strftime('%Y-%m-%dT%H:%M:%S')
+                  + ': wall ' + str(round(record.wall_time, 2)) + 's, CPU ' + str(round(record.cpu_time, 2))
+                  + 's, ndata ' + str(record.ndata) + ' (fitted ' + str(record.ndata_fitted) + ')'
+                  + ', niter ' + str(record.niter) + ', nfev ' + str(record.nfev)
+                  + ', model ' + str(record.selected_model) + ', warm start ' + repr(record.warm_start)
+                  + ', peak RSS ' + str(round(record.peak_rss, 1) if record.peak_rss else None) + 'MiB'
+                  + ', status ' + repr(record.status) + ' [' + stages + ']')
+
+        print('\nCost distribution:')
+        for key, label in [('wall_time', 'Wall time [s]'), ('cpu_time', 'CPU time [s]'),
+                           ('niter', 'Iterations'), ('nfev', 'Function evaluations'),
+                           ('peak_rss', 'Peak RSS [MiB]')]:
+            if key in distribution:
+                print(label + ': ' + ', '.join([stat + ' ' + str(round(value, 3))
+                                                for stat, value in distribution[key].items()]))
+        print('Fraction of wall time per stage: '
+              + ', '.join([stage + ' ' + str(round(fraction, 3))
+                           for stage, fraction in distribution['stage_fraction'].items()]))
+        for decade, entry in distribution['wall_time_by_ndata'].items():
+            print('ndata ' + decade + ': ' + str(entry['nfits']) + ' fits, median wall time '
+                  + str(round(entry['median'], 3)) + 's')
+
+        print('\nTrend by ' + options['trend'] + ':')
+        for entry in fit_telemetry.cost_trend(qs, by=options['trend']):
+            print(str(entry[options['trend']]) + ': ' + str(entry['nfits']) + ' fits, total wall time '
+                  + str(round(entry['total_wall_time'], 2)) + 's, mean wall time '
+                  + str(round(entry['mean_wall_time'], 3)) + 's, mean CPU time '
+                  + str(round(entry['mean_cpu_time'], 3)) + 's, nfev ' + str(entry['total_nfev']))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from mop.toolbox import target_jobs
+from django.db import connection
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = 'Run the model fits and TAP requests queued from the target pages, one after another, ' \
+           'exiting once no queued jobs remain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-running', help='Maximum number of jobs run concurrently by all workers',
+                            default=target_jobs.MAX_RUNNING_JOBS, type=int)
+
+    def handle(self, *args, **options):
+
+        t1 = datetime.datetime.utcnow()
+        logger.info('RUN_TARGET_JOBS: Started at ' + str(t1))
+
+        njobs = target_jobs.run_jobs(max_running=options['max_running'])
+
+        connection.close()
+        t2 = datetime.datetime.utcnow()
+        logger.info('RUN_TARGET_JOBS: Ran ' + str(njobs) + ' job(s) in ' + str(t2 - t1))
@@ -18,6 +18,7 @@ from tom_dataproducts.processors.data_serializers import SpectrumSerializer
 from tom_observations.utils import get_sidereal_visibility
 from tom_targets.forms import TargetVisibilityForm
 from mop.toolbox import utilities
+from mop.toolbox import model_evaluation
 from mop.forms import TargetClassificationForm
 import logging
 
@@ -96,10 +97,13 @@ def mop_photometry(mulens):
     ))
 
     ### Try to plot model if exist
-    if mulens.existing_model:
+    (model_times, model_mags) = model_evaluation.model_lightcurve(mulens,
+                                                                  tmin=getattr(mulens, 'first_observation', None),
+                                                                  tmax=getattr(mulens, 'last_observation', None))
+    if model_times is not None:
 
-        fig.add_trace(go.Scatter(x = np.array(mulens.existing_model.value['lc_model_time']) - 2460000,
-                                 y = np.array(mulens.existing_model.value['lc_model_magnitude']),
+        fig.add_trace(go.Scatter(x = model_times - 2460000,
+                                 y = model_mags,
                                  mode = 'lines',
                                  name = 'Model',
                                  opacity = 0.5,
@@ -158,7 +162,7 @@ def interferometry_data(mulens):
     # Check for a valid model fit:
     context['model_valid'] = check_model_valid(mulens)
 
-    if mulens.existing_model:
+    if model_evaluation.model_parameters(mulens):
         context['t0_date'] = str(convert_JD_to_UTC(mulens.t0))
     else:
         context['t0_date'] = None
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from tom_observations.models import ObservationRecord
 from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
 from tom_targets.models import TargetExtra
+from django.db.models import Max
 from astropy import units as u
 from astropy.coordinates import Angle
 from astropy.time import Time, TimezoneInfo
@@ -15,6 +16,9 @@ from shapely.geometry.polygon import Polygon
 
 from mop.toolbox import TAP_priority
 from mop.toolbox import mop_classes
+from mop.toolbox import model_evaluation
+from mop.toolbox import lightcurve_summary
+from mop.toolbox import lightcurve_loader
 import logging
 
 logger = logging.getLogger(__name__)
@@ -207,13 +211,12 @@ def TAP_telescope_class(sdss_i_mag):
 #   return mag_now
 
 def TAP_mag_now(mulens):
-    lightcurve = ReducedDatum.objects.filter(target=mulens, data_type='lc_model')
     time_now = Time(datetime.datetime.now()).jd
 
-    if mulens.existing_model:
-        closest_mag = np.argmin(np.abs(lightcurve[0].value['lc_model_time']-time_now))
-        mag_now =  lightcurve[0].value['lc_model_magnitude'][closest_mag]
-
+    # The model magnitude is evaluated directly from the fitted parameters of the target
+    mag_now = model_evaluation.evaluate_model(mulens, time_now)
+    if mag_now is not None:
+        mag_now = float(mag_now)
         mulens.mag_now = round(mag_now,3)
         mulens.save()
         
@@ -280,24 +283,24 @@ def TAP_time_last_datapoint(target, source_name=None):
     Returns time of the latest datapoint in the lightcurve.  If no photometry for this target is available,
     this function returns a default timestamp for 1995-01-01.  This is done to indicate that any subsequent
     photometry should be considered to be more recent and therefore ingested.
+    The time is read from the target's LightcurveSummary where this is up to date, and otherwise from
+    the latest timestamp in the DB, rather than from the full lightcurve.
     """
-    if not source_name:
-        datasets = PhotometryReducedDatum.objects.filter(target=target).order_by('timestamp')
+    summary = lightcurve_summary.get_current_summary(target) if not source_name else None
+    if summary:
+        last_jd = summary.last_jd
     else:
-        datasets = PhotometryReducedDatum.objects.filter(target=target, source_name__icontains=source_name).order_by('timestamp')
+        qs = PhotometryReducedDatum.objects.filter(target=target)
+        if source_name:
+            qs = qs.filter(source_name__icontains=source_name)
+        else:
+            qs = qs.exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)
+        last_timestamp = qs.aggregate(Max('timestamp'))['timestamp__max']
+        last_jd = Time(last_timestamp, format='datetime').jd if last_timestamp else None
 
     # If there is existing photometry for this object, identify the most recent datapoint
-    if datasets.count() > 0:
-        time = [Time(i.timestamp, format='datetime').jd for i in datasets]
-
-        # It's apparently possible for targets to get ingested with a single, zero-length dataset array,
-        # in which case this exception handling is needed
-        if len(time) > 0:
-            last_jd = time[-1]
-            last_ts = Time(last_jd, format='jd').to_datetime(timezone=TimezoneInfo())
-        else:
-            last_jd = None
-            last_ts = None
+    if last_jd:
+        last_ts = Time(last_jd, format='jd').to_datetime(timezone=TimezoneInfo())
 
     # If there is no photometry for this target, return a default timestamp a long time ago
     # so that any photometry that subsequently becomes available will be more recent and MOP will
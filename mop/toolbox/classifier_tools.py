@@ -2,6 +2,10 @@ from astroquery.vizier import Vizier
 from astropy.coordinates import Angle, SkyCoord
 from astropy import units as u
 from mop.brokers import tns
+from mop.toolbox import lightcurve_summary
+from mop.toolbox import lightcurve_loader
+from tom_dataproducts.models import PhotometryReducedDatum
+from django.db.models import Min
 import logging
 import requests
 import numpy as np
@@ -197,21 +201,31 @@ def check_valid_dmag(mulens):
     lightcurves, and use it to estimate the change in magnitude from the baseline.
     If the change is < 0.5, return False, as the target has not brightened enough to be
     considered for follow-up.  If > 0.5mag, return True.
+    The peak magnitude is read from the target's LightcurveSummary where this is up to date, otherwise
+    from the brightest valid magnitude in the DB, or failing that from the lightcurves in mulens.datasets.
     """
 
-    if len(mulens.datasets) > 0:
+    summary = lightcurve_summary.get_current_summary(mulens)
+    if summary:
+        peak_mag = summary.mag_min
 
-        peak_mag = 50.0
+    else:
+        peak_mag = PhotometryReducedDatum.objects.filter(target=mulens, brightness__gt=0.0)\
+            .exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)\
+            .aggregate(Min('brightness'))['brightness__min']
+
+    if peak_mag is None and len(mulens.datasets) > 0:
         for passband, lc in mulens.datasets.items():
-            idx = np.where(lc[:,1] > 0.0)
-            if lc[idx].min() < peak_mag:
-                peak_mag = lc[idx].min()
+            mags = lc[lc[:,1] > 0.0, 1]
+            if len(mags) > 0 and (peak_mag is None or mags.min() < peak_mag):
+                peak_mag = mags.min()
+
+    if peak_mag is None:
+        return False
 
-        delta_mag = float(mulens.baseline_magnitude) - peak_mag
+    delta_mag = float(mulens.baseline_magnitude) - peak_mag
 
-        if delta_mag < 0.5:
-            return False
-    else:
+    if delta_mag < 0.5:
         return False
 
     return True
@@ -0,0 +1,287 @@
+from tom_dataproducts.models import PhotometryReducedDatum
+from mop.toolbox import fittools, synthetic_lightcurves, pspl_tools
+from pyLIMA.models import PSPL_model
+from pyLIMA.fits import TRF_fit
+from astropy.time import Time
+from datetime import datetime, timezone
+import importlib.metadata
+import subprocess
+import platform
+import time
+import os
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stages of the fitting pipeline which can be benchmarked, in the order they are run for each event.
+# The fit is benchmarked both from the default initial guess and from the minimum of the grid search
+STAGES = ['repackage_lightcurves', 'grid_search_guess', 'fit_pspl_omega2', 'fit_pspl_omega2_grid',
+          'gather_model_parameters', 'generate_model_lightcurve']
+
+# Stages which fit the event, for which the number of iterations and the quality of the fits are recorded
+FIT_STAGES = {'fit_pspl_omega2': 'default', 'fit_pspl_omega2_grid': 'grid'}
+
+# Maximum offset of the fitted t0 from the true value, in units of the true tE, and maximum factor
+# between the fitted and true tE, for a fit to be considered to have found the true event
+T0_TOLERANCE = 0.5
+TE_TOLERANCE = 2.0
+
+# Default numbers of datapoints per event, spanning the range from sparse alerts to dense survey lightcurves
+NDATA = [100, 1000, 10000, 100000]
+
+# Telescopes simulated for the benchmark events, combining survey and follow-up datasets
+TELESCOPES = ('I', 'g_ZTF', 'gp')
+
+def synthetic_photometry(datasets):
+    """
+    Function to convert the lightcurves of a synthetic event into the unsaved PhotometryReducedDatums
+    that would be returned by a query of the TOM, so that repackage_lightcurves can be timed without
+    the cost of the database query.
+
+    Parameters:
+        datasets     dict   of lightcurve arrays with columns [time, mag, err_mag]
+
+    Returns:
+        photometry   list   of PhotometryReducedDatums in order of timestamp
+    """
+
+    photometry = []
+    for name, lc in datasets.items():
+        timestamps = Time(lc[:, 0], format='jd').to_datetime(timezone=timezone.utc)
+        for ts, row in zip(timestamps, lc):
+            photometry.append(PhotometryReducedDatum(
+                timestamp=ts,
+                source_name='Synthetic',
+                bandpass=name,
+                brightness=float(row[1]),
+                brightness_error=float(row[2])
+            ))
+    photometry.sort(key=lambda rd: rd.timestamp)
+
+    return photometry
+
+def fit_pylima_model(datasets):
+    """Function to perform the pyLIMA fit of a static PSPL model to an event, returning the pyLIMA
+    Event and fit object required by gather_model_parameters"""
+
+    pevent = fittools.build_pylima_event(0.0, 0.0, datasets)
+    pspl = PSPL_model.PSPLmodel(pevent, parallax=['None', 0.], blend_flux_parameter='ftotal')
+    pspl.define_model_parameters()
+    fit_tap = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
+    fit_tap.fit()
+
+    return pevent, fit_tap
+
+def assess_fit(event, fit_result):
+    """
+    Function to summarize the outcome of a fit of a synthetic event, as the number of optimizer
+    iterations and function evaluations, and whether the fit failed its quality checks or converged
+    to a minimum away from the true event.
+
+    Parameters:
+        event       dict   Synthetic event, as produced by synthetic_lightcurves.generate_pspl_event
+        fit_result  tuple  (model_params, model_lightcurve, fit_status) returned by fit_pspl_omega2
+
+    Returns:
+        outcome     dict   of niter, nfev, failed and missed
+    """
+
+    (model_params, model_lightcurve, status) = fit_result
+    telemetry = model_params.get('fit_telemetry', {})
+    outcome = {'niter': telemetry.get('niter', 0), 'nfev': telemetry.get('nfev', 0),
+               'failed': False, 'missed': False}
+
+    truth = event['params']
+    if not status or not np.isfinite(model_params.get('tE', np.nan)):
+        outcome['failed'] = True
+    elif np.abs(model_params['t0'] - truth['t0']) > T0_TOLERANCE * truth['tE'] \
+            or not (1.0 / TE_TOLERANCE <= model_params['tE'] / truth['tE'] <= TE_TOLERANCE):
+        outcome['missed'] = True
+
+    return outcome
+
+def time_stage(stage, event, backend='pylima', repeats=3, outcomes=None):
+    """
+    Function to time repeated calls of a single stage of the fitting pipeline for one event.
+    The inputs of each stage are prepared outside the timed region, so that only the function
+    named is measured.
+
+    Parameters:
+        stage     str    Name of the stage, from STAGES
+        event     dict   Synthetic event, as produced by synthetic_lightcurves.generate_pspl_event
+        backend   str    Backend used by fit_pspl_omega2
+        repeats   int    Number of timed calls
+        outcomes  list   Optional, to be extended with the outcome of each call of the FIT_STAGES,
+                         as given by assess_fit
+
+    Returns:
+        times     list   Duration of each call [s]
+    """
+
+    datasets = event['datasets']
+    if stage == 'repackage_lightcurves':
+        photometry = synthetic_photometry(datasets)
+        func = lambda: fittools.repackage_lightcurves(photometry)
+
+    elif stage == 'grid_search_guess':
+        dataset = pspl_tools.PSPLDataset([lc for (name, lc) in fittools.select_lightcurves(datasets)])
+        func = lambda: pspl_tools.grid_search_guess(dataset)
+
+    elif stage in FIT_STAGES:
+        func = lambda: fittools.fit_pspl_omega2(0.0, 0.0, datasets, backend=backend,
+                                                initializer=FIT_STAGES[stage])
+
+    elif stage == 'gather_model_parameters':
+        (pevent, fit_tap) = fit_pylima_model(datasets)
+        def func():
+            # The fit statistics are cached on the fit object, and are cleared so that each call
+            # measures the full calculation
+            fit_tap.fit_results.pop('fit_statistics', None)
+            return fittools.gather_model_parameters(pevent, fit_tap)
+
+    elif stage == 'generate_model_lightcurve':
+        (model_params, model_lightcurve, status) = fittools.fit_pspl_omega2(0.0, 0.0, datasets, backend='numpy')
+        func = lambda: fittools.generate_model_lightcurve(model_params, datasets)
+
+    else:
+        raise ValueError('Unknown benchmark stage ' + stage)
+
+    times = []
+    for i in range(repeats):
+        t1 = time.perf_counter()
+        output = func()
+        times.append(time.perf_counter() - t1)
+        if stage in FIT_STAGES and outcomes is not None:
+            outcomes.append(assess_fit(event, output))
+
+    return times
+
+def run_benchmarks(ndata_list=NDATA, nevents=3, seed=42, repeats=3, backend='pylima', stages=STAGES):
+    """
+    Function to benchmark the stages of the fitting pipeline on sets of synthetic events of
+    increasing size.  The events for each ndata are generated from the same seed, so that the
+    results are reproducible between runs and can be compared between commits.
+
+    Parameters:
+        ndata_list  list   Numbers of datapoints per event
+        nevents     int    Number of synthetic events for each ndata
+        seed        int    Seed for the synthetic event generator
+        repeats     int    Number of timed calls of each stage per event
+        backend     str    Backend used by fit_pspl_omega2
+        stages      list   Names of the stages to benchmark, from STAGES
+
+    Returns:
+        benchmark   dict   with the 'metadata' of the run and a list of 'results', one per stage
+                           and ndata, giving the duration of each call and summary statistics [s].
+                           The results of the FIT_STAGES also give the median number of iterations
+                           and function evaluations, and the numbers of failed fits and of fits
+                           which converged away from the true event
+    """
+
+    benchmark = {
+        'metadata': get_metadata(),
+        'config': {'ndata': list(ndata_list), 'nevents': nevents, 'seed': seed, 'repeats': repeats,
+                   'backend': backend, 'stages': list(stages), 'telescopes': list(TELESCOPES)},
+        'results': []
+    }
+
+    for ndata in ndata_list:
+        events = synthetic_lightcurves.generate_event_set(nevents, seed=seed, ndata=ndata, telescopes=TELESCOPES)
+        npts = int(np.mean([sum([len(lc) for lc in event['datasets'].values()]) for event in events]))
+
+        for stage in stages:
+            times = []
+            outcomes = []
+            for event in events:
+                times += time_stage(stage, event, backend=backend, repeats=repeats, outcomes=outcomes)
+
+            result = {
+                'stage': stage,
+                'ndata': ndata,
+                'npts': npts,
+                'times': times,
+                'median': float(np.median(times)),
+                'min': float(np.min(times)),
+                'mean': float(np.mean(times)),
+                'points_per_second': float(npts / np.median(times)) if np.median(times) > 0.0 else None
+            }
+            if len(outcomes) > 0:
+                result['niter_median'] = float(np.median([outcome['niter'] for outcome in outcomes]))
+                result['niter_max'] = int(np.max([outcome['niter'] for outcome in outcomes]))
+                result['nfev_median'] = float(np.median([outcome['nfev'] for outcome in outcomes]))
+                result['nfailed'] = int(sum([outcome['failed'] for outcome in outcomes]))
+                result['nmissed'] = int(sum([outcome['missed'] for outcome in outcomes]))
+            benchmark['results'].append(result)
+            logger.info('FIT_BENCHMARKS: ' + stage + ' ndata=' + str(ndata)
+                        + ' median ' + str(round(result['median'], 6)) + 's')
+
+    return benchmark
+
+def compare_benchmarks(benchmark, reference, tolerance=0.2):
+    """
+    Function to compare the results of a benchmark run with those of a reference run, e.g. from an
+    earlier commit.  Stages are matched by name and ndata, and compared by their median duration.
+    For the FIT_STAGES, any increase in the number of failed fits, or of fits which converged away
+    from the true event, is also a regression.
+
+    Parameters:
+        benchmark   dict   Results of the current run, as returned by run_benchmarks
+        reference   dict   Results of the reference run
+        tolerance   float  Fractional increase in the median duration considered a regression
+
+    Returns:
+        comparison  list   of dicts giving the stage, ndata, the reference and current median
+                           durations, their ratio, the change in the number of failed or missed
+                           fits where these are recorded, and whether this is a regression
+    """
+
+    reference_results = {(r['stage'], r['ndata']): r for r in reference['results']}
+
+    comparison = []
+    for result in benchmark['results']:
+        ref = reference_results.get((result['stage'], result['ndata']))
+        if ref is None or ref['median'] <= 0.0:
+            continue
+        ratio = result['median'] / ref['median']
+        entry = {
+            'stage': result['stage'],
+            'ndata': result['ndata'],
+            'reference_median': ref['median'],
+            'median': result['median'],
+            'ratio': ratio,
+            'regression': bool(ratio > 1.0 + tolerance)
+        }
+        if 'nfailed' in result and 'nfailed' in ref:
+            entry['delta_failed'] = result['nfailed'] - ref['nfailed']
+            entry['delta_missed'] = result['nmissed'] - ref['nmissed']
+            entry['regression'] = entry['regression'] or entry['delta_failed'] > 0 or entry['delta_missed'] > 0
+        comparison.append(entry)
+
+    return comparison
+
+def get_metadata():
+    """Function to describe the environment of a benchmark run, so that results from different
+    commits and machines can be told apart"""
+
+    metadata = {
+        'date': datetime.now(timezone.utc).isoformat(),
+        'commit': None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__
+    }
+
+    try:
+        metadata['pyLIMA'] = importlib.metadata.version('pyLIMA')
+    except importlib.metadata.PackageNotFoundError:
+        metadata['pyLIMA'] = None
+
+    try:
+        metadata['commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                            check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    return metadata
@@ -0,0 +1,359 @@
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import functools
+import time
+import gc
+import os
+import logging
+from mop.toolbox import fittools, utilities, fit_telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def count_workers(cores, ntasks):
+    """Function to determine how many worker processes to use for a given number of fitting tasks.
+    The number of workers is capped at the number of available CPUs, since the fits are CPU-bound,
+    and at the number of tasks so that no idle processes are created"""
+
+    ncpus = os.cpu_count() or 1
+
+    if not cores or cores < 1:
+        cores = 1
+
+    return max(1, min(cores, ncpus, ntasks))
+
+
+def fit_event_worker(task, backend='pylima', binning=None, concurrent_models=False, initializer='default'):
+    """
+    Function to fit a single event in a worker process.  This function is deliberately free of
+    database access: the parent process packages the lightcurves and stores the results, so that
+    the workers need only the photometry arrays.
+
+    Parameters:
+        task    tuple   (event name, RA, Dec, datasets dictionary, previous fit parameters or None)
+        backend str     Fitting backend passed to fittools.fit_pspl_omega2
+        binning dict    Optional binning of the baseline photometry passed to fittools.fit_pspl_omega2
+        concurrent_models bool  Fit the two PSPL models concurrently, see fittools.fit_pspl_omega2
+        initializer str  Method used to find the starting parameters, see fittools.fit_pspl_omega2
+
+    Returns:
+        result tuple   (event name, model_params, model_lightcurve, fit_status)
+    """
+
+    (name, ra, dec, datasets, previous_fit) = task
+    telemetry = fit_telemetry.start_telemetry(datasets, backend)
+
+    try:
+        (model_params, model_lightcurve, fit_status) = fittools.fit_pspl_omega2(
+            ra, dec, datasets, backend=backend, previous_fit=previous_fit, binning=binning,
+            concurrent_models=concurrent_models, initializer=initializer)
+
+    # Exceptions are caught here rather than being allowed to propagate, since an exception raised
+    # by a worker would otherwise end the whole run
+    except Exception as e:
+        logger.warning('FIT_POOL: Fitting event ' + name + ' hit an exception: ' + repr(e))
+        model_params = {'fit_telemetry': fit_telemetry.finish_telemetry(telemetry)}
+        model_lightcurve = None
+        fit_status = False
+
+    return name, model_params, model_lightcurve, fit_status
+
+
+def fit_events(tasks, cores=1, backend='pylima', binning=None, concurrent_models=False, initializer='default'):
+    """
+    Generator to fit a list of events, distributing the fits over a pool of worker processes with
+    fit_event_stream, using no more workers than there are tasks.  Results are yielded back to the
+    caller in the order in which the fits complete.
+
+    Parameters:
+        tasks   list   of tuples of (event name, RA, Dec, datasets dictionary, previous fit or None)
+        cores   int    Number of worker processes requested
+        backend str    Fitting backend passed to fittools.fit_pspl_omega2
+        binning dict   Optional binning of the baseline photometry passed to fittools.fit_pspl_omega2
+        concurrent_models bool  Fit the two PSPL models of each event concurrently
+        initializer str  Method used to find the starting parameters, see fittools.fit_pspl_omega2
+
+    Returns:
+        result  tuple  (event name, model_params, model_lightcurve, fit_status) for each task
+    """
+
+    return fit_event_stream(tasks, cores=count_workers(cores, len(tasks)), backend=backend, binning=binning,
+                            concurrent_models=concurrent_models, initializer=initializer)
+
+
+def check_memory_limit(memory_limit):
+    """Function to determine whether the resident memory of the current process exceeds the
+    limit given [MiB].  A garbage collection is made before the limit is enforced, so that memory
+    held only by released objects is not counted.  A limit of None or zero disables the check"""
+
+    if not memory_limit:
+        return False
+
+    if utilities.memory_usage() <= memory_limit:
+        return False
+
+    gc.collect()
+
+    return utilities.memory_usage() > memory_limit
+
+
+def fit_event_stream(tasks, cores=1, backend='pylima', max_pending=None, memory_limit=None, binning=None,
+                     concurrent_models=False, initializer='default', max_tasks_per_worker=None,
+                     rss_watermark=None, worker_stats=None):
+    """
+    Generator to fit a stream of events, distributing the fits over a pool of worker processes.
+    The tasks are drawn lazily from an iterable in the parent process, so that the photometry of an event need only be loaded from the database shortly before it is
+    fitted, and can be released as soon as its results have been stored.
+    The number of tasks submitted to the pool but not yet returned is bounded, and no further
+    tasks are drawn while the resident memory of the parent process exceeds memory_limit, until
+    the pending fits have completed.  At least one task is always allowed to be pending, so that
+    the stream continues to progress even if the limit cannot be met.
+    If max_tasks_per_worker or rss_watermark are given, the fits are made by a RecyclingPool,
+    whose workers are replaced once they have completed that number of fits or their resident
+    memory has passed the watermark.  In this case a worker process is used even for a single core,
+    so that memory accumulated by the fits is never held by the parent process.
+
+    Parameters:
+        tasks        iterable  of tuples of (event name, RA, Dec, datasets dictionary, previous fit or None)
+        cores        int       Number of worker processes requested
+        backend      str       Fitting backend passed to fittools.fit_pspl_omega2
+        max_pending  int       Maximum number of tasks pending in the pool, default 2 per worker
+        memory_limit float     Optional resident memory ceiling for the parent process [MiB]
+        binning      dict      Optional binning of the baseline photometry passed to fittools.fit_pspl_omega2
+        concurrent_models bool Fit the two PSPL models of each event concurrently
+        initializer  str       Method used to find the starting parameters, see fittools.fit_pspl_omega2
+        max_tasks_per_worker int  Optional number of fits after which each worker is replaced
+        rss_watermark float    Optional resident memory of a worker [MiB] above which it is replaced
+        worker_stats list      Optional, to be populated with the memory statistics of each worker
+                               of a RecyclingPool
+
+    Returns:
+        result  tuple  (event name, model_params, model_lightcurve, fit_status) for each task
+    """
+
+    worker = functools.partial(fit_event_worker, backend=backend, binning=binning,
+                               concurrent_models=concurrent_models, initializer=initializer)
+    nworkers = count_workers(cores, cores)
+    if not max_pending or max_pending < 1:
+        max_pending = 2 * nworkers
+    logger.info('FIT_POOL: Fitting a stream of events with ' + str(nworkers) + ' worker(s), '
+                + str(max_pending) + ' pending task(s) and memory limit ' + repr(memory_limit) + 'MiB')
+
+    if max_tasks_per_worker or rss_watermark:
+        pool = RecyclingPool(worker, nworkers, max_tasks=max_tasks_per_worker, rss_watermark=rss_watermark)
+        try:
+            for result in pool.stream(tasks, max_pending=max_pending, memory_limit=memory_limit):
+                yield result
+        finally:
+            pool.close()
+            if worker_stats is not None:
+                worker_stats.extend(pool.stats)
+
+    # With a single worker, each event is loaded, fitted and returned before the next is drawn
+    elif nworkers == 1:
+        for task in tasks:
+            yield worker(task)
+
+    # Tasks are submitted individually, as capacity becomes available, so that the iterable of
+    # tasks, and any database queries needed to load them, are consumed only in this process
+    else:
+        tasks = iter(tasks)
+        exhausted = False
+        pending = {}
+
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=nworkers, mp_context=ctx) as executor:
+            while not exhausted or len(pending) > 0:
+                while not exhausted and len(pending) < max_pending:
+                    if len(pending) > 0 and check_memory_limit(memory_limit):
+                        logger.info('FIT_POOL: Memory limit reached with ' + str(len(pending))
+                                    + ' pending task(s), waiting for fits to complete')
+                        break
+                    try:
+                        task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(worker, task)] = task[0]
+
+                if len(pending) > 0:
+                    (done, not_done) = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = pending.pop(future)
+
+                        # Exceptions raised within the fit are caught by the worker, so any
+                        # remaining are failures to transfer the task or its result
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.warning('FIT_POOL: Fitting event ' + name + ' failed in the pool: ' + repr(e))
+                            result = (name, {}, None, False)
+                        yield result
+
+
+def recycling_worker_loop(conn, func):
+    """
+    Function run by each worker process of a RecyclingPool.  The worker reports its resident memory
+    when it starts, then receives tasks through its connection one at a time and returns the result
+    of each together with its resident memory after the fit, until it receives None.
+    """
+
+    conn.send(('started', utilities.memory_usage()))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        result = func(task)
+        conn.send(('result', result, utilities.memory_usage()))
+
+    conn.close()
+
+
+class RecyclingPool(object):
+    """
+    Pool of worker processes for fitting a stream of events, in which each worker is replaced by a
+    fresh process once it has completed max_tasks fits, or once its resident memory exceeds
+    rss_watermark [MiB].  Memory accumulated within a worker by the fitting libraries is therefore
+    released at regular intervals, without interrupting the stream: replacement workers are forked
+    from the parent process as soon as their predecessor retires, and the next task is already
+    drawn and waiting for them.
+    The memory statistics of every worker are recorded in the stats attribute.
+    """
+
+    def __init__(self, func, nworkers, max_tasks=None, rss_watermark=None):
+        self.func = func
+        self.nworkers = nworkers
+        self.max_tasks = max_tasks
+        self.rss_watermark = rss_watermark
+        self.ctx = multiprocessing.get_context('fork')
+        self.workers = []
+        self.stats = []
+
+    def start_worker(self):
+        """Method to fork a new worker process"""
+
+        (conn, child_conn) = self.ctx.Pipe()
+        process = self.ctx.Process(target=recycling_worker_loop, args=(child_conn, self.func))
+        process.start()
+        child_conn.close()
+
+        stats = {'pid': process.pid, 'ntasks': 0, 'rss_start': None, 'rss_peak': None,
+                 'rss_end': None, 'wall_time': 0.0, 'retired': None}
+        self.stats.append(stats)
+        worker = {'process': process, 'conn': conn, 'task': None, 'started': time.perf_counter(),
+                  'stats': stats}
+        self.workers.append(worker)
+
+        return worker
+
+    def retire_worker(self, worker, reason):
+        """Method to stop a worker process, recording the reason"""
+
+        try:
+            worker['conn'].send(None)
+        except (OSError, ValueError):
+            pass
+        worker['process'].join(timeout=10.0)
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+            worker['process'].join()
+        worker['conn'].close()
+
+        worker['stats']['retired'] = reason
+        worker['stats']['wall_time'] = time.perf_counter() - worker['started']
+        self.workers.remove(worker)
+        logger.info('FIT_POOL: Retired worker ' + str(worker['stats']['pid']) + ' (' + reason + ') after '
+                    + str(worker['stats']['ntasks']) + ' task(s), peak RSS '
+                    + str(worker['stats']['rss_peak']) + 'MiB')
+
+    def needs_recycling(self, worker):
+        """Method to return the reason why a worker should be replaced, or None"""
+
+        stats = worker['stats']
+        if self.max_tasks and stats['ntasks'] >= self.max_tasks:
+            return 'max_tasks'
+        if self.rss_watermark and stats['rss_end'] and stats['rss_end'] > self.rss_watermark:
+            return 'rss_watermark'
+
+        return None
+
+    def stream(self, tasks, max_pending=None, memory_limit=None):
+        """
+        Generator to fit a stream of tasks, yielding the results in the order in which the fits
+        complete.  Up to max_pending tasks are drawn ahead of the workers, subject to the memory
+        limit of the parent process, so that an idle worker never waits for the next task to be loaded.
+        """
+
+        tasks = iter(tasks)
+        exhausted = False
+        ready = []
+        if not max_pending or max_pending < self.nworkers:
+            max_pending = self.nworkers
+
+        while True:
+            # Draw tasks until enough are pending, either waiting or being fitted
+            nbusy = len([w for w in self.workers if w['task'] is not None])
+            while not exhausted and len(ready) + nbusy < max_pending:
+                if len(ready) + nbusy > 0 and check_memory_limit(memory_limit):
+                    break
+                try:
+                    ready.append(next(tasks))
+                except StopIteration:
+                    exhausted = True
+
+            # Assign the waiting tasks to idle workers, starting workers as required
+            while len(ready) > 0:
+                idle = [w for w in self.workers if w['task'] is None]
+                if len(idle) == 0 and len(self.workers) < self.nworkers:
+                    idle = [self.start_worker()]
+                if len(idle) == 0:
+                    break
+                idle[0]['task'] = ready.pop(0)
+                idle[0]['conn'].send(idle[0]['task'])
+
+            busy = [w for w in self.workers if w['task'] is not None]
+            if len(busy) == 0:
+                if exhausted and len(ready) == 0:
+                    return
+                continue
+
+            for conn in wait_connections([w['conn'] for w in busy]):
+                worker = [w for w in busy if w['conn'] is conn][0]
+                stats = worker['stats']
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    # The worker died during the fit, e.g. because it was killed for exceeding
+                    # the memory available
+                    name = worker['task'][0]
+                    logger.warning('FIT_POOL: Worker ' + str(stats['pid']) + ' exited while fitting ' + name)
+                    worker['task'] = None
+                    self.retire_worker(worker, 'crashed')
+                    yield (name, {}, None, False)
+                    continue
+
+                if message[0] == 'started':
+                    stats['rss_start'] = stats['rss_peak'] = message[1]
+                    continue
+
+                (result, rss) = message[1:]
+                worker['task'] = None
+                stats['ntasks'] += 1
+                stats['rss_end'] = rss
+                stats['rss_peak'] = max(stats['rss_peak'] or 0.0, rss)
+
+                reason = self.needs_recycling(worker)
+                if reason:
+                    self.retire_worker(worker, reason)
+
+                yield result
+
+    def close(self):
+        """Method to stop all remaining workers"""
+
+        for worker in list(self.workers):
+            self.retire_worker(worker, 'end_of_run' if worker['task'] is None else 'terminated')
@@ -0,0 +1,180 @@
+from microlensing_targets.models import FitJob
+from django.db import transaction, connection
+from django.db.models import Q, F
+from django.utils import timezone
+import threading
+import datetime
+import socket
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Duration of the lease taken by a worker on the jobs it claims [s].  Leases are renewed by the
+# worker's heartbeat at a fraction of this interval, so a job is returned to the queue within
+# this time of its worker crashing
+LEASE_DURATION = 600.0
+HEARTBEAT_FRACTION = 1.0 / 3.0
+
+# Maximum number of times a job may be claimed before it is marked as failed, so that an event
+# whose fit repeatedly crashes its worker does not block the queue
+MAX_ATTEMPTS = 3
+
+# Minimum interval before a completed job can be enqueued again [s], so that an event fitted by one
+# worker is not re-enqueued by another whose selection of events predates that fit
+REQUEUE_INTERVAL = 4.0 * 3600.0
+
+def get_worker_id():
+    """Function to return an identifier for the current worker process, unique across pods"""
+
+    return socket.gethostname() + ':' + str(os.getpid())
+
+def enqueue_fits(ranking, requeue_interval=REQUEUE_INTERVAL):
+    """
+    Function to add a set of events to the queue of model fits.  Events which are already queued
+    or leased have their priority updated, while events whose previous job completed more than
+    requeue_interval ago are queued again.  Concurrent calls from different workers are safe,
+    since each target has at most one job.
+
+    Parameters:
+        ranking           list   of tuples of (score, number of datapoints, MicrolensingTarget),
+                                 as returned by fit_scheduler.rank_fits
+        requeue_interval  float  Minimum interval before a completed job can be queued again [s]
+
+    Returns:
+        nqueued           int    Number of events newly added to the queue
+    """
+
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=requeue_interval)
+    nqueued = 0
+
+    with transaction.atomic():
+        existing = set(FitJob.objects.filter(target__in=[mulens for (score, ndata, mulens) in ranking])
+                       .values_list('target', flat=True))
+
+        new_jobs = []
+        for (score, ndata, mulens) in ranking:
+            if mulens.pk in existing:
+                FitJob.objects.filter(target=mulens, status__in=['queued', 'leased']).update(priority=score)
+                nqueued += FitJob.objects.filter(
+                    target=mulens,
+                    status__in=['done', 'failed'],
+                    completed__lt=cutoff
+                ).update(status='queued', priority=score, enqueued=now, worker='', lease_expiry=None,
+                         attempts=0, completed=None)
+            else:
+                new_jobs.append(FitJob(target=mulens, priority=score, enqueued=now))
+
+        # Jobs created concurrently by another worker are ignored
+        FitJob.objects.bulk_create(new_jobs, ignore_conflicts=True)
+        nqueued += len(new_jobs)
+
+    logger.info('FIT_QUEUE: Enqueued ' + str(nqueued) + ' of ' + str(len(ranking)) + ' events')
+
+    return nqueued
+
+def claim_fits(worker, nclaim, lease_duration=LEASE_DURATION):
+    """
+    Function to claim the highest-priority jobs available in the queue, by taking a lease on them.
+    Jobs are available if they are queued or if their previous lease has expired.  The jobs are
+    selected with SKIP LOCKED, so that concurrent workers claim disjoint sets of jobs without
+    waiting for each other.
+
+    Parameters:
+        worker          str    Identifier of the worker
+        nclaim          int    Maximum number of jobs to claim
+        lease_duration  float  Duration of the lease [s]
+
+    Returns:
+        target_list     list   MicrolensingTargets of the claimed jobs, in order of priority
+    """
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Jobs that have exhausted their attempts are not claimed again
+        nfailed = FitJob.objects.filter(
+            status='leased',
+            lease_expiry__lt=now,
+            attempts__gte=MAX_ATTEMPTS
+        ).update(status='failed', completed=now)
+        if nfailed > 0:
+            logger.warning('FIT_QUEUE: ' + str(nfailed) + ' job(s) failed after '
+                           + str(MAX_ATTEMPTS) + ' attempts')
+
+        jobs = list(FitJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status='queued') | Q(status='leased', lease_expiry__lt=now),
+            attempts__lt=MAX_ATTEMPTS
+        ).order_by('-priority', 'enqueued').values_list('pk', flat=True)[:nclaim])
+
+        FitJob.objects.filter(pk__in=jobs).update(
+            status='leased',
+            worker=worker,
+            lease_expiry=now + datetime.timedelta(seconds=lease_duration),
+            attempts=F('attempts') + 1
+        )
+
+    claimed = FitJob.objects.filter(pk__in=jobs, worker=worker).select_related('target')\
+        .order_by('-priority', 'enqueued')
+    target_list = [job.target for job in claimed]
+
+    logger.info('FIT_QUEUE: Worker ' + worker + ' claimed ' + str(len(target_list)) + ' job(s)')
+
+    return target_list
+
+def renew_leases(worker, lease_duration=LEASE_DURATION):
+    """Function to extend the leases on all jobs currently held by a worker.
+    Returns the number of leases renewed"""
+
+    return FitJob.objects.filter(status='leased', worker=worker).update(
+        lease_expiry=timezone.now() + datetime.timedelta(seconds=lease_duration)
+    )
+
+def complete_fits(worker, target_list):
+    """Function to mark the jobs of a list of events as done, provided that the worker still holds
+    their leases.  Returns the number of jobs completed"""
+
+    return FitJob.objects.filter(target__in=target_list, status='leased', worker=worker).update(
+        status='done',
+        lease_expiry=None,
+        completed=timezone.now()
+    )
+
+def release_fits(worker):
+    """Function to return any jobs still leased by a worker to the queue, e.g. when the worker
+    reaches its deadline before completing them.  The claim does not count as an attempt.
+    Returns the number of jobs released"""
+
+    return FitJob.objects.filter(status='leased', worker=worker).update(
+        status='queued',
+        worker='',
+        lease_expiry=None,
+        attempts=F('attempts') - 1
+    )
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Thread which renews the leases held by a worker at regular intervals, for as long as the
+    worker is running.  The thread uses its own database connection, and renews each lease in
+    its own short transaction.
+    """
+
+    def __init__(self, worker, lease_duration=LEASE_DURATION, interval=None):
+        super().__init__(daemon=True)
+        self.worker = worker
+        self.lease_duration = lease_duration
+        self.interval = interval if interval else lease_duration * HEARTBEAT_FRACTION
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                nrenewed = renew_leases(self.worker, lease_duration=self.lease_duration)
+                logger.info('FIT_QUEUE: Worker ' + self.worker + ' renewed ' + str(nrenewed) + ' lease(s)')
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,265 @@
+from tom_dataproducts.models import PhotometryReducedDatum
+from django.db.models import Count, Max
+from mop.toolbox import lightcurve_loader
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Limits on the interval between successive model fits of an event [days].  The minimum
+# corresponds to the cadence of the fit_need_events_PSPL cronjob
+MIN_FIT_INTERVAL = 4.0 / 24.0
+MAX_FIT_INTERVAL = 10.0
+
+# Interval between fits of an event at its peak, as a fraction of its tE.  The interval grows
+# linearly with the distance from the peak, in units of tE
+FIT_INTERVAL_TE_FRACTION = 0.02
+
+# Weights of the terms of the scoring function used to rank events for fitting
+SCORE_WEIGHTS = {
+    'age': 1.0,
+    'new_data': 1.0,
+    'tap_priority': 1.0,
+    'peak': 2.0
+}
+
+# Maximum contribution of the time since the last fit to the score, expressed as a multiple of the
+# fit interval, so that events which have never been fitted do not displace all others
+MAX_AGE_RATIO = 10.0
+
+# Model of the wall-clock time required to load and fit an event:
+# overhead per event plus time per datapoint [s]
+FIT_COST_OVERHEAD = 1.0
+FIT_COST_PER_POINT = 1.0e-3
+
+# Fraction of the cronjob's activeDeadlineSeconds reserved for the queries and storage of results
+# outside the fitting loop
+DEADLINE_MARGIN = 0.2
+
+def valid_model(t0, tE):
+    """Function to determine whether a stored model provides valid t0, tE parameters.
+    Parameters that could not be fitted are stored as zero"""
+
+    return bool(t0) and bool(tE) and np.isfinite(t0) and np.isfinite(tE) and tE > 0.0
+
+def fit_interval(t0, tE, time_now, max_interval=MAX_FIT_INTERVAL, min_interval=MIN_FIT_INTERVAL):
+    """
+    Function to calculate the interval before an event is next due to be fitted.  The interval
+    scales with the event's tE, so that short-timescale events are fitted more often, and it
+    increases with the distance from the peak, so that events in their baseline are fitted rarely.
+
+    Parameters:
+        t0, tE        float  Parameters of the current model of the event
+        time_now      float  Current JD
+        max_interval  float  Maximum interval [days]
+        min_interval  float  Minimum interval [days]
+
+    Returns:
+        interval      float  [days]
+    """
+
+    # Events without a valid model, including new events and those whose fit failed, are due again
+    # after the minimum interval, since they may be evolving rapidly
+    if not valid_model(t0, tE):
+        return min_interval
+
+    interval = FIT_INTERVAL_TE_FRACTION * tE * (1.0 + abs(time_now - t0) / tE)
+
+    return float(np.clip(interval, min_interval, max_interval))
+
+def next_fit_due(t0, tE, time_now, max_interval=MAX_FIT_INTERVAL):
+    """Function to return the JD when an event is next due to be fitted"""
+
+    return time_now + fit_interval(t0, tE, time_now, max_interval=max_interval)
+
+def count_datapoints(target_list):
+    """
+    Function to count the number of photometric datapoints stored for each of a list of Targets,
+    in a single query.
+
+    Returns:
+        counts  dict  Number of datapoints indexed by Target ID
+    """
+
+    qs = PhotometryReducedDatum.objects.filter(target__in=target_list)\
+        .values('target').annotate(ndata=Count('id'))
+
+    counts = {entry['target']: entry['ndata'] for entry in qs}
+
+    return counts
+
+def count_new_datapoints(mulens, ndata):
+    """Function to estimate the number of datapoints received for an event since its last model fit,
+    from the datapoint counts recorded in the fingerprint of the data used for that fit"""
+
+    if mulens.fit_fingerprint and 'counts' in mulens.fit_fingerprint:
+        nfitted = sum(mulens.fit_fingerprint['counts'].values())
+    else:
+        nfitted = 0
+
+    return max(ndata - nfitted, 0)
+
+def find_events_with_new_data(candidates):
+    """
+    Function to identify the events of a set which have received photometry since their last model
+    fit, with a single aggregate query.  Where the fingerprint of the data used for the last fit is
+    known, an event has new data if its number of datapoints or the time of its latest datapoint
+    differ from those of the fingerprint, which also catches datapoints received late.  Otherwise
+    it has new data if its latest datapoint was obtained after its last fit.
+
+    Parameters:
+        candidates  list   of tuples of (Target ID, last_fit, fit_fingerprint)
+
+    Returns:
+        new_data    set    of the IDs of the Targets with new data
+    """
+
+    if len(candidates) == 0:
+        return set()
+
+    qs = PhotometryReducedDatum.objects.filter(target__in=[entry[0] for entry in candidates])\
+        .exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)\
+        .values('target').annotate(ndata=Count('pk'), last_timestamp=Max('timestamp'))\
+        .values_list('target', 'ndata', 'last_timestamp')
+    photometry = {target_id: (ndata, last_timestamp) for (target_id, ndata, last_timestamp) in qs}
+    if len(photometry) == 0:
+        return set()
+
+    target_ids = list(photometry.keys())
+    last_jd = lightcurve_loader.datetimes_to_jd([photometry[target_id][1] for target_id in target_ids])
+    last_jd = dict(zip(target_ids, last_jd))
+
+    new_data = set()
+    for (target_id, last_fit, fingerprint) in candidates:
+        if target_id not in photometry:
+            continue
+        if fingerprint and 'counts' in fingerprint:
+            if photometry[target_id][0] != sum(fingerprint['counts'].values()) \
+                    or last_jd[target_id] > fingerprint.get('max_jd', 0.0):
+                new_data.add(target_id)
+        elif last_jd[target_id] > float(last_fit):
+            new_data.add(target_id)
+
+    return new_data
+
+def fit_priority_score(mulens, nnew, time_now, max_interval=MAX_FIT_INTERVAL):
+    """
+    Function to calculate the score used to rank events for model fitting.
+    The score combines:
+        - the time since the last fit, relative to the fit interval appropriate for the event
+        - the number of new datapoints since the last fit
+        - the TAP priority of the event
+        - the proximity of the event to its peak, in units of tE
+
+    Parameters:
+        mulens        MicrolensingTarget
+        nnew          int    Number of new datapoints since the last fit
+        time_now      float  Current JD
+        max_interval  float  Maximum interval between fits [days]
+
+    Returns:
+        score         float
+    """
+
+    t0 = float(mulens.t0) if mulens.t0 else 0.0
+    tE = float(mulens.tE) if mulens.tE else 0.0
+    interval = fit_interval(t0, tE, time_now, max_interval=max_interval)
+
+    age = min(max(time_now - float(mulens.last_fit), 0.0) / interval, MAX_AGE_RATIO)
+    tap_priority = float(mulens.tap_priority) if np.isfinite(mulens.tap_priority) else 0.0
+    if valid_model(t0, tE):
+        peak = np.exp(-0.5 * ((time_now - t0) / tE) ** 2)
+    else:
+        peak = 0.0
+
+    score = SCORE_WEIGHTS['age'] * np.log10(1.0 + age) \
+            + SCORE_WEIGHTS['new_data'] * np.log10(1.0 + nnew) \
+            + SCORE_WEIGHTS['tap_priority'] * np.log10(1.0 + max(tap_priority, 0.0)) \
+            + SCORE_WEIGHTS['peak'] * peak
+
+    return float(score)
+
+def estimate_fit_cost(ndata):
+    """Function to estimate the wall-clock time required to load and fit an event [s]"""
+
+    return FIT_COST_OVERHEAD + FIT_COST_PER_POINT * ndata
+
+def time_budget(active_deadline, margin=DEADLINE_MARGIN):
+    """Function to derive the wall-clock time available for fitting events during a single run [s],
+    from the activeDeadlineSeconds of the cronjob"""
+
+    return active_deadline * (1.0 - margin)
+
+def rank_fits(target_list, time_now, max_interval=MAX_FIT_INTERVAL):
+    """
+    Function to rank a list of events for model fitting in order of their fit_priority_score.
+
+    Parameters:
+        target_list   list   MicrolensingTargets which are due to be fitted
+        time_now      float  Current JD
+        max_interval  float  Maximum interval between fits [days]
+
+    Returns:
+        ranking       list   of tuples of (score, number of datapoints, MicrolensingTarget),
+                             in descending order of score
+    """
+
+    counts = count_datapoints(target_list)
+
+    ranking = []
+    for mulens in target_list:
+        ndata = counts.get(mulens.pk, 0)
+        nnew = count_new_datapoints(mulens, ndata)
+        score = fit_priority_score(mulens, nnew, time_now, max_interval=max_interval)
+        ranking.append((score, ndata, mulens))
+    ranking.sort(key=lambda entry: entry[0], reverse=True)
+
+    return ranking
+
+def schedule_fits(target_list, time_now, budget, cores=1, max_nevents=None, max_interval=MAX_FIT_INTERVAL,
+                  resume=None):
+    """
+    Function to select the events to fit during a single run.  The candidate events are ranked
+    by their fit_priority_score, and selected in order of priority until the estimated time
+    required to fit them fills the time budget available.  Events carried over from a previous
+    run which did not reach them are ranked ahead of all others, in their original order.
+
+    Parameters:
+        target_list   list   MicrolensingTargets which are due to be fitted
+        time_now      float  Current JD
+        budget        float  Wall-clock time available for fitting [s]
+        cores         int    Number of worker processes that will perform the fits
+        max_nevents   int    Optional maximum number of events to select
+        max_interval  float  Maximum interval between fits [days]
+        resume        list   Optional IDs of Targets carried over from a previous run
+
+    Returns:
+        selected      list   MicrolensingTargets to be fitted, in order of priority
+    """
+
+    ranking = rank_fits(target_list, time_now, max_interval=max_interval)
+    if resume:
+        order = {pk: i for i, pk in enumerate(resume)}
+        ranking.sort(key=lambda entry: order.get(entry[2].pk, len(order)))
+
+    # The fits are distributed over the workers, so the budget available scales with their number.
+    # The highest-priority event is always selected, even if its fit is expected to exceed the budget
+    total_budget = budget * max(cores, 1)
+    selected = []
+    total_cost = 0.0
+    for (score, ndata, mulens) in ranking:
+        if max_nevents and len(selected) >= max_nevents:
+            break
+        cost = estimate_fit_cost(ndata)
+        if len(selected) > 0 and total_cost + cost > total_budget:
+            continue
+        selected.append(mulens)
+        total_cost += cost
+        logger.info('FIT_SCHEDULER: Selected ' + mulens.name + ' with score ' + str(round(score, 3))
+                    + ', ' + str(ndata) + ' datapoints, estimated cost ' + str(round(cost, 1)) + 's')
+
+    logger.info('FIT_SCHEDULER: Selected ' + str(len(selected)) + ' of ' + str(len(target_list))
+                + ' candidate events, with estimated total cost ' + str(round(total_cost, 1))
+                + 's for a budget of ' + str(round(total_budget, 1)) + 's')
+
+    return selected
@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import stats
+import logging
+
+logger = logging.getLogger(__name__)
+
+def compute_fit_statistics(residuals, reference_mask=None, nparams=5):
+    """
+    Function to derive the goodness-of-fit statistics of a model from a single vector of its
+    normalized photometric residuals.  The chi squared is computed over all datapoints, while the
+    tests of the normality of the residuals, and chi2_dof, consider the reference dataset only.
+    The residuals of the reference dataset are sorted once and shared between the
+    Shapiro-Wilk, Anderson-Darling and Kolmogorov-Smirnov tests.
+
+    Parameters:
+        residuals       array  Normalized residuals (data - model)/sigma of all datapoints
+        reference_mask  array  Boolean mask selecting the datapoints of the reference dataset;
+                               if None, all datapoints are used
+        nparams         int    Number of parameters used to compute chi2_dof
+
+    Returns:
+        statistics      dict   chi2, ndata, chi2_dof, sw_test, ad_test, ks_test
+    """
+
+    residuals = np.asarray(residuals, dtype=float)
+    if reference_mask is None:
+        reference_mask = np.ones(len(residuals), dtype=bool)
+
+    square_residuals = residuals ** 2
+    statistics = {
+        'chi2': float(square_residuals.sum()),
+        'ndata': len(residuals)
+    }
+
+    try:
+        sample = np.sort(residuals[reference_mask])
+        n = len(sample)
+        if n <= max(nparams, 2):
+            raise ValueError('Too few datapoints in the reference dataset (' + str(n) + ')')
+        statistics['chi2_dof'] = float(square_residuals[reference_mask].sum() / (n - nparams))
+
+        # Shapiro-Wilk test of the normality of the residuals
+        statistics['sw_test'] = float(stats.shapiro(sample)[0])
+
+        # Kolmogorov-Smirnov distance between the residuals and a normal distribution with
+        # mu = 0, sigma = 1
+        i = np.arange(1.0, n + 1.0)
+        cdf = stats.norm.cdf(sample)
+        statistics['ks_test'] = float(max((i / n - cdf).max(), (cdf - (i - 1.0) / n).max()))
+
+        # Anderson-Darling statistic for a normal distribution of the sample mean and standard deviation
+        w = (sample - sample.mean()) / sample.std(ddof=1)
+        statistics['ad_test'] = float(
+            -n - np.sum((2.0 * i - 1.0) / n * (stats.norm.logcdf(w) + stats.norm.logsf(w)[::-1]))
+        )
+
+    except ValueError as e:
+        logger.warning('FIT_STATISTICS: Unable to compute residual statistics: ' + repr(e))
+        for key in ['chi2_dof', 'sw_test', 'ad_test', 'ks_test']:
+            statistics[key] = np.nan
+
+    return statistics
+
+def get_fit_statistics(fit_results, residual_function, nparams=5):
+    """
+    Function to return the goodness-of-fit statistics of a fitted model.  The residuals are
+    evaluated, using the function provided, only the first time the statistics of a given fit
+    are requested; the result is cached in the fit_results dictionary of the fit so that later
+    callers reuse it without evaluating the model again.
+
+    Parameters:
+        fit_results        dict      fit_results of a pyLIMA fit object, or the dictionary returned
+                                     by pspl_tools.fit_pspl or pspl_batch.fit_pspl_batch
+        residual_function  callable  Returning a tuple of (normalized residuals, reference_mask)
+        nparams            int       Number of parameters used to compute chi2_dof
+
+    Returns:
+        statistics         dict      as returned by compute_fit_statistics
+    """
+
+    if 'fit_statistics' not in fit_results:
+        (residuals, reference_mask) = residual_function()
+        fit_results['fit_statistics'] = compute_fit_statistics(residuals, reference_mask=reference_mask,
+                                                               nparams=nparams)
+
+    return fit_results['fit_statistics']
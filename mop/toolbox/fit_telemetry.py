@@ -0,0 +1,205 @@
+from microlensing_targets.models import FitTelemetry, StalenessCheck
+from mop.toolbox import utilities
+from django.db.models.functions import TruncDate
+from django.db.models import Count, Sum
+from django.utils import timezone
+from contextlib import contextmanager
+import datetime
+import time
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Age after which telemetry records are deleted [days]
+RETENTION = 90.0
+
+def start_telemetry(datasets, backend):
+    """
+    Function to begin the telemetry record of a model fit, describing the lightcurves to be fitted.
+
+    Parameters:
+        datasets   dict   of lightcurve arrays, indexed by dataset name
+        backend    str    Fitting backend
+
+    Returns:
+        telemetry  dict   to be completed as the fit progresses
+    """
+
+    ndata_per_telescope = {name: len(lc) for name, lc in datasets.items()}
+
+    return {
+        'backend': backend,
+        'ndata': int(sum(ndata_per_telescope.values())),
+        'ndata_fitted': int(sum(ndata_per_telescope.values())),
+        'ndata_per_telescope': ndata_per_telescope,
+        'niter': 0,
+        'nfev': 0,
+        'selected_model': None,
+        'stages': {},
+        'wall_time': 0.0,
+        'cpu_time': 0.0,
+        'peak_rss': utilities.memory_usage(),
+        't_start': (time.perf_counter(), time.process_time())
+    }
+
+@contextmanager
+def timed_stage(telemetry, stage):
+    """
+    Context manager to accumulate the wall-clock and CPU time of a stage of a fit in its telemetry.
+    The resident memory of the process is sampled at the end of each stage, and its maximum
+    recorded as the peak for the fit.  Note that CPU time spent in other processes, e.g. by a
+    model fitted concurrently, is not included.
+    """
+
+    t1 = (time.perf_counter(), time.process_time())
+    try:
+        yield
+    finally:
+        stage_times = telemetry['stages'].setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+        stage_times['wall'] += time.perf_counter() - t1[0]
+        stage_times['cpu'] += time.process_time() - t1[1]
+        telemetry['peak_rss'] = max(telemetry['peak_rss'], utilities.memory_usage())
+
+def finish_telemetry(telemetry):
+    """Function to record the total wall-clock and CPU time of a fit in its telemetry"""
+
+    (wall, cpu) = telemetry.pop('t_start')
+    telemetry['wall_time'] = time.perf_counter() - wall
+    telemetry['cpu_time'] = time.process_time() - cpu
+
+    return telemetry
+
+def store_telemetry(mulens, model_params, fit_status, run=None):
+    """
+    Function to store the telemetry of a fit, if it was recorded, as a FitTelemetry entry.
+
+    Parameters:
+        mulens        MicrolensingTarget
+        model_params  dict   Fitted model parameters, including the fit_telemetry
+        fit_status    bool   Status of the fit
+        run           FitCheckpoint  Optional, the run in which the fit was made
+
+    Returns:
+        record        FitTelemetry or None
+    """
+
+    telemetry = model_params.get('fit_telemetry') if model_params else None
+    if not telemetry:
+        return None
+
+    record = FitTelemetry.objects.create(
+        target=mulens,
+        run=run,
+        created=timezone.now(),
+        backend=telemetry.get('backend', ''),
+        status=bool(fit_status),
+        ndata=telemetry.get('ndata', 0),
+        ndata_fitted=telemetry.get('ndata_fitted', 0),
+        ndata_per_telescope=telemetry.get('ndata_per_telescope', {}),
+        niter=telemetry.get('niter', 0),
+        nfev=telemetry.get('nfev', 0),
+        warm_start=bool(model_params.get('fit_warm_start', False)),
+        selected_model=telemetry.get('selected_model'),
+        wall_time=telemetry.get('wall_time', 0.0),
+        cpu_time=telemetry.get('cpu_time', 0.0),
+        stage_times=telemetry.get('stages', {}),
+        peak_rss=telemetry.get('peak_rss')
+    )
+
+    return record
+
+def prune_telemetry(retention=RETENTION):
+    """Function to delete telemetry records, including the records of model staleness tests,
+    older than the retention period [days].  Returns the number of records deleted"""
+
+    cutoff = timezone.now() - datetime.timedelta(days=retention)
+    (ndeleted, details) = FitTelemetry.objects.filter(created__lt=cutoff).delete()
+    (nchecks, details) = StalenessCheck.objects.filter(created__lt=cutoff).delete()
+    ndeleted += nchecks
+
+    return ndeleted
+
+def slowest_fits(qs, nfits=10):
+    """Function to return the nfits most expensive fits of a QuerySet of FitTelemetry,
+    by wall-clock time"""
+
+    return list(qs.select_related('target').order_by('-wall_time')[:nfits])
+
+def cost_distribution(qs, percentiles=(50, 90, 99)):
+    """
+    Function to summarize the distribution of the cost of a set of fits.
+
+    Parameters:
+        qs           QuerySet of FitTelemetry
+        percentiles  list   Percentiles to report
+
+    Returns:
+        distribution dict   giving, for the wall and CPU time, niter, nfev and peak RSS, the given
+                            percentiles and the maximum, together with the fraction of the total
+                            wall-clock time spent in each stage and the median wall time of fits in
+                            each decade of ndata
+    """
+
+    records = list(qs.values_list('wall_time', 'cpu_time', 'niter', 'nfev', 'peak_rss', 'ndata', 'stage_times'))
+    distribution = {'nfits': len(records)}
+    if len(records) == 0:
+        return distribution
+
+    for i, key in enumerate(['wall_time', 'cpu_time', 'niter', 'nfev', 'peak_rss']):
+        values = np.array([r[i] for r in records if r[i] is not None], dtype=float)
+        if len(values) > 0:
+            distribution[key] = {'p' + str(p): float(np.percentile(values, p)) for p in percentiles}
+            distribution[key]['max'] = float(values.max())
+
+    total_wall = sum([r[0] for r in records])
+    stage_wall = {}
+    for r in records:
+        for stage, times in r[6].items():
+            stage_wall[stage] = stage_wall.get(stage, 0.0) + times['wall']
+    distribution['stage_fraction'] = {stage: wall / total_wall if total_wall > 0.0 else 0.0
+                                      for stage, wall in stage_wall.items()}
+
+    ndata_decades = {}
+    for r in records:
+        decade = int(np.floor(np.log10(r[5]))) if r[5] > 0 else 0
+        ndata_decades.setdefault(decade, []).append(r[0])
+    distribution['wall_time_by_ndata'] = {
+        '1e' + str(decade) + '-1e' + str(decade + 1): {'nfits': len(values), 'median': float(np.median(values))}
+        for decade, values in sorted(ndata_decades.items())
+    }
+
+    return distribution
+
+def cost_trend(qs, by='day'):
+    """
+    Function to summarize the cost of a set of fits over time, grouped by the day on which they
+    were made or by the fit_need_events_PSPL run that made them.
+
+    Parameters:
+        qs   QuerySet of FitTelemetry
+        by   str   'day' or 'run'
+
+    Returns:
+        trend  list   of dicts giving the group, number of fits, total and mean wall and CPU time
+                      and total nfev, in chronological order
+    """
+
+    if by == 'run':
+        group = 'run'
+        qs = qs.filter(run__isnull=False)
+    else:
+        group = 'day'
+        qs = qs.annotate(day=TruncDate('created'))
+
+    trend = []
+    for entry in qs.values(group).annotate(
+            nfits=Count('id'),
+            total_wall_time=Sum('wall_time'),
+            total_cpu_time=Sum('cpu_time'),
+            total_nfev=Sum('nfev')).order_by(group):
+        entry['mean_wall_time'] = entry['total_wall_time'] / entry['nfits']
+        entry['mean_cpu_time'] = entry['total_cpu_time'] / entry['nfits']
+        trend.append(entry)
+
+    return trend
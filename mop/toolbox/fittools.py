@@ -4,9 +4,7 @@ from pyLIMA import event
 from pyLIMA import telescopes
 from pyLIMA import toolbox
 from pyLIMA.fits import TRF_fit
-from pyLIMA.fits import stats
 from pyLIMA.models import PSPL_model
-from pyLIMA.outputs import pyLIMA_plots
 from astropy import units as unit
 from astropy.time import Time
 import pytz
@@ -15,7 +13,18 @@ import logging
 from datetime import datetime, timedelta
 from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
 import json
+import multiprocessing
+import signal
+import os
 from django.db import connection
+from collections import OrderedDict
+from mop.toolbox import pspl_tools
+from mop.toolbox import pspl_batch
+from mop.toolbox import model_lightcurves
+from mop.toolbox import fit_statistics
+from mop.toolbox import lightcurve_binning
+from mop.toolbox import fit_telemetry
+from mop.toolbox import lightcurve_loader
 
 
 logger = logging.getLogger(__name__)
@@ -49,7 +58,8 @@ def mag_to_flux(mag):
 
     return flux
 
-def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
+def fit_pspl_omega2(ra, dec, datasets, emag_limit=None, backend='pylima', previous_fit=None, binning=None,
+                    concurrent_models=False, initializer='default'):
     """
     Fit photometry using pyLIMAv1.9 with a static PSPL TRF fit
     checking if blend is constrained, if so using a soft_l1 loss function
@@ -61,56 +71,82 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
     dec : float, Declination in degrees
     photometry : array containing all telescope passband light curves
     emag_limit : array, limit on the error
+    backend : str, code used to perform the fits, either 'pylima' (default) or 'numpy' to use
+              the vectorized PSPL model with analytic Jacobian from pspl_tools
+    previous_fit : dict, optional parameters of the previous fit to this event, from
+              MicrolensingTarget.get_previous_fit, used to warm-start the fits
+    binning : dict, optional keyword arguments of lightcurve_binning.reduce_datasets (window,
+              tE_multiple).  If given, the baseline photometry is binned before fitting, while
+              the photometry around the peak of the event is kept at full resolution
+    concurrent_models : bool, if True the fit of model 2, which does not depend on the result of
+              model 1, is started speculatively in a separate process while model 1 is fitted,
+              and discarded if model 1 shows that it is not required
+    initializer : str, method used to find the starting parameters of cold-start fits, either
+              'default', the estimate made by pyLIMA or pspl_tools.initial_guess from the peak of
+              the reference lightcurve, or 'grid', the minimum of a coarse grid of models
+              evaluated by pspl_tools.grid_search_guess
 
     Returns
     -------
-    to_return : list of arrays containing fit parameters, model_telescope and cost function
+    to_return : list of arrays containing fit parameters, model lightcurve array and fit status.
+              The fit parameters include the fit_telemetry, recording the cost of each stage of the fit
     """
     # Fit configuration
-    use_boundaries = True
     verbose = True
     status = True
-
-    # Initialize the new event to be fitted:
-    current_event = event.Event(ra=ra, dec=dec)
-    current_event.name = 'MOP_to_fit'
-    if verbose: logger.info('FITTOOLS: established event')
-
-    # Using the lightcurves stored in the TOM for this target,
-    # create a list of PyLIMA telescopes, and associate them with the event:
-    tel_list = pylima_telescopes_from_datasets(datasets, emag_limit=emag_limit)
-    for tel in tel_list:
-        current_event.telescopes.append(tel)
-    if verbose: logger.info('FITTOOLS: appended ' + str(len(tel_list)) +' telescopes')
+    telemetry = fit_telemetry.start_telemetry(datasets, backend)
 
     # Exception handling here because pyLIMA does its own weeding of poor data from the
     # lightcurves.  Occasionally this leads to all data in a lightcurve being rejected,
     # and pyLIMA will crash if you feed it an empty lightcurve
     #try:
-    # The above function imposes a priority order on the list of lightcurves to model,
-    # so the reference dataset will always be the first one
-    current_event.find_survey('Tel_0')
-    current_event.check_event()
+    # Optionally bin the baseline photometry, which adds little information to the fit but can
+    # dominate its cost for densely-sampled survey lightcurves
+    fit_datasets = datasets
+    if binning:
+        with fit_telemetry.timed_stage(telemetry, 'binning'):
+            fit_datasets = lightcurve_binning.reduce_datasets(datasets, order_datasets(datasets),
+                                                              previous_fit=previous_fit, **binning)
+        telemetry['ndata_fitted'] = int(sum([len(lc) for lc in fit_datasets.values()]))
+
+    # The data are packaged according to the backend used.  In both cases a priority order is
+    # imposed on the list of lightcurves to model, so the reference dataset will always be the first one
+    with fit_telemetry.timed_stage(telemetry, 'package'):
+        if backend == 'numpy':
+            fit_data = pspl_tools.PSPLDataset(
+                [lc for (name, lc) in select_lightcurves(fit_datasets, emag_limit=emag_limit)]
+            )
+            ntel = fit_data.ntel
+        else:
+            fit_data = build_pylima_event(ra, dec, fit_datasets, emag_limit=emag_limit, verbose=verbose)
+            ntel = len(fit_data.telescopes)
+
+    # The grid search is made on the same lightcurves as the fit, and its result shared by both
+    # models, which are fitted within the same boundaries
+    guess = None
+    if initializer == 'grid':
+        with fit_telemetry.timed_stage(telemetry, 'initialize'):
+            guess = grid_initial_guess(fit_data, fit_datasets, backend=backend, emag_limit=emag_limit)
+        if verbose: logger.info('FITTOOLS: grid search initial guess ' + repr(guess))
+
+    # MODEL 2 may be started before model 1, since it depends only on the data
+    model2_fit = None
+    if concurrent_models:
+        model2_fit = start_model_fit(fit_data, 2, backend=backend, verbose=verbose, previous_fit=previous_fit,
+                                     guess=guess)
 
     # MODEL 1: PSPL model without parallax
-    pspl = PSPL_model.PSPLmodel(current_event, parallax=['None', 0.],
-                                    blend_flux_parameter='ftotal')
-    pspl.define_model_parameters()
-    fit_tap = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
-    if verbose: logger.info('FITTOOLS: Set model 1, static PSPL')
-    if use_boundaries:
-        delta_t0 = 10.
-        default_t0_lower = fit_tap.fit_parameters["t0"][1][0]
-        default_t0_upper = fit_tap.fit_parameters["t0"][1][1]
-        fit_tap.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + delta_t0]
-        fit_tap.fit_parameters["tE"][1] = [1., 1000.]
-        fit_tap.fit_parameters["u0"][1] = [0.0, 2.0]
-        if verbose: logger.info('FITTOOLS: model 1 fit boundaries: t0: '
-                                + repr(fit_tap.fit_parameters["t0"][1])
-                                + ' tE: ' + repr(fit_tap.fit_parameters["tE"][1])
-                                + ' u0: ' + repr(fit_tap.fit_parameters["u0"][1]))
-    fit_tap.fit()
-    model1_params = gather_model_parameters(current_event, fit_tap, verbose)
+    try:
+        with fit_telemetry.timed_stage(telemetry, 'model1'):
+            model1_params = fit_pspl_model(fit_data, 1, backend=backend, verbose=verbose,
+                                           previous_fit=previous_fit, guess=guess)
+    except Exception:
+        if model2_fit:
+            cancel_model_fit(model2_fit)
+        raise
+    nfev = model1_params['nfev']
+    njev = model1_params['njev']
+    warm_start = model1_params['warm_start']
     if verbose: logger.info('FITTOOLS: model 1 fitted parameters ' + repr(model1_params))
 
     # Evaluate the quality of the best-available model.
@@ -127,22 +163,20 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
     if verbose: logger.info('FITTOOLS: fit no-blend model? ' + repr(do_noblend_model))
 
     # MODEL 2: PSPL model without blending or parallax
+    if not do_noblend_model and model2_fit:
+        cancel_model_fit(model2_fit)
+        if verbose: logger.info('FITTOOLS: discarded speculative fit of model 2')
+
     if do_noblend_model:
-        pspl2 = PSPL_model.PSPLmodel(current_event, parallax=['None', 0.],
-                                    blend_flux_parameter='ftotal')
-        pspl2.define_model_parameters()
-        fit_tap2 = TRF_fit.TRFfit(pspl2, loss_function='soft_l1')
-        if verbose: logger.info('FITTOOLS: Set model 2, static PSPL without blending')
-        if use_boundaries:
-            fit_tap2.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + delta_t0]
-            fit_tap2.fit_parameters["tE"][1] = [1., 1000.]
-            fit_tap2.fit_parameters["u0"][1] = [0.0, 2.0]
-            if verbose: logger.info('FITTOOLS: model 2 fit boundaries: t0: '
-                                + repr(fit_tap2.fit_parameters["t0"][1])
-                                + ' tE: ' + repr(fit_tap2.fit_parameters["tE"][1])
-                                + ' u0: ' + repr(fit_tap2.fit_parameters["u0"][1]))
-        fit_tap2.fit()
-        model2_params = gather_model_parameters(current_event, fit_tap2, verbose)
+        with fit_telemetry.timed_stage(telemetry, 'model2'):
+            if model2_fit:
+                model2_params = finish_model_fit(model2_fit)
+            else:
+                model2_params = fit_pspl_model(fit_data, 2, backend=backend, verbose=verbose,
+                                               previous_fit=previous_fit, guess=guess)
+        nfev += model2_params['nfev']
+        njev += model2_params['njev']
+        warm_start = warm_start and model2_params['warm_start']
         # default null as in the former implementation
         #model2_params['blend_magnitude'] = np.nan
         if verbose: logger.info('FITTOOLS: model 2 fitted parameters ' + repr(model2_params))
@@ -160,7 +194,7 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
         # The threshold is calculated assuming a 3-sigma distribution.
         best_model = model2_params
         delta_chi2 = model2_params['chi2'] - model1_params['chi2']
-        dchi2_threshold = stats.chi2.ppf(0.9973, len(tel_list))
+        dchi2_threshold = stats.chi2.ppf(0.9973, ntel)
         if verbose: logger.info('FITTOOLS: Model 1 chi2 = ' + str(model1_params['chi2']) \
                                 + ', model 2 chi2 = ' + str(model2_params['chi2']) \
                                 + ', delta_chi2 = ' + str(delta_chi2) \
@@ -171,6 +205,20 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
         else:
             if verbose: logger.info('FITTOOLS: Using model 2 (no parallax) as best-fit model')
 
+    # Record the cost of the fits in terms of the number of function evaluations, and the
+    # number saved relative to the most recent cold-start fit of this event.  A warm start which
+    # costs more than the reference saves nothing, and one which falls back to a cold start is
+    # not counted as a warm start, so that the saving is never negative
+    best_model['fit_warm_start'] = warm_start
+    best_model['fit_nfev'] = nfev
+    best_model['fit_nfev_saved'] = 0
+    if warm_start and previous_fit.get('nfev_reference', 0) > 0:
+        best_model['fit_nfev_saved'] = max(0, int(previous_fit['nfev_reference']) - nfev)
+    elif previous_fit:
+        if verbose: logger.info('FITTOOLS: warm start fell back to a cold start')
+    if verbose: logger.info('FITTOOLS: fit used ' + str(nfev) + ' function evaluations, warm start: '
+                            + repr(warm_start) + ', saved ' + str(best_model['fit_nfev_saved']))
+
     # Exception handling if PyLIMA rejects data internally
     #except:
     #    best_model = {'tE': np.nan}
@@ -179,56 +227,394 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
 
     # Generate the model lightcurve timeseries with the fitted parameters
     if not np.isnan(best_model['tE']):
-        model_telescope = generate_model_lightcurve(current_event, best_model, verbose)
+        with fit_telemetry.timed_stage(telemetry, 'lightcurve'):
+            model_lightcurve = generate_model_lightcurve(best_model, datasets, verbose=verbose)
         if verbose: logger.info('FITTOOLS: generated model lightcurve')
     else:
-        model_telescope = None
+        model_lightcurve = None
         if verbose: logger.info('FITTOOLS: cannot generate model lightcurve')
 
-    return best_model, model_telescope, status
+    # The optimizers used by both backends evaluate the Jacobian once per iteration
+    telemetry['niter'] = int(njev)
+    telemetry['nfev'] = int(nfev)
+    telemetry['selected_model'] = 2 if best_model is not model1_params else 1
+    best_model['fit_telemetry'] = fit_telemetry.finish_telemetry(telemetry)
 
+    return best_model, model_lightcurve, status
 
-def repackage_lightcurves(photometry_qs):
-    """Function to sort through a QuerySet of PhotometryReducedDatums for a given event and repackage the data as a
-     dictionary of individual lightcurves in PyLIMA-compatible format for different facilities.
-     """
+def build_pylima_event(ra, dec, datasets, emag_limit=None, verbose=False):
+    """Function to create a pyLIMA Event for the given coordinates and datasets"""
 
-    datasets = {}
+    # Initialize the new event to be fitted:
+    current_event = event.Event(ra=ra, dec=dec)
+    current_event.name = 'MOP_to_fit'
+    if verbose: logger.info('FITTOOLS: established event')
 
-    for rd in photometry_qs:
-        if rd.source_name != 'Interferometry_predictor':
-            # Identify different lightcurves from the filter label given
-            passband = rd.bandpass
-            if passband in datasets.keys():
-                lc = datasets[passband]
-            else:
-                lc = []
+    # Using the lightcurves stored in the TOM for this target,
+    # create a list of PyLIMA telescopes, and associate them with the event:
+    tel_list = pylima_telescopes_from_datasets(datasets, emag_limit=emag_limit)
+    for tel in tel_list:
+        current_event.telescopes.append(tel)
+    if verbose: logger.info('FITTOOLS: appended ' + str(len(tel_list)) +' telescopes')
 
-            # Append the datapoint to the corresponding dataset
-            try:
-                lc.append([Time(rd.timestamp).jd, rd.brightness, rd.brightness_error])
-            except:
-                lc.append([Time(rd.timestamp).jd, rd.brightness, 1.0])
+    current_event.find_survey('Tel_0')
+    current_event.check_event()
 
-            datasets[passband] = lc
+    return current_event
 
-    # Count the total number of datapoints available, and convert the
-    # accumulated lightcurves into numpy arrays:
-    ndata = 0
-    for passband, lc in datasets.items():
-        ndata += len(lc)
-        datasets[passband] = np.array(lc)
+def grid_initial_guess(fit_data, fit_datasets, backend='pylima', emag_limit=None):
+    """Function to find the starting parameters (t0, u0, tE) of a fit from a coarse grid search,
+    within the same t0 boundary as the fit.  For the pyLIMA backend, the lightcurves are packaged
+    as a PSPLDataset for the search"""
 
-    return datasets, ndata
+    if backend == 'numpy':
+        dataset = fit_data
+    else:
+        dataset = pspl_tools.PSPLDataset([lc for (name, lc) in select_lightcurves(fit_datasets,
+                                                                                  emag_limit=emag_limit)])
 
-def pylima_telescopes_from_datasets(datasets, emag_limit=None):
-    """Function to convert the dictionary of datasets retrieved from MOP of the lightcurves for this object,
-    and convert them into PyLIMA Telescope objects.
-    This function returns a list of Telescope objects containing the lightcurve data, applying an
-    order of preference, so that prioritized datasets occur at the start of the list.
+    (guess, chi2) = pspl_tools.grid_search_guess(dataset)
+
+    return [float(x) for x in guess]
+
+def fit_pspl_model(fit_data, model_number, backend='pylima', verbose=False, previous_fit=None, guess=None):
+    """
+    Function to perform a single static PSPL TRF fit with a soft_l1 loss function and the
+    standard MOP parameter boundaries, using the requested backend.
+
+    If the parameters of a previous fit are provided, the fit is first warm-started from them.
+    Should the warm-start fit fail its quality checks, the fit is repeated from the default
+    (cold-start) initial guess.
+
+    Parameters:
+        fit_data     pyLIMA Event for the pyLIMA backend or pspl_tools.PSPLDataset for the numpy backend
+        model_number int    Index of the model, used for logging
+        backend      str    'pylima' or 'numpy'
+        previous_fit dict   Optional parameters of the previous fit, from MicrolensingTarget.get_previous_fit
+        guess        list   Optional starting values of (t0, u0, tE) for the cold-start fit
+
+    Returns:
+        model_params dict   Fitted parameters, in the format produced by gather_model_parameters
+    """
+
+    nfev = 0
+    njev = 0
+    if previous_fit:
+        model_params = run_pspl_fit(fit_data, model_number, backend=backend, verbose=verbose,
+                                    previous_fit=previous_fit)
+        nfev += model_params['nfev']
+        njev += model_params['njev']
+
+        if check_warm_start(model_params, previous_fit, verbose=verbose):
+            model_params['warm_start'] = True
+            return model_params
+
+        logger.info('FITTOOLS: model ' + str(model_number)
+                    + ' warm-start fit failed quality checks, refitting from a cold start')
+
+    model_params = run_pspl_fit(fit_data, model_number, backend=backend, verbose=verbose, guess=guess)
+    model_params['nfev'] += nfev
+    model_params['njev'] += njev
+    model_params['warm_start'] = False
+
+    return model_params
+
+def start_model_fit(fit_data, model_number, backend='pylima', verbose=False, previous_fit=None, guess=None):
+    """
+    Function to start a fit_pspl_model in a separate process, so that it runs concurrently with
+    work in the current process.  The fork start method is used, so the data need not be transferred
+    to the new process; only the fitted parameters are returned, through a pipe.
+
+    Returns:
+        model_fit    tuple  (Process, Connection from which the result is received)
+    """
+
+    ctx = multiprocessing.get_context('fork')
+    (receiver, sender) = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=model_fit_process,
+                          args=(sender, fit_data, model_number, backend, verbose, previous_fit, guess))
+    process.start()
+    sender.close()
+
+    return process, receiver
+
+def model_fit_process(sender, fit_data, model_number, backend, verbose, previous_fit, guess):
+    """Function run by the process started by start_model_fit.  The process leads its own process
+    group, so that any processes started by pyLIMA are stopped along with it if it is cancelled"""
+
+    os.setpgrp()
+    try:
+        result = fit_pspl_model(fit_data, model_number, backend=backend, verbose=verbose,
+                                previous_fit=previous_fit, guess=guess)
+    except Exception as e:
+        result = e
+    sender.send(result)
+    sender.close()
+
+def finish_model_fit(model_fit):
+    """Function to wait for the result of a fit started by start_model_fit.
+    Exceptions raised by the fit are re-raised in the current process"""
+
+    (process, receiver) = model_fit
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = RuntimeError('Model fit process exited with code ' + repr(process.exitcode))
+    receiver.close()
+    process.join()
+
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+def cancel_model_fit(model_fit):
+    """Function to stop a fit started by start_model_fit whose result is no longer required"""
+
+    (process, receiver) = model_fit
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        process.terminate()
+    receiver.close()
+    process.join()
+
+def run_pspl_fit(fit_data, model_number, backend='pylima', verbose=False, previous_fit=None, guess=None):
+    """
+    Function to run the optimizer for a single static PSPL fit, either from the default initial
+    guess or warm-started from the parameters of a previous fit.
+
+    Parameters:
+        fit_data     pyLIMA Event for the pyLIMA backend or pspl_tools.PSPLDataset for the numpy backend
+        model_number int    Index of the model, used for logging
+        backend      str    'pylima' or 'numpy'
+        previous_fit dict   Optional parameters of the previous fit
+        guess        list   Optional starting values of (t0, u0, tE) for a cold start, in place of
+                            the default estimate
+
+    Returns:
+        model_params dict   Fitted parameters, including the number of function and Jacobian
+                            evaluations (nfev, njev) and, for warm starts, the trust region applied (fit_trust_region)
+    """
+
+    use_boundaries = True
+    delta_t0 = 10.
+
+    if backend == 'numpy':
+        if verbose: logger.info('FITTOOLS: Set model ' + str(model_number) + ', static PSPL (numpy)')
+        fit_parameters = pspl_tools.parameter_bounds(fit_data, delta_t0=delta_t0)
+        x_scale = None
+        fit_bounds = fit_parameters
+        if previous_fit:
+            (guess, x_scale, fit_bounds) = warm_start_settings(previous_fit, fit_parameters)
+            if verbose: logger.info('FITTOOLS: model ' + str(model_number) + ' warm start from '
+                                    + repr(guess) + ' with trust region ' + repr(fit_bounds))
+        if verbose: logger.info('FITTOOLS: model ' + str(model_number) + ' fit boundaries: t0: '
+                                + repr(fit_parameters["t0"][1])
+                                + ' tE: ' + repr(fit_parameters["tE"][1])
+                                + ' u0: ' + repr(fit_parameters["u0"][1]))
+
+        # For warm starts, the parameters are scaled according to their uncertainties in
+        # the previous fit, while the fluxes retain the default scaling
+        if x_scale is not None:
+            x0 = np.array(list(guess) + pspl_tools.solve_linear_fluxes(guess[0], guess[1], guess[2], fit_data))
+            x_scale = np.concatenate((x_scale, 10 ** np.floor(np.log10(np.abs(x0[3:]) + 1e-300)) + 1))
+
+        fit_results = pspl_tools.fit_pspl(fit_data, guess=guess, fit_parameters=fit_bounds,
+                                          loss='soft_l1', x_scale=x_scale)
+        statistics = fit_statistics.get_fit_statistics(
+            fit_results, lambda: (fit_results['residuals'], fit_data.telescope_mask(0)))
+        model_params = package_model_parameters(list(fit_parameters.keys()), fit_results['best_model'],
+                                                fit_results['covariance_matrix'], statistics,
+                                                fit_data.ndata, fit_parameters, verbose)
+        model_params['nfev'] = int(fit_results['nfev'])
+        model_params['njev'] = int(fit_results['njev'])
+
+    else:
+        pspl = PSPL_model.PSPLmodel(fit_data, parallax=['None', 0.],
+                                    blend_flux_parameter='ftotal')
+        pspl.define_model_parameters()
+        fit_tap = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
+        if verbose: logger.info('FITTOOLS: Set model ' + str(model_number) + ', static PSPL')
+        if use_boundaries:
+            default_t0_lower = fit_tap.fit_parameters["t0"][1][0]
+            default_t0_upper = fit_tap.fit_parameters["t0"][1][1]
+            fit_tap.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + delta_t0]
+            fit_tap.fit_parameters["tE"][1] = [1., 1000.]
+            fit_tap.fit_parameters["u0"][1] = [0.0, 2.0]
+            if verbose: logger.info('FITTOOLS: model ' + str(model_number) + ' fit boundaries: t0: '
+                                    + repr(fit_tap.fit_parameters["t0"][1])
+                                    + ' tE: ' + repr(fit_tap.fit_parameters["tE"][1])
+                                    + ' u0: ' + repr(fit_tap.fit_parameters["u0"][1]))
+
+        # pyLIMA computes its own parameter scaling from the starting guess, so for this backend
+        # the warm start sets the initial guess and the trust region only.  The telescope fluxes
+        # are then estimated by pyLIMA from the guess
+        fit_parameters = fit_tap.fit_parameters
+        fit_bounds = fit_parameters
+        if guess is not None and not previous_fit:
+            fit_tap.model_parameters_guess = [float(x) for x in
+                                              pspl_tools.clip_to_bounds(guess, fit_parameters)]
+            if verbose: logger.info('FITTOOLS: model ' + str(model_number) + ' starting from ' + repr(guess))
+        if previous_fit:
+            (guess, x_scale, fit_bounds) = warm_start_settings(previous_fit, fit_parameters)
+            fit_tap.fit_parameters = fit_bounds
+            fit_tap.model_parameters_guess = [float(x) for x in guess]
+            if verbose: logger.info('FITTOOLS: model ' + str(model_number) + ' warm start from '
+                                    + repr(guess) + ' with trust region ' + repr(fit_bounds))
+
+        fit_tap.fit()
+        model_params = gather_model_parameters(fit_data, fit_tap, verbose)
+        model_params['fit_parameters'] = fit_parameters
+        model_params['nfev'] = int(fit_tap.fit_results['fit_object'].nfev)
+        model_params['njev'] = int(fit_tap.fit_results['fit_object'].njev)
+
+    if previous_fit:
+        model_params['fit_trust_region'] = fit_bounds
+
+    return model_params
+
+def fit_pspl_batch(event_datasets, emag_limit=None, verbose=False):
     """
+    Function to fit static PSPL models (equivalent to model 1 of fit_pspl_omega2) to a set of events
+    simultaneously, using the batched least-squares solver in pspl_batch.
+
+    Parameters:
+        event_datasets  list   of datasets dictionaries, one per event, in the format
+                               produced by repackage_lightcurves
+        emag_limit      float  Optional limit on the photometric uncertainties
+
+    Returns:
+        results         list   of model parameter dictionaries, one per event, in the format
+                               produced by gather_model_parameters
+    """
+
+    delta_t0 = 10.
+
+    fit_data = [pspl_tools.PSPLDataset([lc for (name, lc) in select_lightcurves(datasets, emag_limit=emag_limit)])
+                for datasets in event_datasets]
+    fit_parameters = [pspl_tools.parameter_bounds(ds, delta_t0=delta_t0) for ds in fit_data]
+
+    batch = pspl_batch.PSPLBatch(fit_data)
+    fit_results = pspl_batch.fit_pspl_batch(batch, fit_parameters=fit_parameters, loss='soft_l1')
+    if verbose: logger.info('FITTOOLS: batch fitted ' + str(len(fit_data)) + ' events')
+
+    results = []
+    for ds, fit in zip(fit_data, fit_results):
+        statistics = fit_statistics.get_fit_statistics(
+            fit, lambda: (fit['residuals'], ds.telescope_mask(0)))
+        model_params = package_model_parameters(list(fit['fit_parameters'].keys()), fit['best_model'],
+                                                fit['covariance_matrix'], statistics, ds.ndata,
+                                                fit['fit_parameters'], verbose)
+        model_params['nfev'] = fit['nfev']
+        results.append(model_params)
+
+    return results
+
+def warm_start_settings(previous_fit, fit_parameters, nsigma=5.0):
+    """
+    Function to derive the settings of a warm-start fit from the parameters of a previous fit.
+    The starting values of (t0, u0, tE) are taken from the previous fit, and their uncertainties,
+    drawn preferably from the stored covariance matrix, are used to scale the parameters and to
+    define a trust region of +/- nsigma around the starting values.  The trust region is never
+    allowed to exceed the standard parameter boundaries, nor to be narrower than a minimum
+    width, since the uncertainties of well-sampled events can be very small.
+
+    Parameters:
+        previous_fit    dict         Parameters of the previous fit
+        fit_parameters  OrderedDict  Standard fit boundaries in pyLIMA format
+        nsigma          float        Half-width of the trust region in units of the uncertainties
+
+    Returns:
+        guess           array        Starting values of (t0, u0, tE)
+        x_scale         array        Characteristic scales of (t0, u0, tE)
+        fit_bounds      OrderedDict  Fit boundaries including the trust region, in pyLIMA format
+    """
+
+    keys = ['t0', 'u0', 'tE']
+    guess = np.array([float(previous_fit[key]) for key in keys])
+    guess = pspl_tools.clip_to_bounds(guess, fit_parameters)
+
+    # The covariance matrix lists the parameters in the same order as the fit
+    sigma = np.array([float(previous_fit[key + '_error']) for key in keys])
+    covariance = np.asarray(previous_fit.get('fit_covariance', []), dtype=float)
+    if covariance.ndim == 2 and covariance.shape[0] >= 3:
+        diag = np.diag(covariance)[0:3]
+        sigma = np.where(np.isfinite(diag) & (diag > 0.0), np.sqrt(np.abs(diag)), sigma)
+
+    min_width = np.array([max(0.1 * guess[2], 1.0), 0.1, 0.2 * guess[2]])
+    sigma = np.where(np.isfinite(sigma) & (sigma > 0.0), sigma, min_width)
+    width = np.maximum(nsigma * sigma, min_width)
+
+    fit_bounds = OrderedDict()
+    for key, value in fit_parameters.items():
+        fit_bounds[key] = [value[0], list(value[1])]
+    for i, key in enumerate(keys):
+        lower = max(fit_parameters[key][1][0], guess[i] - width[i])
+        upper = min(fit_parameters[key][1][1], guess[i] + width[i])
+        fit_bounds[key][1] = [lower, upper]
+
+    x_scale = np.minimum(sigma, width)
+
+    return guess, x_scale, fit_bounds
+
+def check_warm_start(model_params, previous_fit, chi2_factor=2.0, verbose=False):
+    """
+    Function to verify the results of a warm-start fit.  The fit is rejected if any of the
+    key parameters could not be determined, if any of (t0, u0, tE) converged to the edge of the
+    trust region, indicating that the solution has moved significantly from the previous fit,
+    or if the reduced chi2 is substantially worse than that of the previous fit.
+
+    Parameters:
+        model_params    dict   Results of the warm-start fit
+        previous_fit    dict   Parameters of the previous fit
+        chi2_factor     float  Maximum permitted ratio of the new to the previous reduced chi2
+
+    Returns:
+        status          bool   True if the warm-start fit is acceptable
+    """
+
+    epsilon = 1e-5
+
+    for key in ['t0', 'u0', 'tE', 'chi2', 'red_chi2']:
+        if not np.isfinite(model_params[key]):
+            if verbose: logger.info('FITTOOLS: warm-start fit ' + key + ' is not finite')
+            return False
+
+    # Boundaries of the trust region that coincide with the standard boundaries are
+    # acceptable, since a cold start fit is subject to the same limits
+    for key in ['t0', 'u0', 'tE']:
+        trust_region = model_params['fit_trust_region'][key][1]
+        limits = model_params['fit_parameters'][key][1]
+        tolerance = epsilon * (trust_region[1] - trust_region[0])
+        for i in range(2):
+            if trust_region[i] != limits[i] and np.abs(model_params[key] - trust_region[i]) < tolerance:
+                if verbose: logger.info('FITTOOLS: warm-start fit ' + key + ' at the edge of the trust region')
+                return False
+
+    previous_red_chi2 = float(previous_fit.get('red_chi2', 0.0))
+    if np.isfinite(previous_red_chi2) and 0.0 < previous_red_chi2 < 99999.0:
+        if model_params['red_chi2'] > chi2_factor * max(previous_red_chi2, 1.0):
+            if verbose: logger.info('FITTOOLS: warm-start fit reduced chi2 ' + str(model_params['red_chi2'])
+                                    + ' exceeds that of the previous fit ' + str(previous_red_chi2))
+            return False
+
+    return True
+
+
+def repackage_lightcurves(photometry_qs):
+    """Function to sort through a QuerySet of PhotometryReducedDatums for a given event and repackage the data as a
+     dictionary of individual lightcurves in PyLIMA-compatible format for different facilities.
+     The datapoints are loaded as columns by lightcurve_loader, without creating model instances.
+     """
+
+    return lightcurve_loader.load_lightcurves(photometry_qs)
+
+def order_datasets(datasets):
+    """Function to sort the names of the available datasets into order, giving preference to main survey
+    datasets, so that the prioritized datasets occur at the start of the list and the reference dataset
+    is always the first one"""
 
-    # Sort the available datasets into order, giving preference to main survey datasets
     priority_order = ['I', 'ip', 'G', 'i_ZTF', 'r_ZTF', 'R', 'g_ZTF', 'gp']
 
     dataset_order = []
@@ -241,9 +627,15 @@ def pylima_telescopes_from_datasets(datasets, emag_limit=None):
         if name not in dataset_order:
             dataset_order.append(name)
 
-    # Loop over all available datasets and create a telescope object for each one
-    tel_list = []
-    for idx, name in enumerate(dataset_order):
+    return dataset_order
+
+def select_lightcurves(datasets, emag_limit=None):
+    """Function to return the lightcurves of the datasets in order of priority, as a list of
+    (dataset name, lightcurve array) tuples, applying the optional filtering of datapoints of low
+    photometric precision"""
+
+    lightcurves = []
+    for name in order_datasets(datasets):
         photometry = datasets[name]
 
         # Enabling optional filtering for datapoints of low photometric precision
@@ -255,63 +647,30 @@ def pylima_telescopes_from_datasets(datasets, emag_limit=None):
 
             mask = (np.abs(photometry[:, -2].astype(float)) < 99.0)
 
-        lightcurve = photometry[mask].astype(float)
+        lightcurves.append((name, photometry[mask]))
+
+    return lightcurves
+
+def pylima_telescopes_from_datasets(datasets, emag_limit=None):
+    """Function to convert the dictionary of datasets retrieved from MOP of the lightcurves for this object,
+    and convert them into PyLIMA Telescope objects.
+    This function returns a list of Telescope objects containing the lightcurve data, applying an
+    order of preference, so that prioritized datasets occur at the start of the list.
+    """
+
+    # Loop over all available datasets and create a telescope object for each one
+    tel_list = []
+    for idx, (name, lightcurve) in enumerate(select_lightcurves(datasets, emag_limit=emag_limit)):
 
         # Treating all sites as ground-based without coordinates
         tel = telescopes.Telescope(name='Tel_'+str(idx), camera_filter=name,
-                                         lightcurve=photometry[mask],
+                                         lightcurve=lightcurve,
                                          lightcurve_names=['time', 'mag', 'err_mag'],
                                          lightcurve_units=['JD', 'mag', 'err_mag'])
         tel_list.append(tel)
 
     return tel_list
 
-def store_model_lightcurve(target, model):
-    """Function to store in the TOM the timeseries lihgtcurve corresponding to a fitted model.
-    The input is a model fit object from PyLIMA"""
-
-    # Why is this timestamp hardwired?
-    model_time = datetime.strptime('2018-06-29 08:15:27.243860', '%Y-%m-%d %H:%M:%S.%f')
-
-    # Extract the model lightcurve timeseries from the PyLIMA fit object
-    data = {
-        'lc_model_time': model.lightcurve_magnitude['time'].value.tolist(),
-        'lc_model_magnitude': model.lightcurve_magnitude['mag'].value.tolist()
-        }
-
-    # Search MOP to see if an existing model is already stored
-    existing_model = ReducedDatum.objects.filter(source_name='MOP',data_type='lc_model',
-                                                 timestamp=model_time, source_location=target.name)
-    logger.info('FIT: Searched for existing models '+repr(existing_model))
-
-    # If there is an existing model for this target, update it
-    if existing_model.count() == 0:
-        rd, created = ReducedDatum.objects.get_or_create(
-                    timestamp=model_time,
-                    value=data,
-                    source_name='MOP',
-                    source_location=target.name,
-                    data_type='lc_model',
-                    target=target
-        )
-
-        rd.save()
-
-    # If no prior model exists, create one
-    else:
-        rd, created = ReducedDatum.objects.update_or_create(
-                    timestamp=existing_model[0].timestamp,
-                    value=existing_model[0].value,
-                    source_name='MOP',
-                    source_location=target.name,
-                    data_type='lc_model',
-                    target=target,
-                    defaults={'value':data}
-        )
-
-        rd.save()
-    connection.close()
-
 def check_event_alive(t0_fit, tE_fit, last_obs_jd):
     """Function to evaluate whether or not an event is still actively going on, based on the current time
     relative to the model fit t0 and tE"""
@@ -339,9 +698,11 @@ def check_event_alive(t0_fit, tE_fit, last_obs_jd):
 
     return alive
 
-def gather_model_parameters(pevent, model_fit, verbose):
+def gather_model_parameters(pevent, model_fit, verbose=False):
     """
     Function to gather the parameters of a PyLIMA fitted model into a dictionary for easier handling.
+    The fit statistics are derived from a single evaluation of the model residuals, which is
+    cached on the fit object.
     """
 
     # PyLIMA model objects store the fitted values of the model parameters in the fit_results attribute,
@@ -350,6 +711,54 @@ def gather_model_parameters(pevent, model_fit, verbose):
     # list of key indices
     param_keys = list(model_fit.fit_parameters.keys())
 
+    ndata = 0
+    for i,tel in enumerate(pevent.telescopes):
+        ndata += len(tel.lightcurve)
+
+    # Reporting actual chi2 instead value of the loss function
+    statistics = fit_statistics.get_fit_statistics(model_fit.fit_results,
+                                                   lambda: pylima_normalized_residuals(model_fit))
+
+    return package_model_parameters(param_keys, model_fit.fit_results["best_model"],
+                                    model_fit.fit_results["covariance_matrix"], statistics, ndata,
+                                    model_fit.fit_parameters, verbose)
+
+def pylima_normalized_residuals(model_fit):
+    """
+    Function to evaluate the normalized photometric residuals of the best-fitting model of a
+    pyLIMA fit, for all telescopes in a single pass.
+
+    Returns:
+        residuals       array  Normalized residuals of all datapoints
+        reference_mask  array  Boolean mask selecting the datapoints of the reference telescope
+    """
+
+    # The model_fit.model_residuals returns photometric and astrometric residuals as a dictionary
+    # while the photometric residuals provides a list of arrays consisting of the
+    # photometric residuals, photometric errors, and error_flux
+    (res, err) = model_fit.model_residuals(model_fit.fit_results['best_model'])
+    residuals = [np.ravel(r) / np.ravel(e) for (r, e) in zip(res['photometry'], err['photometry'])]
+    reference_mask = np.concatenate([np.full(len(r), i == 0) for (i, r) in enumerate(residuals)])
+
+    return np.concatenate(residuals), reference_mask
+
+def package_model_parameters(param_keys, best_model, covariance, statistics, ndata, fit_parameters,
+                             verbose):
+    """
+    Function to package the results of a model fit into the dictionary of parameters used by MOP,
+    deriving the source, blend and baseline magnitudes and the fit statistics.
+    This is independent of the code used to perform the fit.
+
+    Parameters:
+        param_keys      list   Names of the fitted parameters, in pyLIMA's nomenclature
+        best_model      array  Best-fitting parameter values
+        covariance      array  Covariance matrix of the fitted parameters
+        statistics      dict   Goodness-of-fit statistics of the best-fitting model, from
+                               fit_statistics.get_fit_statistics
+        ndata           int    Total number of datapoints fitted
+        fit_parameters  dict   Fitted parameters and their boundaries, in pyLIMA's format
+    """
+
     model_params = {}
 
     for i, key in enumerate(param_keys):
@@ -357,13 +766,10 @@ def gather_model_parameters(pevent, model_fit, verbose):
             ndp = 3
         else:
             ndp = 5
-        model_params[key] = np.around(model_fit.fit_results["best_model"][i], ndp)
-        model_params[key+'_error'] = np.around(np.sqrt(model_fit.fit_results["covariance_matrix"][i,i]), ndp)
+        model_params[key] = np.around(best_model[i], ndp)
+        model_params[key+'_error'] = np.around(np.sqrt(covariance[i,i]), ndp)
 
-    # model_params['chi2'] = np.around(model_fit.fit_results["best_model"][-1], 3)
-    # Reporting actual chi2 instead value of the loss function
-    (chi2, pyLIMA_parameters) = model_fit.model_chi2(model_fit.fit_results["best_model"])
-    model_params['chi2'] = np.around(chi2, 3)
+    model_params['chi2'] = np.around(statistics['chi2'], 3)
 
     # If the model did not include parallax, zero those parameters
     if 'piEN' not in param_keys:
@@ -373,9 +779,6 @@ def gather_model_parameters(pevent, model_fit, verbose):
         model_params['piEE_error'] = 0.0
 
     # Calculate the reduced chi2
-    ndata = 0
-    for i,tel in enumerate(pevent.telescopes):
-        ndata += len(tel.lightcurve)
     model_params['red_chi2'] = np.around(model_params['chi2'] / float(ndata - len(param_keys)),3)
 
     # Retrieve the flux parameters, converting from PyLIMA's key nomenclature to MOPs
@@ -448,32 +851,14 @@ def gather_model_parameters(pevent, model_fit, verbose):
         + '+/-' + str(model_params['baseline_mag_error'])
     )
 
-    model_params['fit_covariance'] = model_fit.fit_results["covariance_matrix"]
+    model_params['fit_covariance'] = covariance
 
-    model_params['fit_parameters'] = model_fit.fit_parameters
+    model_params['fit_parameters'] = fit_parameters
 
-    # Calculate fit statistics
-    # The model_fit.model_residuals returns photometric and astrometric residuals as a dictionary
-    # while the photometric residuals provides a list of arrays consisting of the
-    # photometric residuals, photometric errors, and error_flux
-    try:
-        res = model_fit.model_residuals(model_fit.fit_results['best_model'])
-        sw_test = stats.normal_Shapiro_Wilk(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['sw_test'] = np.around(sw_test[0],3)
-        ad_test = stats.normal_Anderson_Darling(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['ad_test'] = np.around(ad_test[0],3)
-        ks_test = stats.normal_Kolmogorov_Smirnov(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['ks_test'] = np.around(ks_test[0],3)
-        model_params['chi2_dof'] = np.sum((np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])) ** 2) / (
-                len(np.ravel(res[0]['photometry'][0])) - 5)
-    except:
-        model_params['sw_test'] = np.nan
-        model_params['ad_test'] = np.nan
-        model_params['ks_test'] = np.nan
-        model_params['chi2_dof'] = np.nan
+    # Fit statistics of the normalized photometric residuals
+    for key in ['sw_test', 'ad_test', 'ks_test']:
+        model_params[key] = np.around(statistics[key], 3)
+    model_params['chi2_dof'] = statistics['chi2_dof']
 
     return model_params
 
@@ -531,43 +916,48 @@ def evaluate_model(best_model, verbose=False):
 
     return best_model
 
-def generate_model_lightcurve(pevent, model_params, verbose):
-    """Function to generate a photometric timeseries corresponding to the given model parameters"""
-
-    pyLIMA_plots.list_of_fake_telescopes = []
+def generate_model_lightcurve(model_params, datasets, max_error=model_lightcurves.MAX_MAG_ERROR,
+                              verbose=False):
+    """
+    Function to generate a photometric timeseries corresponding to the given model parameters.
+    The PSPL model is evaluated in closed form, sampled adaptively so that linear interpolation
+    between the points reproduces the model to within max_error in magnitude.
+    The timeseries covers the full range of the data, and at least t0 +/- 5 tE.
+
+    Parameters:
+        model_params  dict   Fitted model parameters, as returned by fit_pspl_omega2
+        datasets      dict   Lightcurves of the event, as produced by repackage_lightcurves
+        max_error     float  Maximum interpolation error in magnitude
+        verbose       bool   Switch for logging output
+
+    Returns:
+        model_lightcurve  array  with columns [time, mag]
+    """
 
     # This doesn't include parallax right now, since none of the fitted models do either yet
-    pspl = PSPL_model.PSPLmodel(pevent, parallax=['None', 0.], blend_flux_parameter='ftotal')
-
-    params = []
-    parameters = ['t0', 'u0', 'tE']
-    for key in parameters:
-        value = model_params[key]
-        params.append(value)
+    (t0, u0, tE) = (model_params['t0'], model_params['u0'], model_params['tE'])
     source_flux = mag_to_flux(model_params['source_magnitude'])
-    params.append(source_flux)
     blend_flux = mag_to_flux(model_params['blend_magnitude'])
-    params.append(source_flux+blend_flux)
-    if verbose: logger.info('GENERATE LC parameter set: ' + repr(params))
-
-    pyLIMA_parameters = pspl.compute_pyLIMA_parameters(params)
-
-    model_telescope = pyLIMA_plots.create_telescopes_to_plot_model(pspl, pyLIMA_parameters)[0]
-
-    flux_model = pspl.compute_the_microlensing_model(model_telescope, pyLIMA_parameters)['photometry']
-
-    magnitude = toolbox.brightness_transformation.flux_to_magnitude(flux_model)
+    if verbose: logger.info('GENERATE LC parameter set: ' + repr([t0, u0, tE, source_flux, blend_flux]))
 
-    model_telescope.lightcurve["mag"] = magnitude * unit.mag
+    tmin = t0 - 5.0 * tE
+    tmax = t0 + 5.0 * tE
+    for lc in datasets.values():
+        if len(lc) > 0:
+            tmin = min(tmin, np.nanmin(lc[:,0]))
+            tmax = max(tmax, np.nanmax(lc[:,0]))
 
-    mask = ~np.isnan(magnitude)
-    model_telescope.lightcurve = model_telescope.lightcurve[mask]
+    (times, mags) = model_lightcurves.sample_pspl_lightcurve(t0, u0, tE, source_flux,
+                                                              source_flux + blend_flux,
+                                                              tmin, tmax, max_error=max_error)
+    if verbose: logger.info('GENERATE LC sampled model at ' + str(len(times)) + ' points')
 
-    return model_telescope
+    return np.c_[times, mags]
 
-def store_model_lightcurve(mulens, model):
+def store_model_lightcurve(mulens, model_lightcurve):
     """Function to store in the TOM the timeseries lightcurve corresponding to a fitted model.
-    The input is a model fit object from PyLIMA.
+    The input is the array of [time, mag] produced by generate_model_lightcurve, which is stored
+    in the compact format of model_lightcurves.encode_model_lightcurve.
 
     Note that this function has to be separate from the MicrolensingTarget class because it uses the
     ReducedDatum objects.  Circular imports result if you try to import ReducedDatums from the Target object"""
@@ -575,11 +965,7 @@ def store_model_lightcurve(mulens, model):
     tz = pytz.timezone('utc')
     model_time = datetime.utcnow().replace(tzinfo=tz)
 
-    # Extract the model lightcurve timeseries from the PyLIMA fit object
-    data = {
-        'lc_model_time': model.lightcurve['time'].value.tolist(),
-        'lc_model_magnitude': model.lightcurve['mag'].value.tolist()
-    }
+    data = model_lightcurves.encode_model_lightcurve(model_lightcurve[:,0], model_lightcurve[:,1])
 
     # If there is no existing model for this target, create one
     if not mulens.existing_model:
@@ -4,6 +4,7 @@ from astropy.coordinates import SkyCoord
 from astropy import units as u
 from mop.brokers import gaia, gsc
 from mop.toolbox import utilities
+from mop.toolbox import model_evaluation
 import numpy as np
 import matplotlib.pyplot as plt
 from astroquery.vizier import Vizier
@@ -543,18 +544,13 @@ def predict_peak_brightness(mag_base, mag_base_error, u0, u0_error):
     return mag_peak, mag_peak_error
 
 def predict_period_above_brightness_threshold(target, Kbase, Kthreshold=14.0):
-    # Search MOP to see if an existing model is already stored.  The model_time parameter is hardwired into
-    # mop.toolbox.fittools.  Unclear why.
-    ##model_time = datetime.strptime('2018-06-29 08:15:27.243860', '%Y-%m-%d %H:%M:%S.%f')
-    qs = ReducedDatum.objects.filter(source_name='MOP', data_type='lc_model',
-                                     source_location=target.name)
     mag_base = target.baseline_magnitude
     interval = np.nan
 
-    # This calculation can only be made if a valid model has been fitted
-    if qs.count() > 0 and not np.isnan(mag_base) and mag_base > 0.0:
-        ts = np.array(qs[0].value['lc_model_time'])
-        mags = np.array(qs[0].value['lc_model_magnitude'])
+    # This calculation can only be made if a valid model has been fitted.  The model lightcurve
+    # is evaluated from the fitted parameters of the target
+    (ts, mags) = model_evaluation.model_lightcurve(target)
+    if ts is not None and not np.isnan(mag_base) and mag_base > 0.0:
 
         # Estimate the K-band lightcurve
         Klc = Kbase + (mags - mag_base)
@@ -0,0 +1,149 @@
+import numpy as np
+import logging
+from mop.toolbox import pspl_tools
+
+logger = logging.getLogger(__name__)
+
+# Default width of the bins used to reduce baseline photometry [days].  Since the JD changes at
+# noon UT, bins of one day collect the datapoints of a single night for sites in the Americas,
+# Europe and Africa
+BIN_WINDOW = 1.0
+
+# Default half-width of the region around t0, in units of tE, in which the photometry is kept
+# at full resolution
+TE_MULTIPLE = 3.0
+
+def bin_lightcurve(lightcurve, window=BIN_WINDOW, keep=None):
+    """
+    Function to reduce a lightcurve by combining the datapoints within each bin of width window
+    into their inverse-variance weighted mean.  Datapoints selected by the keep mask are returned
+    unbinned.
+
+    Parameters:
+        lightcurve  array  with columns [time, mag, err_mag]
+        window      float  Width of each bin [days]
+        keep        array  Optional boolean mask of the datapoints to keep at full resolution
+
+    Returns:
+        binned      array  with columns [time, mag, err_mag], sorted by time
+    """
+
+    lightcurve = np.asarray(lightcurve, dtype=float)
+    if len(lightcurve) == 0:
+        return lightcurve
+    if keep is None:
+        keep = np.zeros(len(lightcurve), dtype=bool)
+
+    # Datapoints without a valid uncertainty cannot be weighted, and are left to the checks
+    # made when the lightcurves are packaged for fitting
+    valid = np.isfinite(lightcurve).all(axis=1) & (lightcurve[:, 2] > 0.0)
+    to_bin = valid & ~keep
+    data = lightcurve[to_bin]
+
+    (bins, index) = np.unique(np.floor(data[:, 0] / window), return_inverse=True)
+    weights = 1.0 / data[:, 2] ** 2
+    sum_weights = np.bincount(index, weights=weights)
+    binned = np.c_[
+        np.bincount(index, weights=weights * data[:, 0]) / sum_weights,
+        np.bincount(index, weights=weights * data[:, 1]) / sum_weights,
+        1.0 / np.sqrt(sum_weights)
+    ]
+
+    binned = np.concatenate((binned, lightcurve[~to_bin]))
+
+    return binned[np.argsort(binned[:, 0], kind='stable')]
+
+def bin_baseline(datasets, t0, tE, window=BIN_WINDOW, tE_multiple=TE_MULTIPLE):
+    """
+    Function to bin the baseline photometry of each dataset of an event, keeping the datapoints
+    within tE_multiple * tE of t0 at full resolution.
+
+    Parameters:
+        datasets     dict   of lightcurve arrays, as produced by repackage_lightcurves
+        t0, tE       float  Estimated parameters of the event
+        window       float  Width of each bin [days]
+        tE_multiple  float  Half-width of the region kept at full resolution, in units of tE
+
+    Returns:
+        binned       dict   of binned lightcurve arrays
+        ndata        int    Total number of datapoints after binning
+    """
+
+    binned = {}
+    ndata = 0
+    for name, lightcurve in datasets.items():
+        lightcurve = np.asarray(lightcurve, dtype=float)
+        if len(lightcurve) > 0:
+            keep = np.abs(lightcurve[:, 0] - t0) <= tE_multiple * tE
+            binned[name] = bin_lightcurve(lightcurve, window=window, keep=keep)
+        else:
+            binned[name] = lightcurve
+        ndata += len(binned[name])
+
+    return binned, ndata
+
+def estimate_event_timescale(datasets, lightcurves, window=BIN_WINDOW):
+    """
+    Function to make a preliminary estimate of the t0 and tE of an event, by fitting a PSPL model
+    to its lightcurves after binning all datapoints.  This fit is much faster than a fit to the
+    full lightcurves, and is used only to locate the part of the lightcurve to keep at full resolution.
+
+    Parameters:
+        datasets     dict   of lightcurve arrays
+        lightcurves  list   of the dataset names in order of priority, the first being the reference
+        window       float  Width of each bin [days]
+
+    Returns:
+        (t0, tE)     tuple of floats, or None if no estimate could be made
+    """
+
+    binned = [bin_lightcurve(datasets[name], window=window) for name in lightcurves]
+    binned = [lc for lc in binned if len(lc) > 0]
+    if len(binned) == 0 or len(binned[0]) < 5:
+        return None
+
+    try:
+        fit_results = pspl_tools.fit_pspl(pspl_tools.PSPLDataset(binned))
+    except (ValueError, np.linalg.LinAlgError) as e:
+        logger.warning('BINNING: Preliminary fit of the binned lightcurve failed: ' + repr(e))
+        return None
+
+    (t0, tE) = (float(fit_results['best_model'][0]), float(fit_results['best_model'][2]))
+    if not np.isfinite(t0) or not np.isfinite(tE) or tE <= 0.0:
+        return None
+
+    return t0, tE
+
+def reduce_datasets(datasets, lightcurves, previous_fit=None, window=BIN_WINDOW, tE_multiple=TE_MULTIPLE):
+    """
+    Function to apply the optional binning of the baseline photometry of an event before it is fitted.
+    The region kept at full resolution is centred on the previous model of the event, if one is
+    available, or on a preliminary estimate of t0 and tE from the binned lightcurve.
+
+    Parameters:
+        datasets      dict   of lightcurve arrays
+        lightcurves   list   of the dataset names in order of priority
+        previous_fit  dict   Optional parameters of the previous fit, from MicrolensingTarget.get_previous_fit
+        window        float  Width of each bin [days]
+        tE_multiple   float  Half-width of the region kept at full resolution, in units of tE
+
+    Returns:
+        datasets      dict   of lightcurve arrays after binning, or the original datasets if the
+                             region of the event could not be located
+    """
+
+    if previous_fit and previous_fit.get('t0') and previous_fit.get('tE'):
+        (t0, tE) = (float(previous_fit['t0']), float(previous_fit['tE']))
+    else:
+        estimate = estimate_event_timescale(datasets, lightcurves, window=window)
+        if estimate is None:
+            logger.info('BINNING: Unable to locate the event, fitting the unbinned lightcurves')
+            return datasets
+        (t0, tE) = estimate
+
+    ndata = sum([len(lc) for lc in datasets.values()])
+    (binned, nbinned) = bin_baseline(datasets, t0, tE, window=window, tE_multiple=tE_multiple)
+    logger.info('BINNING: Binned ' + str(ndata) + ' datapoints to ' + str(nbinned)
+                + ', keeping full resolution within ' + str(tE_multiple) + 'tE of t0=' + str(round(t0, 3)))
+
+    return binned
@@ -0,0 +1,120 @@
+from django.db.models.query import QuerySet
+from datetime import timezone
+from operator import attrgetter
+from astropy.time.utils import day_frac
+import numpy as np
+import erfa
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields of PhotometryReducedDatum required to build the lightcurves of a target
+PHOTOMETRY_FIELDS = ('timestamp', 'bandpass', 'brightness', 'brightness_error', 'source_name')
+
+# Sources of PhotometryReducedDatums which are not measurements of the target's lightcurve
+EXCLUDED_SOURCES = ['Interferometry_predictor']
+
+# Uncertainty assigned to datapoints without a photometric error, e.g. where only a limit is available
+DEFAULT_ERROR = 1.0
+
+def datetimes_to_jd(timestamps):
+    """
+    Function to convert a sequence of datetimes to UTC Julian Dates in a single step, rather than
+    creating an astropy Time for each datapoint.  The calendar fields of all of the datetimes are
+    converted together by ERFA, exactly as astropy converts them one at a time, so that the
+    results are identical to Time(ts).jd, including on days with a leap second.
+    Naive datetimes are assumed to be UTC, as they are by astropy.
+
+    Parameters:
+        timestamps  list   of datetimes
+
+    Returns:
+        jd          array  of Julian Dates
+    """
+
+    fields = np.array(
+        [(ts.astimezone(timezone.utc) if ts.tzinfo else ts).timetuple()[:6] + (ts.microsecond,)
+         for ts in timestamps],
+        dtype=np.int64
+    ).reshape(-1, 7)
+
+    (jd1, jd2) = erfa.dtf2d('UTC', *fields[:, :5].T.astype(np.intc), fields[:, 5] + fields[:, 6] / 1e6)
+    (jd1, jd2) = day_frac(jd1, jd2)
+
+    return jd1 + jd2
+
+def photometry_columns(photometry):
+    """
+    Function to extract the photometry of a target as columns of arrays.  If a QuerySet of
+    PhotometryReducedDatums is given, only the required fields are fetched, through values_list,
+    so that no model instances are created.  Any other sequence of datapoints, such as the named
+    tuples yielded by querytools.stream_photometry_for_targetset or a list of
+    PhotometryReducedDatums, is read by attribute.  Datapoints from EXCLUDED_SOURCES are removed.
+
+    Parameters:
+        photometry  QuerySet or list of datapoints with the attributes in PHOTOMETRY_FIELDS
+
+    Returns:
+        columns     dict   of arrays of 'jd', 'mag', 'mag_err' and 'bandpass', in the order of the
+                           datapoints given
+    """
+
+    if isinstance(photometry, QuerySet):
+        rows = list(photometry.values_list(*PHOTOMETRY_FIELDS))
+    else:
+        rows = list(map(attrgetter(*PHOTOMETRY_FIELDS), photometry))
+    rows = [row for row in rows if row[4] not in EXCLUDED_SOURCES]
+
+    if len(rows) == 0:
+        return {'jd': np.zeros(0), 'mag': np.zeros(0), 'mag_err': np.zeros(0),
+                'bandpass': np.zeros(0, dtype=object)}
+
+    (timestamps, bandpasses, mags, errors, sources) = zip(*rows)
+
+    return {
+        'jd': datetimes_to_jd(timestamps),
+        'mag': np.array(mags, dtype=float),
+        'mag_err': np.array([DEFAULT_ERROR if e is None else e for e in errors], dtype=float),
+        'bandpass': np.array(bandpasses, dtype=object)
+    }
+
+def build_datasets(columns):
+    """
+    Function to divide the columns of photometry into the lightcurves of each bandpass, in the
+    PyLIMA-compatible format of arrays with columns [time, mag, err_mag].  The bandpasses are given
+    in the order in which they first occur, and the datapoints of each retain their order.
+
+    Parameters:
+        columns     dict   of arrays, as returned by photometry_columns
+
+    Returns:
+        datasets    dict   of lightcurve arrays indexed by bandpass
+        ndata       int    Total number of datapoints
+    """
+
+    datasets = {}
+    if len(columns['jd']) == 0:
+        return datasets, 0
+
+    (bandpasses, first, index) = np.unique(columns['bandpass'].astype(str), return_index=True,
+                                           return_inverse=True)
+    lc = np.c_[columns['jd'], columns['mag'], columns['mag_err']]
+    for i in np.argsort(first):
+        datasets[columns['bandpass'][first[i]]] = lc[index == i]
+
+    return datasets, len(lc)
+
+def load_lightcurves(photometry):
+    """
+    Function to load the lightcurves of a target from its photometry, equivalent to
+    fittools.repackage_lightcurves
+
+    Parameters:
+        photometry  QuerySet or list of datapoints, as accepted by photometry_columns
+
+    Returns:
+        datasets    dict   of lightcurve arrays indexed by bandpass
+        ndata       int    Total number of datapoints
+    """
+
+    return build_datasets(photometry_columns(photometry))
@@ -0,0 +1,244 @@
+from tom_targets.models import Target
+from mop.toolbox import lightcurve_loader, querytools, packed_lightcurves
+from django.utils import timezone
+import json
+import os
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default directory of the snapshot, if configured.  The snapshot is intended for local and manual
+# batch runs, e.g. benchmarks and refits of many events from a workstation: the deployed jobs have no
+# persistent volume to hold it, so none is assumed, and they read the packed lightcurves instead
+SNAPSHOT_DIR = os.getenv('LIGHTCURVE_SNAPSHOT_DIR')
+
+# Version of the layout of the snapshot files
+SNAPSHOT_FORMAT = 1
+
+# Fraction of the datapoints in the snapshot files belonging to superseded lightcurves above which
+# the snapshot is compacted into a single segment
+COMPACT_THRESHOLD = 0.5
+
+def snapshot_state(target_list):
+    """
+    Function to summarize the photometry of a set of targets with a single query, as the largest
+    ID and the number of their PhotometryReducedDatums, derived from the per-source
+    packed_lightcurves.photometry_state.  Any ingest, revision through re-ingest or deletion of
+    datapoints changes this state, so it identifies the lightcurves in a snapshot which are no
+    longer current.
+
+    Parameters:
+        target_list  list   of Targets
+
+    Returns:
+        state        dict   of [last datum ID, number of datapoints] indexed by the target pk,
+                            for every target in target_list
+    """
+
+    state = {}
+    for target_id, sources in packed_lightcurves.photometry_state(target_list).items():
+        (ndata, last_datum) = packed_lightcurves.combine_state(sources, lambda key: '').get('', (0, 0))
+        state[target_id] = [last_datum, ndata]
+
+    return state
+
+def read_index(path):
+    """Function to read the index of the snapshot in the directory given, returning None if there is none"""
+
+    try:
+        with open(os.path.join(path, 'index.json'), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('format') != SNAPSHOT_FORMAT:
+        return None
+
+    return index
+
+def write_index(index, path):
+    """Function to replace the index of a snapshot atomically, so that readers always find a complete index"""
+
+    tmp_file = os.path.join(path, 'index.json.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, os.path.join(path, 'index.json'))
+
+def write_segment(path, segment_id, columns):
+    """Function to write the columns of JD, magnitude and uncertainty of a set of lightcurves to a
+    new segment file of the snapshot, as a single array of shape (3, N)"""
+
+    file_name = 'segment_' + str(segment_id).zfill(6) + '.npy'
+    data = np.concatenate(columns, axis=1) if len(columns) > 0 else np.zeros((3, 0))
+    tmp_file = os.path.join(path, file_name + '.tmp')
+    with open(tmp_file, 'wb') as f:
+        np.save(f, np.ascontiguousarray(data, dtype=float))
+    os.replace(tmp_file, os.path.join(path, file_name))
+
+    return file_name
+
+def refresh_snapshot(path, target_list=None, full=False, compact_threshold=COMPACT_THRESHOLD):
+    """
+    Function to bring the lightcurve snapshot up to date with the photometry in the database.
+    Only the lightcurves of targets whose photometry has changed since they were written, or which
+    are new to the snapshot, are retrieved, and these are written to a new segment file, while the
+    lightcurves of targets no longer selected are dropped from the index.  Once more than
+    compact_threshold of the stored datapoints belong to superseded lightcurves, all current
+    lightcurves are rewritten to a single segment.  Readers which opened the snapshot earlier
+    continue to read their version of it.
+
+    Parameters:
+        path          str    Directory of the snapshot
+        target_list   list   of Targets to include, by default all alive microlensing events
+        full          bool   Rewrite all of the lightcurves
+        compact_threshold  float  Fraction of superseded datapoints which triggers compaction
+
+    Returns:
+        summary       dict   giving the number of targets in the snapshot, the number updated and
+                             removed, the total number of datapoints, the number of segment files
+                             and whether the snapshot was compacted
+    """
+
+    os.makedirs(path, exist_ok=True)
+    if target_list is None:
+        target_list = list(Target.objects.filter(alive=True, classification__icontains='Microlensing'))
+
+    index = None if full else read_index(path)
+    if index is None:
+        index = {'format': SNAPSHOT_FORMAT, 'created': timezone.now().isoformat(), 'next_segment': 0,
+                 'segments': {}, 'targets': {}}
+
+    # The state of the photometry is taken before it is retrieved, so that datapoints ingested
+    # in the meantime are picked up by the next refresh
+    state = snapshot_state(target_list)
+    selected = {str(mulens.pk) for mulens in target_list}
+    removed = [key for key in index['targets'].keys() if key not in selected]
+    for key in removed:
+        del index['targets'][key]
+    stale = [mulens for mulens in target_list
+             if index['targets'].get(str(mulens.pk), {}).get('state') != state[mulens.pk]]
+
+    # Write the lightcurves of the targets which have changed to a new segment
+    if len(stale) > 0:
+        segment_id = index['next_segment']
+        columns = []
+        offset = 0
+        for mulens, photometry in querytools.stream_photometry_for_targetset(stale):
+            (datasets, ndata) = lightcurve_loader.load_lightcurves(photometry)
+            entry = {'name': mulens.name, 'state': state[mulens.pk], 'segment': segment_id,
+                     'ndata': ndata, 'bandpasses': []}
+            for bandpass, lc in datasets.items():
+                columns.append(lc.T)
+                entry['bandpasses'].append([bandpass, offset, len(lc)])
+                offset += len(lc)
+            index['targets'][str(mulens.pk)] = entry
+        index['segments'][str(segment_id)] = {'file': write_segment(path, segment_id, columns), 'ndata': offset}
+        index['next_segment'] = segment_id + 1
+
+    # Compact the snapshot if it is largely made of superseded lightcurves
+    nstored = sum([segment['ndata'] for segment in index['segments'].values()])
+    ncurrent = sum([entry['ndata'] for entry in index['targets'].values()])
+    compacted = False
+    if len(index['segments']) > 1 and nstored > 0 and (nstored - ncurrent) / nstored > compact_threshold:
+        snapshot = LightcurveSnapshot(path, index=index)
+        segment_id = index['next_segment']
+        columns = []
+        offset = 0
+        for entry in index['targets'].values():
+            segment = snapshot.get_segment(entry['segment'])
+            for item in entry['bandpasses']:
+                columns.append(segment[:, item[1]:item[1] + item[2]])
+                item[1] = offset
+                offset += item[2]
+            entry['segment'] = segment_id
+        index['segments'] = {str(segment_id): {'file': write_segment(path, segment_id, columns), 'ndata': offset}}
+        index['next_segment'] = segment_id + 1
+        compacted = True
+
+    # Drop the segments no longer referenced once the new index is in place.  Readers holding a
+    # memory map of a removed file can still read it until they close it
+    referenced = {str(entry['segment']) for entry in index['targets'].values()}
+    index['segments'] = {key: segment for key, segment in index['segments'].items() if key in referenced}
+    index['updated'] = timezone.now().isoformat()
+    write_index(index, path)
+    current_files = {'index.json'} | {segment['file'] for segment in index['segments'].values()}
+    for file_name in os.listdir(path):
+        if file_name.startswith('segment_') and file_name not in current_files:
+            os.remove(os.path.join(path, file_name))
+
+    summary = {'ntargets': len(index['targets']), 'nupdated': len(stale), 'nremoved': len(removed),
+               'ndata': ncurrent, 'nsegments': len(index['segments']), 'compacted': compacted}
+    logger.info('LIGHTCURVE_SNAPSHOT: Refreshed snapshot in ' + path + ': ' + repr(summary))
+
+    return summary
+
+
+class LightcurveSnapshot():
+    """
+    Reader of a lightcurve snapshot.  The segment files are memory-mapped when first needed, and the
+    lightcurves of each target are returned as read-only views of them, so that no data are copied
+    or read from the database.
+    """
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self.index = index if index is not None else read_index(path)
+        if self.index is None:
+            raise FileNotFoundError('No lightcurve snapshot found in ' + path)
+        self.segments = {}
+
+    def __contains__(self, target):
+        return str(target.pk) in self.index['targets']
+
+    def __len__(self):
+        return len(self.index['targets'])
+
+    def get_segment(self, segment_id):
+        """Method to return the memory-mapped array of a segment of the snapshot"""
+
+        if segment_id not in self.segments:
+            file_name = self.index['segments'][str(segment_id)]['file']
+            self.segments[segment_id] = np.load(os.path.join(self.path, file_name), mmap_mode='r')
+
+        return self.segments[segment_id]
+
+    def get_lightcurves(self, target):
+        """
+        Method to return the lightcurves of a target from the snapshot, in the format of
+        lightcurve_loader.load_lightcurves, as read-only views of the memory-mapped segment.
+
+        Returns:
+            datasets   dict   of lightcurve arrays indexed by bandpass, or None if the target
+                              is not in the snapshot
+            ndata      int    Total number of datapoints
+        """
+
+        entry = self.index['targets'].get(str(target.pk))
+        if entry is None:
+            return None, 0
+
+        segment = self.get_segment(entry['segment'])
+        datasets = {bandpass: segment[:, offset:offset + n].T for (bandpass, offset, n) in entry['bandpasses']}
+
+        return datasets, entry['ndata']
+
+    def current_targets(self, target_list):
+        """Method to identify the targets whose lightcurves in the snapshot are up to date with the
+        photometry in the database, using a single query.  Returns a set of target pks"""
+
+        state = snapshot_state(target_list)
+
+        return {mulens.pk for mulens in target_list
+                if self.index['targets'].get(str(mulens.pk), {}).get('state') == state[mulens.pk]}
+
+
+def open_snapshot(path):
+    """Function to open the lightcurve snapshot in the directory given, returning None if there is none,
+    so that callers can fall back to reading the database"""
+
+    try:
+        return LightcurveSnapshot(path)
+    except FileNotFoundError:
+        logger.warning('LIGHTCURVE_SNAPSHOT: No snapshot found in ' + path)
+        return None
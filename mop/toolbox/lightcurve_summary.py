@@ -0,0 +1,122 @@
+from microlensing_targets.models import LightcurveSummary
+from tom_dataproducts.models import PhotometryReducedDatum
+from mop.toolbox import lightcurve_loader
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils import timezone
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Statistics held in a LightcurveSummary, in addition to the number of datapoints
+SUMMARY_FIELDS = ('first_jd', 'last_jd', 'mag_min', 'mag_max', 'mag_median', 'mag_baseline')
+
+def summarize_lightcurve(jd, mag):
+    """
+    Function to calculate the summary statistics of a lightcurve.  Magnitudes which are not positive
+    or not finite, e.g. where only a limit is available, are excluded from the magnitude statistics.
+    The baseline is estimated as the median magnitude of the fainter half of the valid datapoints,
+    which is dominated by the unmagnified source for a transient event.
+
+    Parameters:
+        jd      array   of Julian Dates
+        mag     array   of magnitudes
+
+    Returns:
+        stats   dict    of ndata and the SUMMARY_FIELDS, which are None where there are no data
+    """
+
+    stats = {'ndata': len(jd)}
+    stats.update({key: None for key in SUMMARY_FIELDS})
+
+    if len(jd) > 0:
+        stats['first_jd'] = float(np.min(jd))
+        stats['last_jd'] = float(np.max(jd))
+
+    valid = mag[np.isfinite(mag) & (mag > 0.0)]
+    if len(valid) > 0:
+        stats['mag_min'] = float(valid.min())
+        stats['mag_max'] = float(valid.max())
+        median = np.median(valid)
+        stats['mag_median'] = float(median)
+        stats['mag_baseline'] = float(np.median(valid[valid >= median]))
+
+    return stats
+
+def store_lightcurve_summaries(target, arrays, bandpasses=None):
+    """
+    Function to update the LightcurveSummaries of a target from arrays of its photometry, such as
+    its packed lightcurves.  The summary of all of the target's photometry is always recalculated,
+    while only those of the bandpasses given are, together with any which have not been summarized
+    before.  Summaries of bandpasses for which there is no longer any photometry are removed.
+    Each summary records the largest ID of the PhotometryReducedDatums it includes, so that
+    get_current_summary can tell whether it is up to date.
+
+    Parameters:
+        target      MicrolensingTarget
+        arrays      dict   of tuples of arrays of (jd, mag) and the largest ID of the
+                           PhotometryReducedDatums they hold, indexed by (bandpass, source_name)
+        bandpasses  list   of bandpasses whose photometry has changed, by default all
+
+    Returns:
+        summaries   dict   of the LightcurveSummaries of the target, indexed by bandpass, with the
+                           summary of all of its photometry under ''
+    """
+
+    summaries = {summary.bandpass: summary for summary in LightcurveSummary.objects.filter(target=target)}
+    available = {key[0] for key in arrays.keys()}
+    if bandpasses is None:
+        bandpasses = available
+    selected = (set(bandpasses) & available) | (available - set(summaries.keys())) | {''}
+
+    now = timezone.now()
+    for bandpass in selected:
+        columns = [data for key, data in arrays.items() if bandpass in ('', key[0])]
+        jd = np.concatenate([data[0] for data in columns]) if len(columns) > 0 else np.zeros(0)
+        mag = np.concatenate([data[1] for data in columns]) if len(columns) > 0 else np.zeros(0)
+
+        summary = summaries.get(bandpass, LightcurveSummary(target=target, bandpass=bandpass))
+        for key, value in summarize_lightcurve(jd, mag).items():
+            setattr(summary, key, value)
+        summary.last_datum = max([data[2] for data in columns], default=0)
+        summary.updated = now
+        summary.save()
+        summaries[bandpass] = summary
+
+    for bandpass in [bandpass for bandpass in summaries.keys() if bandpass not in available | {''}]:
+        summaries.pop(bandpass).delete()
+
+    return summaries
+
+def get_current_summary(target, bandpass=''):
+    """
+    Function to read the LightcurveSummary of a target's photometry in a single bandpass, or of all
+    of its photometry by default, only if it is up to date with the photometry.  The number and the
+    largest ID of the datapoints are compared with those summarized in the same query, so nothing
+    is written to the database.
+
+    Parameters:
+        target     MicrolensingTarget
+        bandpass   str    Bandpass of the summary, or '' for all bandpasses
+
+    Returns:
+        summary    LightcurveSummary or None if there is no current summary, e.g. where photometry
+                   has been ingested since the summaries were last updated
+    """
+
+    photometry = PhotometryReducedDatum.objects.filter(target=OuterRef('target'))\
+        .exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)
+    if bandpass:
+        photometry = photometry.filter(bandpass=bandpass)
+    photometry = photometry.order_by().values('target')
+
+    summary = LightcurveSummary.objects.filter(target=target, bandpass=bandpass).annotate(
+        current_ndata=Subquery(photometry.annotate(n=Count('pk')).values('n')),
+        current_last_datum=Subquery(photometry.annotate(last=Max('pk')).values('last'))
+    ).first()
+
+    if summary is None or summary.ndata != (summary.current_ndata or 0) \
+            or summary.last_datum != (summary.current_last_datum or 0):
+        return None
+
+    return summary
@@ -0,0 +1,133 @@
+from mop.toolbox import pspl_tools, model_lightcurves
+from functools import lru_cache
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of sampled model lightcurves held in the in-process cache
+MODEL_CACHE_SIZE = 512
+
+# Half-width of the range of a sampled model lightcurve around t0, in units of tE
+MODEL_RANGE_TE = 5.0
+
+def model_parameters(mulens):
+    """
+    Function to extract the PSPL model parameters stored for a MicrolensingTarget, together with
+    the version of the fit they came from.  Targets which have not been fitted, or whose fit
+    failed, have t0, tE or source_magnitude set to zero or NaN, and have no valid model.
+    A blend_magnitude of zero or NaN indicates that no blend flux was fitted.
+
+    Parameters:
+        mulens   MicrolensingTarget
+
+    Returns:
+        params   tuple  (t0, u0, tE, source_flux, blend_flux, fit version) or None
+    """
+
+    try:
+        (t0, u0, tE, source_mag) = [float(getattr(mulens, key))
+                                    for key in ['t0', 'u0', 'tE', 'source_magnitude']]
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+    if not np.all(np.isfinite([t0, u0, tE, source_mag])) or t0 == 0.0 or tE <= 0.0 or source_mag == 0.0:
+        return None
+
+    try:
+        blend_mag = float(mulens.blend_magnitude)
+    except (AttributeError, TypeError, ValueError):
+        blend_mag = 0.0
+    if np.isfinite(blend_mag) and blend_mag != 0.0:
+        blend_flux = pspl_tools.magnitude_to_flux(blend_mag)
+    else:
+        blend_flux = 0.0
+
+    # The time of the last fit changes whenever the target is refitted, and identifies the fit version
+    version = getattr(mulens, 'last_fit', None)
+
+    return (t0, u0, tE, pspl_tools.magnitude_to_flux(source_mag), blend_flux, version)
+
+def model_magnitude(params, times):
+    """Function to evaluate the PSPL model magnitude at the given times [JD] in closed form,
+    from the parameters returned by model_parameters"""
+
+    (t0, u0, tE, source_flux, blend_flux, version) = params
+    A = pspl_tools.pspl_magnification(np.asarray(times, dtype=float), t0, u0, tE)
+
+    return pspl_tools.flux_to_magnitude(source_flux * A + blend_flux)
+
+def evaluate_model(mulens, times):
+    """
+    Function to compute the magnitude of the fitted model of a target at any set of times,
+    directly from its stored parameters.
+
+    Parameters:
+        mulens   MicrolensingTarget
+        times    float or array  Timestamps [JD]
+
+    Returns:
+        mags     float or array  Model magnitudes, or None if the target has no valid model
+    """
+
+    params = model_parameters(mulens)
+    if not params:
+        return None
+
+    return model_magnitude(params, times)
+
+def model_lightcurve(mulens, tmin=None, tmax=None, max_error=model_lightcurves.MAX_MAG_ERROR):
+    """
+    Function to return the model lightcurve of a target, sampled adaptively so that linear
+    interpolation between the points reproduces the model to within max_error in magnitude.
+    The lightcurve covers at least t0 +/- 5 tE, extended to include tmin and tmax if given.
+
+    Sampled lightcurves are held in an in-process LRU cache keyed by the target and the version
+    and parameters of its fit, so that the cache is invalidated when the target is refitted.
+    The arrays returned are shared between callers and are read-only.
+
+    Parameters:
+        mulens     MicrolensingTarget
+        tmin       float  Optional, earliest time to include [JD]
+        tmax       float  Optional, latest time to include [JD]
+        max_error  float  Maximum interpolation error in magnitude
+
+    Returns:
+        times      array  Timestamps [JD], or None if the target has no valid model
+        mags       array  Model magnitudes, or None
+    """
+
+    params = model_parameters(mulens)
+    if not params:
+        return None, None
+
+    (t0, tE) = (params[0], params[2])
+    range_min = t0 - MODEL_RANGE_TE * tE
+    range_max = t0 + MODEL_RANGE_TE * tE
+    if tmin is not None and np.isfinite(tmin):
+        range_min = min(range_min, float(tmin))
+    if tmax is not None and np.isfinite(tmax):
+        range_max = max(range_max, float(tmax))
+
+    return _sampled_lightcurve(mulens.pk, params, range_min, range_max, max_error)
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _sampled_lightcurve(pk, params, tmin, tmax, max_error):
+
+    (t0, u0, tE, source_flux, blend_flux, version) = params
+    (times, mags) = model_lightcurves.sample_pspl_lightcurve(t0, u0, tE, source_flux, source_flux + blend_flux,
+                                                              tmin, tmax, max_error=max_error)
+    times.flags.writeable = False
+    mags.flags.writeable = False
+
+    return times, mags
+
+def cache_info():
+    """Function to return the hits, misses and size of the cache of sampled model lightcurves"""
+
+    return _sampled_lightcurve.cache_info()
+
+def clear_cache():
+    """Function to empty the cache of sampled model lightcurves"""
+
+    _sampled_lightcurve.cache_clear()
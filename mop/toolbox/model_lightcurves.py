@@ -0,0 +1,128 @@
+import numpy as np
+import base64
+from mop.toolbox import pspl_tools
+
+# Default maximum error in magnitude permitted when interpolating linearly between the
+# sampled points of a model lightcurve
+MAX_MAG_ERROR = 0.001
+
+# Identifier of the compact format used to store model lightcurves in lc_model ReducedDatums
+LC_MODEL_FORMAT = 'float32_base64'
+
+def sample_pspl_lightcurve(t0, u0, tE, fsource, ftotal, tmin, tmax, max_error=MAX_MAG_ERROR,
+                           nbase=64, max_iterations=30):
+    """
+    Function to sample the lightcurve of a PSPL model adaptively, evaluating the magnification
+    in closed form.  The sampling starts from a base grid which is dense around t0 and
+    increasingly sparse in the wings, and each interval is then bisected until the model
+    magnitude at its midpoint differs from the linear interpolation between its ends by
+    no more than max_error.
+
+    Parameters:
+        t0, u0, tE      float  PSPL model parameters
+        fsource         float  Source flux of the reference dataset
+        ftotal          float  Total flux of the reference dataset at baseline
+        tmin, tmax      float  Range of JDs to cover
+        max_error       float  Maximum interpolation error in magnitude
+        nbase           int    Number of points in the base grid
+        max_iterations  int    Maximum number of bisections of any interval
+
+    Returns:
+        times           array  Sorted timestamps [JD]
+        mags            array  Model magnitudes at each timestamp
+    """
+
+    def model_magnitude(t):
+        A = pspl_tools.pspl_magnification(t, t0, u0, tE)
+        return pspl_tools.flux_to_magnitude(fsource * (A - 1.0) + ftotal)
+
+    # Base grid spaced uniformly in arcsinh((t - t0) / width), which is linear within the
+    # width of the peak and logarithmic beyond it.  The width of the peak scales with u0*tE
+    width = abs(tE) * max(abs(u0), 1e-3)
+    x = np.linspace(np.arcsinh((tmin - t0) / width), np.arcsinh((tmax - t0) / width), nbase)
+    times = t0 + width * np.sinh(x)
+    times[0] = tmin
+    times[-1] = tmax
+    if tmin < t0 < tmax:
+        times = np.unique(np.append(times, t0))
+    mags = model_magnitude(times)
+
+    # Bisect only those intervals where the linear interpolation is not yet accurate enough,
+    # so that each iteration evaluates the model for the new midpoints alone
+    sampled_times = [times]
+    sampled_mags = [mags]
+    (t_left, t_right, m_left, m_right) = (times[:-1], times[1:], mags[:-1], mags[1:])
+    for i in range(max_iterations):
+        t_mid = 0.5 * (t_left + t_right)
+        m_mid = model_magnitude(t_mid)
+        refine = np.abs(m_mid - 0.5 * (m_left + m_right)) > max_error
+        if not refine.any():
+            break
+
+        sampled_times.append(t_mid[refine])
+        sampled_mags.append(m_mid[refine])
+        t_left, t_right = np.concatenate((t_left[refine], t_mid[refine])), \
+                          np.concatenate((t_mid[refine], t_right[refine]))
+        m_left, m_right = np.concatenate((m_left[refine], m_mid[refine])), \
+                          np.concatenate((m_mid[refine], m_right[refine]))
+
+    times = np.concatenate(sampled_times)
+    mags = np.concatenate(sampled_mags)
+    idx = np.argsort(times)
+
+    return times[idx], mags[idx]
+
+def encode_model_lightcurve(times, mags):
+    """
+    Function to pack a model lightcurve into the compact form stored in lc_model ReducedDatums.
+    The arrays are stored as base64-encoded float32 values, with the timestamps expressed
+    relative to a reference JD so that no precision is lost near the peak of the event.
+
+    Parameters:
+        times    array  Timestamps [JD]
+        mags     array  Model magnitudes
+
+    Returns:
+        value    dict   JSON-serializable value of the ReducedDatum
+    """
+
+    times = np.asarray(times, dtype=float)
+    mags = np.asarray(mags, dtype=float)
+
+    # The reference time is taken at the brightest point of the lightcurve, where the sampling
+    # is densest
+    t_ref = float(times[np.argmin(mags)]) if len(times) > 0 else 0.0
+
+    value = {
+        'lc_model_format': LC_MODEL_FORMAT,
+        'lc_model_time_reference': t_ref,
+        'lc_model_time': base64.b64encode((times - t_ref).astype('<f4').tobytes()).decode('ascii'),
+        'lc_model_magnitude': base64.b64encode(mags.astype('<f4').tobytes()).decode('ascii')
+    }
+
+    return value
+
+def decode_model_lightcurve(value):
+    """
+    Function to unpack the model lightcurve stored in an lc_model ReducedDatum.  Both the
+    compact format and the lists of timestamps and magnitudes stored by earlier versions
+    of MOP are supported.
+
+    Parameters:
+        value    dict   Value of the ReducedDatum
+
+    Returns:
+        times    array  Timestamps [JD]
+        mags     array  Model magnitudes
+    """
+
+    if value.get('lc_model_format') == LC_MODEL_FORMAT:
+        times = np.frombuffer(base64.b64decode(value['lc_model_time']), dtype='<f4').astype(float) \
+                + value['lc_model_time_reference']
+        mags = np.frombuffer(base64.b64decode(value['lc_model_magnitude']), dtype='<f4').astype(float)
+
+    else:
+        times = np.array(value['lc_model_time'], dtype=float)
+        mags = np.array(value['lc_model_magnitude'], dtype=float)
+
+    return times, mags
@@ -0,0 +1,240 @@
+from microlensing_targets.models import StalenessCheck
+from mop.toolbox import pspl_tools, model_evaluation, fittools, fit_scheduler
+from django.utils import timezone
+from scipy import stats
+import time
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Probability of the chi2 of the new datapoints under the stored model below which the model is
+# considered to be inconsistent with them
+P_THRESHOLD = 1e-3
+
+# Shift in t0 or u0 implied by the new datapoints, in units of its uncertainty, above which the
+# event is refitted
+SHIFT_THRESHOLD = 1.0
+
+# Minimum number of datapoints fitted previously in a passband for its fluxes to be calibrated
+MIN_CALIBRATION_POINTS = 5
+
+def split_new_datapoints(mulens):
+    """
+    Function to divide the lightcurves of a target into the datapoints used in its last model fit
+    and those received since, using the fingerprint recorded for that fit.  If later datapoints
+    were found to be consistent with the model without a refit, the fingerprint also records the
+    data the model was originally fitted to, and all datapoints received since are treated as new.
+
+    Parameters:
+        mulens     MicrolensingTarget with datasets and fit_fingerprint
+
+    Returns:
+        lightcurves  dict   of tuples of (fitted, new) lightcurve arrays, indexed by passband, or
+                            None if the datapoints fitted previously have since been revised
+    """
+
+    anchor = mulens.fit_fingerprint.get('model', mulens.fit_fingerprint)
+    max_jd = anchor['max_jd']
+
+    lightcurves = {}
+    for passband, lc in mulens.datasets.items():
+        lc = np.asarray(lc, dtype=float).reshape(-1, 3)
+        old = lc[:, 0] <= max_jd
+        if int(old.sum()) != anchor['counts'].get(passband, 0):
+            return None
+        lightcurves[passband] = (lc[old], lc[~old])
+
+    # Passbands that have been removed entirely also indicate revised data
+    if any([count > 0 and passband not in lightcurves for passband, count in anchor['counts'].items()]):
+        return None
+
+    return lightcurves
+
+def check_model_staleness(mulens, p_threshold=P_THRESHOLD, shift_threshold=SHIFT_THRESHOLD):
+    """
+    Function to test whether the stored model of a target still describes its lightcurve, using
+    only the datapoints received since the model was fitted.  The source and blend fluxes of each
+    passband are calibrated by a linear fit of the stored magnification to the datapoints fitted
+    previously.  The model is then scored against the new datapoints by their chi2, with the
+    photometric uncertainties rescaled by the reduced chi2 of the previous datapoints, and by the
+    Gauss-Newton shift in t0 and u0 that the new datapoints imply given the information in all
+    of the data.  A refit is required if the new datapoints are improbable under the model, or
+    if the shift in either parameter exceeds shift_threshold times its uncertainty.
+
+    Parameters:
+        mulens           MicrolensingTarget with datasets loaded by get_reduced_data
+        p_threshold      float  Minimum probability of the chi2 of the new datapoints
+        shift_threshold  float  Maximum shift in t0 or u0 in units of its uncertainty
+
+    Returns:
+        result           dict   with the decision 'refit', its 'reason', the number of new datapoints
+                                'nnew', their normalized 'chi2_new' and its 'p_value', and the
+                                't0_shift' and 'u0_shift' in units of their uncertainties
+    """
+
+    result = {'refit': True, 'reason': '', 'nnew': 0, 'chi2_new': None, 'p_value': None,
+              't0_shift': None, 'u0_shift': None}
+
+    params = model_evaluation.model_parameters(mulens)
+    if not params or not mulens.fit_fingerprint or 'max_jd' not in mulens.fit_fingerprint:
+        result['reason'] = 'No previous model to test'
+        return result
+
+    lightcurves = split_new_datapoints(mulens)
+    if lightcurves is None:
+        result['reason'] = 'Photometry revised since last fit'
+        return result
+
+    (t0, u0, tE) = params[0:3]
+    chi2_old = 0.0
+    ndof_old = 0
+    chi2_new = 0.0
+    nnew = 0
+    information = np.zeros((2, 2))
+    gradient = np.zeros(2)
+    for passband, (old, new) in lightcurves.items():
+        old = old[np.isfinite(old).all(axis=1) & (old[:, 2] > 0.0)]
+        new = new[np.isfinite(new).all(axis=1) & (new[:, 2] > 0.0)]
+        if len(new) > 0 and len(old) < MIN_CALIBRATION_POINTS:
+            result['reason'] = 'New datapoints in uncalibrated passband ' + passband
+            return result
+        if len(old) < MIN_CALIBRATION_POINTS:
+            continue
+
+        # Calibrate the source and blend fluxes of this passband from the datapoints fitted previously
+        (A, dA_dt0, dA_du0, dA_dtE) = pspl_tools.pspl_magnification_derivatives(old[:, 0], t0, u0, tE)
+        flux = pspl_tools.magnitude_to_flux(old[:, 1])
+        weight = 1.0 / pspl_tools.error_magnitude_to_error_flux(old[:, 2], flux)**2
+        design = np.c_[A, np.ones(len(A))]
+        normal = design.T @ (design * weight[:, np.newaxis])
+        if np.linalg.cond(normal) > 1e12:
+            result['reason'] = 'Fluxes of passband ' + passband + ' are not constrained'
+            return result
+        (fs, fb) = np.linalg.solve(normal, design.T @ (weight * flux))
+        chi2_old += np.sum(weight * (flux - fs * A - fb)**2)
+        ndof_old += len(old) - 2
+        jacobian = fs * np.c_[dA_dt0, dA_du0]
+        information += jacobian.T @ (jacobian * weight[:, np.newaxis])
+
+        if len(new) > 0:
+            (A, dA_dt0, dA_du0, dA_dtE) = pspl_tools.pspl_magnification_derivatives(new[:, 0], t0, u0, tE)
+            flux = pspl_tools.magnitude_to_flux(new[:, 1])
+            weight = 1.0 / pspl_tools.error_magnitude_to_error_flux(new[:, 2], flux)**2
+            residuals = flux - fs * A - fb
+            chi2_new += np.sum(weight * residuals**2)
+            nnew += len(new)
+            jacobian = fs * np.c_[dA_dt0, dA_du0]
+            information += jacobian.T @ (jacobian * weight[:, np.newaxis])
+            gradient += jacobian.T @ (weight * residuals)
+
+    result['nnew'] = nnew
+    if nnew == 0:
+        result['refit'] = False
+        result['reason'] = 'No new datapoints'
+        return result
+
+    # Photometric uncertainties are often underestimated, so they are rescaled by the reduced chi2
+    # of the model for the datapoints fitted previously, but never reduced
+    scale = max(chi2_old / ndof_old, 1.0) if ndof_old > 0 else 1.0
+    result['chi2_new'] = float(chi2_new / scale / nnew)
+    result['p_value'] = float(stats.chi2.sf(chi2_new / scale, nnew))
+
+    try:
+        covariance = np.linalg.inv(information / scale)
+        shift = covariance @ (gradient / scale)
+        (result['t0_shift'], result['u0_shift']) = [float(abs(shift[i]) / np.sqrt(covariance[i, i]))
+                                                    for i in range(2)]
+    except np.linalg.LinAlgError:
+        result['reason'] = 'Shift in t0 and u0 not constrained'
+        return result
+
+    if result['p_value'] < p_threshold:
+        result['reason'] = 'New datapoints inconsistent with model'
+    elif max(result['t0_shift'], result['u0_shift']) > shift_threshold:
+        result['reason'] = 'New datapoints shift t0 or u0'
+    else:
+        result['refit'] = False
+        result['reason'] = 'New datapoints consistent with model'
+
+    return result
+
+def advance_fit_bookkeeping(mulens, time_now):
+    """
+    Function to update the fit records of a target whose stored model was found to describe its
+    new datapoints, as if it had been refitted: the fingerprint of the current data is recorded,
+    together with that of the data the model was fitted to, and the time of the last fit, the next
+    fit due and the alive status are updated.  The model parameters themselves are unchanged.
+    """
+
+    fingerprint = dict(mulens.fingerprint)
+    fingerprint['model'] = mulens.fit_fingerprint.get('model', {
+        'counts': mulens.fit_fingerprint['counts'],
+        'max_jd': mulens.fit_fingerprint['max_jd']
+    })
+
+    mulens.store_parameter_set({
+        'fit_fingerprint': fingerprint,
+        'last_fit': time_now,
+        'next_fit_due': fit_scheduler.next_fit_due(float(mulens.t0), float(mulens.tE), time_now),
+        'alive': fittools.check_event_alive(float(mulens.t0), float(mulens.tE), mulens.last_observation)
+    })
+
+def apply_staleness_gate(mulens, time_now, run=None):
+    """
+    Function to decide whether a target that has received new datapoints needs to be refitted.
+    If its stored model still describes the data, the fit records are advanced without a refit.
+    The outcome of each test is recorded as a StalenessCheck.
+
+    Parameters:
+        mulens     MicrolensingTarget with datasets loaded by get_reduced_data
+        time_now   float  Current JD
+        run        FitCheckpoint  Optional, the run in which the test was made
+
+    Returns:
+        refit      bool   True if the target should be refitted
+    """
+
+    t1 = time.perf_counter()
+    result = check_model_staleness(mulens)
+    if not result['refit']:
+        advance_fit_bookkeeping(mulens, time_now)
+    wall_time = time.perf_counter() - t1
+
+    StalenessCheck.objects.create(
+        target=mulens,
+        run=run,
+        created=timezone.now(),
+        wall_time=wall_time,
+        **result
+    )
+    logger.info('STALENESS: ' + mulens.name + ' ' + ('refit' if result['refit'] else 'not refitted') + ': '
+                + result['reason'] + ', ' + str(result['nnew']) + ' new datapoints, chi2 '
+                + repr(result['chi2_new']) + ', shift t0 ' + repr(result['t0_shift'])
+                + ' u0 ' + repr(result['u0_shift']) + ' sigma')
+
+    return result['refit']
+
+def staleness_summary(qs):
+    """
+    Function to summarize a set of staleness tests, giving the fraction of refits they avoided.
+
+    Parameters:
+        qs        QuerySet of StalenessCheck
+
+    Returns:
+        summary   dict   giving the number of tests, the number of refits avoided and their
+                         fraction, the median cost of a test [s] and the number of tests
+                         resulting in each reason
+    """
+
+    records = list(qs.values_list('refit', 'reason', 'wall_time'))
+    summary = {'nchecks': len(records), 'navoided': len([r for r in records if not r[0]])}
+    summary['fraction_avoided'] = summary['navoided'] / summary['nchecks'] if summary['nchecks'] > 0 else 0.0
+    summary['median_wall_time'] = float(np.median([r[2] for r in records])) if len(records) > 0 else 0.0
+
+    summary['reasons'] = {}
+    for r in records:
+        summary['reasons'][r[1]] = summary['reasons'].get(r[1], 0) + 1
+
+    return summary
@@ -1,6 +1,5 @@
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target,TargetExtra
-from astropy.time import Time
 from mop.toolbox import fittools
 from datetime import datetime
 import json
@@ -73,11 +72,10 @@ class MicrolensingEvent():
         # Unpack the lightcurve data:
         (self.datasets, self.ndata) = fittools.repackage_lightcurves(self.red_data)
 
-        # Extract the timestamp of the last observation
-        time = [Time(i.timestamp).jd for i in self.red_data]
-        if len(time) > 0:
-            self.first_observation = min(time)
-            self.last_observation = max(time)
+        # Extract the timestamps of the first and last observations
+        if self.ndata > 0:
+            self.first_observation = float(min([lc[:, 0].min() for lc in self.datasets.values()]))
+            self.last_observation = float(max([lc[:, 0].max() for lc in self.datasets.values()]))
         else:
             self.first_observation = None
             self.last_observation = None
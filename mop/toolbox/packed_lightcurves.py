@@ -0,0 +1,421 @@
+from microlensing_targets.models import MicrolensingTarget, PackedLightcurve, LightcurveSummary
+from tom_dataproducts.models import PhotometryReducedDatum
+from mop.toolbox import lightcurve_loader, lightcurve_summary
+from django.db import transaction
+from django.db.models import Q, Count, Max
+from functools import reduce
+import operator
+from django.utils import timezone
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Binary format of the packed arrays, little-endian double precision
+PACKED_DTYPE = np.dtype('<f8')
+
+def pack_array(values):
+    """Function to pack an array of floats into bytes for storage in a PackedLightcurve"""
+
+    return np.ascontiguousarray(values, dtype=PACKED_DTYPE).tobytes()
+
+def unpack_array(data):
+    """Function to unpack the bytes of a PackedLightcurve field into a read-only array, without
+    copying the data"""
+
+    return np.frombuffer(data, dtype=PACKED_DTYPE)
+
+def fetch_packed_columns(target, after=None):
+    """
+    Function to retrieve the photometry of a target from its PhotometryReducedDatums, as columns
+    grouped by bandpass and source.  Datapoints from lightcurve_loader.EXCLUDED_SOURCES are omitted.
+
+    Parameters:
+        target     MicrolensingTarget
+        after      dict   Optional, of datapoint IDs indexed by (bandpass, source_name).  If given,
+                          only the photometry of these bandpasses and sources is retrieved, from the
+                          datapoints with IDs greater than that given
+
+    Returns:
+        columns    dict   of tuples of arrays of (jd, mag, mag_err, id), indexed by (bandpass, source_name),
+                          in time order
+    """
+
+    rows = PhotometryReducedDatum.objects.filter(target=target)\
+        .exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)
+    if after is not None:
+        if len(after) == 0:
+            return {}
+        rows = rows.filter(reduce(operator.or_, [Q(bandpass=key[0], source_name=key[1], pk__gt=last_datum)
+                                                 for key, last_datum in after.items()]))
+    rows = rows.order_by('timestamp')\
+        .values_list('bandpass', 'source_name', 'timestamp', 'brightness', 'brightness_error', 'pk')
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[0], row[1]), []).append(row[2:])
+
+    columns = {}
+    for key, group in groups.items():
+        (timestamps, mags, errors, ids) = zip(*group)
+        columns[key] = (
+            lightcurve_loader.datetimes_to_jd(timestamps),
+            np.array(mags, dtype=float),
+            np.array([lightcurve_loader.DEFAULT_ERROR if e is None else e for e in errors], dtype=float),
+            np.array(ids, dtype=np.int64)
+        )
+
+    return columns
+
+def photometry_state(target_list):
+    """
+    Function to summarize the photometry of a set of targets with a single aggregate query, as the
+    number of datapoints and the largest datapoint ID for each bandpass and source.  A packed
+    lightcurve is current if it holds the same number of datapoints and the same last datapoint.
+    Unlike a single high-water mark of datapoint IDs, the counts also reveal datapoints which were
+    given their IDs before others ingested concurrently but committed after them, and deletions.
+
+    Parameters:
+        target_list  list   of Targets
+
+    Returns:
+        state        dict   of dicts of (ndata, last datum ID) indexed by (bandpass, source_name),
+                            indexed by the pk of every target in target_list
+    """
+
+    state = {mulens.pk: {} for mulens in target_list}
+    qs = PhotometryReducedDatum.objects.filter(target__in=target_list)\
+        .exclude(source_name__in=lightcurve_loader.EXCLUDED_SOURCES)\
+        .values('target', 'bandpass', 'source_name')\
+        .annotate(ndata=Count('pk'), last_datum=Max('pk'))\
+        .values_list('target', 'bandpass', 'source_name', 'ndata', 'last_datum')
+    for (target_id, bandpass, source_name, ndata, last_datum) in qs:
+        state[target_id][(bandpass, source_name)] = (ndata, last_datum)
+
+    return state
+
+def combine_state(state, group):
+    """
+    Function to combine the photometry_state of a target over groups of bandpasses and sources,
+    e.g. to give the number of datapoints and the last datapoint ID of each bandpass.
+
+    Parameters:
+        state      dict      of (ndata, last datum ID) indexed by (bandpass, source_name), for one target
+        group      callable  Returning the key of the group of a (bandpass, source_name)
+
+    Returns:
+        combined   dict      of (ndata, last datum ID) indexed by group
+    """
+
+    combined = {}
+    for key, (ndata, last_datum) in state.items():
+        (ntotal, last_total) = combined.get(group(key), (0, 0))
+        combined[group(key)] = (ntotal + ndata, max(last_total, last_datum))
+
+    return combined
+
+def packed_state(target_list):
+    """Function to summarize the packed lightcurves of a set of targets, in the format of
+    photometry_state, with a single query which does not read the packed arrays"""
+
+    state = {mulens.pk: {} for mulens in target_list}
+    qs = PackedLightcurve.objects.filter(target__in=target_list)\
+        .values_list('target', 'bandpass', 'source_name', 'ndata', 'last_datum')
+    for (target_id, bandpass, source_name, ndata, last_datum) in qs:
+        state[target_id][(bandpass, source_name)] = (ndata, last_datum)
+
+    return state
+
+def current_packed_targets(target_list):
+    """Function to identify the targets of a set whose packed lightcurves are up to date with their
+    photometry, using two queries.  Returns a set of target pks"""
+
+    photometry = photometry_state(target_list)
+    packed = packed_state(target_list)
+
+    return {mulens.pk for mulens in target_list if photometry[mulens.pk] == packed[mulens.pk]}
+
+def current_summary_targets(target_list):
+    """Function to identify the targets of a set whose LightcurveSummaries are all up to date with
+    their photometry, using two queries.  Returns a set of target pks"""
+
+    totals = {}
+    for target_id, state in photometry_state(target_list).items():
+        totals[target_id] = combine_state(state, lambda key: key[0])
+        totals[target_id].update(combine_state(state, lambda key: ''))
+
+    summarized = {mulens.pk: {} for mulens in target_list}
+    qs = LightcurveSummary.objects.filter(target__in=target_list)\
+        .values_list('target', 'bandpass', 'ndata', 'last_datum')
+    for (target_id, bandpass, ndata, last_datum) in qs:
+        # A target without photometry may or may not have an empty summary
+        if ndata > 0:
+            summarized[target_id][bandpass] = (ndata, last_datum)
+
+    return {mulens.pk for mulens in target_list if totals[mulens.pk] == summarized[mulens.pk]}
+
+def lock_target(target):
+    """Function to lock the row of a target for the rest of the current transaction, so that its
+    packed lightcurves are updated by one process at a time, including when none exist yet"""
+
+    return MicrolensingTarget.objects.select_for_update().only('pk').get(pk=target.pk)
+
+def store_packed_lightcurve(lc, jd, mag, mag_err, last_datum):
+    """Function to store the arrays of a PackedLightcurve, sorted into time order, incrementing its version"""
+
+    order = np.argsort(jd, kind='stable')
+    lc.jd = pack_array(jd[order])
+    lc.mag = pack_array(mag[order])
+    lc.mag_err = pack_array(mag_err[order])
+    lc.ndata = len(jd)
+    lc.last_datum = last_datum
+    lc.version += 1
+    lc.updated = timezone.now()
+    lc.save()
+
+def refresh_packed_lightcurves(target):
+    """
+    Function to bring the packed lightcurves of a target up to date with its photometry.  The number
+    of datapoints and the last datapoint ID of each bandpass and source are compared with those
+    packed.  Where they differ, the datapoints with IDs greater than the last packed are appended,
+    if this accounts for all of the new photometry, and otherwise the packed lightcurve is rebuilt
+    from all of its photometry, e.g. where a datapoint was committed after others with greater IDs,
+    or datapoints have been deleted.  The LightcurveSummaries of the bandpasses which change are
+    recalculated from the packed lightcurves at the same time.
+    The target's row is locked while its packed lightcurves are updated, so that concurrent
+    refreshes of the same target are made in turn.  This is called by the harvesters following
+    ingest, and is cheap if there are no new datapoints.
+
+    Parameters:
+        target     MicrolensingTarget
+
+    Returns:
+        nnew       int    Number of datapoints added, less any removed
+    """
+
+    with transaction.atomic():
+        lock_target(target)
+        state = photometry_state([target])[target.pk]
+        current = packed_state([target])[target.pk]
+        changed = [key for key in set(state.keys()) | set(current.keys()) if state.get(key) != current.get(key)]
+
+        if len(changed) == 0:
+            return 0
+
+        # The packed arrays are only read once they are known to need updating
+        packed = {(lc.bandpass, lc.source_name): lc for lc in PackedLightcurve.objects.filter(target=target)}
+
+        # Datapoints with IDs greater than the last packed are appended where they account for
+        # all of the change in the photometry
+        updated = set()
+        nnew = 0
+        new_columns = fetch_packed_columns(target, after={key: packed[key].last_datum if key in packed else 0
+                                                          for key in changed if key in state})
+        rebuild = []
+        for key in changed:
+            lc = packed.get(key)
+            if key not in state:
+                nnew -= lc.ndata
+                packed.pop(key).delete()
+            elif key in new_columns and (lc.ndata if lc else 0) + len(new_columns[key][0]) == state[key][0] \
+                    and int(new_columns[key][3].max()) == state[key][1]:
+                (jd, mag, mag_err, ids) = new_columns[key]
+                if lc:
+                    jd = np.r_[unpack_array(lc.jd), jd]
+                    mag = np.r_[unpack_array(lc.mag), mag]
+                    mag_err = np.r_[unpack_array(lc.mag_err), mag_err]
+                else:
+                    lc = PackedLightcurve(target=target, bandpass=key[0], source_name=key[1])
+                    packed[key] = lc
+                nnew += len(ids)
+                store_packed_lightcurve(lc, jd, mag, mag_err, int(ids.max()))
+            else:
+                rebuild.append(key)
+            updated.add(key[0])
+
+        # Otherwise the packed lightcurve is rebuilt from all of its photometry
+        if len(rebuild) > 0:
+            logger.warning('PACKED_LIGHTCURVES: Rebuilding packed lightcurves ' + repr(rebuild) + ' of '
+                           + target.name + ' which do not match their photometry')
+            for key, (jd, mag, mag_err, ids) in fetch_packed_columns(target, after={key: 0 for key in rebuild}).items():
+                lc = packed.get(key, PackedLightcurve(target=target, bandpass=key[0], source_name=key[1]))
+                nnew += len(ids) - lc.ndata
+                store_packed_lightcurve(lc, jd, mag, mag_err, int(ids.max()))
+                packed[key] = lc
+
+        summarize_packed_lightcurves(target, packed, bandpasses=updated)
+
+    logger.info('PACKED_LIGHTCURVES: Updated the packed lightcurves ' + repr(sorted(changed)) + ' of '
+                + target.name + ' with ' + str(nnew) + ' datapoints')
+
+    return nnew
+
+def summarize_packed_lightcurves(target, packed=None, bandpasses=None):
+    """
+    Function to recalculate the LightcurveSummaries of a target from its packed lightcurves.
+
+    Parameters:
+        target      MicrolensingTarget
+        packed      dict   of PackedLightcurves indexed by (bandpass, source_name), by default
+                           those stored for the target
+        bandpasses  list   of bandpasses whose photometry has changed, by default all
+
+    Returns:
+        summaries   dict   of LightcurveSummaries indexed by bandpass
+    """
+
+    if packed is None:
+        packed = {(lc.bandpass, lc.source_name): lc for lc in PackedLightcurve.objects.filter(target=target)}
+
+    arrays = {key: (unpack_array(lc.jd), unpack_array(lc.mag), lc.last_datum) for key, lc in packed.items()}
+
+    return lightcurve_summary.store_lightcurve_summaries(target, arrays, bandpasses=bandpasses)
+
+def check_packed_lightcurves(target):
+    """
+    Function to compare the packed lightcurves of a target with its PhotometryReducedDatums, to
+    identify those which are missing, stale or no longer have any photometry, e.g. because datapoints
+    have been revised or deleted since they were packed.
+
+    Parameters:
+        target     MicrolensingTarget
+
+    Returns:
+        problems   dict   of descriptions of the inconsistencies, indexed by (bandpass, source_name)
+    """
+
+    columns = fetch_packed_columns(target)
+    packed = {(lc.bandpass, lc.source_name): lc for lc in PackedLightcurve.objects.filter(target=target)}
+
+    problems = {}
+    for key in set(columns.keys()) | set(packed.keys()):
+        if key not in packed:
+            problems[key] = 'Packed lightcurve missing'
+        elif key not in columns:
+            problems[key] = 'No photometry for packed lightcurve'
+        else:
+            (jd, mag, mag_err, ids) = columns[key]
+            lc = packed[key]
+            if lc.ndata != len(jd):
+                problems[key] = 'Packed ' + str(lc.ndata) + ' datapoints out of ' + str(len(jd))
+            elif lc.last_datum != int(ids.max()):
+                problems[key] = 'Last datapoint packed ' + str(lc.last_datum) + ' not ' + str(int(ids.max()))
+            else:
+                # Datapoints with identical timestamps may be stored in a different order
+                stored = np.c_[unpack_array(lc.jd), unpack_array(lc.mag), unpack_array(lc.mag_err)]
+                expected = np.c_[jd, mag, mag_err]
+                stored = stored[np.lexsort(stored.T[::-1])]
+                expected = expected[np.lexsort(expected.T[::-1])]
+                if not np.allclose(stored, expected, rtol=0.0, atol=1e-9, equal_nan=True):
+                    problems[key] = 'Packed datapoints differ from photometry'
+
+    return problems
+
+def rebuild_packed_lightcurves(target):
+    """
+    Function to rebuild all of the packed lightcurves of a target from its PhotometryReducedDatums,
+    removing any for which there is no longer any photometry, and to recalculate all of its
+    LightcurveSummaries.  Returns the number of packed lightcurves stored
+    """
+
+    with transaction.atomic():
+        lock_target(target)
+        packed = {(lc.bandpass, lc.source_name): lc for lc in PackedLightcurve.objects.filter(target=target)}
+        columns = fetch_packed_columns(target)
+
+        for key, (jd, mag, mag_err, ids) in columns.items():
+            lc = packed.get(key, PackedLightcurve(target=target, bandpass=key[0], source_name=key[1]))
+            store_packed_lightcurve(lc, jd, mag, mag_err, int(ids.max()))
+            packed[key] = lc
+
+        for key in [key for key in packed.keys() if key not in columns]:
+            packed.pop(key).delete()
+
+        summarize_packed_lightcurves(target, packed)
+
+    return len(columns)
+
+def combine_packed_lightcurves(packed):
+    """
+    Function to combine packed lightcurves into the format of lightcurve_loader.load_lightcurves.
+    The lightcurves from different sources in the same bandpass are combined in time order, and the
+    bandpasses are given in the order of their first datapoint.
+
+    Parameters:
+        packed     list   of the PackedLightcurves of a target
+
+    Returns:
+        datasets   dict   of lightcurve arrays indexed by bandpass
+        ndata      int    Total number of datapoints
+    """
+
+    combined = {}
+    for lc in sorted(packed, key=lambda lc: (lc.bandpass, lc.source_name)):
+        combined.setdefault(lc.bandpass, []).append(
+            np.c_[unpack_array(lc.jd), unpack_array(lc.mag), unpack_array(lc.mag_err)]
+        )
+
+    datasets = {}
+    for bandpass, lcs in combined.items():
+        lc = np.concatenate(lcs)
+        datasets[bandpass] = lc[np.argsort(lc[:, 0], kind='stable')]
+    datasets = dict(sorted(datasets.items(), key=lambda item: item[1][0, 0] if len(item[1]) > 0 else np.inf))
+
+    return datasets, sum([len(lc) for lc in datasets.values()])
+
+def load_packed_lightcurves(target, refresh=False):
+    """
+    Function to load the lightcurves of a target from its packed lightcurves, in the format of
+    lightcurve_loader.load_lightcurves.
+
+    Parameters:
+        target     MicrolensingTarget
+        refresh    bool   Bring the packed lightcurves up to date with the photometry, e.g. ingested
+                          through a data processor, before they are read
+
+    Returns:
+        datasets   dict   of lightcurve arrays indexed by bandpass
+        ndata      int    Total number of datapoints
+    """
+
+    if refresh:
+        refresh_packed_lightcurves(target)
+
+    return combine_packed_lightcurves(PackedLightcurve.objects.filter(target=target))
+
+def stream_packed_lightcurves(target_list, chunk_size=25):
+    """
+    Generator to load the lightcurves of a set of targets from their packed lightcurves, in the
+    order of target_list, reading those of each chunk of targets with a single query.
+
+    Parameters:
+        target_list  list   of Targets, with no duplicates
+        chunk_size   int    Number of targets whose packed lightcurves are read by each query
+
+    Returns:
+        (target, datasets)  tuple of Target and the dictionary of its lightcurves, for each entry
+                            in target_list
+    """
+
+    chunk_size = max(1, int(chunk_size))
+    for i in range(0, len(target_list), chunk_size):
+        chunk = target_list[i:i + chunk_size]
+        packed = {mulens.pk: [] for mulens in chunk}
+        for lc in PackedLightcurve.objects.filter(target__in=chunk):
+            packed[lc.target_id].append(lc)
+
+        for mulens in chunk:
+            (datasets, ndata) = combine_packed_lightcurves(packed.pop(mulens.pk))
+            yield mulens, datasets
+
+def update_lightcurve_summaries(target):
+    """
+    Function to bring the packed lightcurves and all of the LightcurveSummaries of a target up to
+    date with its photometry, e.g. where the packed lightcurves were made before the summaries were
+    introduced.  Returns the dictionary of LightcurveSummaries indexed by bandpass
+    """
+
+    with transaction.atomic():
+        lock_target(target)
+        refresh_packed_lightcurves(target)
+        return summarize_packed_lightcurves(target)
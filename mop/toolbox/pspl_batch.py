@@ -0,0 +1,335 @@
+import numpy as np
+import logging
+from mop.toolbox import pspl_tools
+
+logger = logging.getLogger(__name__)
+
+
+class PSPLBatch():
+    """
+    Class holding the lightcurves of a set of events, stacked into padded arrays so that the PSPL
+    residuals and Jacobians of all events can be evaluated in a single vectorized step.
+
+    Each event occupies one row of the arrays.  Events with fewer datapoints or telescopes than the
+    largest event in the batch are padded: padded datapoints carry zero weight and the parameters
+    of absent telescopes are held fixed.
+    """
+
+    def __init__(self, datasets):
+        """
+        Parameters:
+            datasets  list  of pspl_tools.PSPLDataset objects
+        """
+
+        self.datasets = datasets
+        self.nevents = len(datasets)
+        self.ndata = np.array([ds.ndata for ds in datasets], dtype=int)
+        self.ntel = np.array([ds.ntel for ds in datasets], dtype=int)
+        self.nparams = 3 + 2 * self.ntel
+
+        nmax = max(self.ndata.max(), 1)
+        tmax = max(self.ntel.max(), 1)
+        self.max_params = 3 + 2 * tmax
+
+        # Padded datapoints use a unit uncertainty and a timestamp drawn from the event so that
+        # the model remains finite everywhere
+        self.time = np.zeros((self.nevents, nmax))
+        self.flux = np.zeros((self.nevents, nmax))
+        self.err_flux = np.ones((self.nevents, nmax))
+        self.tel_index = np.zeros((self.nevents, nmax), dtype=int)
+        self.data_mask = np.zeros((self.nevents, nmax), dtype=bool)
+        self.param_mask = np.zeros((self.nevents, self.max_params), dtype=bool)
+
+        for i, ds in enumerate(datasets):
+            n = ds.ndata
+            self.time[i, :] = ds.time[0] if n > 0 else 0.0
+            self.time[i, 0:n] = ds.time
+            self.flux[i, 0:n] = ds.flux
+            self.err_flux[i, 0:n] = ds.err_flux
+            self.tel_index[i, 0:n] = ds.tel_index
+            self.data_mask[i, 0:n] = True
+            self.param_mask[i, 0:self.nparams[i]] = True
+
+        # One-hot encoding of the telescope of each datapoint, used to distribute the flux
+        # parameters over the datapoints
+        self.tel_onehot = (self.tel_index[:, :, np.newaxis] == np.arange(tmax)) \
+                          & self.data_mask[:, :, np.newaxis]
+
+def batch_model_flux(params, batch, index):
+    """
+    Function to compute the model flux of a subset of events in a batch
+
+    Parameters:
+        params  array  (nsubset, max_params) parameter vectors
+        batch   PSPLBatch
+        index   array  Indices of the events in the batch to evaluate
+
+    Returns:
+        A       array  (nsubset, nmax) magnification
+        flux    array  (nsubset, nmax) model flux
+    """
+
+    A = pspl_tools.pspl_magnification(batch.time[index], params[:, 0:1], params[:, 1:2], params[:, 2:3])
+    onehot = batch.tel_onehot[index]
+    fs = np.einsum('ent,et->en', onehot, params[:, 3::2])
+    ft = np.einsum('ent,et->en', onehot, params[:, 4::2])
+
+    return A, fs * (A - 1.0) + ft
+
+def batch_residuals(params, batch, index):
+    """Returns the normalized residuals (model - data) / sigma of a subset of events in a batch,
+    set to zero for padded datapoints"""
+
+    (A, model) = batch_model_flux(params, batch, index)
+    res = (model - batch.flux[index]) / batch.err_flux[index]
+
+    return np.where(batch.data_mask[index], res, 0.0)
+
+def batch_jacobian(params, batch, index):
+    """
+    Function to compute the analytic Jacobian of the normalized residuals of a subset of events
+    in a batch, with zero rows for padded datapoints and zero columns for absent telescopes
+
+    Returns:
+        jac     array  (nsubset, nmax, max_params)
+    """
+
+    (A, dA_dt0, dA_du0, dA_dtE) = pspl_tools.pspl_magnification_derivatives(
+        batch.time[index], params[:, 0:1], params[:, 1:2], params[:, 2:3])
+    onehot = batch.tel_onehot[index]
+    fs = np.einsum('ent,et->en', onehot, params[:, 3::2])
+
+    jac = np.zeros((len(index), batch.time.shape[1], batch.max_params))
+    jac[:, :, 0] = fs * dA_dt0
+    jac[:, :, 1] = fs * dA_du0
+    jac[:, :, 2] = fs * dA_dtE
+    jac[:, :, 3::2] = (A - 1.0)[:, :, np.newaxis] * onehot
+    jac[:, :, 4::2] = onehot
+
+    jac /= batch.err_flux[index][:, :, np.newaxis]
+    jac *= batch.data_mask[index][:, :, np.newaxis]
+
+    return jac
+
+def loss_function(residuals, loss='soft_l1'):
+    """
+    Function to evaluate a robust loss function and its first two derivatives, following the
+    conventions of scipy.optimize.least_squares with f_scale=1, for z = residuals**2
+
+    Returns:
+        rho     array  Loss for each residual
+        rho1    array  First derivative with respect to z
+        rho2    array  Second derivative with respect to z
+    """
+
+    z = residuals * residuals
+    if loss == 'soft_l1':
+        t = 1.0 + z
+        rho = 2.0 * (np.sqrt(t) - 1.0)
+        rho1 = 1.0 / np.sqrt(t)
+        rho2 = -0.5 * t ** -1.5
+    else:
+        rho = z
+        rho1 = np.ones_like(z)
+        rho2 = np.zeros_like(z)
+
+    return rho, rho1, rho2
+
+def batch_cost(params, batch, index, loss='soft_l1'):
+    """Returns the cost, 0.5 * sum(rho(residuals**2)), of each of a subset of events"""
+
+    res = batch_residuals(params, batch, index)
+    (rho, rho1, rho2) = loss_function(res, loss=loss)
+    rho = np.where(batch.data_mask[index], rho, 0.0)
+
+    return 0.5 * rho.sum(axis=1)
+
+def scaled_normal_equations(params, batch, index, loss='soft_l1'):
+    """
+    Function to compute the Gauss-Newton approximation to the Hessian, J^T J, and the gradient,
+    J^T r, of the cost of a subset of events, using the Jacobian and residuals scaled for the
+    robust loss function in the same way as scipy.optimize.least_squares
+
+    Returns:
+        cost    array  (nsubset,)
+        JTJ     array  (nsubset, max_params, max_params)
+        grad    array  (nsubset, max_params)
+    """
+
+    res = batch_residuals(params, batch, index)
+    jac = batch_jacobian(params, batch, index)
+    (rho, rho1, rho2) = loss_function(res, loss=loss)
+    mask = batch.data_mask[index]
+    rho = np.where(mask, rho, 0.0)
+
+    z = res * res
+    jac_scale = np.sqrt(np.maximum(rho1 + 2.0 * rho2 * z, 1e-300))
+    res_scaled = res * rho1 / jac_scale
+    jac_scaled = jac * jac_scale[:, :, np.newaxis]
+
+    JTJ = np.einsum('enp,enq->epq', jac_scaled, jac_scaled)
+    grad = np.einsum('enp,en->ep', jac_scaled, res_scaled)
+
+    return 0.5 * rho.sum(axis=1), JTJ, grad
+
+def fit_pspl_batch(batch, guesses=None, fit_parameters=None, loss='soft_l1', max_iter=200,
+                   ftol=1e-10, xtol=1e-10):
+    """
+    Function to fit static PSPL models to all events in a PSPLBatch simultaneously, using a
+    Levenberg-Marquardt iteration that is vectorized over the events.  Each event keeps its own
+    damping parameter and convergence flag; events that have converged are dropped from
+    subsequent iterations.  The parameters are kept within the fit boundaries by projection,
+    and those held at a boundary are fixed for the iteration.
+
+    Parameters:
+        batch           PSPLBatch
+        guesses         list   Optional starting values of (t0, u0, tE) for each event
+        fit_parameters  list   Optional fit boundaries for each event, in pyLIMA format, defaulting
+                               to those of pspl_tools.parameter_bounds
+        loss            str    'soft_l1' or 'linear'
+        max_iter        int    Maximum number of iterations
+
+    Returns:
+        fit_results     list   of dictionaries for each event, in the format returned by pspl_tools.fit_pspl
+    """
+
+    nevents = batch.nevents
+    P = batch.max_params
+
+    if fit_parameters is None:
+        fit_parameters = [pspl_tools.parameter_bounds(ds) for ds in batch.datasets]
+
+    # The starting parameters and boundaries are established per event, since these
+    # depend on the individual lightcurves.  Absent parameters are fixed at zero
+    params = np.zeros((nevents, P))
+    lower = np.zeros((nevents, P))
+    upper = np.zeros((nevents, P))
+    for i, ds in enumerate(batch.datasets):
+        guess = pspl_tools.initial_guess(ds) if guesses is None else guesses[i]
+        guess = pspl_tools.clip_to_bounds(guess, fit_parameters[i])
+        fluxes = pspl_tools.solve_linear_fluxes(guess[0], guess[1], guess[2], ds)
+        x0 = pspl_tools.clip_to_bounds(list(guess[0:3]) + fluxes, fit_parameters[i])
+        n = batch.nparams[i]
+        params[i, 0:n] = x0
+        lower[i, 0:n] = [v[1][0] for v in fit_parameters[i].values()]
+        upper[i, 0:n] = [v[1][1] for v in fit_parameters[i].values()]
+    margin = 1e-10 * (upper - lower)
+
+    # A relatively high initial damping favours short, gradient-like first steps, which
+    # reduces the risk of the poorly-constrained t0 escaping the peak of the lightcurve
+    damping = np.full(nevents, 10.0)
+    scale = np.zeros((nevents, P))
+    nfev = np.ones(nevents, dtype=int)
+    njev = np.zeros(nevents, dtype=int)
+    status = np.zeros(nevents, dtype=int)
+    active = np.arange(nevents)
+
+    # Inactive parameters are decoupled from the normal equations by giving them unit curvature
+    # and zero gradient, so that their step is always zero
+    inactive = ~batch.param_mask
+    identity = np.eye(P)
+
+    cost = batch_cost(params, batch, active, loss=loss)
+    for iteration in range(max_iter):
+        if len(active) == 0:
+            break
+
+        (cost_a, JTJ, grad) = scaled_normal_equations(params[active], batch, active, loss=loss)
+        njev[active] += 1
+
+        # Parameters held at a boundary by a gradient pointing outside the permitted range are
+        # fixed for this iteration, in the same way as the parameters of absent telescopes
+        x = params[active]
+        at_bound = ((x <= lower[active] + 2.0 * margin[active]) & (grad > 0.0)) \
+                   | ((x >= upper[active] - 2.0 * margin[active]) & (grad < 0.0))
+        fixed = inactive[active] | at_bound
+        grad[fixed] = 0.0
+        JTJ[fixed] = 0.0
+        JTJ.transpose(0, 2, 1)[fixed] = 0.0
+
+        # The damping is scaled by the largest curvature seen so far for each parameter,
+        # following the approach of MINPACK, which prevents excessive steps in parameters
+        # that are temporarily poorly constrained
+        diag = np.diagonal(JTJ, axis1=1, axis2=2)
+        scale[active] = np.maximum(scale[active], diag)
+        diag = np.where(fixed, 1.0, np.maximum(scale[active], 1e-300))
+
+        # Inner loop: increase the damping of each event until its step reduces the cost
+        accepted = np.zeros(len(active), dtype=bool)
+        new_params = params[active].copy()
+        new_cost = cost_a.copy()
+        for attempt in range(20):
+            trial = ~accepted
+            if not trial.any():
+                break
+            A = JTJ[trial] + (damping[active][trial][:, np.newaxis] * diag[trial])[:, :, np.newaxis] * identity
+            A[fixed[trial]] = identity[np.newaxis].repeat(trial.sum(), axis=0)[fixed[trial]]
+            try:
+                step = -np.linalg.solve(A, grad[trial][:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('epq,eq->ep', np.linalg.pinv(A), grad[trial])
+
+            idx = active[trial]
+            trial_params = np.clip(params[idx] + step, lower[idx] + margin[idx], upper[idx] - margin[idx])
+            trial_params[inactive[idx]] = 0.0
+            trial_cost = batch_cost(trial_params, batch, idx, loss=loss)
+            nfev[idx] += 1
+
+            better = np.isfinite(trial_cost) & (trial_cost <= cost_a[trial])
+            positions = np.where(trial)[0]
+            new_params[positions[better]] = trial_params[better]
+            new_cost[positions[better]] = trial_cost[better]
+            accepted[positions[better]] = True
+            damping[idx[better]] = np.maximum(damping[idx[better]] / 3.0, 1e-12)
+            damping[idx[~better]] = damping[idx[~better]] * 10.0
+
+        # Convergence is reached when the reduction in cost or the change in the parameters
+        # becomes negligible.  Events whose step cannot reduce the cost have also converged
+        dcost = cost_a - new_cost
+        dx = np.abs(new_params - params[active])
+        small_cost = accepted & (dcost <= ftol * np.maximum(cost_a, 1e-300))
+        small_step = accepted & np.all(dx <= xtol * (np.abs(params[active]) + xtol), axis=1)
+        stalled = ~accepted | (damping[active] > 1e16)
+
+        params[active] = new_params
+        cost[active] = new_cost
+
+        status[active[small_cost]] = 2
+        status[active[small_step & ~small_cost]] = 3
+        status[active[stalled]] = 2
+        converged = small_cost | small_step | stalled
+        active = active[~converged]
+
+    # Any event still active has exhausted the maximum number of iterations
+    status[active] = 0
+
+    # Covariance matrices are estimated in the same way as for the single event fit, from
+    # the robust loss-scaled Jacobian at the solution
+    (cost, JTJ, grad) = scaled_normal_equations(params, batch, np.arange(nevents), loss=loss)
+    residuals = batch_residuals(params, batch, np.arange(nevents))
+
+    fit_results = []
+    for i, ds in enumerate(batch.datasets):
+        n = batch.nparams[i]
+        loss_value = 2.0 * cost[i]
+        try:
+            covariance = np.linalg.pinv(JTJ[i, 0:n, 0:n])
+        except np.linalg.LinAlgError:
+            covariance = np.zeros((n, n))
+        covariance *= loss_value / (ds.ndata - n)
+        res = residuals[i, 0:ds.ndata]
+
+        fit_results.append({
+            'best_model': params[i, 0:n].copy(),
+            'covariance_matrix': covariance,
+            loss: loss_value,
+            'chi2': np.sum(res ** 2),
+            'residuals': res,
+            'fit_parameters': fit_parameters[i],
+            'nfev': int(nfev[i]),
+            'njev': int(njev[i]),
+            'status': int(status[i]),
+            'success': bool(status[i] > 0)
+        })
+
+    return fit_results
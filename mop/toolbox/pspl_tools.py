@@ -0,0 +1,471 @@
+import numpy as np
+from scipy.optimize import least_squares
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+ZP = 27.4 #pyLIMA convention
+
+# Minimum lens-source separation used to avoid the singularity in the magnification at u=0
+U_MIN = 1e-10
+
+# Configuration of the grid search for starting parameters: the width of the bins to which the
+# lightcurves are reduced [days], the numbers of trial values of t0 on a uniform grid and at the
+# brightest datapoints, the number and range of the logarithmically-spaced trial values of u0 and
+# tE, and the maximum size of the arrays evaluated in each block
+GRID_BIN_WINDOW = 0.5
+GRID_N_T0 = 20
+GRID_N_PEAKS = 20
+GRID_N_U0 = 7
+GRID_U0_MIN = 0.003
+GRID_U0_MAX = 1.5
+GRID_N_TE = 10
+GRID_MAX_ELEMENTS = 5000000
+
+class PSPLDataset():
+    """
+    Class holding the lightcurves of a single event in the concatenated, flux-based form used
+    to evaluate the PSPL model for all telescopes in one vectorized step.
+
+    The lightcurves are cleaned in the same way as pyLIMA cleans the data of its Telescope objects:
+    non-finite entries, zero uncertainties and duplicated timestamps are removed.
+    """
+
+    def __init__(self, lightcurves, names=None):
+        """
+        Parameters:
+            lightcurves  list  of arrays with columns [time, mag, err_mag], in order of priority,
+                               so that the first lightcurve is the reference dataset
+            names        list  of dataset names, optional
+        """
+
+        if names is None:
+            names = ['Tel_' + str(i) for i in range(len(lightcurves))]
+        self.names = names
+
+        time = []
+        flux = []
+        err_flux = []
+        tel_index = []
+        self.max_flux = []
+        for i, lc in enumerate(lightcurves):
+            lc = np.asarray(lc, dtype=float)
+            good = np.all(np.isfinite(lc[:, 0:3]), axis=1) & (lc[:, 2] != 0.0)
+            (unique_times, unique_index) = np.unique(lc[:, 0], return_index=True)
+            mask = np.zeros(len(lc), dtype=bool)
+            mask[unique_index] = True
+            lc = lc[good & mask]
+
+            f = magnitude_to_flux(lc[:, 1])
+            time.append(lc[:, 0])
+            flux.append(f)
+            err_flux.append(error_magnitude_to_error_flux(lc[:, 2], f))
+            tel_index.append(np.full(len(lc), i, dtype=int))
+            self.max_flux.append(np.max(f) if len(f) > 0 else 0.0)
+
+        self.time = np.concatenate(time)
+        self.flux = np.concatenate(flux)
+        self.err_flux = np.concatenate(err_flux)
+        self.tel_index = np.concatenate(tel_index)
+        self.ntel = len(lightcurves)
+        self.ndata = len(self.time)
+
+    def telescope_mask(self, i):
+        return self.tel_index == i
+
+    def parameter_keys(self):
+        """List of the model parameters, following pyLIMA's naming and order for a PSPL model
+        with the ftotal blend flux parameterization"""
+
+        keys = ['t0', 'u0', 'tE']
+        for i in range(self.ntel):
+            keys += ['fsource_Tel_' + str(i), 'ftotal_Tel_' + str(i)]
+
+        return keys
+
+def magnitude_to_flux(mag):
+
+    return 10 ** ((ZP - mag) / 2.5)
+
+def error_magnitude_to_error_flux(err_mag, flux):
+
+    return np.abs(err_mag * flux * np.log(10) / 2.5)
+
+def flux_to_magnitude(flux):
+
+    return ZP - 2.5 * np.log10(flux)
+
+def pspl_magnification(t, t0, u0, tE):
+    """
+    Function to compute the Paczynski magnification for a point-source point-lens event
+
+    Parameters:
+        t   array  Timestamps [JD]
+        t0  float  Time of closest approach [JD]
+        u0  float  Minimum impact parameter [Einstein radii]
+        tE  float  Einstein crossing time [days]
+
+    Returns:
+        A   array  Magnification at each timestamp
+    """
+
+    tau = (t - t0) / tE
+    u2 = np.maximum(tau * tau + u0 * u0, U_MIN * U_MIN)
+    u = np.sqrt(u2)
+
+    return (u2 + 2.0) / (u * np.sqrt(u2 + 4.0))
+
+def pspl_magnification_derivatives(t, t0, u0, tE):
+    """
+    Function to compute the PSPL magnification together with its closed-form partial
+    derivatives with respect to t0, u0 and tE
+
+    Returns:
+        A       array  Magnification
+        dA_dt0  array
+        dA_du0  array
+        dA_dtE  array
+    """
+
+    tau = (t - t0) / tE
+    u2 = np.maximum(tau * tau + u0 * u0, U_MIN * U_MIN)
+    u = np.sqrt(u2)
+    sqrt_u2_4 = np.sqrt(u2 + 4.0)
+
+    A = (u2 + 2.0) / (u * sqrt_u2_4)
+
+    # dA/du = -8 / (u^2 (u^2 + 4)^(3/2)), and the chain rule through u(t0, u0, tE)
+    dA_du = -8.0 / (u2 * sqrt_u2_4 ** 3)
+    dA_dt0 = dA_du * (-tau / (tE * u))
+    dA_du0 = dA_du * (u0 / u)
+    dA_dtE = dA_du * (-tau * tau / (tE * u))
+
+    return A, dA_dt0, dA_du0, dA_dtE
+
+def unpack_fluxes(params, dataset):
+    """Returns the per-datapoint source and total fluxes from a parameter vector"""
+
+    fsource = np.asarray(params[3::2])
+    ftotal = np.asarray(params[4::2])
+
+    return fsource[dataset.tel_index], ftotal[dataset.tel_index]
+
+def pspl_model_flux(params, dataset):
+    """
+    Function to compute the model flux for all datapoints in a PSPLDataset, for the
+    parameter vector [t0, u0, tE, fsource_Tel_0, ftotal_Tel_0, fsource_Tel_1, ...]
+    The blend flux is given by ftotal - fsource, so that F = fsource * (A - 1) + ftotal
+    """
+
+    A = pspl_magnification(dataset.time, params[0], params[1], params[2])
+    (fs, ft) = unpack_fluxes(params, dataset)
+
+    return fs * (A - 1.0) + ft
+
+def pspl_residuals(params, dataset):
+    """Returns the normalized residuals (model - data) / sigma for all datapoints"""
+
+    return (pspl_model_flux(params, dataset) - dataset.flux) / dataset.err_flux
+
+def pspl_jacobian(params, dataset):
+    """
+    Function to compute the analytic Jacobian of the normalized residuals with respect to
+    the parameter vector [t0, u0, tE, fsource_Tel_0, ftotal_Tel_0, ...]
+    """
+
+    (A, dA_dt0, dA_du0, dA_dtE) = pspl_magnification_derivatives(dataset.time,
+                                                                   params[0], params[1], params[2])
+    (fs, ft) = unpack_fluxes(params, dataset)
+
+    jac = np.zeros((dataset.ndata, 3 + 2 * dataset.ntel))
+    jac[:, 0] = fs * dA_dt0
+    jac[:, 1] = fs * dA_du0
+    jac[:, 2] = fs * dA_dtE
+
+    rows = np.arange(dataset.ndata)
+    jac[rows, 3 + 2 * dataset.tel_index] = A - 1.0
+    jac[rows, 4 + 2 * dataset.tel_index] = 1.0
+
+    return jac / dataset.err_flux[:, np.newaxis]
+
+def solve_linear_fluxes(t0, u0, tE, dataset):
+    """
+    Function to find the source and total flux of each telescope for a given set of (t0, u0, tE),
+    by solving the weighted linear least-squares problem F = fsource * (A - 1) + ftotal
+
+    Returns:
+        fluxes  list  [fsource_Tel_0, ftotal_Tel_0, fsource_Tel_1, ...]
+    """
+
+    A = pspl_magnification(dataset.time, t0, u0, tE)
+    fluxes = []
+    for i in range(dataset.ntel):
+        mask = dataset.telescope_mask(i)
+        w = 1.0 / dataset.err_flux[mask]
+        design = np.c_[(A[mask] - 1.0) * w, w]
+        try:
+            (solution, res, rank, sv) = np.linalg.lstsq(design, dataset.flux[mask] * w, rcond=None)
+            fluxes += [solution[0], solution[1]]
+        except np.linalg.LinAlgError:
+            fluxes += [np.median(dataset.flux[mask]), np.median(dataset.flux[mask])]
+
+    return fluxes
+
+def parameter_bounds(dataset, delta_t0=10.0):
+    """
+    Function to return the boundaries of the fit parameters, matching those used by
+    fittools.fit_pspl_omega2 for the pyLIMA TRF fit
+
+    Returns:
+        fit_parameters  OrderedDict  {key: [index, (lower, upper)]}, in pyLIMA's format
+    """
+
+    fit_parameters = OrderedDict()
+    fit_parameters['t0'] = [0, [dataset.time.min(), dataset.time.max() + delta_t0]]
+    fit_parameters['u0'] = [1, [0.0, 2.0]]
+    fit_parameters['tE'] = [2, [1.0, 1000.0]]
+    for i in range(dataset.ntel):
+        fit_parameters['fsource_Tel_' + str(i)] = [3 + 2 * i, (0.0, dataset.max_flux[i])]
+        fit_parameters['ftotal_Tel_' + str(i)] = [4 + 2 * i, (0, dataset.max_flux[i])]
+
+    return fit_parameters
+
+def initial_guess(dataset):
+    """
+    Function to estimate starting values of (t0, u0, tE) from the reference lightcurve,
+    using the same approach as pyLIMA: the baseline flux is estimated from the faint
+    datapoints, t0 from the peak of the smoothed lightcurve, u0 from the peak magnification
+    and tE from the duration of the half-magnification section of the lightcurve.
+    """
+
+    mask = dataset.telescope_mask(0)
+    order = np.argsort(dataset.time[mask])
+    time = dataset.time[mask][order]
+    flux = dataset.flux[mask][order]
+    err_flux = dataset.err_flux[mask][order]
+
+    # Lightly smooth the lightcurve so that single outliers do not define the peak
+    if len(flux) >= 3:
+        flux_clean = np.convolve(flux, np.ones(3) / 3.0, mode='same')
+        flux_clean[0] = flux[0]
+        flux_clean[-1] = flux[-1]
+    else:
+        flux_clean = flux
+
+    # Baseline flux estimate, assuming no blending
+    baseline_flux_0 = np.min(flux)
+    baseline_flux = np.median(flux)
+    while np.abs(baseline_flux_0 - baseline_flux) > 0.01 * baseline_flux:
+        baseline_flux_0 = baseline_flux
+        index = (flux < baseline_flux) | (np.abs(flux - baseline_flux) < np.abs(err_flux))
+        if index.sum() < 100:
+            baseline_flux = np.median(np.sort(flux)[:100])
+            break
+        baseline_flux = np.median(flux[index])
+
+    ipeak = np.argmax(flux_clean)
+    t0 = time[ipeak]
+    Amax = flux_clean[ipeak] / baseline_flux
+    if Amax <= 1.0 or not np.isfinite(Amax):
+        Amax = 1.1
+    u0 = np.sqrt(-2.0 + 2.0 * np.sqrt(1.0 - 1.0 / (1.0 - Amax ** 2)))
+
+    # The half-magnification points satisfy A(u_half) = (Amax + 1) / 2
+    A_half = 0.5 * (Amax + 1.0)
+    u_half = np.sqrt(2.0 * (A_half / np.sqrt(A_half ** 2 - 1.0) - 1.0))
+    above = np.where(flux_clean > baseline_flux * A_half)[0]
+    tE = 20.0
+    if len(above) > 1 and u_half > u0:
+        half_width = 0.5 * (time[above[-1]] - time[above[0]])
+        if half_width > 0.0:
+            tE = half_width / np.sqrt(u_half ** 2 - u0 ** 2)
+
+    return [t0, u0, tE]
+
+def bin_dataset(dataset, window=GRID_BIN_WINDOW):
+    """
+    Function to reduce the lightcurves of a PSPLDataset to the inverse-variance weighted mean flux
+    of each telescope within bins of width window, so that coarse grids of models can be evaluated
+    quickly for events with dense lightcurves.
+
+    Returns:
+        time, flux, err_flux, tel_index  arrays of the binned datapoints
+    """
+
+    bins = np.floor((dataset.time - dataset.time.min()) / window).astype(np.int64)
+    (keys, index) = np.unique(bins * dataset.ntel + dataset.tel_index, return_inverse=True)
+    weights = 1.0 / dataset.err_flux ** 2
+    sum_weights = np.bincount(index, weights=weights)
+
+    time = np.bincount(index, weights=weights * dataset.time) / sum_weights
+    flux = np.bincount(index, weights=weights * dataset.flux) / sum_weights
+    err_flux = 1.0 / np.sqrt(sum_weights)
+    tel_index = (keys % dataset.ntel).astype(int)
+
+    return time, flux, err_flux, tel_index
+
+def grid_t0_candidates(time, flux, err_flux, tel_index, ntel, t0_bounds, n_t0=GRID_N_T0, n_peaks=GRID_N_PEAKS):
+    """
+    Function to choose the trial values of t0 for a grid search: a uniform grid across the permitted
+    range, supplemented by the times of the datapoints that are most significantly brighter than the
+    baseline of their telescope, so that short events are sampled even when the uniform grid is coarse
+    """
+
+    significance = np.zeros(len(flux))
+    for i in range(ntel):
+        mask = tel_index == i
+        if mask.sum() > 0:
+            significance[mask] = (flux[mask] - np.median(flux[mask])) / err_flux[mask]
+    npeaks = min(n_peaks, len(flux))
+    peaks = time[np.argsort(significance)[::-1][0:npeaks]]
+
+    t0 = np.concatenate((np.linspace(t0_bounds[0], t0_bounds[1], n_t0), peaks))
+
+    return np.unique(np.clip(t0, t0_bounds[0], t0_bounds[1]))
+
+def grid_search_guess(dataset, fit_parameters=None, n_u0=GRID_N_U0, n_tE=GRID_N_TE,
+                      max_elements=GRID_MAX_ELEMENTS):
+    """
+    Function to estimate starting values of (t0, u0, tE) by evaluating the chi2 of a coarse grid of
+    PSPL models.  For each trial (t0, u0, tE), the source and total flux of each telescope are
+    solved linearly, so the chi2 of all grid points follows from weighted sums of the magnification
+    which are evaluated in a single broadcast over the grid and the datapoints.  The broadcast is
+    divided into blocks of at most max_elements to bound the memory used, and is made on the
+    lightcurves binned by bin_dataset.
+
+    Parameters:
+        dataset         PSPLDataset
+        fit_parameters  OrderedDict  Optional fit boundaries in pyLIMA format, defaults to those of
+                                     parameter_bounds; the grid lies within them
+        n_u0, n_tE      int    Number of logarithmically-spaced trial values of u0 and tE
+        max_elements    int    Maximum number of elements of the arrays of each block
+
+    Returns:
+        guess           list   [t0, u0, tE] of the grid point with the lowest chi2
+        chi2            float  chi2 of that grid point, for the binned lightcurves
+    """
+
+    if fit_parameters is None:
+        fit_parameters = parameter_bounds(dataset)
+    (time, flux, err_flux, tel_index) = bin_dataset(dataset)
+
+    (u0_min, u0_max) = fit_parameters['u0'][1]
+    (tE_min, tE_max) = fit_parameters['tE'][1]
+    t0_grid = grid_t0_candidates(time, flux, err_flux, tel_index, dataset.ntel, fit_parameters['t0'][1])
+    u0_grid = np.logspace(np.log10(max(u0_min, GRID_U0_MIN)), np.log10(min(u0_max, GRID_U0_MAX)), n_u0)
+    tE_grid = np.logspace(np.log10(tE_min), np.log10(tE_max), n_tE)
+    (t0, u0, tE) = [g.ravel() for g in np.meshgrid(t0_grid, u0_grid, tE_grid, indexing='ij')]
+
+    # Weighted sums of the data for each telescope, which do not depend on the model
+    w = 1.0 / err_flux ** 2
+    onehot = (tel_index[:, np.newaxis] == np.arange(dataset.ntel)).astype(float)
+    W = w[:, np.newaxis] * onehot
+    Sw = W.sum(axis=0)
+    Sy = (flux[:, np.newaxis] * W).sum(axis=0)
+    Syy = (flux[:, np.newaxis] ** 2 * W).sum(axis=0)
+    Wy = flux[:, np.newaxis] * W
+
+    chi2 = np.empty(len(t0))
+    block = max(1, int(max_elements // max(len(time), 1)))
+    for i in range(0, len(t0), block):
+        sl = slice(i, i + block)
+        # The magnification is written with a single square root, since this dominates the cost
+        tau = (time - t0[sl, np.newaxis]) / tE[sl, np.newaxis]
+        u2 = np.maximum(tau * tau + u0[sl, np.newaxis] ** 2, U_MIN * U_MIN)
+        X = (u2 + 2.0) / np.sqrt(u2 * (u2 + 4.0)) - 1.0
+        Sx = X @ W
+        Sxx = (X * X) @ W
+        Sxy = X @ Wy
+
+        # Linear least-squares solution for F = fsource * (A - 1) + ftotal.  Solutions with a negative
+        # source or blend flux are unphysical, and are replaced by the solution on the boundary:
+        # the constant-flux solution, or that with no blending, F = fsource * A
+        det = Sw * Sxx - Sx * Sx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fs = np.where(det > 0.0, (Sw * Sxy - Sx * Sy) / det, 0.0)
+            fs = np.maximum(fs, 0.0)
+            ft = (Sy - fs * Sx) / Sw
+            unblended = np.maximum((Sxy + Sy) / (Sxx + 2.0 * Sx + Sw), 0.0)
+        negative_blend = ft < fs
+        fs = np.where(negative_blend, unblended, fs)
+        ft = np.where(negative_blend, unblended, ft)
+        chi2[sl] = (Syy - 2.0 * fs * Sxy - 2.0 * ft * Sy + fs * fs * Sxx
+                    + 2.0 * fs * ft * Sx + ft * ft * Sw).sum(axis=1)
+
+    best = int(np.nanargmin(chi2))
+
+    return [t0[best], u0[best], tE[best]], float(chi2[best])
+
+def clip_to_bounds(guess, fit_parameters):
+    """Function to move a parameter guess inside the fit boundaries, as required by the TRF method"""
+
+    nparams = len(guess)
+    lower = np.array([v[1][0] for v in fit_parameters.values()], dtype=float)[0:nparams]
+    upper = np.array([v[1][1] for v in fit_parameters.values()], dtype=float)[0:nparams]
+    margin = 1e-6 * (upper - lower)
+
+    return np.clip(np.asarray(guess, dtype=float), lower + margin, upper - margin)
+
+def fit_pspl(dataset, guess=None, fit_parameters=None, loss='soft_l1', x_scale=None, max_nfev=50000):
+    """
+    Function to fit a static PSPL model to a PSPLDataset with scipy's Trust Region Reflective
+    least-squares method, using the analytic Jacobian.
+
+    Parameters:
+        dataset         PSPLDataset
+        guess           list   Optional starting values of (t0, u0, tE); the telescope fluxes are
+                               solved linearly
+        fit_parameters  OrderedDict  Optional fit boundaries in pyLIMA format, defaults to those of
+                               parameter_bounds
+        loss            str    Loss function passed to scipy.optimize.least_squares
+        x_scale         array  Optional characteristic scale of each parameter
+
+    Returns:
+        fit_results     dict   with best_model, covariance_matrix, chi2 and the optimizer diagnostics
+    """
+
+    if fit_parameters is None:
+        fit_parameters = parameter_bounds(dataset)
+    if guess is None:
+        guess = initial_guess(dataset)
+
+    guess = clip_to_bounds(guess, fit_parameters)
+    fluxes = solve_linear_fluxes(guess[0], guess[1], guess[2], dataset)
+    x0 = clip_to_bounds(list(guess[0:3]) + fluxes, fit_parameters)
+
+    bounds_min = [v[1][0] for v in fit_parameters.values()]
+    bounds_max = [v[1][1] for v in fit_parameters.values()]
+
+    # Same parameter scaling and tolerances as pyLIMA's TRF fit
+    if x_scale is None:
+        x_scale = 10 ** np.floor(np.log10(np.abs(x0) + 1e-300)) + 1
+
+    result = least_squares(pspl_residuals, x0, jac=pspl_jacobian, args=(dataset,),
+                           method='trf', bounds=(bounds_min, bounds_max),
+                           loss=loss, max_nfev=max_nfev,
+                           xtol=10**-10, ftol=10**-10, gtol=10**-10,
+                           x_scale=x_scale)
+
+    loss_value = result.cost * 2.0
+    nparams = len(x0)
+    try:
+        covariance = np.linalg.pinv(np.dot(result.jac.T, result.jac))
+    except (ValueError, np.linalg.LinAlgError):
+        covariance = np.zeros((nparams, nparams))
+    covariance *= loss_value / (dataset.ndata - nparams)
+
+    residuals = pspl_residuals(result.x, dataset)
+
+    return {
+        'best_model': result.x,
+        'covariance_matrix': covariance,
+        loss: loss_value,
+        'chi2': np.sum(residuals ** 2),
+        'residuals': residuals,
+        'fit_parameters': fit_parameters,
+        'nfev': result.nfev,
+        'njev': result.njev,
+        'status': result.status,
+        'success': result.success
+    }
@@ -1,7 +1,9 @@
 from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
 from tom_targets.models import Target, TargetName, TargetList
 from django.db.models import Q
-from mop.toolbox import utilities
+from mop.toolbox import utilities, packed_lightcurves, fit_scheduler
+from itertools import groupby
+from operator import attrgetter
 import logging
 import datetime
 from astropy.time import Time, TimeDelta
@@ -82,16 +84,88 @@ def get_alive_events_outside_HCZ(option):
 
     return target_data
 
-def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photometry=True):
+def group_by_target(qs, target_list):
     """
-    Function to retrieve all TargetExtra and ReducedDatums associated with a set of targets
+    Function to partition the results of a single query over a set of targets by the target
+    they belong to, so that each target need not be queried separately.
+
+    Parameters:
+        qs           QuerySet  of objects with a target foreign key
+        target_list  list      of Targets included in the query
+
+    Returns:
+        groups       dict   of lists of the objects of each target, indexed by the pk of every
+                            target in target_list, in the order of the QuerySet
+    """
+
+    groups = {mulens.pk: [] for mulens in target_list}
+    for item in qs:
+        groups[item.target_id].append(item)
+
+    return groups
+
+def fetch_reduced_datums_for_targetset(target_list, tabular=True):
+    """
+    Function to retrieve the derived datasets used by MicrolensingTarget.get_reduced_data for a set
+    of targets, i.e. their model lightcurves and tabular datasets, with one query for each kind.
+    The values of the model lightcurves are deferred, since they are only replaced when a new
+    model is stored.
+
+    Parameters:
+        target_list  list   of Targets, with no duplicates
+        tabular      bool   Retrieve the tabular datasets, which are not needed to fit the targets
+
+    Returns:
+        datums       dict   of lists of ReducedDatums, indexed by the pk of every target in target_list,
+                            giving the model lightcurves first
+    """
+
+    models = group_by_target(
+        ReducedDatum.objects.filter(target__in=target_list, data_type='lc_model')
+        .defer('value').order_by("timestamp"),
+        target_list
+    )
+    if not tabular:
+        return models
+
+    datums = group_by_target(
+        ReducedDatum.objects.filter(
+            target__in=target_list,
+            data_type='tabular',
+            source_name__in=['Interferometry_predictor', 'GSC_query_results', 'AOFT_table']
+        ).order_by("timestamp"),
+        target_list
+    )
+
+    return {pk: models[pk] + datums[pk] for pk in models.keys()}
+
+def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photometry=True, snapshot=None):
+    """
+    Function to retrieve all TargetExtra and ReducedDatums associated with a set of targets.
+    The names, photometry and derived datasets of the whole set are each retrieved with a single
+    query and partitioned by target, so that the number of queries made does not depend on the
+    number of targets.
+
+    Parameters:
+        target_list        list   of Targets, with no duplicates
+        check_need_to_fit  bool   Only return the targets which need to be fitted
+        fetch_photometry   bool   Load the lightcurves and derived datasets of the targets
+        snapshot           LightcurveSnapshot  Optional, snapshot from which to read the lightcurves
+                                  that are up to date, instead of the database
+
+    Returns:
+        target_data        dict   of MicrolensingTargets indexed by name
     """
     t1 = datetime.datetime.utcnow()
 
-    # Perform the search for associated data
-    datums = ReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-    photometry_datums = PhotometryReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-    names = TargetName.objects.filter(target__in=target_list)
+    # Perform the search for associated data.  Only the derived datasets used by
+    # get_reduced_data are retrieved, and the values of the model lightcurves are deferred
+    names = group_by_target(TargetName.objects.filter(target__in=target_list), target_list)
+    if fetch_photometry:
+        datums = fetch_reduced_datums_for_targetset(target_list)
+        photometry_stream = stream_lightcurves_for_targetset(target_list, snapshot=snapshot)
+    else:
+        photometry_stream = ((mulens, None, None) for mulens in target_list)
 
     t2 = datetime.datetime.utcnow()
     logger.info('queryTools: Retrieved associated data for ' + str(len(target_list)) + ' Targets')
@@ -99,13 +173,13 @@ def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photomet
     logger.info('queryTools: Time taken: ' + str(t2 - t1))
 
     # Create microlensing event instances for the selected targets, associating all of the
-    # data products for later use
+    # data products for later use.  The photometry of each target is read from the stream in turn
     logger.info('queryTools: collating data on microlensing event set')
     target_data = {}
-    for i, mulens in enumerate(target_list):
-        mulens.get_target_names(names.filter(target=mulens))
+    for i, (mulens, photometry, datasets) in enumerate(photometry_stream):
+        mulens.get_target_names(names[mulens.pk])
         if fetch_photometry:
-            mulens.get_reduced_data(photometry_datums.filter(target=mulens), datums.filter(target=mulens))
+            mulens.get_reduced_data(photometry, datums[mulens.pk], datasets=datasets)
         if check_need_to_fit:
             (status, reason) = mulens.check_need_to_fit()
             logger.info('queryTools: Need to fit: ' + repr(status) + ', reason: ' + reason)
@@ -233,4 +307,109 @@ def get_alive_events_with_old_model(max_model_age):
         last_fit__lte=cutoff
     )
 
-    return ts
\ No newline at end of file
+    return ts
+
+def get_alive_events_due_for_fit(max_model_age, time_now=None):
+    """
+    Fetch the Targets that are alive, classified as microlensing and which are due to be refitted,
+    because their next_fit_due date has passed.  Targets for which no next_fit_due date has been set
+    are selected if their last_fit date is older than the threshold max_model_age [hours].
+    Targets deferred to a later next_fit_due date are not selected on the basis of their last_fit,
+    which need not change when they are evaluated without being refitted, but are selected as soon
+    as they receive new photometry, leaving fit_scheduler.rank_fits to prioritize them.
+    """
+
+    if not time_now:
+        time_now = Time(datetime.datetime.utcnow()).jd
+    cutoff = Time(datetime.datetime.utcnow() - datetime.timedelta(hours=max_model_age)).jd
+
+    deferred = Target.objects.filter(
+        alive=True,
+        classification__icontains='Microlensing',
+        next_fit_due__gt=time_now
+    ).values_list('pk', 'last_fit', 'fit_fingerprint')
+    new_data = fit_scheduler.find_events_with_new_data(list(deferred))
+
+    ts = Target.objects.select_for_update(skip_locked=True).filter(
+        Q(next_fit_due__gt=0.0, next_fit_due__lte=time_now) | Q(next_fit_due=0.0, last_fit__lte=cutoff)
+        | Q(pk__in=new_data),
+        alive=True,
+        classification__icontains='Microlensing'
+    )
+
+    return ts
+
+def stream_photometry_for_targetset(target_list, chunk_size=25):
+    """
+    Generator to retrieve the photometry for a set of targets, yielding the datapoints of one
+    target at a time, in the order of target_list.  The target list is paged through in chunks,
+    retrieving the photometry of each chunk of targets with a single ordinary query, so that only
+    the datapoints of the current chunk are held in memory.  No server-side cursor is held open
+    between chunks, which would not survive the transaction pooling of a connection pooler while
+    the events are being fitted.  Each datapoint is returned as a named tuple with the timestamp,
+    bandpass, brightness, brightness_error and source_name of the PhotometryReducedDatum, as used by
+    MicrolensingTarget.get_reduced_data, so that no model instances are created.
+
+    Parameters:
+        target_list  list   of Targets, with no duplicates
+        chunk_size   int    Number of targets whose photometry is retrieved by each query
+
+    Returns:
+        (target, datapoints)  tuple of Target and list of datapoints, for each entry in target_list.
+                              Targets without photometry are yielded with an empty list
+    """
+
+    chunk_size = max(1, int(chunk_size))
+    for i in range(0, len(target_list), chunk_size):
+        chunk = target_list[i:i + chunk_size]
+        qs = PhotometryReducedDatum.objects.filter(target__in=chunk)\
+            .order_by('target', 'timestamp')\
+            .values_list('target', 'timestamp', 'bandpass', 'brightness', 'brightness_error', 'source_name',
+                         named=True)
+        photometry = {target_id: list(datapoints) for target_id, datapoints in groupby(qs, key=attrgetter('target'))}
+
+        for mulens in chunk:
+            yield mulens, photometry.pop(mulens.pk, [])
+
+def stream_lightcurves_for_targetset(target_list, snapshot=None, packed=True):
+    """
+    Generator to retrieve the lightcurves of a set of targets, in the order of target_list, reading
+    them from a lightcurve snapshot where it is up to date, then from the packed lightcurves of the
+    targets where these are up to date, and otherwise streaming the photometry from the database
+    with stream_photometry_for_targetset.  Nothing is written to the database.
+
+    Parameters:
+        target_list  list   of Targets, with no duplicates
+        snapshot     LightcurveSnapshot  Optional snapshot of the lightcurves
+        packed       bool   Read the packed lightcurves of the targets where they are current
+
+    Returns:
+        (target, photometry, datasets)  tuple of Target and either the list of its datapoints from
+                              the database, with datasets None, or the dictionary of its lightcurves
+                              from the snapshot or packed lightcurves, with photometry None
+    """
+
+    from_snapshot = snapshot.current_targets(target_list) if snapshot else set()
+    if len(from_snapshot) > 0:
+        logger.info('queryTools: Reading the lightcurves of ' + str(len(from_snapshot)) + ' out of '
+                    + str(len(target_list)) + ' targets from the snapshot')
+
+    remaining = [mulens for mulens in target_list if mulens.pk not in from_snapshot]
+    from_packed = packed_lightcurves.current_packed_targets(remaining) if packed and len(remaining) > 0 else set()
+    if len(from_packed) > 0:
+        logger.info('queryTools: Reading the lightcurves of ' + str(len(from_packed)) + ' out of '
+                    + str(len(target_list)) + ' targets from their packed lightcurves')
+
+    packed_stream = packed_lightcurves.stream_packed_lightcurves([mulens for mulens in remaining
+                                                                  if mulens.pk in from_packed])
+    stream = stream_photometry_for_targetset([mulens for mulens in remaining if mulens.pk not in from_packed])
+    for mulens in target_list:
+        if mulens.pk in from_snapshot:
+            (datasets, ndata) = snapshot.get_lightcurves(mulens)
+            yield mulens, None, datasets
+        elif mulens.pk in from_packed:
+            (loaded, datasets) = next(packed_stream)
+            yield loaded, None, datasets
+        else:
+            (streamed, photometry) = next(stream)
+            yield streamed, photometry, None
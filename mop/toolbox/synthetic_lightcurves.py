@@ -0,0 +1,138 @@
+import numpy as np
+from mop.toolbox import pspl_tools
+
+# Default characteristics of the surveys and follow-up facilities simulated, indexed by the
+# dataset names used by MOP:
+#   fraction      Fraction of the total number of datapoints contributed
+#   mag_limit     Magnitude at which the photometric uncertainty reaches 0.1mag
+#   sigma_floor   Systematic noise floor [mag]
+#   seasonal      Whether the observations are restricted to the Bulge season
+#   followup      Whether the facility observes only around the peak of the event
+SYNTHETIC_TELESCOPES = {
+    'I': {'fraction': 0.6, 'mag_limit': 20.5, 'sigma_floor': 0.005, 'seasonal': True, 'followup': False},
+    'G': {'fraction': 0.05, 'mag_limit': 20.0, 'sigma_floor': 0.01, 'seasonal': False, 'followup': False},
+    'g_ZTF': {'fraction': 0.2, 'mag_limit': 20.0, 'sigma_floor': 0.01, 'seasonal': True, 'followup': False},
+    'gp': {'fraction': 0.15, 'mag_limit': 21.0, 'sigma_floor': 0.003, 'seasonal': True, 'followup': True},
+}
+
+# Duration of the Bulge observing season, [days]
+SEASON_LENGTH = 240.0
+
+def photometric_error(mag, mag_limit, sigma_floor):
+    """Function to estimate the photometric uncertainty as a function of magnitude, for a
+    noise model that is photon-limited for faint stars and reaches a systematic floor for bright stars"""
+
+    sigma_phot = 0.1 * 10 ** (0.2 * (mag - mag_limit))
+
+    return np.sqrt(sigma_phot ** 2 + sigma_floor ** 2)
+
+def observation_times(rng, npts, tstart, tend, seasonal=True, weather_loss=0.3):
+    """
+    Function to simulate a set of observation timestamps, including the diurnal cycle, nights lost
+    to weather and, optionally, the annual gap in the visibility of the Galactic Bulge
+
+    Parameters:
+        rng           numpy Generator
+        npts          int    Number of timestamps required
+        tstart, tend  float  Range of JDs
+        seasonal      bool   Whether to restrict the observations to the Bulge season
+        weather_loss  float  Fraction of nights lost to weather
+
+    Returns:
+        times         array  Sorted timestamps [JD]
+    """
+
+    if npts <= 0 or tend <= tstart:
+        return np.array([])
+
+    # Each simulated site observes during a window of ~8hrs per night, at a random longitude
+    night_offset = rng.uniform(0.0, 1.0)
+    night_length = 0.33
+    nights = np.arange(np.floor(tstart), np.ceil(tend) + 1)
+    clear_nights = nights[rng.uniform(size=len(nights)) > weather_loss]
+    if seasonal:
+        clear_nights = clear_nights[((clear_nights - tstart) % 365.25) < SEASON_LENGTH]
+    if len(clear_nights) == 0:
+        clear_nights = nights
+
+    times = rng.choice(clear_nights, size=npts) + night_offset + rng.uniform(0.0, night_length, size=npts)
+    times = times[(times >= tstart) & (times <= tend)]
+
+    # Timestamps falling outside the range are replaced by redrawing from those inside it
+    if len(times) < npts:
+        if len(times) > 0:
+            extra = rng.choice(times, size=npts - len(times)) + rng.uniform(-0.01, 0.01, size=npts - len(times))
+        else:
+            extra = rng.uniform(tstart, tend, size=npts)
+        times = np.concatenate((times, extra))
+
+    return np.sort(times)
+
+def generate_pspl_event(rng, ndata=1000, telescopes=('I', 'gp'), tstart=2460000.5,
+                        duration=730.5, outlier_fraction=0.01):
+    """
+    Function to generate the multi-telescope lightcurve of a synthetic PSPL event
+
+    Parameters:
+        rng               numpy Generator
+        ndata             int    Total number of datapoints, distributed between the telescopes
+        telescopes        list   Names of the datasets to simulate, from SYNTHETIC_TELESCOPES
+        tstart            float  JD of the start of the lightcurve
+        duration          float  Length of the lightcurve [days]
+        outlier_fraction  float  Fraction of datapoints affected by outliers
+
+    Returns:
+        event             dict   with the true 'params' of the event and the simulated 'datasets',
+                                 in the format produced by fittools.repackage_lightcurves
+    """
+
+    tend = tstart + duration
+
+    # Draw the event parameters, placing the peak within an observing season
+    season = rng.integers(0, max(int(duration // 365.25), 1))
+    t0 = tstart + season * 365.25 + rng.uniform(0.1, 0.9) * SEASON_LENGTH
+    u0 = 10 ** rng.uniform(-2.0, 0.0)
+    tE = float(np.clip(10 ** rng.normal(1.3, 0.3), 3.0, 300.0))
+    baseline_mag = rng.uniform(16.0, 20.0)
+    blend_fraction = rng.uniform(0.1, 1.0)
+
+    params = {'t0': t0, 'u0': u0, 'tE': tE, 'baseline_magnitude': baseline_mag,
+              'blend_fraction': blend_fraction}
+
+    fractions = np.array([SYNTHETIC_TELESCOPES[name]['fraction'] for name in telescopes])
+    npts = np.maximum(np.round(ndata * fractions / fractions.sum()).astype(int), 3)
+
+    datasets = {}
+    for name, n in zip(telescopes, npts):
+        config = SYNTHETIC_TELESCOPES[name]
+        if config['followup']:
+            t1 = max(tstart, t0 - 1.5 * tE)
+            t2 = min(tend, t0 + 1.5 * tE)
+        else:
+            (t1, t2) = (tstart, tend)
+        time = observation_times(rng, n, t1, t2, seasonal=config['seasonal'])
+
+        # Each telescope sees a different baseline, due to differences in bandpass and
+        # the resolution of blended stars
+        tel_baseline = baseline_mag + rng.normal(0.0, 0.3)
+        ftotal = pspl_tools.magnitude_to_flux(tel_baseline)
+        fsource = blend_fraction * ftotal
+        A = pspl_tools.pspl_magnification(time, t0, u0, tE)
+        model_mag = pspl_tools.flux_to_magnitude(fsource * (A - 1.0) + ftotal)
+
+        err = photometric_error(model_mag, config['mag_limit'], config['sigma_floor'])
+        mag = model_mag + rng.normal(0.0, 1.0, size=len(time)) * err
+        outliers = rng.uniform(size=len(time)) < outlier_fraction
+        mag[outliers] += rng.normal(0.0, 10.0, size=outliers.sum()) * err[outliers]
+
+        datasets[name] = np.c_[time, mag, err]
+
+    return {'params': params, 'datasets': datasets}
+
+def generate_event_set(nevents, seed=42, ndata=1000, telescopes=('I', 'gp'), **kwargs):
+    """Function to generate a reproducible set of synthetic PSPL events from a seeded random
+    number generator.  Additional keyword arguments are passed to generate_pspl_event"""
+
+    rng = np.random.default_rng(seed)
+
+    return [generate_pspl_event(rng, ndata=ndata, telescopes=telescopes, **kwargs) for i in range(nevents)]
@@ -0,0 +1,247 @@
+from microlensing_targets.models import TargetJob
+from mop.toolbox import fit_queue
+from django.core.management import call_command
+from django.db import transaction, connection, IntegrityError
+from django.conf import settings
+from django.utils import timezone
+from io import StringIO
+import subprocess
+import datetime
+import sys
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Arguments passed to each command for a job, following the name of the target
+COMMAND_ARGS = {
+    'fit_event_PSPL': {'args': [], 'kwargs': {'cores': 0}},
+    'run_TAP': {'args': ['live_obs'], 'kwargs': {}}
+}
+
+# Maximum number of jobs run concurrently, so that the worker processes do not compete with the
+# web server for the CPUs of the pod
+MAX_RUNNING_JOBS = 1
+
+# Time after which a job still marked as running is assumed to have been lost, e.g. because the
+# pod running it was restarted [s]
+JOB_TIMEOUT = 3600.0
+
+# Maximum length of the command output retained with a job
+MAX_MESSAGE_LENGTH = 2000
+
+# Number of attempts made to queue a job while the job which blocked it completes
+MAX_SUBMIT_ATTEMPTS = 3
+
+# Key of the PostgreSQL advisory lock serializing the workers as they claim jobs
+CLAIM_LOCK_KEY = 726354001
+
+def submit_job(target, command, launch=True):
+    """
+    Function to request that a command be run for a target by a worker process.  If a job for the
+    same command and target is already queued or running, that job is returned instead of
+    creating another, so that concurrent requests for the same target are only run once.
+
+    Parameters:
+        target   MicrolensingTarget
+        command  str    Name of the management command, from TargetJob.COMMAND_CHOICES
+        launch   bool   Whether to start a worker process to run the job
+
+    Returns:
+        job      TargetJob
+        created  bool   False if an existing job was returned
+    """
+
+    if command not in COMMAND_ARGS:
+        raise ValueError('Unsupported command for target jobs: ' + command)
+
+    expire_jobs()
+    job = None
+    for attempt in range(MAX_SUBMIT_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                job = TargetJob.objects.create(target=target, command=command, requested=timezone.now())
+            created = True
+            logger.info('TARGET_JOBS: Queued job ' + str(job.pk) + ' to run ' + command + ' for ' + target.name)
+            break
+
+        # The job which blocked this one may complete before it can be retrieved, in which case
+        # the request is queued again
+        except IntegrityError:
+            job = TargetJob.objects.filter(target=target, command=command, status__in=['queued', 'running'])\
+                .order_by('-requested').first()
+            created = False
+            if job:
+                logger.info('TARGET_JOBS: Job ' + str(job.pk) + ' to run ' + command + ' for ' + target.name
+                            + ' is already ' + job.status)
+                break
+
+    # Should every attempt be blocked by jobs that complete in the meantime, the latest of these
+    # has served the request
+    if not job:
+        job = TargetJob.objects.filter(target=target, command=command).order_by('-requested').first()
+        logger.info('TARGET_JOBS: Job ' + str(job.pk) + ' to run ' + command + ' for ' + target.name
+                    + ' completed while the request was made')
+
+    # A worker is started for any job still waiting, in case the worker for an earlier request
+    # was lost before reaching it
+    if launch and job.status == 'queued':
+        launch_worker()
+
+    return job, created
+
+def launch_worker():
+    """Function to start a detached process running the run_target_jobs command, which works
+    through the queued jobs and exits once the queue is empty"""
+
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'run_target_jobs'],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        logger.info('TARGET_JOBS: Started worker process ' + str(proc.pid))
+    except OSError as e:
+        logger.error('TARGET_JOBS: Unable to start worker process: ' + repr(e))
+        proc = None
+
+    return proc
+
+def expire_jobs(timeout=JOB_TIMEOUT):
+    """Function to mark as failed any jobs that have been running for longer than the timeout,
+    so that they no longer block new requests for the same target.  Returns the number of jobs expired"""
+
+    now = timezone.now()
+    nexpired = TargetJob.objects.filter(
+        status='running',
+        started__lt=now - datetime.timedelta(seconds=timeout)
+    ).update(status='failed', finished=now, message='Job did not complete within ' + str(timeout) + 's')
+    if nexpired > 0:
+        logger.warning('TARGET_JOBS: Expired ' + str(nexpired) + ' job(s) that did not complete')
+
+    return nexpired
+
+def lock_job_queue():
+    """Function to serialize the workers claiming jobs for the rest of the current transaction,
+    so that the count of running jobs cannot change between a worker counting them and claiming
+    a job.  PostgreSQL provides a transaction-level advisory lock for this, while other databases,
+    such as the SQLite used for development, already serialize their write transactions"""
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLAIM_LOCK_KEY])
+
+def claim_job(worker, max_running=MAX_RUNNING_JOBS):
+    """
+    Function to claim the oldest queued job, provided that fewer than max_running jobs are
+    already running.  The workers take the lock of the job queue in turn to count the running
+    jobs and claim the next, so that no more than max_running jobs are started.  Jobs are also
+    selected with SKIP LOCKED so that concurrent workers claim different jobs.
+
+    Parameters:
+        worker       str   Identifier of the worker
+        max_running  int   Maximum number of jobs running concurrently
+
+    Returns:
+        job          TargetJob or None if no job can be claimed
+    """
+
+    expire_jobs()
+    with transaction.atomic():
+        lock_job_queue()
+        if TargetJob.objects.filter(status='running').count() >= max_running:
+            return None
+
+        job = TargetJob.objects.select_for_update(skip_locked=True).filter(status='queued')\
+            .order_by('requested').first()
+        if not job:
+            return None
+
+        job.status = 'running'
+        job.started = timezone.now()
+        job.worker = worker
+        job.save(update_fields=['status', 'started', 'worker'])
+
+    return job
+
+def run_job(job):
+    """Function to run the command of a claimed job, recording its outcome and the end of its output.
+    Returns True if the command completed successfully"""
+
+    logger.info('TARGET_JOBS: Running job ' + str(job.pk) + ': ' + job.command + ' for ' + job.target.name)
+
+    out = StringIO()
+    config = COMMAND_ARGS[job.command]
+    try:
+        call_command(job.command, job.target.name, *config['args'], stdout=out, **config['kwargs'])
+        job.status = 'done'
+        job.message = out.getvalue()[-MAX_MESSAGE_LENGTH:]
+    except Exception as e:
+        logger.exception('TARGET_JOBS: Job ' + str(job.pk) + ' failed')
+        job.status = 'failed'
+        job.message = (out.getvalue() + repr(e))[-MAX_MESSAGE_LENGTH:]
+
+    job.finished = timezone.now()
+
+    # The job is only updated if it is still held by this worker, since it may have been expired
+    TargetJob.objects.filter(pk=job.pk, status='running', worker=job.worker).update(
+        status=job.status, finished=job.finished, message=job.message
+    )
+    logger.info('TARGET_JOBS: Job ' + str(job.pk) + ' ' + job.status + ' after '
+                + str(job.finished - job.started))
+
+    return job.status == 'done'
+
+def run_jobs(worker=None, max_running=MAX_RUNNING_JOBS):
+    """Function to run queued jobs one after another until none remain that can be claimed.
+    Returns the number of jobs run"""
+
+    if not worker:
+        worker = fit_queue.get_worker_id()
+
+    njobs = 0
+    while True:
+        job = claim_job(worker, max_running=max_running)
+        if not job:
+            break
+        run_job(job)
+        njobs += 1
+
+    return njobs
+
+def job_status(job):
+    """Function to summarize a job in a JSON-serializable form for the target page"""
+
+    runtime = None
+    if job.started:
+        runtime = ((job.finished if job.finished else timezone.now()) - job.started).total_seconds()
+
+    return {
+        'id': job.pk,
+        'command': job.command,
+        'label': job.get_command_display(),
+        'status': job.status,
+        'requested': job.requested.isoformat(),
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+        'runtime': runtime,
+        'active': job.status in ['queued', 'running']
+    }
+
+def latest_jobs(target):
+    """Function to return the most recent job of each command for a target"""
+
+    jobs = []
+    for command, label in TargetJob.COMMAND_CHOICES:
+        job = TargetJob.objects.filter(target=target, command=command).order_by('-requested').first()
+        if job:
+            jobs.append(job)
+
+    return jobs
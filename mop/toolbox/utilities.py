@@ -73,5 +73,10 @@ def checkpoint():
 
     logger.info('CHECKPOINT: N DB connections: '
                 + str(len(connection.queries)) + ', memory: '
-                + str(round(psutil.Process(os.getpid()).memory_info().rss / 1048576, 2)) + 'MiB')
+                + str(round(memory_usage(), 2)) + 'MiB')
+
+def memory_usage():
+    """Function to return the resident memory of the current process in MiB"""
+
+    return psutil.Process(os.getpid()).memory_info().rss / 1048576
 
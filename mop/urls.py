@@ -15,10 +15,12 @@ Including another URLconf
 """
 from django.urls import path, include
 
-from mop.views import MOPTargetDetailView, ActiveObsView, PriorityTargetsView, TargetFacilitySelectionView
+from mop.views import MOPTargetDetailView, ActiveObsView, PriorityTargetsView, TargetFacilitySelectionView, \
+    TargetJobStatusView
 
 urlpatterns = [
     path('targets/<int:pk>/', MOPTargetDetailView.as_view(), name='detail'),
+    path('targets/<int:pk>/jobs/', TargetJobStatusView.as_view(), name='target-jobs'),
     path('activeobs/', ActiveObsView.as_view(), name='activeobs'),
     path('prioritytargets/', PriorityTargetsView.as_view(), name='prioritytargets'),
     path('', include('tom_common.urls')),
@@ -1,8 +1,7 @@
 from django.shortcuts import redirect
+from django.http import JsonResponse
 from django.urls import reverse
-from django.core.management import call_command
 from django.conf import settings
-from io import StringIO
 from tom_targets.views import TargetDetailView
 from tom_targets.models import Target, TargetExtra, TargetList
 from tom_observations.models import ObservationRecord
@@ -21,7 +20,7 @@ from django_filters.views import FilterView
 from guardian.mixins import PermissionListMixin
 from guardian.shortcuts import get_objects_for_user
 from datetime import datetime, timedelta
-from mop.toolbox import utilities, querytools
+from mop.toolbox import utilities, querytools, target_jobs
 from mop.toolbox.mop_classes import MicrolensingEvent
 from django.views.generic.list import ListView
 import numpy as np
@@ -73,13 +72,12 @@ class MOPTargetDetailView(TargetDetailView):
         logger.info('TARGETDETAIL: chk 1, time taken ' + str(t2 - t1))
         utilities.checkpoint()
 
+        # Model fits and TAP runs are queued to be run by a separate worker process, so that
+        # the page does not wait for them to complete
         fit_event = request.GET.get('fit_event', False)
         if fit_event:
-            target_id = self.get_object().id
-            target_name = self.get_object().name
-            out = StringIO()
-            call_command('fit_event_PSPL', target_name, cores=0, stdout=out)
-            return redirect(reverse('tom_targets:detail', args=(target_id,)))
+            self.submit_target_job(request, target, 'fit_event_PSPL')
+            return redirect(reverse('tom_targets:detail', args=(target.id,)))
 
         t3 = datetime.utcnow()
         logger.info('TARGETDETAIL: chk 2, time taken ' + str(t3 - t2))
@@ -87,11 +85,8 @@ class MOPTargetDetailView(TargetDetailView):
 
         TAP_event = request.GET.get('tap_event', False)
         if TAP_event:
-            target_id = self.get_object().id
-            target_name = self.get_object().name
-            out = StringIO()
-            call_command('run_TAP', target_name, stdout=out)
-            return redirect(reverse('tom_targets:detail', args=(target_id,)))
+            self.submit_target_job(request, target, 'run_TAP')
+            return redirect(reverse('tom_targets:detail', args=(target.id,)))
 
         t4 = datetime.utcnow()
         logger.info('TARGETDETAIL: chk 3, time taken ' + str(t4 - t3))
@@ -101,6 +96,30 @@ class MOPTargetDetailView(TargetDetailView):
 
         return super().get(request, *args, **kwargs)
 
+    def submit_target_job(self, request, target, command):
+        """Method to queue a command to be run for the target, reporting the status of the job"""
+
+        (job, created) = target_jobs.submit_job(target, command)
+        if created:
+            messages.info(request, job.get_command_display() + ' queued for ' + target.name
+                          + '; this page will be updated when it completes')
+        else:
+            messages.info(request, job.get_command_display() + ' for ' + target.name
+                          + ' is already ' + job.status)
+
+class TargetJobStatusView(MOPTargetDetailView):
+    """View returning the status of the most recent jobs requested for a target as JSON, which
+    is polled by the target page while jobs are in progress"""
+
+    def get(self, request, *args, **kwargs):
+        target = self.get_object()
+        jobs = target_jobs.latest_jobs(target)
+
+        return JsonResponse({
+            'target': target.name,
+            'jobs': [target_jobs.job_status(job) for job in jobs]
+        })
+
 class ActiveObsView(ListView):
     template_name = 'active_obs_list.html'
     paginate_by = 25
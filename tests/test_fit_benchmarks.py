@@ -0,0 +1,54 @@
+from django.test import TestCase
+from mop.toolbox import fit_benchmarks, fittools, synthetic_lightcurves
+import numpy as np
+import json
+import copy
+
+
+class TestFitBenchmarks(TestCase):
+    def setUp(self):
+        self.event = synthetic_lightcurves.generate_event_set(1, seed=7, ndata=200)[0]
+
+    def test_synthetic_photometry(self):
+        photometry = fit_benchmarks.synthetic_photometry(self.event['datasets'])
+        (datasets, ndata) = fittools.repackage_lightcurves(photometry)
+
+        # Repackaging the synthetic photometry should recover the original lightcurves
+        assert(ndata == sum([len(lc) for lc in self.event['datasets'].values()]))
+        for name, lc in self.event['datasets'].items():
+            np.testing.assert_allclose(datasets[name], lc, rtol=0.0, atol=1e-6)
+
+    def test_run_benchmarks(self):
+        benchmark = fit_benchmarks.run_benchmarks(ndata_list=[100], nevents=1, repeats=2, backend='numpy')
+
+        assert(len(benchmark['results']) == len(fit_benchmarks.STAGES))
+        for result in benchmark['results']:
+            assert(len(result['times']) == 2)
+            assert(result['min'] <= result['median'])
+
+        # The fits from both initial guesses should record their iterations and failures
+        fit_results = [result for result in benchmark['results'] if result['stage'] in fit_benchmarks.FIT_STAGES]
+        assert(len(fit_results) == 2)
+        for result in fit_results:
+            assert(result['niter_median'] > 0)
+            assert(result['nfailed'] == 0)
+
+        # The results should be serializable, and a run compared with itself shows no regressions
+        reference = json.loads(json.dumps(benchmark))
+        comparison = fit_benchmarks.compare_benchmarks(benchmark, reference)
+        assert(len(comparison) == len(fit_benchmarks.STAGES))
+        assert(not any([entry['regression'] for entry in comparison]))
+
+        slower = copy.deepcopy(reference)
+        for result in slower['results']:
+            result['median'] *= 2.0
+        comparison = fit_benchmarks.compare_benchmarks(slower, reference, tolerance=0.2)
+        assert(all([entry['regression'] for entry in comparison]))
+
+        # More failed fits should be a regression even if the fits are no slower
+        worse = copy.deepcopy(reference)
+        for result in worse['results']:
+            if 'nfailed' in result:
+                result['nfailed'] += 1
+        comparison = fit_benchmarks.compare_benchmarks(worse, reference)
+        assert([entry['stage'] for entry in comparison if entry['regression']] == list(fit_benchmarks.FIT_STAGES))
@@ -0,0 +1,74 @@
+from django.test import TestCase
+from django.utils import timezone
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from microlensing_targets.models import FitCheckpoint, FitJob
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+from datetime import datetime, timedelta
+import numpy as np
+from mop.management.commands.fit_need_events_PSPL import fit_target_list, Command
+
+
+class TestFitCheckpoint(TestCase):
+    def setUp(self):
+        self.time_now = Time(datetime.utcnow()).jd
+        tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        rng = np.random.default_rng(7)
+        self.targets = []
+        for j in range(3):
+            target = Target.objects.create(
+                name='OGLE-2023-BLG-000' + str(j),
+                ra=271.1925,
+                dec=-28.3164
+            )
+            self.targets.append(target)
+            for i in range(5):
+                ts = tstart + TimeDelta(i * 1.0 * u.day)
+                PhotometryReducedDatum.objects.create(
+                    timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+                    source_name='OGLE',
+                    source_location=target.name,
+                    target=target,
+                    bandpass='I',
+                    brightness=rng.normal(18.0, 0.01),
+                    brightness_error=0.01)
+        self.options = {'force': False, 'warm_start': False, 'backend': 'numpy', 'cores': 1,
+                        'max_pending': 0, 'memory_limit': 0, 'batch_size': 1}
+
+    def test_fit_target_list_deadline(self):
+        # A run which has already passed its deadline should record all events as remaining
+        checkpoint = FitCheckpoint.objects.create(started=timezone.now())
+        completed = fit_target_list(self.targets, self.time_now, self.options,
+                                    deadline=datetime.utcnow() - timedelta(seconds=1),
+                                    checkpoint=checkpoint)
+        checkpoint = FitCheckpoint.objects.get(pk=checkpoint.pk)
+        assert(len(completed) == 0)
+        assert(checkpoint.remaining == [t.pk for t in self.targets])
+        assert(checkpoint.finished is not None)
+
+        # Otherwise all events should be completed, in this case without fits since they
+        # have too few datapoints
+        completed = fit_target_list(self.targets, self.time_now, self.options,
+                                    deadline=datetime.utcnow() + timedelta(seconds=600),
+                                    checkpoint=checkpoint)
+        checkpoint = FitCheckpoint.objects.get(pk=checkpoint.pk)
+        assert(completed == set([t.pk for t in self.targets]))
+        assert(checkpoint.remaining == [])
+        assert(checkpoint.ncompleted == 3)
+
+    def test_handle_queue(self):
+        # A queue worker should record its run in a checkpoint and claim no more than the maximum
+        # number of events, leaving the rest in the queue for other workers
+        options = dict(self.options, run_every=24.0, max_events=2, claim_size=1)
+        ncheckpoints = FitCheckpoint.objects.count()
+        Command().handle_queue(datetime.utcnow(), self.time_now, datetime.utcnow() + timedelta(seconds=600),
+                               options)
+
+        assert(FitJob.objects.filter(status='done').count() == 2)
+        assert(FitJob.objects.filter(status='queued').count() == 1)
+        checkpoint = FitCheckpoint.objects.order_by('-started').first()
+        assert(FitCheckpoint.objects.count() == ncheckpoints + 1)
+        assert(checkpoint.ncompleted == 2)
+        assert(checkpoint.remaining == [])
+        assert(checkpoint.finished is not None)
@@ -0,0 +1,111 @@
+from django.test import TestCase
+from unittest import mock
+from os import getcwd, path
+import os
+import numpy as np
+from mop.toolbox import fit_pool, fittools
+
+
+class TestFitPool(TestCase):
+    def setUp(self):
+        lightcurve_file = path.join(getcwd(), 'tests/data/OGLE-2023-BLG-0348_phot.dat')
+        data = np.loadtxt(lightcurve_file)
+        datasets = {'I': data[:, 0:3]}
+
+        self.tasks = [
+            ('Event-1', 271.1925, -28.3164, datasets, None),
+            ('Event-2', 271.1925, -28.3164, datasets, None)
+        ]
+
+    def test_count_workers(self):
+        ncpus = os.cpu_count()
+
+        assert(fit_pool.count_workers(0, 10) == 1)
+        assert(fit_pool.count_workers(4, 1) == 1)
+        assert(fit_pool.count_workers(ncpus + 10, 1000) == ncpus)
+
+    def test_fit_event_worker(self):
+        (name, model_params, model_lightcurve, fit_status) = fit_pool.fit_event_worker(self.tasks[0])
+
+        assert(name == 'Event-1')
+        assert(fit_status)
+        for key in ['t0', 'u0', 'tE', 'chi2', 'fit_covariance']:
+            assert(key in model_params.keys())
+
+    def test_fit_events(self):
+        # A pool of worker processes should be used even where the host has a single CPU
+        with mock.patch('os.cpu_count', return_value=4):
+            assert(fit_pool.count_workers(2, len(self.tasks)) == 2)
+            results = list(fit_pool.fit_events(self.tasks, cores=2))
+
+        assert(len(results) == len(self.tasks))
+        assert(set([r[0] for r in results]) == set(['Event-1', 'Event-2']))
+        assert(all([r[3] for r in results]))
+
+        # Both tasks used the same lightcurve, so the fitted parameters should agree regardless
+        # of which process performed the fit
+        assert(results[0][1]['t0'] == results[1][1]['t0'])
+
+    def test_fit_event_stream(self):
+        # The tasks should be drawn lazily from the generator, with no more pending than allowed
+        drawn = []
+        def generate_tasks():
+            for i in range(4):
+                drawn.append(i)
+                (name, ra, dec, datasets, previous_fit) = self.tasks[0]
+                yield ('Event-' + str(i), ra, dec, datasets, previous_fit)
+
+        # A pool of worker processes should be used even where the host has a single CPU
+        with mock.patch('os.cpu_count', return_value=4):
+            stream = fit_pool.fit_event_stream(generate_tasks(), cores=2, max_pending=2)
+            first = next(stream)
+            assert(len(drawn) <= 3)
+            results = [first] + list(stream)
+        assert(set([r[0] for r in results]) == set(['Event-' + str(i) for i in range(4)]))
+        assert(all([r[3] for r in results]))
+
+        # A memory limit which cannot be met should reduce the stream to one pending task at a
+        # time, without preventing it from completing
+        results = list(fit_pool.fit_event_stream(self.tasks, cores=2, memory_limit=1.0))
+        assert(len(results) == len(self.tasks))
+        assert(fit_pool.check_memory_limit(1.0))
+        assert(not fit_pool.check_memory_limit(0))
+
+    def test_recycling_pool(self):
+        tasks = [('Event-' + str(i),) + self.tasks[0][1:] for i in range(4)]
+
+        # Workers should be replaced after the given number of fits, even with a single core
+        worker_stats = []
+        results = list(fit_pool.fit_event_stream(tasks, cores=1, backend='numpy', max_tasks_per_worker=2,
+                                                 worker_stats=worker_stats))
+        assert(set([r[0] for r in results]) == set([t[0] for t in tasks]))
+        assert(all([r[3] for r in results]))
+        assert([stats['ntasks'] for stats in worker_stats] == [2, 2])
+        assert(all([stats['retired'] == 'max_tasks' for stats in worker_stats]))
+        assert(all([stats['rss_peak'] >= stats['rss_start'] > 0.0 for stats in worker_stats]))
+        assert(os.getpid() not in [stats['pid'] for stats in worker_stats])
+
+        # Workers should also be replaced once their memory passes the watermark
+        worker_stats = []
+        results = list(fit_pool.fit_event_stream(tasks[0:2], cores=2, backend='numpy', rss_watermark=1.0,
+                                                 worker_stats=worker_stats))
+        assert(len(results) == 2)
+        assert([stats['retired'] for stats in worker_stats] == ['rss_watermark', 'rss_watermark'])
+
+    def test_concurrent_models(self):
+        (name, ra, dec, datasets, previous_fit) = self.tasks[0]
+        (serial_params, serial_lightcurve, serial_status) = fittools.fit_pspl_omega2(ra, dec, datasets)
+        (params, model_lightcurve, fit_status) = fittools.fit_pspl_omega2(ra, dec, datasets,
+                                                                          concurrent_models=True)
+
+        # Fitting model 2 concurrently should not change the choice of model or its parameters
+        assert(fit_status == serial_status)
+        for key in ['t0', 'u0', 'tE', 'chi2', 'nfev']:
+            assert(params[key] == serial_params[key])
+        np.testing.assert_array_equal(model_lightcurve, serial_lightcurve)
+
+        # A cancelled fit should leave no running processes behind
+        fit_data = fittools.build_pylima_event(ra, dec, datasets)
+        model_fit = fittools.start_model_fit(fit_data, 2)
+        fittools.cancel_model_fit(model_fit)
+        assert(not model_fit[0].is_alive())
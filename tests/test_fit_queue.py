@@ -0,0 +1,72 @@
+from django.test import TestCase
+from django.utils import timezone
+from tom_targets.models import Target
+from microlensing_targets.models import FitJob
+from mop.toolbox import fit_queue
+import datetime
+
+
+class TestFitQueue(TestCase):
+    def setUp(self):
+        self.targets = []
+        for i in range(5):
+            self.targets.append(Target.objects.create(
+                name='Gaia24abc' + str(i),
+                ra=271.1925,
+                dec=-28.3164
+            ))
+        self.ranking = [(float(i), 100, target) for i, target in enumerate(self.targets)]
+
+    def test_enqueue_fits(self):
+        assert(fit_queue.enqueue_fits(self.ranking) == 5)
+
+        # Events already in the queue should not be duplicated
+        assert(fit_queue.enqueue_fits(self.ranking) == 0)
+        assert(FitJob.objects.count() == 5)
+
+        # Completed jobs are only queued again once the requeue interval has passed
+        FitJob.objects.all().update(status='done', completed=timezone.now())
+        assert(fit_queue.enqueue_fits(self.ranking) == 0)
+        FitJob.objects.all().update(completed=timezone.now() - datetime.timedelta(days=1))
+        assert(fit_queue.enqueue_fits(self.ranking) == 5)
+        assert(FitJob.objects.filter(status='queued').count() == 5)
+
+    def test_claim_fits(self):
+        fit_queue.enqueue_fits(self.ranking)
+
+        # Workers should claim disjoint sets of jobs, in order of priority
+        claim1 = fit_queue.claim_fits('worker-1', 2)
+        claim2 = fit_queue.claim_fits('worker-2', 2)
+        assert([t.name for t in claim1] == ['Gaia24abc4', 'Gaia24abc3'])
+        assert([t.name for t in claim2] == ['Gaia24abc2', 'Gaia24abc1'])
+
+        assert(fit_queue.renew_leases('worker-1') == 2)
+        assert(fit_queue.complete_fits('worker-1', claim1) == 2)
+
+        # A worker cannot complete jobs which it does not hold
+        assert(fit_queue.complete_fits('worker-1', claim2) == 0)
+
+        # Releasing the remaining jobs returns them to the queue
+        assert(fit_queue.release_fits('worker-2') == 2)
+        assert(FitJob.objects.filter(status='queued').count() == 3)
+        assert(FitJob.objects.filter(status='done').count() == 2)
+
+    def test_expired_leases(self):
+        fit_queue.enqueue_fits(self.ranking)
+        claim1 = fit_queue.claim_fits('worker-1', 5)
+        assert(len(claim1) == 5)
+
+        # Jobs are not available to other workers while their lease is valid
+        assert(len(fit_queue.claim_fits('worker-2', 5)) == 0)
+
+        # Once the worker stops renewing its leases, the jobs are claimed by another worker
+        FitJob.objects.all().update(lease_expiry=timezone.now() - datetime.timedelta(seconds=1))
+        claim2 = fit_queue.claim_fits('worker-2', 5)
+        assert(len(claim2) == 5)
+        assert(fit_queue.complete_fits('worker-1', claim1) == 0)
+
+        # Jobs which repeatedly exhaust their leases are eventually marked as failed
+        for i in range(fit_queue.MAX_ATTEMPTS):
+            FitJob.objects.all().update(lease_expiry=timezone.now() - datetime.timedelta(seconds=1))
+            fit_queue.claim_fits('worker-3', 5)
+        assert(FitJob.objects.filter(status='failed').count() == 5)
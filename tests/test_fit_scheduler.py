@@ -0,0 +1,144 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from astropy.time import Time, TimezoneInfo
+from datetime import datetime
+import numpy as np
+from mop.toolbox import fit_scheduler, querytools
+
+
+class TestFitScheduler(TestCase):
+    def setUp(self):
+        self.time_now = Time(datetime.utcnow()).jd
+
+        # Configuration of the test events: t0 offset from now [days], tE [days], days since last fit,
+        # TAP priority, number of datapoints, number of datapoints at the last fit
+        configs = {
+            'Peaking-short-tE': [0.5, 5.0, 0.5, 50.0, 30, 20],
+            'Peaking-long-tE': [-10.0, 150.0, 0.5, 10.0, 20, 20],
+            'Baseline-long-tE': [-400.0, 100.0, 3.0, 0.0, 40, 40],
+            'Never-fitted': [None, None, None, 0.0, 10, 0],
+        }
+        self.targets = {}
+        for name, config in configs.items():
+            t = Target.objects.create(name=name, ra=270.0, dec=-28.0)
+            if config[0] is not None:
+                t.t0 = self.time_now + config[0]
+                t.tE = config[1]
+                t.last_fit = self.time_now - config[2]
+            t.tap_priority = config[3]
+            if config[5] > 0:
+                t.fit_fingerprint = {'counts': {'I': config[5]}, 'max_jd': self.time_now - 31.0 + config[5],
+                                     'hash': ''}
+            t.save()
+            self.targets[name] = t
+
+            for i in range(config[4]):
+                ts = Time(self.time_now - 30.0 + i, format='jd')
+                PhotometryReducedDatum.objects.create(
+                    timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+                    source_name='OGLE',
+                    source_location=name,
+                    target=t,
+                    bandpass='I',
+                    brightness=18.0,
+                    brightness_error=0.01)
+
+    def test_fit_interval(self):
+        # Short-timescale events should be refitted more often than long-timescale events
+        short_interval = fit_scheduler.fit_interval(self.time_now, 5.0, self.time_now)
+        long_interval = fit_scheduler.fit_interval(self.time_now, 150.0, self.time_now)
+        assert(short_interval < long_interval)
+        assert(short_interval >= fit_scheduler.MIN_FIT_INTERVAL)
+
+        # Events far from their peak should be refitted less often
+        wing_interval = fit_scheduler.fit_interval(self.time_now - 300.0, 150.0, self.time_now)
+        assert(wing_interval > long_interval)
+        assert(wing_interval <= fit_scheduler.MAX_FIT_INTERVAL)
+
+        # Events without a valid model, e.g. new events or those whose fit failed, are refitted after
+        # the minimum interval
+        assert(fit_scheduler.fit_interval(0.0, 0.0, self.time_now) == fit_scheduler.MIN_FIT_INTERVAL)
+        assert(fit_scheduler.fit_interval(np.nan, np.nan, self.time_now) == fit_scheduler.MIN_FIT_INTERVAL)
+
+        due = fit_scheduler.next_fit_due(self.time_now, 5.0, self.time_now)
+        np.testing.assert_allclose(due, self.time_now + short_interval)
+
+    def test_count_datapoints(self):
+        counts = fit_scheduler.count_datapoints(list(self.targets.values()))
+
+        assert(counts[self.targets['Peaking-short-tE'].pk] == 30)
+        assert(counts[self.targets['Baseline-long-tE'].pk] == 40)
+        assert(fit_scheduler.count_new_datapoints(self.targets['Peaking-short-tE'], 30) == 10)
+        assert(fit_scheduler.count_new_datapoints(self.targets['Never-fitted'], 10) == 10)
+
+    def test_fit_priority_score(self):
+        scores = {}
+        for name, t in self.targets.items():
+            nnew = fit_scheduler.count_new_datapoints(t, 0)
+            scores[name] = fit_scheduler.fit_priority_score(t, nnew, self.time_now)
+
+        assert(scores['Peaking-short-tE'] > scores['Peaking-long-tE'])
+        assert(scores['Peaking-long-tE'] > scores['Baseline-long-tE'])
+
+    def test_schedule_fits(self):
+        target_list = list(self.targets.values())
+
+        # With an ample budget, all events should be scheduled, in order of priority
+        selected = fit_scheduler.schedule_fits(target_list, self.time_now, 3600.0)
+        assert(len(selected) == len(target_list))
+        assert(selected[0].name == 'Peaking-short-tE')
+
+        # A limited budget should be filled with the highest-priority events
+        budget = fit_scheduler.estimate_fit_cost(30) + fit_scheduler.estimate_fit_cost(20)
+        selected = fit_scheduler.schedule_fits(target_list, self.time_now, budget)
+        assert([t.name for t in selected] == ['Peaking-short-tE', 'Peaking-long-tE'])
+
+        # The budget scales with the number of worker processes
+        selected = fit_scheduler.schedule_fits(target_list, self.time_now, budget, cores=2)
+        assert(len(selected) == len(target_list))
+
+        selected = fit_scheduler.schedule_fits(target_list, self.time_now, 3600.0, max_nevents=1)
+        assert(len(selected) == 1)
+
+        # Events carried over from a previous run should be scheduled first
+        resume = [self.targets['Never-fitted'].pk, self.targets['Baseline-long-tE'].pk]
+        selected = fit_scheduler.schedule_fits(target_list, self.time_now, 3600.0, resume=resume)
+        assert([t.name for t in selected] == ['Never-fitted', 'Baseline-long-tE',
+                                              'Peaking-short-tE', 'Peaking-long-tE'])
+
+    def test_get_alive_events_due_for_fit(self):
+        for t in self.targets.values():
+            t.next_fit_due = fit_scheduler.next_fit_due(t.t0, t.tE, t.last_fit)
+            t.save()
+
+        ts = querytools.get_alive_events_due_for_fit(48.0, time_now=self.time_now)
+        names = [t.name for t in ts]
+
+        # The short-tE event is due again within hours of its last fit, while the long-tE events are not.
+        # The baseline event is deferred to its next_fit_due date, even though its last fit is older
+        # than the maximum model age
+        assert('Peaking-short-tE' in names)
+        assert('Peaking-long-tE' not in names)
+        assert('Baseline-long-tE' not in names)
+        assert('Never-fitted' in names)
+
+        # Events with no next_fit_due date should fall back to the age of their last fit
+        t = self.targets['Peaking-long-tE']
+        t.next_fit_due = 0.0
+        t.save()
+        names = [t.name for t in querytools.get_alive_events_due_for_fit(48.0, time_now=self.time_now)]
+        assert('Peaking-long-tE' not in names)
+        names = [t.name for t in querytools.get_alive_events_due_for_fit(6.0, time_now=self.time_now)]
+        assert('Peaking-long-tE' in names)
+        assert('Baseline-long-tE' not in names)
+
+        # Deferred events should be selected as soon as they receive new photometry
+        t = self.targets['Baseline-long-tE']
+        assert(fit_scheduler.find_events_with_new_data([(t.pk, t.last_fit, t.fit_fingerprint)]) == set())
+        PhotometryReducedDatum.objects.create(
+            timestamp=Time(self.time_now - 0.5, format='jd').to_datetime(timezone=TimezoneInfo()),
+            source_name='OGLE', source_location=t.name, target=t, bandpass='I',
+            brightness=18.0, brightness_error=0.01)
+        names = [t.name for t in querytools.get_alive_events_due_for_fit(48.0, time_now=self.time_now)]
+        assert('Baseline-long-tE' in names)
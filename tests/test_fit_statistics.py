@@ -0,0 +1,45 @@
+from django.test import TestCase
+import numpy as np
+from scipy import stats
+from mop.toolbox import fit_statistics
+
+
+class TestFitStatistics(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.residuals = np.concatenate((rng.normal(0.1, 1.2, size=500), rng.normal(0.0, 3.0, size=100)))
+        self.reference_mask = np.zeros(len(self.residuals), dtype=bool)
+        self.reference_mask[0:500] = True
+
+    def test_compute_fit_statistics(self):
+        statistics = fit_statistics.compute_fit_statistics(self.residuals, reference_mask=self.reference_mask)
+        reference = self.residuals[0:500]
+
+        # chi2 is computed over all datasets, the remaining statistics over the reference dataset alone
+        np.testing.assert_allclose(statistics['chi2'], np.sum(self.residuals ** 2))
+        assert(statistics['ndata'] == len(self.residuals))
+        np.testing.assert_allclose(statistics['chi2_dof'], np.sum(reference ** 2) / (len(reference) - 5))
+        np.testing.assert_allclose(statistics['sw_test'], stats.shapiro(reference)[0])
+        np.testing.assert_allclose(statistics['ks_test'], stats.kstest(reference, 'norm', args=(0, 1))[0])
+        np.testing.assert_allclose(statistics['ad_test'], stats.anderson(reference, dist='norm')[0])
+
+    def test_compute_fit_statistics_small_sample(self):
+        statistics = fit_statistics.compute_fit_statistics(np.array([0.5, -0.5]))
+
+        assert(statistics['chi2'] == 0.5)
+        for key in ['chi2_dof', 'sw_test', 'ad_test', 'ks_test']:
+            assert(np.isnan(statistics[key]))
+
+    def test_get_fit_statistics(self):
+        ncalls = []
+        def residual_function():
+            ncalls.append(1)
+            return self.residuals, self.reference_mask
+
+        fit_results = {}
+        statistics = fit_statistics.get_fit_statistics(fit_results, residual_function)
+        cached_statistics = fit_statistics.get_fit_statistics(fit_results, residual_function)
+
+        assert(len(ncalls) == 1)
+        assert(fit_results['fit_statistics'] == statistics)
+        assert(cached_statistics == statistics)
@@ -0,0 +1,73 @@
+from django.test import TestCase
+from django.utils import timezone
+from tom_targets.models import Target
+from microlensing_targets.models import FitTelemetry
+from mop.toolbox import fit_telemetry, fit_pool, fittools, synthetic_lightcurves
+import datetime
+
+
+class TestFitTelemetry(TestCase):
+    def setUp(self):
+        self.event = synthetic_lightcurves.generate_event_set(1, seed=5, ndata=500)[0]
+        self.target = Target.objects.create(
+            name='Gaia24abc',
+            ra=271.1925,
+            dec=-28.3164
+        )
+
+    def test_fit_telemetry(self):
+        (model_params, model_lightcurve, fit_status) = fittools.fit_pspl_omega2(
+            0.0, 0.0, self.event['datasets'], backend='numpy')
+        telemetry = model_params['fit_telemetry']
+
+        assert(telemetry['ndata'] == sum([len(lc) for lc in self.event['datasets'].values()]))
+        assert(telemetry['ndata_per_telescope']['I'] == len(self.event['datasets']['I']))
+        assert(telemetry['nfev'] == model_params['fit_nfev'])
+        assert(0 < telemetry['niter'] <= telemetry['nfev'])
+        assert(telemetry['selected_model'] in [1, 2])
+        for stage in ['package', 'model1', 'lightcurve']:
+            assert(stage in telemetry['stages'])
+        assert(sum([t['wall'] for t in telemetry['stages'].values()]) <= telemetry['wall_time'])
+
+        record = fit_telemetry.store_telemetry(self.target, model_params, fit_status)
+        assert(record.nfev == telemetry['nfev'])
+        assert(record.peak_rss > 0.0)
+
+        # Fits that fail should still record the time they took
+        (name, model_params, model_lightcurve, fit_status) = fit_pool.fit_event_worker(
+            ('Gaia24abc', 0.0, 0.0, {'I': [[1.0]]}, None), backend='numpy')
+        assert(not fit_status)
+        record = fit_telemetry.store_telemetry(self.target, model_params, fit_status)
+        assert(not record.status)
+        assert(record.wall_time >= 0.0)
+
+    def test_cost_summary(self):
+        for i, (wall_time, ndata) in enumerate([(1.0, 150), (2.0, 1500), (10.0, 15000)]):
+            FitTelemetry.objects.create(
+                target=self.target,
+                created=timezone.now() - datetime.timedelta(days=i),
+                ndata=ndata,
+                nfev=100 * (i + 1),
+                wall_time=wall_time,
+                cpu_time=wall_time,
+                stage_times={'model1': {'wall': 0.5 * wall_time, 'cpu': 0.5 * wall_time}}
+            )
+        qs = FitTelemetry.objects.all()
+
+        assert(fit_telemetry.slowest_fits(qs, nfits=1)[0].wall_time == 10.0)
+
+        distribution = fit_telemetry.cost_distribution(qs)
+        assert(distribution['nfits'] == 3)
+        assert(distribution['wall_time']['p50'] == 2.0)
+        assert(distribution['wall_time']['max'] == 10.0)
+        assert(distribution['stage_fraction']['model1'] == 0.5)
+        assert(list(distribution['wall_time_by_ndata'].keys()) == ['1e2-1e3', '1e3-1e4', '1e4-1e5'])
+
+        trend = fit_telemetry.cost_trend(qs, by='day')
+        assert(len(trend) == 3)
+        assert(trend[-1]['total_wall_time'] == 1.0)
+        assert(len(fit_telemetry.cost_trend(qs, by='run')) == 0)
+
+        # Old records are deleted once they exceed the retention period
+        FitTelemetry.objects.filter(wall_time=10.0).update(created=timezone.now() - datetime.timedelta(days=100))
+        assert(fit_telemetry.prune_telemetry() == 1)
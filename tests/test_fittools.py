@@ -7,6 +7,7 @@ from tom_targets.models import Target, TargetExtra
 import numpy as np
 from os import getcwd, path
 from mop.toolbox import fittools
+from mop.toolbox import model_lightcurves
 from astropy.time import Time, TimeDelta, TimezoneInfo
 from astropy import units as u
 from astropy.table import Column, Table, QTable
@@ -125,6 +126,120 @@ class TestModelingTools(TestCase):
         for key in expected_keys:
             assert (key in model_params.keys())
 
+    def test_fit_pspl_omega2_warm_start(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (cold_params, cold_lightcurve, cold_status) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        previous_fit = {key: cold_params[key] for key in
+                        ['t0', 't0_error', 'u0', 'u0_error', 'tE', 'tE_error', 'red_chi2', 'fit_covariance']}
+        previous_fit['nfev_reference'] = cold_params['fit_nfev']
+
+        (warm_params, warm_lightcurve, warm_status) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets,
+                previous_fit=previous_fit)
+
+        assert(not cold_params['fit_warm_start'])
+        assert(warm_params['fit_warm_start'])
+        assert(warm_params['fit_nfev'] < cold_params['fit_nfev'])
+        assert(warm_params['fit_nfev_saved'] == cold_params['fit_nfev'] - warm_params['fit_nfev'])
+        np.testing.assert_allclose(warm_params['t0'], cold_params['t0'], atol=0.01)
+        np.testing.assert_allclose(warm_params['tE'], cold_params['tE'], rtol=0.01)
+        np.testing.assert_allclose(warm_params['chi2'], cold_params['chi2'], rtol=1e-3)
+
+        # A warm start which costs more than the reference should not report a negative saving
+        previous_fit['nfev_reference'] = 1
+        (warm_params, warm_lightcurve, warm_status) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets,
+                previous_fit=previous_fit)
+        assert(warm_params['fit_warm_start'])
+        assert(warm_params['fit_nfev_saved'] == 0)
+
+    def test_warm_start_settings(self):
+
+        previous_fit = {
+            't0': 2460065.1632, 't0_error': 0.003,
+            'u0': 0.71928, 'u0_error': 0.01,
+            'tE': 12.30278, 'tE_error': 0.2,
+            'fit_covariance': np.array([])
+        }
+        fit_parameters = OrderedDict(
+                [('t0', [0, [2457790.87823, 2460190.67737]]),
+                 ('u0', [1, [0.0, 2.0]]),
+                 ('tE', [2, [1.0, 1000.0]]),
+                 ('fsource_Tel_0', [3, (0.0, 5445.026528424209)]),
+                 ('ftotal_Tel_0', [4, (0.0, 5445.026528424209)])]
+        )
+
+        (guess, x_scale, fit_bounds) = fittools.warm_start_settings(previous_fit, fit_parameters)
+
+        np.testing.assert_allclose(guess, [2460065.1632, 0.71928, 12.30278])
+        np.testing.assert_allclose(x_scale, [0.003, 0.01, 0.2])
+
+        # The trust region should contain the starting values, respect the minimum widths
+        # and never exceed the standard boundaries
+        for i, key in enumerate(['t0', 'u0', 'tE']):
+            assert(fit_bounds[key][1][0] < guess[i] < fit_bounds[key][1][1])
+            assert(fit_bounds[key][1][0] >= fit_parameters[key][1][0])
+            assert(fit_bounds[key][1][1] <= fit_parameters[key][1][1])
+        assert(fit_bounds['t0'][1][1] - fit_bounds['t0'][1][0] >= 2.0)
+        assert(fit_bounds['fsource_Tel_0'][1] == list(fit_parameters['fsource_Tel_0'][1]))
+
+        # The standard boundaries should not be modified
+        assert(fit_parameters['t0'][1] == [2457790.87823, 2460190.67737])
+
+    def test_check_warm_start(self):
+
+        model_params = {
+            't0': 2460065.1632, 'u0': 0.71928, 'tE': 12.30278, 'chi2': 4760.658, 'red_chi2': 2.5,
+            'fit_parameters': OrderedDict(
+                [('t0', [0, [2457790.87823, 2460190.67737]]),
+                 ('u0', [1, [0.0, 2.0]]),
+                 ('tE', [2, [1.0, 1000.0]])]),
+            'fit_trust_region': OrderedDict(
+                [('t0', [0, [2460064.0, 2460066.0]]),
+                 ('u0', [1, [0.0, 2.0]]),
+                 ('tE', [2, [10.0, 15.0]])])
+        }
+        previous_fit = {'red_chi2': 2.4}
+
+        assert(fittools.check_warm_start(model_params, previous_fit))
+
+        # Solutions at the edge of the trust region should be rejected
+        test_params = model_params.copy()
+        test_params['tE'] = 15.0
+        assert(not fittools.check_warm_start(test_params, previous_fit))
+
+        # But not those at the standard boundaries, which apply equally to cold starts
+        test_params = model_params.copy()
+        test_params['u0'] = 0.0
+        assert(fittools.check_warm_start(test_params, previous_fit))
+
+        test_params = model_params.copy()
+        test_params['red_chi2'] = 10.0
+        assert(not fittools.check_warm_start(test_params, previous_fit))
+
+        test_params = model_params.copy()
+        test_params['t0'] = np.nan
+        assert(not fittools.check_warm_start(test_params, previous_fit))
+
+    def test_get_previous_fit(self):
+
+        target = self.params['target']
+        assert(target.get_previous_fit() is None)
+
+        target.store_model_parameters(self.params['model_params'])
+        target.store_parameter_set({'fit_warm_start': True, 'fit_nfev': 10, 'fit_nfev_saved': 40})
+
+        previous_fit = target.get_previous_fit()
+
+        assert(previous_fit['t0'] == self.params['model_params']['t0'])
+        assert(previous_fit['tE'] == self.params['model_params']['tE'])
+        assert(previous_fit['fit_covariance'].shape == (5, 5))
+        assert(previous_fit['nfev_reference'] == 50)
+
     def test_repackage_lightcurves(self):
 
         (datasets, ndata) = fittools.repackage_lightcurves(self.params['photometry'])
@@ -144,7 +259,9 @@ class TestModelingTools(TestCase):
 
     def test_store_model_lightcurve(self):
 
-        fittools.store_model_lightcurve(self.params['target'], self.params['pylima_model'])
+        times = np.linspace(2460000.0, 2460500.0, 500)
+        mags = np.random.normal(loc=18.0, scale=0.5, size=len(times))
+        fittools.store_model_lightcurve(self.params['target'], np.c_[times, mags])
 
         qs = ReducedDatum.objects.filter(
             source_name='MOP',
@@ -153,6 +270,10 @@ class TestModelingTools(TestCase):
         )
 
         assert(qs.count() > 0)
+
+        (model_times, model_mags) = model_lightcurves.decode_model_lightcurve(qs[0].value)
+        np.testing.assert_allclose(model_times, times, atol=1e-3)
+        np.testing.assert_allclose(model_mags, mags, atol=1e-5)
         
     def test_event_alive(self):
         t0_fit = Time.now() + TimeDelta(2.0*u.day)
@@ -227,11 +348,18 @@ class TestModelingTools(TestCase):
             'source_magnitude', 'source_mag_error',
             'blend_magnitude', 'blend_mag_error',
             'baseline_magnitude', 'baseline_mag_error',
-            'fit_covariance', 'chi2', 'red_chi2'
+            'fit_covariance', 'chi2', 'red_chi2',
+            'sw_test', 'ad_test', 'ks_test', 'chi2_dof'
         ]
         for key in expected_keys:
             assert(key in model_params.keys())
 
+        # The statistics should be consistent with pyLIMA's own chi2, and cached on the fit object
+        (chi2, pyLIMA_parameters) = model_fit.model_chi2(model_fit.fit_results['best_model'])
+        np.testing.assert_allclose(model_params['chi2'], chi2, atol=1e-3)
+        assert(not np.isnan(model_params['sw_test']))
+        assert('fit_statistics' in model_fit.fit_results.keys())
+
     def test_test_quality_of_model_fit(self):
 
         result = fittools.test_quality_of_model_fit(self.params['model_params'])
@@ -258,18 +386,19 @@ class TestModelingTools(TestCase):
         # Load test dataset
         datasets = self.load_test_photometry(self.params['lightcurve_file'])
 
-        # Create PyLIMA event object with data
-        pevent = self.params['pylima_event']
-        tel_list = fittools.pylima_telescopes_from_datasets(datasets)
-        for tel in tel_list:
-            pevent.telescopes.append(tel)
-
         # Generate a model lightcurve
-        model_tel = fittools.generate_model_lightcurve(pevent,
-                                                       self.params['model_params'])
-
-        assert(len(model_tel.lightcurve_magnitude) > 0)
-        assert(model_tel.lightcurve_magnitude.colnames == ['time', 'mag', 'err_mag'])
+        model_lc = fittools.generate_model_lightcurve(self.params['model_params'], datasets)
+
+        assert(model_lc.shape[1] == 2)
+        assert(len(model_lc) > 0)
+        assert((np.diff(model_lc[:,0]) > 0.0).all())
+
+        # The model should span both the data and the event itself
+        t0 = self.params['model_params']['t0']
+        tE = self.params['model_params']['tE']
+        assert(model_lc[0,0] <= min(datasets['I'][:,0].min(), t0 - 5.0 * tE))
+        assert(model_lc[-1,0] >= max(datasets['I'][:,0].max(), t0 + 5.0 * tE))
+        assert(model_lc[:,1].min() < self.params['model_params']['baseline_magnitude'])
 
 
 def generate_test_ReducedDatums(target, tel_configs, source_name='OGLE'):
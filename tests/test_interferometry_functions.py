@@ -81,18 +81,13 @@ class TestInterferomeinterferometry_predictiontryFunctions(TestCase):
         lc[:,1].fill(16.5)
         lc[50:75,1].fill(13.2)
         self.params['lc'] = lc
-        model_time = datetime.strptime('2018-06-29 08:15:27.243860', '%Y-%m-%d %H:%M:%S.%f')
-        rd, created = ReducedDatum.objects.get_or_create(
-            timestamp=model_time,
-            value={
-            'lc_model_time': lc[:,0].tolist(),
-            'lc_model_magnitude': lc[:,1].tolist()
-            },
-            source_name='MOP',
-            source_location=self.st.name,
-            data_type='lc_model',
-            target=self.st
-        )
+
+        # Model parameters from which the model lightcurve of the target is evaluated
+        self.st.t0 = lc[50,0]
+        self.st.tE = 20.0
+        self.st.source_magnitude = self.st.baseline_magnitude
+        self.st.blend_magnitude = 0.0
+        self.st.save()
 
     def test_convert_Gmag_to_JHK(self):
 
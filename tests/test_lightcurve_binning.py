@@ -0,0 +1,59 @@
+from django.test import TestCase
+import numpy as np
+from mop.toolbox import lightcurve_binning, fittools, synthetic_lightcurves
+
+
+class TestLightcurveBinning(TestCase):
+    def setUp(self):
+        self.events = synthetic_lightcurves.generate_event_set(1, seed=11, ndata=3000,
+                                                               telescopes=('I', 'gp'), duration=1000.0)
+
+    def test_bin_lightcurve(self):
+        # Two nights of data with different uncertainties
+        lightcurve = np.array([
+            [2460000.6, 18.0, 0.01],
+            [2460000.7, 18.1, 0.02],
+            [2460001.6, 17.5, 0.05],
+            [2460001.7, 17.7, 0.05],
+            [2460001.8, 17.0, 0.05]
+        ])
+        binned = lightcurve_binning.bin_lightcurve(lightcurve, window=1.0)
+        assert(len(binned) == 2)
+
+        # Inverse-variance weighted mean
+        w = np.array([1.0 / 0.01 ** 2, 1.0 / 0.02 ** 2])
+        np.testing.assert_allclose(binned[0, 0], np.sum(w * lightcurve[0:2, 0]) / w.sum())
+        np.testing.assert_allclose(binned[0, 1], np.sum(w * lightcurve[0:2, 1]) / w.sum())
+        np.testing.assert_allclose(binned[0, 2], 1.0 / np.sqrt(w.sum()))
+        np.testing.assert_allclose(binned[1, 2], 0.05 / np.sqrt(3.0))
+
+        # Datapoints to be kept should be returned unbinned
+        keep = np.array([False, False, False, False, True])
+        binned = lightcurve_binning.bin_lightcurve(lightcurve, window=1.0, keep=keep)
+        assert(len(binned) == 3)
+        np.testing.assert_allclose(binned[-1], lightcurve[-1])
+
+    def test_bin_baseline(self):
+        event = self.events[0]
+        (t0, tE) = (event['params']['t0'], event['params']['tE'])
+        (binned, ndata) = lightcurve_binning.bin_baseline(event['datasets'], t0, tE, tE_multiple=3.0)
+
+        assert(ndata < sum([len(lc) for lc in event['datasets'].values()]))
+        for name, lc in event['datasets'].items():
+            peak = np.abs(lc[:, 0] - t0) <= 3.0 * tE
+            binned_peak = np.abs(binned[name][:, 0] - t0) <= 3.0 * tE
+            assert(binned_peak.sum() >= peak.sum())
+
+    def test_fit_binned(self):
+        event = self.events[0]
+        (params, model_lightcurve, status) = fittools.fit_pspl_omega2(
+            0.0, 0.0, event['datasets'], backend='numpy')
+        (binned_params, model_lightcurve, status) = fittools.fit_pspl_omega2(
+            0.0, 0.0, event['datasets'], backend='numpy', binning={'window': 1.0, 'tE_multiple': 3.0})
+
+        # The binned fit should recover the parameters of the unbinned fit within their uncertainties
+        for key in ['t0', 'u0', 'tE']:
+            assert(np.abs(binned_params[key] - params[key]) < 2.0 * params[key + '_error'])
+
+        # The model lightcurve should still cover the full range of the data
+        assert(model_lightcurve[0, 0] <= event['datasets']['I'][:, 0].min())
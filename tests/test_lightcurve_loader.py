@@ -0,0 +1,83 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+import datetime
+from mop.toolbox import lightcurve_loader
+from mop.toolbox import querytools
+
+
+class TestLightcurveLoader(TestCase):
+    def setUp(self):
+        self.target = Target.objects.create(name='Gaia23abc', ra=271.1925, dec=-28.3164)
+        tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        rng = np.random.default_rng(3)
+        for i in range(30):
+            ts = tstart + TimeDelta(i * 0.731 * u.day)
+            PhotometryReducedDatum.objects.create(
+                timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+                source_name=['Gaia', 'OGLE', 'Interferometry_predictor'][i % 3],
+                source_location=self.target.name,
+                target=self.target,
+                bandpass=['G', 'I', 'I'][i % 3],
+                brightness=rng.normal(18.0, 0.01),
+                brightness_error=None if i == 4 else 0.01)
+
+    def test_datetimes_to_jd(self):
+        timestamps = [datetime.datetime(2024, 5, 17, 3, 25, 41, 123456, tzinfo=datetime.timezone.utc),
+                      datetime.datetime(2024, 5, 17, 3, 25, 41, 123456),
+                      datetime.datetime(2019, 1, 1, 12, 0, 0, tzinfo=TimezoneInfo(utc_offset=2 * u.hour)),
+                      datetime.datetime(2016, 12, 31, 18, 0, 0, tzinfo=datetime.timezone.utc)]
+        jd = lightcurve_loader.datetimes_to_jd(timestamps)
+
+        # The conversion should be identical to astropy's, including on the day of a leap second
+        np.testing.assert_array_equal(jd, [Time(ts).jd for ts in timestamps])
+        assert(jd[0] == jd[1])
+
+    def test_load_lightcurves(self):
+        qs = PhotometryReducedDatum.objects.filter(target=self.target).order_by('timestamp')
+        (datasets, ndata) = lightcurve_loader.load_lightcurves(qs)
+
+        # Each bandpass should contain the datapoints of the target's lightcurve in time order,
+        # excluding those from the interferometry predictor
+        assert(list(datasets.keys()) == ['G', 'I'])
+        assert(ndata == 20)
+        for rd in qs.exclude(source_name='Interferometry_predictor'):
+            lc = datasets[rd.bandpass]
+            i = np.argmin(np.abs(lc[:, 0] - Time(rd.timestamp).jd))
+            assert(lc[i, 0] == Time(rd.timestamp).jd)
+            assert(lc[i, 1] == rd.brightness)
+            assert(lc[i, 2] == (rd.brightness_error if rd.brightness_error else lightcurve_loader.DEFAULT_ERROR))
+        assert((np.diff(datasets['I'][:, 0]) > 0.0).all())
+
+        # The same lightcurves should be loaded from the streamed datapoints and from model instances
+        (mulens, photometry) = list(querytools.stream_photometry_for_targetset([self.target]))[0]
+        for source in [photometry, list(qs)]:
+            (datasets2, ndata2) = lightcurve_loader.load_lightcurves(source)
+            assert(ndata2 == ndata)
+            for passband, lc in datasets.items():
+                assert(np.array_equal(datasets2[passband], lc))
+
+        # The first and last observations are taken from the lightcurves
+        mulens.get_reduced_data(qs, ReducedDatum.objects.filter(target=mulens))
+        assert(mulens.first_observation == datasets['G'][0, 0])
+        assert(mulens.last_observation == datasets['I'][-1, 0])
+
+        # The fingerprint should match that of the lightcurves built with a Time for each datapoint,
+        # as before the loader was introduced, so that no event is refitted because of the conversion
+        fingerprint = mulens.fingerprint
+        legacy = {}
+        for rd in qs.exclude(source_name='Interferometry_predictor'):
+            legacy.setdefault(rd.bandpass, []).append(
+                [Time(rd.timestamp).jd, rd.brightness,
+                 rd.brightness_error if rd.brightness_error else lightcurve_loader.DEFAULT_ERROR])
+        mulens.datasets = {passband: np.array(lc) for passband, lc in legacy.items()}
+        assert(mulens.compute_photometry_fingerprint() == fingerprint)
+
+        # Targets without photometry should have no lightcurves
+        target2 = Target.objects.create(name='Gaia23abd', ra=271.1925, dec=-28.3164)
+        (datasets, ndata) = lightcurve_loader.load_lightcurves(PhotometryReducedDatum.objects.filter(target=target2))
+        assert(datasets == {})
+        assert(ndata == 0)
@@ -0,0 +1,110 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+import tempfile
+import os
+from mop.toolbox import lightcurve_snapshot
+from mop.toolbox import lightcurve_loader
+from mop.toolbox import querytools
+
+
+class TestLightcurveSnapshot(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = self.tmpdir.name
+        self.tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        self.rng = np.random.default_rng(13)
+        self.targets = []
+        for j, npts in enumerate([12, 0, 20]):
+            target = Target.objects.create(name='Gaia23abc' + str(j), ra=271.1925, dec=-28.3164)
+            self.targets.append(target)
+            for i in range(npts):
+                self.add_datapoint(target, i * 1.0, ['G', 'I'][i % 2])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def add_datapoint(self, target, dt, bandpass):
+        ts = self.tstart + TimeDelta(dt * u.day)
+        PhotometryReducedDatum.objects.create(
+            timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+            source_name='Gaia',
+            source_location=target.name,
+            target=target,
+            bandpass=bandpass,
+            brightness=self.rng.normal(18.0, 0.01),
+            brightness_error=0.01)
+
+    def assert_snapshot_current(self, snapshot, target):
+        (expected, ndata) = lightcurve_loader.load_lightcurves(
+            PhotometryReducedDatum.objects.filter(target=target).order_by('timestamp'))
+        (datasets, ndata2) = snapshot.get_lightcurves(target)
+        assert(ndata2 == ndata)
+        assert(list(datasets.keys()) == list(expected.keys()))
+        for bandpass, lc in expected.items():
+            np.testing.assert_array_equal(datasets[bandpass], lc)
+
+    def test_refresh_snapshot(self):
+        summary = lightcurve_snapshot.refresh_snapshot(path=self.path)
+        assert(summary['ntargets'] == 3)
+        assert(summary['nupdated'] == 3)
+        assert(summary['ndata'] == 32)
+
+        # The lightcurves should be read-only views of the memory-mapped snapshot
+        snapshot = lightcurve_snapshot.LightcurveSnapshot(self.path)
+        for target in self.targets:
+            self.assert_snapshot_current(snapshot, target)
+        (datasets, ndata) = snapshot.get_lightcurves(self.targets[2])
+        assert(not datasets['G'].flags.writeable)
+        assert(np.shares_memory(datasets['G'], snapshot.get_segment(0)))
+
+        # Only the lightcurves of targets whose photometry has changed should be rewritten
+        assert(lightcurve_snapshot.refresh_snapshot(path=self.path)['nupdated'] == 0)
+        self.add_datapoint(self.targets[0], 30.0, 'I')
+        summary = lightcurve_snapshot.refresh_snapshot(path=self.path)
+        assert(summary['nupdated'] == 1)
+        assert(summary['nsegments'] == 2)
+        self.assert_snapshot_current(lightcurve_snapshot.LightcurveSnapshot(self.path), self.targets[0])
+
+        # A snapshot opened earlier should continue to return the lightcurves it was opened with
+        (datasets, ndata) = snapshot.get_lightcurves(self.targets[0])
+        assert(ndata == 12)
+
+        # Targets which are no longer alive should be dropped, and the superseded data compacted
+        Target.objects.filter(pk=self.targets[2].pk).update(alive=False)
+        summary = lightcurve_snapshot.refresh_snapshot(path=self.path)
+        assert(summary['nremoved'] == 1)
+        assert(summary['compacted'])
+        assert(summary['nsegments'] == 1)
+        assert(len([f for f in os.listdir(self.path) if f.startswith('segment_')]) == 1)
+        snapshot = lightcurve_snapshot.LightcurveSnapshot(self.path)
+        assert(self.targets[2] not in snapshot)
+        self.assert_snapshot_current(snapshot, self.targets[0])
+
+    def test_stream_lightcurves_for_targetset(self):
+        lightcurve_snapshot.refresh_snapshot(path=self.path)
+        snapshot = lightcurve_snapshot.open_snapshot(self.path)
+        self.add_datapoint(self.targets[2], 40.0, 'G')
+
+        # Lightcurves should be read from the snapshot unless they have changed since it was written
+        results = list(querytools.stream_lightcurves_for_targetset(self.targets, snapshot=snapshot))
+        assert([mulens.pk for (mulens, photometry, datasets) in results] == [t.pk for t in self.targets])
+        assert(results[0][1] is None and results[0][2] is not None)
+        assert(results[2][1] is not None and results[2][2] is None)
+
+        # The targets should be loaded identically from the snapshot and the database
+        target_data = querytools.fetch_data_for_targetset(self.targets, check_need_to_fit=False)
+        fingerprints = {name: mulens.fingerprint for name, mulens in target_data.items()}
+        target_data = querytools.fetch_data_for_targetset(self.targets, check_need_to_fit=False, snapshot=snapshot)
+        assert({name: mulens.fingerprint for name, mulens in target_data.items()} == fingerprints)
+        assert(target_data[self.targets[2].name].ndata == 21)
+
+        # Once the snapshot is current, no photometry should be read from the database
+        lightcurve_snapshot.refresh_snapshot(path=self.path)
+        snapshot = lightcurve_snapshot.open_snapshot(self.path)
+        with self.assertNumQueries(4):
+            querytools.fetch_data_for_targetset(self.targets, check_need_to_fit=False, snapshot=snapshot)
+        assert(lightcurve_snapshot.open_snapshot(os.path.join(self.path, 'missing')) is None)
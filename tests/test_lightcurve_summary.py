@@ -0,0 +1,125 @@
+from django.test import TestCase
+from django.core.management import call_command
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from microlensing_targets.models import LightcurveSummary
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+from mop.toolbox import lightcurve_summary
+from mop.toolbox import packed_lightcurves
+from mop.toolbox import TAP
+
+
+class TestLightcurveSummary(TestCase):
+    def setUp(self):
+        self.target = Target.objects.create(name='Gaia23abc', ra=271.1925, dec=-28.3164)
+        self.tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        for i in range(30):
+            self.add_datapoint(i * 0.5, ['G', 'I', 'I'][i % 3], ['Gaia', 'OGLE', 'KMTNet'][i % 3],
+                               18.0 - 0.1 * i if i < 10 else 18.0)
+
+    def add_datapoint(self, dt, bandpass, source_name, mag):
+        ts = self.tstart + TimeDelta(dt * u.day)
+        return PhotometryReducedDatum.objects.create(
+            timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+            source_name=source_name,
+            source_location=self.target.name,
+            target=self.target,
+            bandpass=bandpass,
+            brightness=mag,
+            brightness_error=0.01)
+
+    def assert_summary_current(self, bandpass):
+        qs = PhotometryReducedDatum.objects.filter(target=self.target)
+        if bandpass:
+            qs = qs.filter(bandpass=bandpass)
+        jd = np.array([Time(rd.timestamp).jd for rd in qs])
+        mag = np.array([rd.brightness for rd in qs])
+        expected = lightcurve_summary.summarize_lightcurve(jd, mag)
+
+        summary = LightcurveSummary.objects.get(target=self.target, bandpass=bandpass)
+        for key, value in expected.items():
+            assert(getattr(summary, key) == value)
+
+    def test_summarize_lightcurve(self):
+        jd = np.array([2460000.5, 2460001.5, 2460002.5, 2460003.5, 2460004.5])
+        mag = np.array([18.0, 17.0, 15.0, -99.0, 18.2])
+        stats = lightcurve_summary.summarize_lightcurve(jd, mag)
+
+        # Invalid magnitudes should be counted as datapoints but excluded from the magnitude statistics
+        assert(stats['ndata'] == 5)
+        assert(stats['first_jd'] == 2460000.5 and stats['last_jd'] == 2460004.5)
+        assert(stats['mag_min'] == 15.0 and stats['mag_max'] == 18.2)
+        assert(stats['mag_median'] == 17.5)
+        assert(stats['mag_baseline'] == 18.1)
+
+        stats = lightcurve_summary.summarize_lightcurve(np.zeros(0), np.zeros(0))
+        assert(stats['ndata'] == 0 and stats['last_jd'] is None and stats['mag_min'] is None)
+
+    def test_refresh_lightcurve_summaries(self):
+        # Summaries should be stored for each bandpass and for all of the target's photometry
+        packed_lightcurves.refresh_packed_lightcurves(self.target)
+        assert(set(LightcurveSummary.objects.filter(target=self.target).values_list('bandpass', flat=True))
+               == {'', 'G', 'I'})
+        for bandpass in ['', 'G', 'I']:
+            self.assert_summary_current(bandpass)
+
+        # New photometry should only update the summaries of the bandpass it belongs to
+        updated = dict(LightcurveSummary.objects.filter(target=self.target).values_list('bandpass', 'updated'))
+        self.add_datapoint(20.0, 'I', 'OGLE', 14.5)
+        packed_lightcurves.refresh_packed_lightcurves(self.target)
+        for bandpass in ['', 'G', 'I']:
+            self.assert_summary_current(bandpass)
+        summary = LightcurveSummary.objects.get(target=self.target, bandpass='G')
+        assert(summary.updated == updated['G'])
+
+        # Summaries which are up to date should be read in a single query
+        with self.assertNumQueries(1):
+            summary = lightcurve_summary.get_current_summary(self.target)
+        assert(summary.ndata == 31)
+        assert(summary.mag_min == 14.5)
+
+        # Photometry inserted in bulk, e.g. by a data processor, should make the summaries stale, so
+        # that the time of the last datapoint is read from the DB, without writing to it
+        timestamp = (self.tstart + TimeDelta(25.0 * u.day)).to_datetime(timezone=TimezoneInfo())
+        PhotometryReducedDatum.objects.bulk_create([PhotometryReducedDatum(
+            timestamp=timestamp, source_name='LCO', source_location=self.target.name, target=self.target,
+            bandpass='gp', brightness=14.0, brightness_error=0.02)])
+        assert(lightcurve_summary.get_current_summary(self.target) is None)
+        assert(lightcurve_summary.get_current_summary(self.target, bandpass='I') is not None)
+        assert(packed_lightcurves.current_summary_targets([self.target]) == set())
+        (last_jd, last_ts) = TAP.TAP_time_last_datapoint(self.target)
+        assert(last_jd == Time(timestamp).jd)
+        assert(not LightcurveSummary.objects.filter(target=self.target, bandpass='gp').exists())
+        assert(LightcurveSummary.objects.get(target=self.target, bandpass='').ndata == 31)
+
+        # The summaries should then be brought up to date by the backfill
+        call_command('backfill_lightcurve_summaries', 'all')
+        assert(packed_lightcurves.current_summary_targets([self.target]) == {self.target.pk})
+        for bandpass in ['', 'G', 'I', 'gp']:
+            self.assert_summary_current(bandpass)
+        summary = lightcurve_summary.get_current_summary(self.target)
+        assert(summary.ndata == 32)
+        assert(summary.mag_min == 14.0)
+
+        # Summaries of bandpasses with no remaining photometry should be removed on rebuild
+        PhotometryReducedDatum.objects.filter(target=self.target, bandpass='G').delete()
+        packed_lightcurves.rebuild_packed_lightcurves(self.target)
+        assert(set(LightcurveSummary.objects.filter(target=self.target).values_list('bandpass', flat=True))
+               == {'', 'I', 'gp'})
+        self.assert_summary_current('')
+        assert(lightcurve_summary.get_current_summary(self.target, bandpass='G') is None)
+
+    def test_backfill_lightcurve_summaries(self):
+        # Targets whose packed lightcurves were made before the summaries were introduced should
+        # be given summaries, while those without photometry need none
+        empty = Target.objects.create(name='Gaia23abd', ra=271.1925, dec=-28.3164)
+        packed_lightcurves.refresh_packed_lightcurves(self.target)
+        LightcurveSummary.objects.all().delete()
+        assert(packed_lightcurves.current_summary_targets(Target.objects.all()) == {empty.pk})
+
+        call_command('backfill_lightcurve_summaries', 'all', chunk_size=1)
+        for bandpass in ['', 'G', 'I']:
+            self.assert_summary_current(bandpass)
+        assert(len(packed_lightcurves.current_summary_targets(Target.objects.all())) == 2)
@@ -0,0 +1,75 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
+import numpy as np
+from mop.toolbox import model_evaluation
+from mop.toolbox import fittools
+from mop.toolbox import pspl_tools
+from mop.toolbox import model_lightcurves
+
+
+class TestModelEvaluation(TestCase):
+    def setUp(self):
+        self.model_params = {
+            't0': 2460100.0,
+            'u0': 0.05,
+            'tE': 30.0,
+            'source_magnitude': 19.0,
+            'blend_magnitude': 18.5,
+            'last_fit': 2460120.0
+        }
+        self.target = Target.objects.create(name='Gaia23abc', ra=271.1925, dec=-28.3164)
+        for key, value in self.model_params.items():
+            setattr(self.target, key, value)
+        self.target.save()
+        model_evaluation.clear_cache()
+
+    def test_evaluate_model(self):
+        times = np.linspace(2460000.0, 2460200.0, 1000)
+        mags = model_evaluation.evaluate_model(self.target, times)
+
+        # The model should be that of the lightcurve generated when the target was fitted
+        fitted_lc = fittools.generate_model_lightcurve(self.model_params, {})
+        np.testing.assert_allclose(mags, np.interp(times, fitted_lc[:,0], fitted_lc[:,1]), atol=2e-3)
+        baseline = pspl_tools.flux_to_magnitude(pspl_tools.magnitude_to_flux(19.0)
+                                                + pspl_tools.magnitude_to_flux(18.5))
+        assert(abs(model_evaluation.evaluate_model(self.target, 2450000.0) - baseline) < 1e-6)
+
+        # Targets which have not been fitted have no model
+        target2 = Target.objects.create(name='Gaia23abd', ra=271.1925, dec=-28.3164)
+        assert(model_evaluation.evaluate_model(target2, times) is None)
+        assert(model_evaluation.model_lightcurve(target2) == (None, None))
+
+    def test_model_lightcurve_cache(self):
+        (times, mags) = model_evaluation.model_lightcurve(self.target)
+        np.testing.assert_allclose(mags, model_evaluation.evaluate_model(self.target, times))
+        assert(times[0] == self.model_params['t0'] - 5.0 * self.model_params['tE'])
+        assert(not mags.flags.writeable)
+
+        # Repeated requests for the same fit should be served from the cache
+        (times2, mags2) = model_evaluation.model_lightcurve(Target.objects.get(pk=self.target.pk))
+        assert(mags2 is mags)
+        assert(model_evaluation.cache_info().hits == 1)
+
+        # Refitting the target should invalidate its cached lightcurve
+        self.target.u0 = 0.2
+        self.target.last_fit = 2460130.0
+        self.target.save()
+        (times3, mags3) = model_evaluation.model_lightcurve(self.target)
+        assert(mags3.min() > mags.min())
+        assert(model_evaluation.cache_info().misses == 2)
+
+    def test_get_reduced_data_model(self):
+        model_lc = fittools.generate_model_lightcurve(self.model_params, {})
+        self.target.existing_model = None
+        fittools.store_model_lightcurve(self.target, model_lc)
+
+        # The stored model is identified without loading its value, and is updated by a refit
+        self.target.get_reduced_data(PhotometryReducedDatum.objects.filter(target=self.target),
+                                     ReducedDatum.objects.filter(target=self.target))
+        assert('value' in self.target.existing_model.get_deferred_fields())
+        fittools.store_model_lightcurve(self.target, model_lc[::2])
+        qs = ReducedDatum.objects.filter(target=self.target, data_type='lc_model')
+        assert(qs.count() == 1)
+        (times, mags) = model_lightcurves.decode_model_lightcurve(qs[0].value)
+        assert(len(times) < len(model_lc))
@@ -0,0 +1,66 @@
+from django.test import TestCase
+import numpy as np
+import json
+from mop.toolbox import model_lightcurves
+from mop.toolbox import pspl_tools
+
+
+class TestModelLightcurves(TestCase):
+    def setUp(self):
+        self.params = {
+            't0': 2460100.0,
+            'u0': 0.01,
+            'tE': 30.0,
+            'fsource': pspl_tools.magnitude_to_flux(19.0),
+            'ftotal': pspl_tools.magnitude_to_flux(18.0),
+            'tmin': 2458000.0,
+            'tmax': 2461000.0
+        }
+
+    def model_magnitude(self, t):
+        A = pspl_tools.pspl_magnification(t, self.params['t0'], self.params['u0'], self.params['tE'])
+        return pspl_tools.flux_to_magnitude(self.params['fsource'] * (A - 1.0) + self.params['ftotal'])
+
+    def test_sample_pspl_lightcurve(self):
+        for max_error in [0.01, 0.001]:
+            (times, mags) = model_lightcurves.sample_pspl_lightcurve(
+                self.params['t0'], self.params['u0'], self.params['tE'],
+                self.params['fsource'], self.params['ftotal'],
+                self.params['tmin'], self.params['tmax'], max_error=max_error)
+
+            assert(times[0] == self.params['tmin'])
+            assert(times[-1] == self.params['tmax'])
+            assert((np.diff(times) > 0.0).all())
+            np.testing.assert_allclose(mags, self.model_magnitude(times))
+
+            # Interpolating the sampled points should reproduce the model everywhere
+            test_times = np.linspace(self.params['tmin'], self.params['tmax'], 500000)
+            interp_error = np.abs(np.interp(test_times, times, mags) - self.model_magnitude(test_times))
+            assert(interp_error.max() < 2.0 * max_error)
+
+            # The sampling should be densest around the peak
+            near_peak = np.abs(times - self.params['t0']) < self.params['tE']
+            assert(near_peak.sum() > (~near_peak).sum())
+
+            # A uniform grid with the resolution required at the peak would need ~10^6 points
+            assert(len(times) < 1000)
+
+    def test_encode_model_lightcurve(self):
+        (times, mags) = model_lightcurves.sample_pspl_lightcurve(
+            self.params['t0'], self.params['u0'], self.params['tE'],
+            self.params['fsource'], self.params['ftotal'],
+            self.params['tmin'], self.params['tmax'])
+
+        value = model_lightcurves.encode_model_lightcurve(times, mags)
+        legacy_value = {'lc_model_time': times.tolist(), 'lc_model_magnitude': mags.tolist()}
+
+        assert(len(json.dumps(value)) < 0.5 * len(json.dumps(legacy_value)))
+
+        (test_times, test_mags) = model_lightcurves.decode_model_lightcurve(json.loads(json.dumps(value)))
+        np.testing.assert_allclose(test_times, times, atol=1e-3)
+        np.testing.assert_allclose(test_mags, mags, atol=1e-5)
+
+        # Lightcurves stored in the original list format must remain readable
+        (test_times, test_mags) = model_lightcurves.decode_model_lightcurve(legacy_value)
+        np.testing.assert_array_equal(test_times, times)
+        np.testing.assert_array_equal(test_mags, mags)
@@ -0,0 +1,90 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from microlensing_targets.models import StalenessCheck
+from mop.toolbox import model_staleness
+from mop.toolbox import pspl_tools
+import numpy as np
+
+
+class TestModelStaleness(TestCase):
+    def setUp(self):
+        self.model_params = {
+            't0': 2460100.0,
+            'u0': 0.1,
+            'tE': 20.0,
+            'source_magnitude': 18.0,
+            'blend_magnitude': 19.0,
+            'last_fit': 2460090.0
+        }
+        self.target = Target.objects.create(name='Gaia24abc', ra=271.1925, dec=-28.3164)
+        for key, value in self.model_params.items():
+            setattr(self.target, key, value)
+        self.target.save()
+        self.rng = np.random.default_rng(7)
+        self.reset_lightcurve()
+
+    def reset_lightcurve(self):
+        # Lightcurve fitted at the time of the last fit, sampled twice per night
+        self.target.datasets = {'I': self.simulate(np.arange(2460000.0, 2460090.0, 0.5))}
+        self.target.last_observation = 2460089.5
+        self.target.fingerprint = self.target.compute_photometry_fingerprint()
+        self.target.fit_fingerprint = self.target.fingerprint
+        self.target.save()
+
+    def simulate(self, times, t0=None):
+        A = pspl_tools.pspl_magnification(times, t0 if t0 else self.model_params['t0'],
+                                          self.model_params['u0'], self.model_params['tE'])
+        flux = pspl_tools.magnitude_to_flux(18.0) * A + pspl_tools.magnitude_to_flux(19.0)
+        mags = pspl_tools.flux_to_magnitude(flux) + self.rng.normal(0.0, 0.01, len(times))
+
+        return np.c_[times, mags, np.full(len(times), 0.01)]
+
+    def add_datapoints(self, lc):
+        self.target.datasets = {'I': np.r_[self.target.datasets['I'], lc]}
+        self.target.last_observation = lc[:, 0].max()
+        self.target.fingerprint = self.target.compute_photometry_fingerprint()
+
+    def test_check_model_staleness(self):
+        # New datapoints predicted by the model should not require a refit
+        self.add_datapoints(self.simulate(np.arange(2460090.0, 2460096.0, 0.5)))
+        result = model_staleness.check_model_staleness(self.target)
+        assert(not result['refit'])
+        assert(result['nnew'] == 12)
+        assert(result['p_value'] > model_staleness.P_THRESHOLD)
+
+        # New datapoints around a peak earlier than predicted should require a refit
+        self.reset_lightcurve()
+        self.add_datapoints(self.simulate(np.arange(2460090.0, 2460096.0, 0.5), t0=2460098.0))
+        result = model_staleness.check_model_staleness(self.target)
+        assert(result['refit'])
+        assert(result['t0_shift'] > model_staleness.SHIFT_THRESHOLD)
+
+        # Revisions to the datapoints already fitted cannot be tested against the model
+        self.reset_lightcurve()
+        self.target.datasets = {'I': self.target.datasets['I'][1:]}
+        result = model_staleness.check_model_staleness(self.target)
+        assert(result['refit'])
+        assert(result['reason'] == 'Photometry revised since last fit')
+
+    def test_apply_staleness_gate(self):
+        self.add_datapoints(self.simulate(np.arange(2460090.0, 2460092.0, 0.5)))
+        assert(not model_staleness.apply_staleness_gate(self.target, 2460092.0))
+
+        # The fit records are advanced as if the event had been refitted, but the model anchored
+        # to the data it was fitted to, so that later datapoints are tested cumulatively
+        target = Target.objects.get(pk=self.target.pk)
+        assert(target.last_fit == 2460092.0)
+        assert(target.u0 == self.model_params['u0'])
+        target.fingerprint = self.target.fingerprint
+        assert(target.check_fingerprint())
+        assert(target.fit_fingerprint['model']['counts'] == {'I': 180})
+
+        self.add_datapoints(self.simulate(np.arange(2460092.0, 2460096.0, 0.5), t0=2460098.0))
+        target.datasets = self.target.datasets
+        target.fingerprint = self.target.fingerprint
+        target.last_observation = self.target.last_observation
+        assert(model_staleness.apply_staleness_gate(target, 2460096.0))
+
+        summary = model_staleness.staleness_summary(StalenessCheck.objects.filter(target=target))
+        assert(summary['nchecks'] == 2)
+        assert(summary['fraction_avoided'] == 0.5)
@@ -0,0 +1,106 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import PhotometryReducedDatum
+from microlensing_targets.models import PackedLightcurve
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+from mop.toolbox import packed_lightcurves
+from mop.toolbox import lightcurve_loader
+
+
+class TestPackedLightcurves(TestCase):
+    def setUp(self):
+        self.target = Target.objects.create(name='Gaia23abc', ra=271.1925, dec=-28.3164)
+        self.tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        self.rng = np.random.default_rng(11)
+        for i in range(30):
+            self.add_datapoint(i * 0.5, ['G', 'I', 'I'][i % 3], ['Gaia', 'OGLE', 'KMTNet'][i % 3])
+
+    def add_datapoint(self, dt, bandpass, source_name):
+        ts = self.tstart + TimeDelta(dt * u.day)
+        return PhotometryReducedDatum.objects.create(
+            timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+            source_name=source_name,
+            source_location=self.target.name,
+            target=self.target,
+            bandpass=bandpass,
+            brightness=self.rng.normal(18.0, 0.01),
+            brightness_error=0.01)
+
+    def assert_lightcurves_equal(self, datasets):
+        (expected, ndata) = lightcurve_loader.load_lightcurves(
+            PhotometryReducedDatum.objects.filter(target=self.target).order_by('timestamp'))
+        assert(list(datasets.keys()) == list(expected.keys()))
+        for bandpass, lc in expected.items():
+            np.testing.assert_array_equal(datasets[bandpass], lc)
+
+    def test_refresh_packed_lightcurves(self):
+        # One packed lightcurve should be stored for each bandpass and source
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == 30)
+        assert(PackedLightcurve.objects.filter(target=self.target).count() == 3)
+        (datasets, ndata) = packed_lightcurves.load_packed_lightcurves(self.target)
+        assert(ndata == 30)
+        self.assert_lightcurves_equal(datasets)
+
+        # New photometry should only update the packed lightcurve it belongs to
+        self.add_datapoint(0.25, 'I', 'KMTNet')
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == 1)
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == 0)
+        versions = dict(PackedLightcurve.objects.filter(target=self.target).values_list('source_name', 'version'))
+        assert(versions == {'Gaia': 1, 'OGLE': 1, 'KMTNet': 2})
+
+        # Photometry inserted in bulk, e.g. by a data processor, should be identified without reading the
+        # packed lightcurves, and added when they are next refreshed
+        PhotometryReducedDatum.objects.bulk_create([PhotometryReducedDatum(
+            timestamp=(self.tstart + TimeDelta(20.0 * u.day)).to_datetime(timezone=TimezoneInfo()),
+            source_name='LCO', source_location=self.target.name, target=self.target,
+            bandpass='gp', brightness=17.5, brightness_error=0.02)])
+        with self.assertNumQueries(2):
+            assert(packed_lightcurves.current_packed_targets([self.target]) == set())
+        (datasets, ndata) = packed_lightcurves.load_packed_lightcurves(self.target, refresh=True)
+        assert(ndata == 32)
+        self.assert_lightcurves_equal(datasets)
+        assert(packed_lightcurves.current_packed_targets([self.target]) == {self.target.pk})
+
+    def test_refresh_out_of_order(self):
+        # A datapoint committed after others with greater IDs, e.g. by a concurrent ingest, should be
+        # added to the packed lightcurve, which is rebuilt
+        rd = PhotometryReducedDatum.objects.filter(target=self.target, source_name='OGLE').order_by('pk').first()
+        rd.delete()
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == 29)
+        rd.save(force_insert=True)
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == 1)
+        assert(packed_lightcurves.check_packed_lightcurves(self.target) == {})
+        (datasets, ndata) = packed_lightcurves.load_packed_lightcurves(self.target)
+        self.assert_lightcurves_equal(datasets)
+
+        # Deleted datapoints should also be removed from the packed lightcurves
+        PhotometryReducedDatum.objects.filter(target=self.target, source_name='Gaia').first().delete()
+        assert(packed_lightcurves.refresh_packed_lightcurves(self.target) == -1)
+        assert(packed_lightcurves.check_packed_lightcurves(self.target) == {})
+
+    def test_check_packed_lightcurves(self):
+        packed_lightcurves.refresh_packed_lightcurves(self.target)
+        assert(packed_lightcurves.check_packed_lightcurves(self.target) == {})
+
+        # Revised or deleted datapoints should be identified as inconsistencies
+        rd = PhotometryReducedDatum.objects.filter(target=self.target, source_name='OGLE').first()
+        rd.brightness = 16.0
+        rd.save()
+        PhotometryReducedDatum.objects.filter(target=self.target, source_name='KMTNet').first().delete()
+        problems = packed_lightcurves.check_packed_lightcurves(self.target)
+        assert(problems[('I', 'OGLE')] == 'Packed datapoints differ from photometry')
+        assert(problems[('I', 'KMTNet')] == 'Packed 10 datapoints out of 9')
+        assert(('G', 'Gaia') not in problems)
+
+        PhotometryReducedDatum.objects.filter(target=self.target, source_name='Gaia').delete()
+        problems = packed_lightcurves.check_packed_lightcurves(self.target)
+        assert(problems[('G', 'Gaia')] == 'No photometry for packed lightcurve')
+
+        # Rebuilding the packed lightcurves should restore their consistency
+        assert(packed_lightcurves.rebuild_packed_lightcurves(self.target) == 2)
+        assert(packed_lightcurves.check_packed_lightcurves(self.target) == {})
+        assert(PackedLightcurve.objects.filter(target=self.target).count() == 2)
+        (datasets, ndata) = packed_lightcurves.load_packed_lightcurves(self.target, refresh=False)
+        self.assert_lightcurves_equal(datasets)
@@ -0,0 +1,82 @@
+from django.test import TestCase
+from tom_targets.models import Target
+from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+from mop.management.commands.fit_need_events_PSPL import run_fit
+
+
+class TestPhotometryFingerprint(TestCase):
+    def setUp(self):
+        self.target = Target.objects.create(
+            name='OGLE-2023-BLG-0348',
+            ra=271.1925,
+            dec=-28.3164
+        )
+        self.tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        rng = np.random.default_rng(3)
+        for bandpass, npts in [('I', 20), ('G', 5)]:
+            for i in range(npts):
+                ts = self.tstart + TimeDelta(i * 1.0 * u.day)
+                PhotometryReducedDatum.objects.create(
+                    timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+                    source_name='OGLE',
+                    source_location=self.target.name,
+                    target=self.target,
+                    bandpass=bandpass,
+                    brightness=rng.normal(18.0, 0.01),
+                    brightness_error=0.01)
+
+    def load_data(self, order='timestamp'):
+        self.target.get_reduced_data(
+            PhotometryReducedDatum.objects.filter(target=self.target).order_by(order),
+            ReducedDatum.objects.filter(target=self.target)
+        )
+
+    def test_compute_photometry_fingerprint(self):
+        self.load_data()
+        fingerprint = self.target.fingerprint
+
+        assert(fingerprint['counts'] == {'G': 5, 'I': 20})
+        np.testing.assert_allclose(fingerprint['max_jd'], (self.tstart + TimeDelta(19.0 * u.day)).jd)
+
+        # The fingerprint should not depend on the order of the data
+        self.load_data(order='-timestamp')
+        assert(self.target.fingerprint == fingerprint)
+
+    def test_check_need_to_fit(self):
+        self.load_data()
+
+        # Store the fingerprint as though it had been consumed by a model fit
+        self.target.store_model_parameters({'fit_fingerprint': self.target.fingerprint})
+        (status, reason) = self.target.check_need_to_fit()
+        assert(not status)
+        assert(self.target.check_fingerprint())
+
+        # A datapoint added with an old timestamp should still trigger a refit
+        ts = self.tstart + TimeDelta(2.5 * u.day)
+        PhotometryReducedDatum.objects.create(
+            timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+            source_name='OGLE',
+            source_location=self.target.name,
+            target=self.target,
+            bandpass='I',
+            brightness=18.0,
+            brightness_error=0.01)
+        self.load_data()
+        (status, reason) = self.target.check_need_to_fit()
+        assert(status)
+        assert(not self.target.check_fingerprint())
+
+    def test_run_fit_unchanged(self):
+        self.load_data()
+        self.target.store_model_parameters({'fit_fingerprint': self.target.fingerprint,
+                                            't0': 2460160.0, 'tE': 20.0, 'chi2': 1234.0})
+
+        # The fit should be skipped, leaving the stored model unchanged
+        result = run_fit(self.target)
+
+        t = Target.objects.get(name=self.target.name)
+        assert(result)
+        assert(t.chi2 == 1234.0)
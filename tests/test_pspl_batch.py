@@ -0,0 +1,72 @@
+from django.test import TestCase
+import numpy as np
+from mop.toolbox import pspl_tools, pspl_batch, fittools, synthetic_lightcurves
+
+
+class TestPSPLBatch(TestCase):
+    def setUp(self):
+        # Events with different numbers of datapoints and telescopes, to exercise the padding
+        self.events = synthetic_lightcurves.generate_event_set(2, seed=3, ndata=300, telescopes=('I', 'gp'))
+        self.events += synthetic_lightcurves.generate_event_set(2, seed=4, ndata=150, telescopes=('I',))
+        self.datasets = [
+            pspl_tools.PSPLDataset([lc for (name, lc) in fittools.select_lightcurves(event['datasets'])])
+            for event in self.events
+        ]
+        self.batch = pspl_batch.PSPLBatch(self.datasets)
+
+    def test_synthetic_events(self):
+        # The generator should be reproducible for a given seed
+        events = synthetic_lightcurves.generate_event_set(2, seed=3, ndata=300, telescopes=('I', 'gp'))
+        for event1, event2 in zip(events, self.events[0:2]):
+            assert(event1['params'] == event2['params'])
+            for name in ['I', 'gp']:
+                np.testing.assert_array_equal(event1['datasets'][name], event2['datasets'][name])
+                assert(np.all(np.diff(event1['datasets'][name][:, 0]) >= 0.0))
+
+    def test_batch_residuals_jacobian(self):
+        index = np.arange(self.batch.nevents)
+        params = np.zeros((self.batch.nevents, self.batch.max_params))
+        for i, ds in enumerate(self.datasets):
+            p = [self.events[i]['params']['t0'], 0.1, 20.0] \
+                + pspl_tools.solve_linear_fluxes(self.events[i]['params']['t0'], 0.1, 20.0, ds)
+            params[i, 0:len(p)] = p
+
+        res = pspl_batch.batch_residuals(params, self.batch, index)
+        jac = pspl_batch.batch_jacobian(params, self.batch, index)
+
+        # Each row of the batch should reproduce the single-event calculation, with zero
+        # contributions from the padding
+        for i, ds in enumerate(self.datasets):
+            n = self.batch.nparams[i]
+            np.testing.assert_allclose(res[i, 0:ds.ndata], pspl_tools.pspl_residuals(params[i, 0:n], ds))
+            np.testing.assert_allclose(jac[i, 0:ds.ndata, 0:n], pspl_tools.pspl_jacobian(params[i, 0:n], ds))
+            assert(np.all(res[i, ds.ndata:] == 0.0))
+            assert(np.all(jac[i, :, n:] == 0.0))
+
+    def test_fit_pspl_batch(self):
+        fit_results = pspl_batch.fit_pspl_batch(self.batch)
+
+        assert(len(fit_results) == len(self.datasets))
+        for ds, fit in zip(self.datasets, fit_results):
+            single_fit = pspl_tools.fit_pspl(ds)
+
+            assert(fit['success'])
+            assert(len(fit['best_model']) == 3 + 2 * ds.ntel)
+            assert(fit['covariance_matrix'].shape == (3 + 2 * ds.ntel, 3 + 2 * ds.ntel))
+            assert(fit['chi2'] <= single_fit['chi2'] * (1.0 + 1e-3))
+            np.testing.assert_allclose(fit['chi2'], single_fit['chi2'], rtol=1e-3)
+            np.testing.assert_allclose(fit['best_model'][0:3], single_fit['best_model'][0:3], rtol=1e-3)
+
+    def test_fittools_fit_pspl_batch(self):
+        results = fittools.fit_pspl_batch([event['datasets'] for event in self.events])
+
+        expected_keys = [
+            't0', 'u0', 'tE', 'piEN', 'piEE',
+            'source_magnitude', 'blend_magnitude', 'baseline_magnitude',
+            'fit_covariance', 'chi2', 'red_chi2', 'fit_parameters'
+        ]
+
+        assert(len(results) == len(self.events))
+        for model_params in results:
+            for key in expected_keys:
+                assert(key in model_params.keys())
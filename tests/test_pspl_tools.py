@@ -0,0 +1,108 @@
+from django.test import TestCase
+from os import getcwd, path
+import numpy as np
+from mop.toolbox import pspl_tools
+from mop.toolbox import fittools
+
+
+class TestPSPLTools(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+
+        # Synthetic two-telescope PSPL event with known parameters
+        self.params = {'t0': 2460150.0, 'u0': 0.15, 'tE': 30.0}
+        t1 = np.sort(rng.uniform(2460000.0, 2460300.0, 800))
+        A1 = pspl_tools.pspl_magnification(t1, self.params['t0'], self.params['u0'], self.params['tE'])
+        mag1 = pspl_tools.flux_to_magnitude(1000.0 * A1 + 500.0) + rng.normal(0, 0.01, len(t1))
+        t2 = np.sort(rng.uniform(2460000.0, 2460300.0, 200))
+        A2 = pspl_tools.pspl_magnification(t2, self.params['t0'], self.params['u0'], self.params['tE'])
+        mag2 = pspl_tools.flux_to_magnitude(2000.0 * A2 + 100.0) + rng.normal(0, 0.02, len(t2))
+
+        self.datasets = {
+            'I': np.c_[t1, mag1, np.full(len(t1), 0.01)],
+            'gp': np.c_[t2, mag2, np.full(len(t2), 0.02)]
+        }
+
+        lightcurve_file = path.join(getcwd(), 'tests/data/OGLE-2023-BLG-0348_phot.dat')
+        data = np.loadtxt(lightcurve_file)
+        self.ogle_datasets = {'I': data[:, 0:3]}
+
+    def test_pspl_magnification(self):
+        t = np.array([self.params['t0']])
+        A = pspl_tools.pspl_magnification(t, self.params['t0'], 1.0, self.params['tE'])
+
+        # At u = 1, A = 3/sqrt(5)
+        np.testing.assert_allclose(A, 3.0 / np.sqrt(5.0))
+
+    def test_pspl_jacobian(self):
+        dataset = pspl_tools.PSPLDataset([self.datasets['I'], self.datasets['gp']])
+        p = np.array([2460150.0, 0.15, 30.0, 1000.0, 1500.0, 2000.0, 2100.0])
+
+        J = pspl_tools.pspl_jacobian(p, dataset)
+
+        # Compare against central finite differences, using a step scaled to each parameter
+        steps = np.array([1e-5, 1e-7, 1e-5, 1e-4, 1e-4, 1e-4, 1e-4])
+        Jn = np.zeros_like(J)
+        for i in range(len(p)):
+            pp = p.copy()
+            pp[i] += steps[i]
+            pm = p.copy()
+            pm[i] -= steps[i]
+            Jn[:, i] = (pspl_tools.pspl_residuals(pp, dataset)
+                        - pspl_tools.pspl_residuals(pm, dataset)) / (2.0 * steps[i])
+
+        assert(J.shape == (dataset.ndata, len(p)))
+        np.testing.assert_allclose(J, Jn, rtol=1e-4, atol=1e-4 * np.abs(J).max())
+
+    def test_fit_pspl(self):
+        dataset = pspl_tools.PSPLDataset([self.datasets['I'], self.datasets['gp']])
+        fit_results = pspl_tools.fit_pspl(dataset)
+
+        assert(fit_results['success'])
+        np.testing.assert_allclose(fit_results['best_model'][0], self.params['t0'], atol=0.1)
+        np.testing.assert_allclose(fit_results['best_model'][1], self.params['u0'], atol=0.01)
+        np.testing.assert_allclose(fit_results['best_model'][2], self.params['tE'], atol=0.5)
+        assert(fit_results['covariance_matrix'].shape == (7, 7))
+
+    def test_backend_parity(self):
+        # The NumPy backend should reproduce the pyLIMA fit for both single and multi-telescope events
+        for datasets in [self.datasets, self.ogle_datasets]:
+            (pylima_params, pylima_lightcurve, pylima_status) = fittools.fit_pspl_omega2(
+                271.1925, -28.3164, datasets, backend='pylima')
+            (numpy_params, numpy_lightcurve, numpy_status) = fittools.fit_pspl_omega2(
+                271.1925, -28.3164, datasets, backend='numpy')
+
+            assert(pylima_status == numpy_status)
+            np.testing.assert_allclose(numpy_params['t0'], pylima_params['t0'], atol=1e-2)
+            np.testing.assert_allclose(numpy_params['u0'], pylima_params['u0'], rtol=1e-3)
+            np.testing.assert_allclose(numpy_params['tE'], pylima_params['tE'], rtol=1e-3)
+            np.testing.assert_allclose(numpy_params['chi2'], pylima_params['chi2'], rtol=1e-3)
+            assert(numpy_lightcurve is not None)
+
+    def test_grid_search_guess(self):
+        dataset = pspl_tools.PSPLDataset([self.datasets['I'], self.datasets['gp']])
+        (guess, chi2) = pspl_tools.grid_search_guess(dataset)
+
+        # The grid minimum should lie within one grid step of the true parameters
+        assert(np.abs(guess[0] - self.params['t0']) < 0.5 * self.params['tE'])
+        assert(0.5 < guess[2] / self.params['tE'] < 2.0)
+        assert(0.05 < guess[1] < 0.5)
+
+        # The chi2 of the grid minimum should be that of the model with linearly-solved fluxes,
+        # evaluated on the binned lightcurves
+        (time, flux, err_flux, tel_index) = pspl_tools.bin_dataset(dataset)
+        A = pspl_tools.pspl_magnification(time, guess[0], guess[1], guess[2])
+        model_chi2 = 0.0
+        for i in range(dataset.ntel):
+            mask = tel_index == i
+            design = np.c_[A[mask] - 1.0, np.ones(mask.sum())] / err_flux[mask, np.newaxis]
+            (solution, res, rank, sv) = np.linalg.lstsq(design, flux[mask] / err_flux[mask], rcond=None)
+            model_chi2 += np.sum((design @ solution - flux[mask] / err_flux[mask]) ** 2)
+        np.testing.assert_allclose(chi2, model_chi2, rtol=1e-6)
+
+        # Fits started from the grid should converge to the same solution as the default
+        (params, model_lightcurve, status) = fittools.fit_pspl_omega2(
+            271.1925, -28.3164, self.datasets, backend='numpy', initializer='grid')
+        assert('initialize' in params['fit_telemetry']['stages'])
+        np.testing.assert_allclose(params['t0'], self.params['t0'], atol=0.1)
+        np.testing.assert_allclose(params['tE'], self.params['tE'], atol=0.5)
@@ -0,0 +1,136 @@
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from tom_targets.models import Target, TargetName
+from tom_dataproducts.models import ReducedDatum, PhotometryReducedDatum
+from astropy.time import Time, TimeDelta, TimezoneInfo
+from astropy import units as u
+import numpy as np
+from mop.toolbox import querytools
+from mop.toolbox import packed_lightcurves
+from mop.management.commands import fit_need_events_PSPL
+
+
+class TestStreamingPhotometry(TestCase):
+    def setUp(self):
+        self.tstart = Time('2023-08-01T00:00:00.0', format='isot')
+        rng = np.random.default_rng(5)
+        self.targets = []
+        for j, npts in enumerate([15, 0, 8]):
+            target = Target.objects.create(
+                name='Gaia23abc' + str(j),
+                ra=271.1925,
+                dec=-28.3164
+            )
+            self.targets.append(target)
+            for i in range(npts):
+                ts = self.tstart + TimeDelta((npts - i) * 1.0 * u.day)
+                PhotometryReducedDatum.objects.create(
+                    timestamp=ts.to_datetime(timezone=TimezoneInfo()),
+                    source_name='Gaia',
+                    source_location=target.name,
+                    target=target,
+                    bandpass='G',
+                    brightness=rng.normal(18.0, 0.01),
+                    brightness_error=0.01)
+
+    def test_stream_photometry_for_targetset(self):
+        target_list = [self.targets[2], self.targets[1], self.targets[0]]
+        # The target list should be paged through with one query per chunk of targets
+        with self.assertNumQueries(2):
+            results = list(querytools.stream_photometry_for_targetset(target_list, chunk_size=2))
+
+        # Every target should be returned once, in the order given, including those without data
+        assert([mulens.name for (mulens, photometry) in results] == [t.name for t in target_list])
+        assert([len(photometry) for (mulens, photometry) in results] == [8, 0, 15])
+
+        # The datapoints of each target should be in time order
+        timestamps = [rd.timestamp for rd in results[2][1]]
+        assert(timestamps == sorted(timestamps))
+
+    def test_get_reduced_data_from_stream(self):
+        mulens = self.targets[0]
+        mulens.get_reduced_data(
+            PhotometryReducedDatum.objects.filter(target=mulens).order_by('timestamp'),
+            ReducedDatum.objects.filter(target=mulens)
+        )
+        fingerprint = mulens.fingerprint
+
+        # The streamed datapoints should produce identical lightcurves
+        (mulens, photometry) = list(querytools.stream_photometry_for_targetset([mulens]))[0]
+        mulens.get_reduced_data(photometry, ReducedDatum.objects.filter(target=mulens))
+        assert(mulens.ndata == 15)
+        assert(mulens.fingerprint == fingerprint)
+
+        # Releasing the data should retain the summary used to store the fit results
+        mulens.release_reduced_data()
+        assert(mulens.red_data is None)
+        assert(len(mulens.datasets) == 0)
+        assert(mulens.ndata == 15)
+        assert(mulens.fingerprint == fingerprint)
+        assert(mulens.last_observation is not None)
+
+    def test_fetch_data_for_targetset(self):
+        TargetName.objects.create(target=self.targets[0], name='OGLE-2023-BLG-0001')
+        ReducedDatum.objects.create(target=self.targets[0], data_type='lc_model', source_name='MOP',
+                                    source_location=self.targets[0].name, timestamp=self.tstart.datetime,
+                                    value={'lc_model_time': [], 'lc_model_magnitude': []})
+        ReducedDatum.objects.create(target=self.targets[2], data_type='tabular', source_name='GSC_query_results',
+                                    source_location=self.targets[2].name, timestamp=self.tstart.datetime,
+                                    value={'ra': [], 'dec': []})
+
+        # The number of queries made should not depend on the number of targets in the set
+        with CaptureQueriesContext(connection) as queries:
+            querytools.fetch_data_for_targetset(self.targets[:2], check_need_to_fit=False)
+        with self.assertNumQueries(len(queries)):
+            target_data = querytools.fetch_data_for_targetset(self.targets, check_need_to_fit=False)
+        assert(len(queries) == 7)
+
+        # Each target should be given its own data, as if it had been queried separately
+        assert(list(target_data.keys()) == [t.name for t in self.targets])
+        assert([mulens.ndata for mulens in target_data.values()] == [15, 0, 8])
+        mulens = target_data[self.targets[0].name]
+        assert(mulens.targetnames == ['OGLE-2023-BLG-0001'])
+        assert('value' in mulens.existing_model.get_deferred_fields())
+        assert(mulens.gsc_results is None)
+        assert(target_data[self.targets[2].name].gsc_results.source_name == 'GSC_query_results')
+        assert(target_data[self.targets[2].name].existing_model is None)
+
+        fingerprint = mulens.fingerprint
+        mulens.get_reduced_data(
+            PhotometryReducedDatum.objects.filter(target=mulens).order_by('timestamp'),
+            ReducedDatum.objects.filter(target=mulens)
+        )
+        assert(mulens.fingerprint == fingerprint)
+
+        # Once the packed lightcurves are current, the lightcurves should be read from them rather than
+        # from the photometry, giving identical results
+        fingerprints = {name: mulens.fingerprint for name, mulens in target_data.items()}
+        for mulens in self.targets:
+            packed_lightcurves.refresh_packed_lightcurves(mulens)
+        with CaptureQueriesContext(connection) as queries:
+            target_data = querytools.fetch_data_for_targetset(self.targets, check_need_to_fit=False)
+        assert(not any(['tom_dataproducts_photometryreduceddatum"."brightness' in q['sql']
+                        for q in queries.captured_queries]))
+        assert({name: mulens.fingerprint for name, mulens in target_data.items()} == fingerprints)
+        assert([mulens.ndata for mulens in target_data.values()] == [15, 0, 8])
+
+    def test_generate_fit_tasks(self):
+        for mulens in self.targets:
+            ReducedDatum.objects.create(target=mulens, data_type='lc_model', source_name='MOP',
+                                        source_location=mulens.name, timestamp=self.tstart.datetime,
+                                        value={'lc_model_time': [], 'lc_model_magnitude': []})
+
+        # The model lightcurves of all of the events should be retrieved together, rather than for each event,
+        # without their values or the tabular datasets, which the fits do not use
+        target_data = {}
+        with CaptureQueriesContext(connection) as queries:
+            tasks = list(fit_need_events_PSPL.generate_fit_tasks(self.targets, target_data, Time.now().jd))
+        datum_queries = [q['sql'] for q in queries.captured_queries
+                         if q['sql'].startswith('SELECT') and 'FROM "tom_dataproducts_reduceddatum"' in q['sql']]
+        assert(len(datum_queries) == 1)
+        assert("'lc_model'" in datum_queries[0] and "'tabular'" not in datum_queries[0])
+
+        assert([task[0] for task in tasks] == [self.targets[0].name])
+        mulens = target_data[self.targets[0].name]
+        assert(mulens.existing_model.target_id == self.targets[0].pk)
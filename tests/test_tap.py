@@ -203,11 +203,24 @@ class TestLightcurveData(TestCase):
         assert (t_last_jd == expected_t_last)
 
     def test_TAP_mag_now(self):
-        mag_now = TAP.TAP_mag_now(self.params['target'])
+        # The current magnitude is evaluated from the model parameters of the target
+        st1 = self.params['target']
+        st1.t0 = Time(datetime.now()).jd
+        st1.u0 = 0.1
+        st1.tE = 30.0
+        st1.source_magnitude = 18.0
+        st1.blend_magnitude = 0.0
+        st1.save()
+
+        mag_now = TAP.TAP_mag_now(st1)
 
-        last_dp = self.params['lc_model']['lc_model_magnitude'][-1]
+        # Expect the target to be close to its peak magnitude of 18 - 2.5log10(A(u0))
+        assert(abs(mag_now - (18.0 - 2.5 * np.log10(10.0375))) < 0.01)
+        assert(st1.mag_now == round(mag_now, 3))
 
-        assert(mag_now == last_dp)
+        # Targets without a valid model have no current magnitude
+        st2 = SiderealTargetFactory.create()
+        assert(TAP.TAP_mag_now(st2) is None)
 
 
 class TestCheckBaselineSN(TestCase):
@@ -0,0 +1,80 @@
+from django.test import TestCase
+from django.utils import timezone
+from django.db import IntegrityError
+from unittest import mock
+from tom_targets.models import Target
+from microlensing_targets.models import TargetJob
+from mop.toolbox import target_jobs
+import datetime
+
+
+class TestTargetJobs(TestCase):
+    def setUp(self):
+        self.target = Target.objects.create(name='Gaia24abc', ra=271.1925, dec=-28.3164)
+
+    def test_submit_job(self):
+        (job, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(created)
+        assert(job.status == 'queued')
+
+        # Repeated requests for the same target should return the job already queued or running
+        (job2, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(not created)
+        assert(job2.pk == job.pk)
+        (job3, created) = target_jobs.submit_job(self.target, 'run_TAP', launch=False)
+        assert(created)
+        TargetJob.objects.filter(pk=job.pk).update(status='running', started=timezone.now())
+        (job4, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(job4.pk == job.pk)
+        assert(TargetJob.objects.count() == 2)
+
+        # Jobs that appear to have been lost should not block new requests
+        TargetJob.objects.filter(pk=job.pk).update(started=timezone.now() - datetime.timedelta(days=1))
+        (job5, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(created)
+        assert(TargetJob.objects.get(pk=job.pk).status == 'failed')
+
+    def test_submit_job_race(self):
+        # A request blocked by a job which completes before it can be retrieved should be queued again
+        create = TargetJob.objects.create
+        attempts = []
+        def create_after_race(**kwargs):
+            attempts.append(kwargs)
+            if len(attempts) == 1:
+                raise IntegrityError('unique_active_target_job')
+            return create(**kwargs)
+
+        with mock.patch.object(TargetJob.objects, 'create', side_effect=create_after_race):
+            (job, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(len(attempts) == 2)
+        assert(created)
+        assert(job.status == 'queued')
+
+        # Should the job keep completing, the latest job is returned
+        TargetJob.objects.filter(pk=job.pk).update(status='done')
+        with mock.patch.object(TargetJob.objects, 'create', side_effect=IntegrityError('unique_active_target_job')):
+            (job2, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(not created)
+        assert(job2.pk == job.pk)
+
+    def test_run_jobs(self):
+        (job, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+
+        # No job should be claimed while the maximum number are already running
+        assert(target_jobs.claim_job('worker-1', max_running=0) is None)
+
+        # The target has no photometry, so the fit completes without a model
+        assert(target_jobs.run_jobs(worker='worker-1') == 1)
+        job = TargetJob.objects.get(pk=job.pk)
+        assert(job.status == 'done')
+        assert(job.worker == 'worker-1')
+        assert(job.finished >= job.started)
+
+        status = target_jobs.job_status(job)
+        assert(status['status'] == 'done')
+        assert(not status['active'])
+        assert(target_jobs.latest_jobs(self.target) == [job])
+
+        # Once the job is complete, the target can be fitted again
+        (job2, created) = target_jobs.submit_job(self.target, 'fit_event_PSPL', launch=False)
+        assert(created)